@@ -0,0 +1,125 @@
+"""
+Synthetic benchmark of the decontamination matcher.
+
+Generates random "benchmark" samples and a random corpus in which a fraction of the documents
+contain a span copied from a benchmark sample, then measures the throughput (words/s) of the
+matcher, with and without the Bloom filter, against a pure Python set-of-n-grams baseline, and
+checks that exactly the injected documents are flagged.
+
+Usage:
+    python benchmark_decontamination.py --num_documents 20000 --words_per_document 500
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from ngram_hashing import NgramBatch, normalize
+from ngram_index import BenchmarkNgramIndex
+
+
+def random_texts(rng, vocabulary, num_texts, num_words):
+    return [
+        " ".join(vocabulary[rng.integers(len(vocabulary), size=num_words)])
+        for _ in range(num_texts)
+    ]
+
+
+def python_baseline(benchmark_texts, corpus, n):
+    ngrams = set()
+    for text in benchmark_texts:
+        words = normalize(text).split()
+        ngrams.update(tuple(words[i : i + n]) for i in range(len(words) - n + 1))
+    flags = []
+    for text in corpus:
+        words = normalize(text).split()
+        flags.append(
+            any(tuple(words[i : i + n]) in ngrams for i in range(len(words) - n + 1))
+        )
+    return np.asarray(flags)
+
+
+def run(label, fn, num_words):
+    start = time.perf_counter()
+    flags = fn()
+    elapsed = time.perf_counter() - start
+    print(
+        f"{label:<24} {elapsed:7.2f}s -> {num_words / elapsed / 1e6:7.2f}M words/s, "
+        f"{int(flags.sum())} flagged"
+    )
+    return flags
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num_benchmark_samples", type=int, default=20000)
+    parser.add_argument("--words_per_sample", type=int, default=60)
+    parser.add_argument("--num_documents", type=int, default=20000)
+    parser.add_argument("--words_per_document", type=int, default=500)
+    parser.add_argument("--contaminated_fraction", type=float, default=0.01)
+    parser.add_argument("--vocabulary_size", type=int, default=30000)
+    parser.add_argument("--ngram_size", type=int, default=13)
+    parser.add_argument("--batch_size", type=int, default=1000)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    vocabulary = np.asarray([f"w{i}" for i in range(args.vocabulary_size)])
+    benchmark_texts = random_texts(
+        rng, vocabulary, args.num_benchmark_samples, args.words_per_sample
+    )
+    corpus = random_texts(rng, vocabulary, args.num_documents, args.words_per_document)
+    contaminated = rng.random(args.num_documents) < args.contaminated_fraction
+    for doc_idx in np.flatnonzero(contaminated):
+        # Insert a span of a benchmark sample, with different casing and punctuation
+        sample_words = benchmark_texts[rng.integers(len(benchmark_texts))].split()
+        start = rng.integers(len(sample_words) - args.ngram_size + 1)
+        span = " ".join(sample_words[start : start + args.ngram_size]).upper() + "."
+        words = corpus[doc_idx].split()
+        position = rng.integers(len(words))
+        corpus[doc_idx] = " ".join(words[:position] + [span] + words[position:])
+    num_words = args.num_documents * args.words_per_document
+    print(
+        f"{args.num_benchmark_samples} benchmark samples, {args.num_documents} documents, "
+        f"{num_words / 1e6:.1f}M words, {int(contaminated.sum())} contaminated"
+    )
+
+    start = time.perf_counter()
+    index = BenchmarkNgramIndex.build(
+        (("synthetic", text) for text in benchmark_texts), n=args.ngram_size
+    )
+    print(
+        f"Indexed {len(index)} {args.ngram_size}-grams in {time.perf_counter() - start:.2f}s"
+    )
+
+    def matcher(use_bloom_filter):
+        flags = []
+        for i in range(0, len(corpus), args.batch_size):
+            texts = corpus[i : i + args.batch_size]
+            batch = NgramBatch(texts, index.n)
+            ngram_idx, _ = index.match(batch, use_bloom_filter=use_bloom_filter)
+            flags.append(
+                np.bincount(batch.doc_idx[ngram_idx], minlength=len(texts)) > 0
+            )
+        return np.concatenate(flags)
+
+    results = {
+        "python sets": run(
+            "python sets",
+            lambda: python_baseline(benchmark_texts, corpus, args.ngram_size),
+            num_words,
+        ),
+        "numpy, no bloom filter": run(
+            "numpy, no bloom filter", lambda: matcher(False), num_words
+        ),
+        "numpy + bloom filter": run(
+            "numpy + bloom filter", lambda: matcher(True), num_words
+        ),
+    }
+    for label, flags in results.items():
+        assert (flags == contaminated).all(), f"{label} flagged the wrong documents"
+    print("All the matchers flagged exactly the contaminated documents.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""Benchmark samples from the lighteval task definitions used for the SmolLM evaluations."""
+
+import fnmatch
+import importlib.util
+import logging
+import os
+import sys
+import types
+from typing import Iterator, List, Optional, Tuple
+
+from datasets import load_dataset
+
+logger = logging.getLogger(__name__)
+
+EVALUATION_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "..", "evaluation"
+)
+DEFAULT_TASKS_FILES = [
+    os.path.join(EVALUATION_DIR, "smollm2", "tasks.py"),
+    os.path.join(EVALUATION_DIR, "smollm3", "tasks.py"),
+]
+
+
+def load_tasks_table(tasks_file: str) -> list:
+    """
+    Imports the `TASKS_TABLE` of a lighteval custom tasks file. The file is imported as a
+    module of a package named after its directory, so that its relative imports work.
+    """
+    tasks_dir = os.path.dirname(os.path.abspath(tasks_file))
+    package_name = f"_decontamination_{os.path.basename(tasks_dir)}"
+    if package_name not in sys.modules:
+        package = types.ModuleType(package_name)
+        package.__path__ = [tasks_dir]
+        sys.modules[package_name] = package
+    module_name = f"{package_name}.{os.path.splitext(os.path.basename(tasks_file))[0]}"
+    spec = importlib.util.spec_from_file_location(module_name, tasks_file)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    spec.loader.exec_module(module)
+    return module.TASKS_TABLE
+
+
+def doc_to_text(doc) -> str:
+    """The query of a lighteval `Doc` followed by its gold answer (one line per gold answer)."""
+    gold_indices = (
+        doc.gold_index if isinstance(doc.gold_index, list) else [doc.gold_index]
+    )
+    answers = [
+        doc.choices[gold_idx]
+        for gold_idx in gold_indices
+        if doc.choices and 0 <= gold_idx < len(doc.choices)
+    ]
+    if len(answers) == 0:
+        return doc.query
+    return "\n".join(doc.query + answer for answer in answers)
+
+
+def iter_benchmark_samples(
+    tasks_files: Optional[List[str]] = None,
+    task_patterns: Optional[List[str]] = None,
+    max_samples_per_task: Optional[int] = None,
+) -> Iterator[Tuple[str, str]]:
+    """
+    Yields `(task name, text)` for every sample of the evaluation splits of the tasks.
+
+    Tasks defined in several files (e.g. `mmlu` in smollm2 and smollm3) are read once, from
+    the first file. Tasks that fail to load are skipped with a warning.
+
+    Args:
+        tasks_files: lighteval custom tasks files. Defaults to the smollm2 and smollm3 ones.
+        task_patterns: `fnmatch` patterns of the task names to keep (e.g. `["mmlu*", "gsm8k"]`).
+        max_samples_per_task: Keep at most this many samples per task.
+    """
+    seen_tasks = set()
+    for tasks_file in tasks_files or DEFAULT_TASKS_FILES:
+        for task in load_tasks_table(tasks_file):
+            if task.name in seen_tasks:
+                continue
+            if task_patterns and not any(
+                fnmatch.fnmatch(task.name, pattern) for pattern in task_patterns
+            ):
+                continue
+            seen_tasks.add(task.name)
+            if task.prompt_function is None:
+                logger.warning(f"{task.name} has no prompt function, skipping it.")
+                continue
+
+            num_samples = 0
+            try:
+                for split in task.evaluation_splits:
+                    dataset = load_dataset(
+                        task.hf_repo,
+                        task.hf_subset,
+                        split=split,
+                        revision=getattr(task, "hf_revision", None),
+                    )
+                    for line in dataset:
+                        doc = task.prompt_function(line, task.name)
+                        if doc is None:
+                            continue
+                        yield task.name, doc_to_text(doc)
+                        num_samples += 1
+                        if max_samples_per_task and num_samples >= max_samples_per_task:
+                            break
+                    if max_samples_per_task and num_samples >= max_samples_per_task:
+                        break
+            except Exception as e:
+                logger.warning(f"Could not load {task.name}: {e}")
+            logger.info(f"{task.name}: {num_samples} samples")
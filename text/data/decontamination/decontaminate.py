@@ -0,0 +1,281 @@
+"""
+Flags the documents of a corpus that contain n-grams of the evaluation benchmarks.
+
+1. The benchmark samples (query + gold answer of the lighteval tasks of `text/evaluation`) are
+   split into word n-grams (13-grams by default), indexed in `--index_dir`.
+2. The corpus shards (jsonl, jsonl.gz or parquet) are streamed through a pool of workers. The
+   n-grams of each batch of documents are hashed with numpy, filtered with a Bloom filter, and
+   the few candidates are verified exactly against the index.
+3. For each shard, `flags/` has a uint8 flag per document (1 = contaminated), `matches/` the
+   contaminated documents with the benchmark samples they overlap. `report.json` has the overlap
+   per benchmark.
+
+Usage:
+    python decontaminate.py --index_dir decontamination_index --output_dir decontamination_output \
+        --input_files "data/*.parquet" --num_workers 32
+"""
+
+import argparse
+import glob
+import gzip
+import json
+import logging
+import os
+from collections import defaultdict
+from multiprocessing import Pool
+
+import numpy as np
+
+from ngram_hashing import NgramBatch
+from ngram_index import BenchmarkNgramIndex
+
+logger = logging.getLogger(__name__)
+
+# Set in each worker by `_init_worker`
+_index = None
+_args = None
+
+
+def iter_text_batches(path, text_column, batch_size):
+    if path.endswith(".parquet"):
+        import pyarrow.parquet as pq
+
+        parquet_file = pq.ParquetFile(path)
+        for record_batch in parquet_file.iter_batches(
+            batch_size=batch_size, columns=[text_column]
+        ):
+            yield [text or "" for text in record_batch.column(0).to_pylist()]
+    else:
+        open_fn = gzip.open if path.endswith(".gz") else open
+        with open_fn(path, "rt", encoding="utf-8") as f:
+            batch = []
+            for line in f:
+                batch.append(json.loads(line).get(text_column) or "")
+                if len(batch) == batch_size:
+                    yield batch
+                    batch = []
+            if len(batch) > 0:
+                yield batch
+
+
+def _init_worker(args):
+    global _index, _args
+    _args = args
+    _index = BenchmarkNgramIndex.load(args.index_dir)
+
+
+def _shard_name(shard_idx, path):
+    name = os.path.basename(path)
+    for extension in [".gz", ".jsonl", ".json", ".parquet"]:
+        name = name[: -len(extension)] if name.endswith(extension) else name
+    return f"{shard_idx:05d}_{name}"
+
+
+def decontaminate_shard(shard):
+    shard_idx, path = shard
+    shard_name = _shard_name(shard_idx, path)
+    report_path = os.path.join(_args.output_dir, "reports", f"{shard_name}.json")
+    if os.path.exists(report_path):
+        with open(report_path) as f:
+            return json.load(f)
+
+    num_benchmarks = len(_index.benchmarks)
+    flags = []
+    num_words = 0
+    matched_ngrams = np.zeros(num_benchmarks, dtype=np.int64)
+    contaminated_documents = np.zeros(num_benchmarks, dtype=np.int64)
+    contaminated_samples = defaultdict(set)
+
+    matches_path = os.path.join(_args.output_dir, "matches", f"{shard_name}.jsonl")
+    with open(matches_path + ".tmp", "w") as matches_file:
+        for texts in iter_text_batches(path, _args.text_column, _args.batch_size):
+            batch = NgramBatch(texts, _index.n)
+            num_words += int(batch.num_words.sum())
+            ngram_idx, entry_idx = _index.match(batch)
+            matches_per_doc = np.bincount(
+                batch.doc_idx[ngram_idx], minlength=len(texts)
+            )
+            is_contaminated = matches_per_doc >= _args.min_matches
+            doc_offset = len(flags)
+            flags.extend(is_contaminated.astype(np.uint8).tolist())
+
+            match_docs = batch.doc_idx[ngram_idx]
+            for doc_idx in np.flatnonzero(is_contaminated).tolist():
+                doc_samples = defaultdict(set)
+                for entry in entry_idx[match_docs == doc_idx].tolist():
+                    benchmark_ids, sample_ids = _index.postings(entry)
+                    for benchmark_id, sample_id in zip(
+                        benchmark_ids.tolist(), sample_ids.tolist()
+                    ):
+                        doc_samples[benchmark_id].add(sample_id)
+                        matched_ngrams[benchmark_id] += 1
+                for benchmark_id, sample_ids in doc_samples.items():
+                    contaminated_documents[benchmark_id] += 1
+                    contaminated_samples[benchmark_id].update(sample_ids)
+                record = {
+                    "doc_idx": doc_offset + doc_idx,
+                    "num_matched_ngrams": int(matches_per_doc[doc_idx]),
+                    "benchmarks": {
+                        _index.benchmarks[benchmark_id]: sorted(sample_ids)
+                        for benchmark_id, sample_ids in doc_samples.items()
+                    },
+                }
+                matches_file.write(json.dumps(record) + "\n")
+    os.replace(matches_path + ".tmp", matches_path)
+    np.save(
+        os.path.join(_args.output_dir, "flags", f"{shard_name}.npy"),
+        np.asarray(flags, dtype=np.uint8),
+    )
+
+    report = {
+        "path": path,
+        "num_documents": len(flags),
+        "num_contaminated_documents": int(sum(flags)),
+        "num_words": num_words,
+        "benchmarks": {
+            _index.benchmarks[benchmark_id]: {
+                "matched_ngrams": int(matched_ngrams[benchmark_id]),
+                "contaminated_documents": int(contaminated_documents[benchmark_id]),
+                "contaminated_samples": sorted(contaminated_samples[benchmark_id]),
+            }
+            for benchmark_id in range(num_benchmarks)
+            if contaminated_documents[benchmark_id] > 0
+        },
+    }
+    # Written last: a shard with a report is done
+    with open(report_path, "w") as f:
+        json.dump(report, f)
+    return report
+
+
+def merge_reports(index, shard_reports):
+    report = {
+        "n": index.n,
+        "num_shards": len(shard_reports),
+        "num_documents": sum(r["num_documents"] for r in shard_reports),
+        "num_contaminated_documents": sum(
+            r["num_contaminated_documents"] for r in shard_reports
+        ),
+        "num_words": sum(r["num_words"] for r in shard_reports),
+        "benchmarks": {},
+    }
+    for benchmark_id, benchmark in enumerate(index.benchmarks):
+        samples = set()
+        matched_ngrams, contaminated_documents = 0, 0
+        for shard_report in shard_reports:
+            shard_benchmark = shard_report["benchmarks"].get(benchmark)
+            if shard_benchmark is not None:
+                samples.update(shard_benchmark["contaminated_samples"])
+                matched_ngrams += shard_benchmark["matched_ngrams"]
+                contaminated_documents += shard_benchmark["contaminated_documents"]
+        num_samples = index.num_samples[benchmark_id]
+        report["benchmarks"][benchmark] = {
+            "num_samples": num_samples,
+            "num_short_samples": index.num_short_samples[benchmark_id],
+            "num_contaminated_samples": len(samples),
+            "contaminated_fraction": len(samples) / num_samples if num_samples else 0.0,
+            "matched_ngrams": matched_ngrams,
+            "contaminated_documents": contaminated_documents,
+        }
+    return report
+
+
+def build_index(args):
+    from benchmarks import iter_benchmark_samples
+
+    samples = iter_benchmark_samples(
+        tasks_files=args.tasks_files,
+        task_patterns=args.tasks,
+        max_samples_per_task=args.max_samples_per_task,
+    )
+    index = BenchmarkNgramIndex.build(
+        samples, n=args.ngram_size, false_positive_rate=args.bloom_false_positive_rate
+    )
+    index.save(args.index_dir)
+    logger.info(
+        f"Indexed {len(index)} {args.ngram_size}-grams of {sum(index.num_samples)} samples "
+        f"from {len(index.benchmarks)} benchmarks in {args.index_dir}"
+    )
+    return index
+
+
+def main(args):
+    if os.path.exists(os.path.join(args.index_dir, "meta.json")):
+        index = BenchmarkNgramIndex.load(args.index_dir)
+        if index.n != args.ngram_size:
+            raise ValueError(
+                f"{args.index_dir} has {index.n}-grams, not {args.ngram_size}-grams."
+            )
+    else:
+        index = build_index(args)
+    if not args.input_files:
+        return
+
+    paths = sorted(path for pattern in args.input_files for path in glob.glob(pattern))
+    for subdir in ["flags", "matches", "reports"]:
+        os.makedirs(os.path.join(args.output_dir, subdir), exist_ok=True)
+
+    shard_reports = []
+    with Pool(args.num_workers, initializer=_init_worker, initargs=(args,)) as pool:
+        for shard_report in pool.imap_unordered(
+            decontaminate_shard, list(enumerate(paths))
+        ):
+            shard_reports.append(shard_report)
+            logger.info(
+                f"[{len(shard_reports)}/{len(paths)}] {shard_report['path']}: "
+                f"{shard_report['num_contaminated_documents']}/{shard_report['num_documents']} "
+                "contaminated documents"
+            )
+
+    report = merge_reports(index, shard_reports)
+    with open(os.path.join(args.output_dir, "report.json"), "w") as f:
+        json.dump(report, f, indent=2)
+
+    print(
+        f"{report['num_contaminated_documents']}/{report['num_documents']} contaminated "
+        f"documents ({report['num_words']} words)"
+    )
+    print(f"{'benchmark':<40} {'samples':>8} {'contaminated':>12} {'docs':>8}")
+    for benchmark, stats in sorted(report["benchmarks"].items()):
+        print(
+            f"{benchmark:<40} {stats['num_samples']:>8} "
+            f"{stats['contaminated_fraction']:>11.2%} {stats['contaminated_documents']:>8}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--index_dir", type=str, required=True)
+    parser.add_argument("--output_dir", type=str, default="decontamination_output")
+    parser.add_argument(
+        "--input_files",
+        type=str,
+        nargs="*",
+        default=[],
+        help="Glob patterns of the corpus shards (jsonl, jsonl.gz or parquet).",
+    )
+    parser.add_argument("--text_column", type=str, default="text")
+    parser.add_argument("--ngram_size", type=int, default=13)
+    parser.add_argument(
+        "--min_matches",
+        type=int,
+        default=1,
+        help="Number of matched n-grams from which a document is contaminated.",
+    )
+    parser.add_argument("--batch_size", type=int, default=1000)
+    parser.add_argument("--num_workers", type=int, default=os.cpu_count())
+    parser.add_argument(
+        "--tasks_files",
+        type=str,
+        nargs="*",
+        default=None,
+        help="lighteval custom tasks files, defaults to the smollm2 and smollm3 ones.",
+    )
+    parser.add_argument(
+        "--tasks", type=str, nargs="*", default=None, help="Task name patterns to keep."
+    )
+    parser.add_argument("--max_samples_per_task", type=int, default=None)
+    parser.add_argument("--bloom_false_positive_rate", type=float, default=1e-3)
+
+    logging.basicConfig(level=logging.INFO)
+    main(parser.parse_args())
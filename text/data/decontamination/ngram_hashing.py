@@ -0,0 +1,148 @@
+"""Vectorized word n-gram hashing.
+
+Texts are normalized (lowercased, ASCII punctuation and whitespace collapsed into word separators), split into
+words, and every word n-gram is hashed into a 64-bit fingerprint. All the hashes of a batch of documents are computed
+with a few numpy passes over the concatenated bytes of the batch, without any per-word Python code:
+- a word is hashed with a polynomial hash of its bytes, computed from a prefix sum of `byte * P**position`,
+- an n-gram is hashed with a polynomial hash of its word hashes, computed the same way from a prefix sum,
+- the n-gram hashes are passed through the splitmix64 finalizer, so that all their bits are usable by a Bloom filter.
+All the arithmetic is modulo 2**64 (numpy's uint64 wrap-around), which is a ring in which odd bases are invertible.
+"""
+
+from typing import List, Sequence, Tuple
+
+import numpy as np
+
+# ASCII characters that are not letters or digits separate words
+_SEPARATOR = ord(" ")
+NORMALIZATION_TABLE = bytes(
+    (
+        c
+        if (ord("a") <= c <= ord("z")) or (ord("0") <= c <= ord("9")) or c >= 128
+        else _SEPARATOR
+    )
+    for c in range(256)
+)
+
+_BYTE_BASE = 0x100000001B3
+_WORD_BASE = 0x9E3779B97F4A7C15
+
+
+class _Powers:
+    """Powers of an odd `base` and of its inverse modulo 2**64, grown on demand."""
+
+    def __init__(self, base: int):
+        self.base = np.uint64(base)
+        self.inverse = np.uint64(pow(base, -1, 1 << 64))
+        self.powers = np.ones(1, dtype=np.uint64)
+        self.inverse_powers = np.ones(1, dtype=np.uint64)
+
+    def get(self, size: int) -> Tuple[np.ndarray, np.ndarray]:
+        if size > len(self.powers):
+            new_size = max(size, 2 * len(self.powers))
+            with np.errstate(over="ignore"):
+                self.powers = np.cumprod(
+                    np.r_[np.uint64(1), np.full(new_size - 1, self.base)],
+                    dtype=np.uint64,
+                )
+                self.inverse_powers = np.cumprod(
+                    np.r_[np.uint64(1), np.full(new_size - 1, self.inverse)],
+                    dtype=np.uint64,
+                )
+        return self.powers[:size], self.inverse_powers[:size]
+
+
+_byte_powers = _Powers(_BYTE_BASE)
+_word_powers = _Powers(_WORD_BASE)
+
+
+def normalize(text: str) -> bytes:
+    return text.lower().encode("utf-8", "ignore").translate(NORMALIZATION_TABLE)
+
+
+def _polynomial_hashes(
+    values: np.ndarray, starts: np.ndarray, ends: np.ndarray, powers: _Powers
+) -> np.ndarray:
+    """`sum(values[start + j] * base**j)` for each `[start, end)` span, modulo 2**64."""
+    pows, inverse_pows = powers.get(len(values) + 1)
+    with np.errstate(over="ignore"):
+        prefix = np.zeros(len(values) + 1, dtype=np.uint64)
+        np.cumsum(values.astype(np.uint64) * pows[: len(values)], out=prefix[1:])
+        return (prefix[ends] - prefix[starts]) * inverse_pows[starts]
+
+
+def _splitmix64(x: np.ndarray) -> np.ndarray:
+    with np.errstate(over="ignore"):
+        x = x ^ (x >> np.uint64(30))
+        x = x * np.uint64(0xBF58476D1CE4E5B9)
+        x = x ^ (x >> np.uint64(27))
+        x = x * np.uint64(0x94D049BB133111EB)
+        return x ^ (x >> np.uint64(31))
+
+
+class NgramBatch:
+    """
+    The hashed word n-grams of a batch of documents.
+
+    Attributes:
+        hashes (`np.ndarray`): uint64 hash of each n-gram, in document then position order.
+        doc_idx (`np.ndarray`): Index (in the batch) of the document of each n-gram.
+        first_word (`np.ndarray`): Index of the first word of each n-gram, to get back its text with `ngram_text`.
+        num_words (`np.ndarray`): Number of words of each document.
+    """
+
+    def __init__(self, texts: Sequence[str], n: int):
+        self.n = n
+        normalized = [normalize(text) for text in texts]
+        # Documents are separated by a separator, so that no word spans two documents
+        self._bytes = b" ".join(normalized) + b" "
+        self.buffer = np.frombuffer(self._bytes, dtype=np.uint8)
+        doc_byte_starts = np.cumsum(
+            [0] + [len(text) + 1 for text in normalized[:-1]], dtype=np.int64
+        )
+
+        is_word = np.r_[False, self.buffer != _SEPARATOR, False].view(np.int8)
+        boundaries = np.diff(is_word)
+        self.word_starts = np.flatnonzero(boundaries == 1)
+        self.word_ends = np.flatnonzero(boundaries == -1)
+        word_docs = np.searchsorted(doc_byte_starts, self.word_starts, side="right") - 1
+        self.num_words = np.bincount(word_docs, minlength=len(texts))
+
+        num_ngrams = max(len(self.word_starts) - n + 1, 0)
+        if num_ngrams == 0:
+            self.hashes = np.empty(0, dtype=np.uint64)
+            self.doc_idx = np.empty(0, dtype=np.int64)
+            self.first_word = np.empty(0, dtype=np.int64)
+            return
+
+        word_hashes = _polynomial_hashes(
+            self.buffer, self.word_starts, self.word_ends, _byte_powers
+        )
+        first_word = np.arange(num_ngrams)
+        hashes = _polynomial_hashes(
+            word_hashes, first_word, first_word + n, _word_powers
+        )
+        # Drop the n-grams spanning two documents
+        valid = word_docs[first_word] == word_docs[first_word + n - 1]
+        self.hashes = _splitmix64(hashes[valid])
+        self.doc_idx = word_docs[first_word[valid]]
+        self.first_word = first_word[valid]
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def ngram_text(self, ngram_idx: int) -> bytes:
+        """Normalized text of an n-gram: its words joined by spaces."""
+        first_word = self.first_word[ngram_idx]
+        return b" ".join(
+            self._bytes[self.word_starts[word] : self.word_ends[word]]
+            for word in range(first_word, first_word + self.n)
+        )
+
+
+def text_ngrams(text: str, n: int) -> Tuple[np.ndarray, List[bytes]]:
+    """Hashes and normalized texts of the word n-grams of one text."""
+    batch = NgramBatch([text], n)
+    return batch.hashes, [
+        batch.ngram_text(ngram_idx) for ngram_idx in range(len(batch))
+    ]
@@ -0,0 +1,253 @@
+"""Index of the n-grams of the benchmarks: a Bloom filter prefilter in front of an exact lookup table."""
+
+import json
+import math
+import os
+from collections import defaultdict
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+
+from ngram_hashing import NgramBatch, text_ngrams
+
+
+class BloomFilter:
+    """
+    Bloom filter over uint64 hashes, with `num_bits` a power of two and the `num_hashes` bit positions derived from
+    the two halves of the hash (double hashing). Lookups are vectorized over arrays of hashes.
+    """
+
+    def __init__(self, bits: np.ndarray, num_hashes: int):
+        self.bits = bits
+        self.num_bits = len(bits) * 8
+        self.num_hashes = num_hashes
+        self._mask = np.uint64(self.num_bits - 1)
+
+    @classmethod
+    def for_capacity(
+        cls, capacity: int, false_positive_rate: float = 1e-3
+    ) -> "BloomFilter":
+        num_bits = max(
+            64, int(-capacity * math.log(false_positive_rate) / math.log(2) ** 2)
+        )
+        num_bits = 1 << (num_bits - 1).bit_length()
+        num_hashes = max(1, round(num_bits / max(capacity, 1) * math.log(2)))
+        return cls(np.zeros(num_bits // 8, dtype=np.uint8), num_hashes)
+
+    def _positions(self, hashes: np.ndarray):
+        low = hashes & np.uint64(0xFFFFFFFF)
+        high = (hashes >> np.uint64(32)) | np.uint64(1)
+        with np.errstate(over="ignore"):
+            for i in range(self.num_hashes):
+                yield (low + np.uint64(i) * high) & self._mask
+
+    def add(self, hashes: np.ndarray):
+        for positions in self._positions(hashes):
+            bit_masks = np.left_shift(1, positions & np.uint64(7)).astype(np.uint8)
+            np.bitwise_or.at(self.bits, positions >> np.uint64(3), bit_masks)
+
+    def contains(self, hashes: np.ndarray) -> np.ndarray:
+        """Boolean mask of the hashes that may be in the filter."""
+        mask = np.ones(len(hashes), dtype=bool)
+        for positions in self._positions(hashes):
+            shifts = (positions & np.uint64(7)).astype(np.uint8)
+            mask &= ((self.bits[positions >> np.uint64(3)] >> shifts) & 1).astype(bool)
+        return mask
+
+
+class BenchmarkNgramIndex:
+    """
+    The word n-grams of benchmark samples, with the samples each of them comes from.
+
+    Entries are unique `(hash, normalized text)` pairs sorted by hash. A corpus n-gram is a match if its hash passes
+    the Bloom filter, is found in the sorted hashes, and its normalized text is the one of the entry (so that a hash
+    collision can't flag a document).
+
+    Attributes:
+        n (`int`): Size of the n-grams, in words.
+        benchmarks (`List[str]`): Names of the benchmarks.
+        num_samples (`List[int]`): Number of samples of each benchmark.
+        num_short_samples (`List[int]`): Number of samples of each benchmark that have less than `n` words.
+        hashes (`np.ndarray`): Sorted uint64 hashes of the entries.
+        texts (`List[bytes]`): Normalized text of each entry.
+        posting_offsets (`np.ndarray`): The samples of entry `i` are `posting_offsets[i]:posting_offsets[i + 1]`.
+        posting_benchmarks, posting_samples (`np.ndarray`): Benchmark and sample indices of the postings.
+    """
+
+    def __init__(
+        self,
+        n: int,
+        benchmarks: List[str],
+        num_samples: List[int],
+        num_short_samples: List[int],
+        hashes: np.ndarray,
+        texts: List[bytes],
+        posting_offsets: np.ndarray,
+        posting_benchmarks: np.ndarray,
+        posting_samples: np.ndarray,
+        bloom_filter: BloomFilter,
+    ):
+        self.n = n
+        self.benchmarks = benchmarks
+        self.num_samples = num_samples
+        self.num_short_samples = num_short_samples
+        self.hashes = hashes
+        self.texts = texts
+        self.posting_offsets = posting_offsets
+        self.posting_benchmarks = posting_benchmarks
+        self.posting_samples = posting_samples
+        self.bloom_filter = bloom_filter
+
+    @classmethod
+    def build(
+        cls,
+        samples: Iterable[Tuple[str, str]],
+        n: int = 13,
+        false_positive_rate: float = 1e-3,
+    ) -> "BenchmarkNgramIndex":
+        """
+        Args:
+            samples: `(benchmark name, text)` pairs. The samples of a benchmark are numbered in the order they come.
+            n (`int`): Size of the n-grams, in words. Samples shorter than `n` words are counted in `num_short_samples`.
+        """
+        benchmarks, num_samples, num_short_samples = [], [], []
+        benchmark_ids: Dict[str, int] = {}
+        entries = defaultdict(set)
+        for benchmark, text in samples:
+            if benchmark not in benchmark_ids:
+                benchmark_ids[benchmark] = len(benchmarks)
+                benchmarks.append(benchmark)
+                num_samples.append(0)
+                num_short_samples.append(0)
+            benchmark_id = benchmark_ids[benchmark]
+            sample_idx = num_samples[benchmark_id]
+            num_samples[benchmark_id] += 1
+
+            hashes, texts = text_ngrams(text, n)
+            if len(hashes) == 0:
+                # Samples shorter than `n` words can't be found by an n-gram overlap
+                num_short_samples[benchmark_id] += 1
+            for ngram_hash, ngram_text in zip(hashes.tolist(), texts):
+                entries[(ngram_hash, ngram_text)].add((benchmark_id, sample_idx))
+
+        keys = sorted(entries.keys())
+        postings = [sorted(entries[key]) for key in keys]
+        hashes = np.asarray([key[0] for key in keys], dtype=np.uint64)
+        posting_offsets = np.cumsum([0] + [len(p) for p in postings], dtype=np.int64)
+        flat_postings = np.asarray(
+            [posting for p in postings for posting in p], dtype=np.int64
+        ).reshape(-1, 2)
+
+        bloom_filter = BloomFilter.for_capacity(len(hashes), false_positive_rate)
+        bloom_filter.add(hashes)
+        return cls(
+            n=n,
+            benchmarks=benchmarks,
+            num_samples=num_samples,
+            num_short_samples=num_short_samples,
+            hashes=hashes,
+            texts=[key[1] for key in keys],
+            posting_offsets=posting_offsets,
+            posting_benchmarks=flat_postings[:, 0].astype(np.int32),
+            posting_samples=flat_postings[:, 1].astype(np.int64),
+            bloom_filter=bloom_filter,
+        )
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def save(self, index_dir: str):
+        os.makedirs(index_dir, exist_ok=True)
+        for name in [
+            "hashes",
+            "posting_offsets",
+            "posting_benchmarks",
+            "posting_samples",
+        ]:
+            np.save(os.path.join(index_dir, f"{name}.npy"), getattr(self, name))
+        np.save(os.path.join(index_dir, "bloom_filter.npy"), self.bloom_filter.bits)
+        with open(os.path.join(index_dir, "texts.txt"), "wb") as f:
+            f.write(b"\n".join(self.texts))
+        meta = {
+            "n": self.n,
+            "benchmarks": self.benchmarks,
+            "num_samples": self.num_samples,
+            "num_short_samples": self.num_short_samples,
+            "bloom_num_hashes": self.bloom_filter.num_hashes,
+        }
+        with open(os.path.join(index_dir, "meta.json"), "w") as f:
+            json.dump(meta, f, indent=2)
+
+    @classmethod
+    def load(cls, index_dir: str) -> "BenchmarkNgramIndex":
+        with open(os.path.join(index_dir, "meta.json")) as f:
+            meta = json.load(f)
+        arrays = {
+            name: np.load(os.path.join(index_dir, f"{name}.npy"), mmap_mode="r")
+            for name in [
+                "hashes",
+                "posting_offsets",
+                "posting_benchmarks",
+                "posting_samples",
+            ]
+        }
+        with open(os.path.join(index_dir, "texts.txt"), "rb") as f:
+            # Normalized texts never contain a newline
+            texts = f.read().split(b"\n") if len(arrays["hashes"]) > 0 else []
+        bloom_filter = BloomFilter(
+            np.load(os.path.join(index_dir, "bloom_filter.npy")),
+            meta["bloom_num_hashes"],
+        )
+        return cls(
+            n=meta["n"],
+            benchmarks=meta["benchmarks"],
+            num_samples=meta["num_samples"],
+            num_short_samples=meta["num_short_samples"],
+            texts=texts,
+            bloom_filter=bloom_filter,
+            **arrays,
+        )
+
+    def match(
+        self, batch: NgramBatch, use_bloom_filter: bool = True
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Finds the n-grams of `batch` that are n-grams of the benchmarks.
+
+        Returns:
+            `(ngram_idx, entry_idx)`: indices of the matching n-grams in `batch`, and of their entries in the index.
+        """
+        candidates = np.arange(len(batch))
+        if use_bloom_filter:
+            candidates = candidates[self.bloom_filter.contains(batch.hashes)]
+        if len(candidates) == 0 or len(self.hashes) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        candidate_hashes = batch.hashes[candidates]
+        entry_idx = np.searchsorted(self.hashes, candidate_hashes)
+        found = entry_idx < len(self.hashes)
+        found[found] = self.hashes[entry_idx[found]] == candidate_hashes[found]
+
+        # Exact verification of the few hash matches
+        matched_ngrams, matched_entries = [], []
+        for ngram_idx, entry_idx in zip(
+            candidates[found].tolist(), entry_idx[found].tolist()
+        ):
+            ngram_text = batch.ngram_text(ngram_idx)
+            ngram_hash = self.hashes[entry_idx]
+            while entry_idx < len(self.hashes) and self.hashes[entry_idx] == ngram_hash:
+                if self.texts[entry_idx] == ngram_text:
+                    matched_ngrams.append(ngram_idx)
+                    matched_entries.append(entry_idx)
+                    break
+                entry_idx += 1
+        return np.asarray(matched_ngrams, dtype=np.int64), np.asarray(
+            matched_entries, dtype=np.int64
+        )
+
+    def postings(self, entry_idx: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Benchmark and sample indices of the samples containing the n-gram of entry `entry_idx`."""
+        start, end = (
+            self.posting_offsets[entry_idx],
+            self.posting_offsets[entry_idx + 1],
+        )
+        return self.posting_benchmarks[start:end], self.posting_samples[start:end]
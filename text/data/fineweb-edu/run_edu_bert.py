@@ -1,17 +1,107 @@
-import torch
+import os
 import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import torch
 from transformers import AutoTokenizer, AutoModelForSequenceClassification
-from datasets import load_dataset
+from datasets import load_dataset, concatenate_datasets
 
+# Set in each tokenization worker by `init_tokenizer`
+_tokenizer = None
+
+
+def init_tokenizer(model_name):
+    global _tokenizer
+    _tokenizer = AutoTokenizer.from_pretrained(model_name)
+    # The workers of the pool tokenize in parallel, no need for more threads
+    os.environ["TOKENIZERS_PARALLELISM"] = "false"
+
+
+def tokenize(texts, max_length):
+    return _tokenizer(texts, truncation=True, max_length=max_length)["input_ids"]
+
+
+def token_budget_batches(lengths, max_tokens_per_batch, max_batch_size):
+    """
+    Groups the documents by length: documents are sorted by token length and packed into
+    batches whose padded size (batch size x longest document) stays within the token budget,
+    so that a long document is only padded with documents of similar length.
+    """
+    order = np.argsort(lengths, kind="stable")
+    batches, batch = [], []
+    for idx in order:
+        # `order` is sorted, so the current document is the longest of the batch
+        if batch and (
+            (len(batch) + 1) * lengths[idx] > max_tokens_per_batch
+            or len(batch) == max_batch_size
+        ):
+            batches.append(batch)
+            batch = []
+        batch.append(idx)
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+class EduScorer:
+    def __init__(self, args):
+        self.tokenizer = AutoTokenizer.from_pretrained(args.model_name)
+        self.max_length = min(self.tokenizer.model_max_length, args.max_length)
+        self.device = torch.device(
+            "cuda" if torch.cuda.is_available() and not args.cpu else "cpu"
+        )
+        dtype = torch.bfloat16
+        if self.device.type == "cpu" and args.cpu_dtype == "float32":
+            dtype = torch.float32
+        self.model = AutoModelForSequenceClassification.from_pretrained(
+            args.model_name, torch_dtype=dtype
+        )
+        self.model.to(self.device)
+        self.model.eval()
+        if args.compile:
+            # Dynamic shapes: the length buckets change the sequence length of every batch
+            self.model = torch.compile(self.model, dynamic=True)
+        self.max_tokens_per_batch = args.max_tokens_per_batch
+        self.max_batch_size = args.max_batch_size
+
+        self.pool = ProcessPoolExecutor(
+            args.num_tokenizer_workers,
+            initializer=init_tokenizer,
+            initargs=(args.model_name,),
+        )
+        self.tokenize_batch_size = args.tokenize_batch_size
+
+    def submit_tokenization(self, texts):
+        """Tokenizes `texts` in the background, returns the futures of the sub-batches."""
+        return [
+            self.pool.submit(
+                tokenize, texts[i : i + self.tokenize_batch_size], self.max_length
+            )
+            for i in range(0, len(texts), self.tokenize_batch_size)
+        ]
+
+    @torch.no_grad()
+    def score(self, tokenization_futures):
+        """Scores of the tokenized documents, in the order of the documents."""
+        input_ids = [ids for future in tokenization_futures for ids in future.result()]
+        lengths = np.fromiter((len(ids) for ids in input_ids), dtype=np.int64)
+        scores = np.zeros(len(input_ids), dtype=np.float32)
+        for batch in token_budget_batches(
+            lengths, self.max_tokens_per_batch, self.max_batch_size
+        ):
+            inputs = self.tokenizer.pad(
+                {"input_ids": [input_ids[idx] for idx in batch]}, return_tensors="pt"
+            ).to(self.device)
+            outputs = self.model(**inputs)
+            scores[batch] = outputs.logits.squeeze(-1).float().cpu().numpy()
+        return scores
+
+    def close(self):
+        self.pool.shutdown()
 
-def main(args):
-    tokenizer = AutoTokenizer.from_pretrained(args.model_name)
-    model = AutoModelForSequenceClassification.from_pretrained(
-        args.model_name, torch_dtype=torch.bfloat16
-    )
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-    model.to(device)
 
+def main(args):
     dataset = load_dataset(
         args.dataset_name,
         args.dataset_config,
@@ -19,27 +109,64 @@ def main(args):
         cache_dir="/scratch/cosmo/cache/",
         num_proc=12,
     )
-    dataset = dataset.filter(
-        lambda x, i: i % args.num_shards == args.shard, with_indices=True, num_proc=12
+    # Same documents as `i % num_shards == shard`, without a full pass over the dataset
+    dataset = dataset.shard(args.num_shards, args.shard, contiguous=False)
+
+    output_dir = os.path.join(
+        args.output_dir, f"{args.output_dataset_config}_{args.shard}"
     )
+    os.makedirs(output_dir, exist_ok=True)
+    chunk_starts = list(range(0, len(dataset), args.chunk_size))
+    chunk_paths = [
+        os.path.join(output_dir, f"chunk_{chunk_idx:05d}.parquet")
+        for chunk_idx in range(len(chunk_starts))
+    ]
+    # Resume: the chunks already written are skipped
+    todo = [
+        chunk_idx
+        for chunk_idx, path in enumerate(chunk_paths)
+        if not os.path.exists(path)
+    ]
+    print(f"{len(chunk_paths) - len(todo)}/{len(chunk_paths)} chunks already scored")
 
-    def compute_scores(batch):
-        inputs = tokenizer(
-            batch[args.text_column],
-            return_tensors="pt",
-            padding="longest",
-            truncation=True,
-        ).to(device)
-        with torch.no_grad():
-            outputs = model(**inputs)
-            logits = outputs.logits.squeeze(-1).float().cpu().numpy()
+    def get_chunk(chunk_idx):
+        start = chunk_starts[chunk_idx]
+        return dataset.select(range(start, min(start + args.chunk_size, len(dataset))))
 
-        batch["score"] = logits.tolist()
-        batch["int_score"] = [int(round(max(0, min(score, 5)))) for score in logits]
-        return batch
+    scorer = EduScorer(args)
+    # The next chunk is tokenized in the background while the current one is scored
+    next_futures = (
+        scorer.submit_tokenization(get_chunk(todo[0])[args.text_column])
+        if todo
+        else None
+    )
+    for i, chunk_idx in enumerate(todo):
+        futures = next_futures
+        if i + 1 < len(todo):
+            next_futures = scorer.submit_tokenization(
+                get_chunk(todo[i + 1])[args.text_column]
+            )
+        scores = scorer.score(futures)
 
-    dataset = dataset.map(compute_scores, batched=True, batch_size=512)
+        chunk = get_chunk(chunk_idx)
+        chunk = chunk.add_column("score", scores.tolist())
+        chunk = chunk.add_column(
+            "int_score", [int(round(max(0, min(score, 5)))) for score in scores]
+        )
+        chunk.to_parquet(chunk_paths[chunk_idx] + ".tmp")
+        os.replace(chunk_paths[chunk_idx] + ".tmp", chunk_paths[chunk_idx])
+        print(f"Scored chunk {chunk_idx + 1}/{len(chunk_paths)}")
+    scorer.close()
 
+    if args.no_push:
+        return
+    # The chunks are memory-mapped, nothing is held in memory
+    dataset = concatenate_datasets(
+        [
+            load_dataset("parquet", data_files=path, split="train")
+            for path in chunk_paths
+        ]
+    )
     while True:
         try:
             config_name = f"{args.output_dataset_config}_{args.shard}"
@@ -70,6 +197,44 @@ if __name__ == "__main__":
     parser.add_argument("--text_column", type=str, default="text")
     parser.add_argument("--shard", type=int, required=True)
     parser.add_argument("--num_shards", type=int, required=True)
+    parser.add_argument(
+        "--output_dir",
+        type=str,
+        default="edu_scores",
+        help="Where the scored chunks are written, and read back from when resuming.",
+    )
+    parser.add_argument(
+        "--chunk_size",
+        type=int,
+        default=100_000,
+        help="Number of documents scored and written at once.",
+    )
+    parser.add_argument("--max_length", type=int, default=512)
+    parser.add_argument(
+        "--max_tokens_per_batch",
+        type=int,
+        default=65536,
+        help="Token budget of a batch (batch size x padded length).",
+    )
+    parser.add_argument("--max_batch_size", type=int, default=512)
+    parser.add_argument("--num_tokenizer_workers", type=int, default=4)
+    parser.add_argument("--tokenize_batch_size", type=int, default=1000)
+    parser.add_argument(
+        "--cpu", action="store_true", help="Score on CPU even if a GPU is available."
+    )
+    parser.add_argument(
+        "--cpu_dtype",
+        type=str,
+        default="bfloat16",
+        choices=["bfloat16", "float32"],
+        help="dtype of the model on CPU (it is always bfloat16 on GPU).",
+    )
+    parser.add_argument(
+        "--compile",
+        action="store_true",
+        help="torch.compile the model with dynamic shapes.",
+    )
+    parser.add_argument("--no_push", action="store_true", help="Only write the chunks.")
 
     args = parser.parse_args()
     main(args)
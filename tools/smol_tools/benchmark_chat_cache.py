@@ -0,0 +1,53 @@
+"""Time to first token of SmolChatter along a conversation, with and without the KV-cache sessions.
+
+Between two chat turns, another tool sharing the model is run, which overwrites the model state like
+switching tools in the demo does. Without the state cache every turn re-processes the whole history,
+with it only the new user turn is evaluated.
+
+Usage:
+    python benchmark_chat_cache.py --turns 20
+    python benchmark_chat_cache.py --turns 20 --no_cache
+"""
+import argparse
+import time
+
+from smol_tools.base import model_registry
+from smol_tools.chatter import SmolChatter
+from smol_tools.rewriter import SmolRewriter
+
+QUESTIONS = [
+    "Tell me about the history of the printing press.",
+    "Who were the main people involved?",
+    "How did it change the way books were made?",
+    "What came before it?",
+    "Give me three consequences for science.",
+]
+
+def time_to_first_token(stream):
+    start = time.perf_counter()
+    ttft = None
+    for chunk in stream:
+        if ttft is None:
+            ttft = time.perf_counter() - start
+    return ttft
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--turns", type=int, default=20)
+    parser.add_argument("--no_cache", action="store_true", help="Disable the state cache")
+    args = parser.parse_args()
+
+    if args.no_cache:
+        model_registry.configure(max_cached_sessions=0)
+    chatter = SmolChatter()
+    # Shares the model of the chatter
+    rewriter = SmolRewriter()
+    chatter.start_new_chat()
+
+    for turn in range(1, args.turns + 1):
+        rewriter.process_to_text("This sentence are not very well writen.")
+        ttft = time_to_first_token(chatter.process(QUESTIONS[(turn - 1) % len(QUESTIONS)]))
+        print(f"turn {turn:3d}: time to first token {ttft * 1000:8.1f} ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""Startup time of the demo: time until the tools are created (when the app can show its windows),
+and time until their models are loaded and warmed up.
+
+Usage:
+    python benchmark_startup.py
+    python benchmark_startup.py --eager  # wait for each model when creating its tool, like before
+    python benchmark_startup.py --n_threads 8 --n_batch 1024 --no_mmap
+"""
+import argparse
+import time
+
+from smol_tools.base import model_registry
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--eager", action="store_true", help="Wait for the model of each tool when creating it")
+    parser.add_argument("--n_threads", type=int, default=None)
+    parser.add_argument("--n_batch", type=int, default=512)
+    parser.add_argument("--no_mmap", action="store_true")
+    args = parser.parse_args()
+
+    model_registry.configure(n_threads=args.n_threads, n_batch=args.n_batch, use_mmap=not args.no_mmap)
+
+    start = time.perf_counter()
+    # Imported here, as importing the agent (transformers) is part of the startup
+    from smol_tools.summarizer import SmolSummarizer
+    from smol_tools.rewriter import SmolRewriter
+    from smol_tools.titler import SmolTitler
+    from smol_tools.agent import SmolToolAgent
+    from smol_tools.chatter import SmolChatter
+
+    tools = []
+    for tool_class in [SmolSummarizer, SmolRewriter, SmolTitler, SmolToolAgent, SmolChatter]:
+        tool = tool_class()
+        tool.preload()
+        if args.eager:
+            tool.wait_until_ready()
+        tools.append(tool)
+    tools_created = time.perf_counter() - start
+
+    for tool in tools:
+        tool.wait_until_ready()
+    models_ready = time.perf_counter() - start
+
+    print(f"Tools created (app can start): {tools_created:6.2f}s")
+    print(f"Models loaded and warmed up:   {models_ready:6.2f}s")
+
+if __name__ == "__main__":
+    main()
@@ -14,6 +14,44 @@ from smol_tools.titler import SmolTitler
 import os
 import getpass
 
+class StreamBuffer:
+    """Collects the deltas streamed by a tool in a worker thread and flushes them to the UI
+    from the Tk main loop at a fixed frame rate, instead of scheduling one UI update per token."""
+
+    def __init__(self, root, on_flush, on_done=None, fps=30):
+        self.root = root
+        self.on_flush = on_flush
+        self.on_done = on_done
+        self.interval_ms = max(1, int(1000 / fps))
+        self._lock = threading.Lock()
+        self._pending = []
+        self._closed = False
+        self.root.after(self.interval_ms, self._flush)
+
+    def put(self, delta: str):
+        """Called from the worker thread"""
+        if delta:
+            with self._lock:
+                self._pending.append(delta)
+
+    def close(self):
+        """Called from the worker thread once the stream is over: flushes what's left, then calls on_done"""
+        with self._lock:
+            self._closed = True
+
+    def _flush(self):
+        with self._lock:
+            text = "".join(self._pending)
+            self._pending.clear()
+            closed = self._closed
+        if text:
+            self.on_flush(text)
+        if closed:
+            if self.on_done:
+                self.on_done()
+        else:
+            self.root.after(self.interval_ms, self._flush)
+
 class TextPopupApp:
     def __init__(self, root):
         self.root = root
@@ -28,6 +66,10 @@ class TextPopupApp:
         self.titler = SmolTitler()
         self.agent = SmolToolAgent()
         self.chatter = SmolChatter()
+        # The models are loaded and warmed up in a background thread, so the app starts right away.
+        # The tools share their model files, which are only loaded once.
+        for tool in [self.summarizer, self.rewriter, self.titler, self.agent, self.chatter]:
+            tool.preload()
         
         self.keyboard_controller = Controller()
         
@@ -46,6 +88,14 @@ class TextPopupApp:
         
         self.username = getpass.getuser()  # Get system username
 
+    def show_loading_state(self, window, tool, title: str):
+        """Set the window title, showing that the model of the tool is loading until it is ready"""
+        if tool.is_ready():
+            window.title(title)
+            return
+        window.title(f"{title} (loading model...)")
+        self.root.after(250, lambda: window.winfo_exists() and self.show_loading_state(window, tool, title))
+
     def generate_summary_from_selected_text(self):
         selected_text = self.get_selected_text()
         if selected_text:
@@ -57,7 +107,7 @@ class TextPopupApp:
         summary_popup = tk.Toplevel(self.root)
         summary_popup.withdraw()  # Hide the window initially
         self.active_popups.append(summary_popup)
-        summary_popup.title("Summary Chat")
+        self.show_loading_state(summary_popup, self.summarizer, "Summary Chat")
         summary_popup.configure(bg='#f6f8fa')
         
         # Set minimum window size
@@ -188,16 +238,12 @@ class TextPopupApp:
                 self.root.after(0, lambda: self.update_summary_chat(
                     chat_display, self.summarizer.name, ""))
                 
-                current_response = ""
-                for output in self.summarizer.process(input_text):
-                    # Only send the new part of the response
-                    if output.startswith(current_response):
-                        new_text = output[len(current_response):]
-                        if new_text:  # Only update if there's new text
-                            current_response = output
-                            self.root.after(0, lambda t=new_text: chat_display.config(state='normal') or 
-                                chat_display.insert("end-1c", t) or 
-                                chat_display.config(state='disabled'))
+                buffer = StreamBuffer(self.root, lambda t: self.append_summary_text(chat_display, t))
+                try:
+                    for chunk in self.summarizer.process(input_text):
+                        buffer.put(chunk.delta)
+                finally:
+                    buffer.close()
             except Exception as e:
                 print(e)
         
@@ -216,6 +262,13 @@ class TextPopupApp:
         chat_display.see(tk.END)
         chat_display.config(state='disabled')
 
+    def append_summary_text(self, chat_display: tk.Text, new_text: str):
+        """Append streamed text to the last message of the summary chat"""
+        chat_display.config(state='normal')
+        chat_display.insert("end-1c", new_text)
+        chat_display.see(tk.END)
+        chat_display.config(state='disabled')
+
     def process_summary_question(self, original_text: str, question: str, 
                                chat_display: tk.Text, chat_input: tk.Text):
         """Process a follow-up question about the summarized text"""
@@ -234,16 +287,12 @@ class TextPopupApp:
                 self.root.after(0, lambda: self.update_summary_chat(
                     chat_display, self.summarizer.name, ""))
 
-                current_response = ""
-                for output in self.summarizer.process(original_text, question=question):
-                    # Only send the new part of the response
-                    if output.startswith(current_response):
-                        new_text = output[len(current_response):]
-                        if new_text:  # Only update if there's new text
-                            current_response = output
-                            self.root.after(0, lambda t=new_text: chat_display.config(state='normal') or 
-                                chat_display.insert("end-1c", t) or 
-                                chat_display.config(state='disabled'))
+                buffer = StreamBuffer(self.root, lambda t: self.append_summary_text(chat_display, t))
+                try:
+                    for chunk in self.summarizer.process(original_text, question=question):
+                        buffer.put(chunk.delta)
+                finally:
+                    buffer.close()
             except Exception as e:
                 print(e)
 
@@ -273,7 +322,7 @@ class TextPopupApp:
         draft_popup = tk.Toplevel(self.root)
         draft_popup.withdraw()  # Hide initially
         self.active_popups.append(draft_popup)
-        draft_popup.title("Draft Reply")
+        self.show_loading_state(draft_popup, self.rewriter, "Draft Reply")
         draft_popup.configure(bg='#f6f8fa')
         
         # Create frame for the two columns
@@ -417,38 +466,40 @@ class TextPopupApp:
         improved_text_widget.config(state='disabled')
         
         def improve(input_text):
+            # The placeholder is replaced by the first flush, the next ones append to it
+            started = []
+            def on_flush(new_text):
+                self.update_improved_text(improved_text_widget, new_text, append=bool(started))
+                started.append(True)
+
+            # Re-enable button and restore original state once the generation is complete (or failed)
+            buffer = StreamBuffer(self.root, on_flush, on_done=lambda: improve_btn.config(
+                state='normal',
+                text="Copy",
+                bg='#0066FF'
+            ))
             try:
-                for output in self.rewriter.process(input_text):
-                    self.root.after(0, lambda t=output: self.update_improved_text(improved_text_widget, t))
-                
-                # Re-enable button and restore original state after generation is complete
-                self.root.after(0, lambda: improve_btn.config(
-                    state='normal',
-                    text="Copy",
-                    bg='#0066FF'
-                ))
-            except Exception as e:
-                # Make sure to re-enable button even if there's an error
-                self.root.after(0, lambda: improve_btn.config(
-                    state='normal',
-                    text="Copy",
-                    bg='#0066FF'
-                ))
-                raise e
+                for chunk in self.rewriter.process(input_text):
+                    buffer.put(chunk.delta)
+            finally:
+                buffer.close()
         
         threading.Thread(target=lambda: improve(text), daemon=True).start()
 
-    def update_improved_text(self, text_widget, new_text):
+    def update_improved_text(self, text_widget, new_text, append=False):
         text_widget.config(state='normal')
-        text_widget.delete("1.0", tk.END)
-        text_widget.insert("1.0", new_text)
+        if append:
+            text_widget.insert("end-1c", new_text)
+        else:
+            text_widget.delete("1.0", tk.END)
+            text_widget.insert("1.0", new_text)
         text_widget.config(state='disabled')
 
     def show_agent_input(self):
         # Create new popup for agent input
         agent_popup = tk.Toplevel(self.root)
         self.active_popups.append(agent_popup)
-        agent_popup.title("SmolAgent")
+        self.show_loading_state(agent_popup, self.agent, "SmolAgent")
         
         # Create input area
         input_frame = tk.Frame(agent_popup)
@@ -475,10 +526,18 @@ class TextPopupApp:
             output_text.config(state='disabled')
             
             def run_agent():
-                full_response = []
-                for response in self.agent.process(query):
-                    full_response.append(response)
-                    self.root.after(0, lambda t="\n".join(full_response): self.update_agent_output(output_text, t))
+                # The "Processing request..." placeholder is replaced by the first flush
+                started = []
+                def on_flush(new_text):
+                    self.update_agent_output(output_text, new_text, append=bool(started))
+                    started.append(True)
+
+                buffer = StreamBuffer(self.root, on_flush)
+                try:
+                    for chunk in self.agent.process(query):
+                        buffer.put(chunk.delta)
+                finally:
+                    buffer.close()
             
             threading.Thread(target=run_agent, daemon=True).start()
         
@@ -496,16 +555,19 @@ class TextPopupApp:
         y = (screen_height - popup_height) // 2
         agent_popup.geometry(f"+{x}+{y}")
 
-    def update_agent_output(self, text_widget, new_text):
+    def update_agent_output(self, text_widget, new_text, append=False):
         text_widget.config(state='normal')
-        text_widget.delete("1.0", tk.END)
-        text_widget.insert("1.0", new_text)
+        if append:
+            text_widget.insert("end-1c", new_text)
+        else:
+            text_widget.delete("1.0", tk.END)
+            text_widget.insert("1.0", new_text)
         text_widget.config(state='disabled')
 
     def show_chat_window(self):
         chat_window = tk.Toplevel(self.root)
         self.active_popups.append(chat_window)
-        chat_window.title("SmolChat")
+        self.show_loading_state(chat_window, self.chatter, "SmolChat")
         
         # Configure the chat window to be resizable
         chat_window.geometry("800x800")
@@ -609,9 +671,7 @@ class TextPopupApp:
                 self.chatter.save_current_chat(current_chat_id, overwrite=True)
             else:
                 # Generate new title for new chat
-                summary = ""
-                for chunk in self.titler.process(chat_history):
-                    summary = chunk
+                summary = self.titler.process_to_text(chat_history)
                 
                 summary_title = summary[:50].strip().replace("/", "-").replace("\\", "-")
                 self.chatter.save_current_chat(summary_title, overwrite=True)
@@ -658,25 +718,19 @@ class TextPopupApp:
         chat_input = input_frame.children['!text']
         chat_input.delete("1.0", tk.END)
         
-        # Initialize an empty string to store the full response
-        self.current_response = ""
-        
         chat_display.see(tk.END)
         chat_display.config(state='disabled')
         
         def chat_response():
+            # Re-enable chat controls after response is complete
+            buffer = StreamBuffer(self.root, lambda t: self.update_chat_display(chat_display, t),
+                                  on_done=self.enable_chat_controls)
             try:
                 for chunk in self.chatter.process(message):
-                    # Only send the new part of the response
-                    if chunk.startswith(self.current_response):
-                        new_text = chunk[len(self.current_response):]
-                        if new_text:  # Only update if there's new text
-                            self.current_response = chunk
-                            self.root.after(0, lambda t=new_text: self.update_chat_display(chat_display, t))
-                self.root.after(0, lambda t="\n\n": self.update_chat_display(chat_display, t))
+                    buffer.put(chunk.delta)
+                buffer.put("\n\n")
             finally:
-                # Re-enable chat controls after response is complete
-                self.root.after(0, self.enable_chat_controls)
+                buffer.close()
         
         threading.Thread(target=chat_response, daemon=True).start()
 
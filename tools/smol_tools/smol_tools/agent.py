@@ -1,4 +1,4 @@
-from .base import SmolTool
+from .base import SmolTool, StreamChunk, collect_text
 from typing import Generator, List, Dict, Any, Callable
 import json
 import re
@@ -73,22 +73,14 @@ class SmolToolAgent(SmolTool):
         )
 
     def llm_engine(self, messages, stop_sequences=["Task", "<|endoftext|>"]) -> str:
-        output = ""
-        for chunk in self.model.create_chat_completion(
-            messages=messages,
+        return collect_text(self._create_chat_completion(
+            messages,
             max_tokens=2048,
             temperature=0.0,
             top_p=1.0,
             top_k=50,
-            repeat_penalty=1.0,
-            stream=True
-        ):
-            content = chunk['choices'][0]['delta'].get('content')
-            if content:
-                if content in ["<end_action>", "<|endoftext|>"]:
-                    break
-                output += content
-        return output
+            repeat_penalty=1.0
+        ))
 
     def _get_system_prompt(self) -> str:
         return """You are an expert in composing functions. You are given a question and a set of possible functions.
@@ -128,20 +120,23 @@ The example format is as follows. Please make sure the parameter type is correct
                 tool_responses.append(f"Tool {tool_call['name']} not found.")
         return tool_responses
 
-    def process(self, text: str) -> Generator[str, None, None]:
+    def process(self, text: str) -> Generator[StreamChunk, None, None]:
         response = self.json_code_agent.run(text, return_generated_code=True)
         # Parse and execute the tool calls
         try:
             tool_calls = self._parse_response(response)
             if tool_calls in [response, [], ""]:
-                yield response
+                yield StreamChunk(delta=response)
+                yield StreamChunk(done=True, text=response)
                 return
             tool_responses = self._call_tools(tool_calls)
         except Exception as e:
             print("error", e)
-            yield response
+            yield StreamChunk(delta=response)
+            yield StreamChunk(done=True, text=response)
             return
 
-        # Yield each tool response
-        for response in tool_responses:
-            yield str(response)
\ No newline at end of file
+        # Yield each tool response, one per line
+        for i, response in enumerate(tool_responses):
+            yield StreamChunk(delta=("\n" if i > 0 else "") + str(response))
+        yield StreamChunk(done=True, text="\n".join(str(response) for response in tool_responses))
\ No newline at end of file
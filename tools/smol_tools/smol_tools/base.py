@@ -1,51 +1,173 @@
 from abc import ABC, abstractmethod
-from typing import Generator, List, Dict, Any, Union, Tuple
-from llama_cpp import Llama
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Generator, List, Dict, Any, Optional, Union, Tuple
+from huggingface_hub import hf_hub_download
+from llama_cpp import Llama, LlamaState
+import hashlib
+import json
+import os
+import pickle
+import threading
 
-class SmolTool(ABC):
-    # Class-level cache for model instances
-    _model_cache: Dict[Tuple[str, str], Llama] = {}
+@dataclass
+class StreamChunk:
+    """A piece of a streamed response.
+
+    Chunks carry the newly generated text in `delta`. The last chunk has `done=True`,
+    an empty `delta` and the full response in `text`, so consumers never need to
+    rebuild or re-render the whole response on every token.
+    """
+    delta: str = ""
+    done: bool = False
+    text: str = ""
+
+def messages_hash(messages: List[Dict[str, str]]) -> str:
+    """Hash of a list of chat messages, identifying the prompt prefix a llama.cpp state was evaluated on"""
+    return hashlib.sha1(json.dumps(messages, sort_keys=True).encode("utf-8")).hexdigest()
+
+class StateCache:
+    """LRU of llama.cpp states (evaluated tokens + KV cache), keyed by session id.
+
+    Each state is stored with the hash of the messages it was evaluated on, so a stale state
+    (e.g. the session was edited since) is never restored.
+    """
+
+    def __init__(self, max_size: int = 4):
+        self.max_size = max_size
+        self._states: "OrderedDict[str, Tuple[str, LlamaState]]" = OrderedDict()
+
+    def get(self, session_id: str) -> Optional[Tuple[str, LlamaState]]:
+        entry = self._states.get(session_id)
+        if entry is not None:
+            self._states.move_to_end(session_id)
+        return entry
+
+    def put(self, session_id: str, prefix_hash: str, state: LlamaState):
+        self._states[session_id] = (prefix_hash, state)
+        self._states.move_to_end(session_id)
+        while len(self._states) > self.max_size:
+            self._states.popitem(last=False)
+
+    def pop(self, session_id: str):
+        self._states.pop(session_id, None)
+
+class LoadedModel:
+    """A loaded model, with the llama.cpp states saved by the tools using it.
+
+    Tools sharing a model share its states, since any of them can overwrite the model's state.
+    """
+
+    def __init__(self, model: Llama, max_cached_sessions: int):
+        self.model = model
+        self.state_cache = StateCache(max_cached_sessions)
+        # (session id, prefix hash) of the saved state the model currently holds
+        self.active_session: Optional[Tuple[str, str]] = None
+
+class ModelRegistry:
+    """Loads the models of the tools on first use, in a background thread.
+
+    Models are deduplicated by file path (and context size), so tools using the same GGUF share
+    one instance. Each model is warmed up in the background thread once loaded, the futures
+    returned by `get` are done when the model is ready.
+    """
+
+    def __init__(self, n_threads: Optional[int] = None, n_batch: int = 512, use_mmap: bool = True,
+                 max_cached_sessions: int = 4):
+        self.n_threads = n_threads
+        self.n_batch = n_batch
+        self.use_mmap = use_mmap
+        self.max_cached_sessions = max_cached_sessions
+        # A single loader thread: models are loaded one at a time, in the order they're requested
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="smol-tools-loader")
+        self._lock = threading.Lock()
+        self._requests: Dict[Tuple[str, str, int], Future] = {}
+        # Only accessed from the loader thread
+        self._models: Dict[Tuple[str, int], LoadedModel] = {}
+
+    def configure(self, **kwargs):
+        """Set options (`n_threads`, `n_batch`, `use_mmap`, `max_cached_sessions`) of the models loaded from now on"""
+        for name, value in kwargs.items():
+            if name not in ["n_threads", "n_batch", "use_mmap", "max_cached_sessions"]:
+                raise ValueError(f"Unknown model option {name}")
+            setattr(self, name, value)
+
+    def get(self, model_repo: str, model_filename: str, n_ctx: int) -> "Future[LoadedModel]":
+        """Start loading the model if it isn't loaded or loading yet, returns its future"""
+        key = (model_repo, model_filename, n_ctx)
+        with self._lock:
+            if key not in self._requests:
+                self._requests[key] = self._executor.submit(self._load, model_repo, model_filename, n_ctx)
+            return self._requests[key]
+
+    def _load(self, model_repo: str, model_filename: str, n_ctx: int) -> LoadedModel:
+        model_path = os.path.realpath(hf_hub_download(repo_id=model_repo, filename=model_filename))
+        if (model_path, n_ctx) in self._models:
+            return self._models[(model_path, n_ctx)]
+
+        print(f"Loading model {model_filename} from {model_repo}...")
+        model = Llama(
+            model_path=model_path,
+            n_ctx=n_ctx,
+            n_threads=self.n_threads,
+            n_batch=self.n_batch,
+            use_mmap=self.use_mmap,
+            verbose=False
+        )
+        print(f"Warming up {model_filename}...")
+        for _ in model.create_chat_completion(
+            messages=[{"role": "user", "content": "This is a test message to warm up the model."}],
+            max_tokens=16,
+            stream=True
+        ):
+            pass
+        print(f"{model_filename} ready!")
+        self._models[(model_path, n_ctx)] = LoadedModel(model, self.max_cached_sessions)
+        return self._models[(model_path, n_ctx)]
+
+model_registry = ModelRegistry()
 
+class SmolTool(ABC):
     def __init__(self, model_repo: str, model_filename: str, system_prompt: str, prefix_text: str = "", n_ctx: int = 8192):
         self.system_prompt = system_prompt
         self.prefix_text = prefix_text
-        
-        # Create a cache key from the model repo and filename
-        cache_key = (model_repo, model_filename)
-        
-        # Track if this is a new model load
-        is_new_model = cache_key not in self._model_cache
-        
-        # Try to get the model from cache, or create and cache a new one
-        if is_new_model:
-            print(f"Loading model {model_filename} from {model_repo}...")
-            self._model_cache[cache_key] = Llama.from_pretrained(
-                repo_id=model_repo,
-                filename=model_filename,
-                n_ctx=n_ctx,
-                verbose=False
-            )
-        
-        self.model = self._model_cache[cache_key]
-        
-        # Only warm up for newly loaded models
-        if is_new_model:
-            self._warm_up()
-
-    def _warm_up(self):
-        """Warm up the model with a test prompt"""
-        print(f"Warming up {self.__class__.__name__}...")
-        test_text = "This is a test message to warm up the model."
-        # Consume the generator to complete the warm-up
-        for _ in self.process(test_text):
-            pass
-        print(f"{self.__class__.__name__} ready!")
+        self.model_repo = model_repo
+        self.model_filename = model_filename
+        self.n_ctx = n_ctx
+        # The model is loaded on first use (or `preload`), by `model_registry`
+        self._model_future: Optional[Future] = None
+
+    def preload(self) -> Future:
+        """Start loading and warming up the model in the background, without waiting for it"""
+        if self._model_future is None:
+            self._model_future = model_registry.get(self.model_repo, self.model_filename, self.n_ctx)
+        return self._model_future
+
+    def is_ready(self) -> bool:
+        """Whether the model is loaded and warmed up"""
+        return self._model_future is not None and self._model_future.done()
+
+    def wait_until_ready(self) -> LoadedModel:
+        return self.preload().result()
+
+    @property
+    def model(self) -> Llama:
+        return self.wait_until_ready().model
+
+    @property
+    def state_cache(self) -> StateCache:
+        return self.wait_until_ready().state_cache
 
     @abstractmethod
-    def process(self, text: str) -> Generator[str, None, None]:
-        """Process the input text and yield results as they're generated"""
+    def process(self, text: str) -> Generator[StreamChunk, None, None]:
+        """Process the input text and yield the deltas of the result as they're generated, then the final message"""
         pass
 
+    def process_to_text(self, text: str, **kwargs) -> str:
+        """Process the input text and return the full result"""
+        return collect_text(self.process(text, **kwargs))
+
     def _create_chat_completion(
         self, 
         messages: List[Dict[str, str]], 
@@ -53,10 +175,26 @@ class SmolTool(ABC):
         top_p: float = 0.9,
         top_k: int = 50,
         repeat_penalty: float = 1.2,
-        max_tokens: int = 256
-    ) -> Generator[str, None, None]:
-        """Helper method to create chat completions with standard parameters"""
-        output = ""
+        max_tokens: int = 256,
+        session_id: Optional[str] = None,
+        session_prefix_hash: Optional[str] = None
+    ) -> Generator[StreamChunk, None, None]:
+        """Helper method to create chat completions with standard parameters.
+        Yields a chunk per generated token, then a final chunk with the full response.
+
+        With a `session_id`, the llama.cpp state saved at the end of the previous completion of the
+        session is restored first if the model doesn't hold it anymore, so that only the new messages
+        are evaluated (llama.cpp reuses the longest common token prefix). The state is saved again
+        once the response is complete.
+
+        The state is identified by the hash of the conversation it was evaluated on, or by
+        `session_prefix_hash` when given: e.g. the hash of a document every prompt of the session
+        starts with, so the state of any previous completion is reused for its common prefix."""
+        if session_id is not None:
+            self._restore_session(session_id, session_prefix_hash or messages_hash(messages[:-1]))
+        # The model state is about to change, it no longer holds any saved session
+        self.wait_until_ready().active_session = None
+        parts = []
         for chunk in self.model.create_chat_completion(
             messages=messages,
             max_tokens=max_tokens,
@@ -70,5 +208,63 @@ class SmolTool(ABC):
             if content:
                 if content in ["<end_action>", "<|endoftext|>"]:
                     break
-                output += content
-                yield output
\ No newline at end of file
+                parts.append(content)
+                yield StreamChunk(delta=content)
+        text = "".join(parts)
+        if session_id is not None:
+            self._save_session(
+                session_id,
+                session_prefix_hash or messages_hash(messages + [{"role": "assistant", "content": text}])
+            )
+        yield StreamChunk(done=True, text=text)
+
+    def _restore_session(self, session_id: str, prefix_hash: str):
+        """Load the saved state of the session into the model, if it matches `prefix_hash`"""
+        loaded_model = self.wait_until_ready()
+        if loaded_model.active_session == (session_id, prefix_hash):
+            return
+        entry = loaded_model.state_cache.get(session_id)
+        if entry is not None and entry[0] == prefix_hash:
+            loaded_model.model.load_state(entry[1])
+            loaded_model.active_session = (session_id, prefix_hash)
+
+    def _save_session(self, session_id: str, prefix_hash: str):
+        loaded_model = self.wait_until_ready()
+        loaded_model.state_cache.put(session_id, prefix_hash, loaded_model.model.save_state())
+        loaded_model.active_session = (session_id, prefix_hash)
+
+    def save_session_state(self, session_id: str, path: str) -> bool:
+        """Write the cached state of a session to `path`, returns whether there was one"""
+        if not self.is_ready():
+            # Nothing was generated yet, so there is no state
+            return False
+        entry = self.state_cache.get(session_id)
+        if entry is None:
+            return False
+        with open(path, 'wb') as f:
+            pickle.dump({'prefix_hash': entry[0], 'state': entry[1]}, f)
+        return True
+
+    def load_session_state(self, session_id: str, path: str) -> bool:
+        """Read a state written by `save_session_state` into the cache, returns whether there was one"""
+        try:
+            with open(path, 'rb') as f:
+                data = pickle.load(f)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError) as e:
+            if not isinstance(e, FileNotFoundError):
+                print(f"Could not load the state in {path}: {e}")
+            return False
+        self.state_cache.put(session_id, data['prefix_hash'], data['state'])
+        return True
+
+def collect_text(stream: Generator[StreamChunk, None, None]) -> str:
+    """Consume a stream of chunks and return the full text"""
+    # The stream is consumed to the end: tools may still have work to do after the final chunk
+    text = None
+    parts = []
+    for chunk in stream:
+        if chunk.done:
+            text = chunk.text
+        else:
+            parts.append(chunk.delta)
+    return text if text is not None else "".join(parts)
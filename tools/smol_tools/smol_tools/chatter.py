@@ -1,9 +1,10 @@
-from .base import SmolTool
+from .base import SmolTool, StreamChunk
 from typing import Generator, List, Dict
 from dataclasses import dataclass
 from datetime import datetime
 import json
 import os
+import uuid
 
 @dataclass
 class ChatMessage:
@@ -35,6 +36,9 @@ class SmolChatter(SmolTool):
         self.chats_dir = "saved_chats"
         self._original_chat_state = None  # To track modifications
         self.name = "SmolLM2-1.7B"
+        # Key of the llama.cpp state of the current chat in the state cache
+        self._session_id = uuid.uuid4().hex
+        self._state_path = None
         
         # Create chats directory if it doesn't exist
         if not os.path.exists(self.chats_dir):
@@ -51,6 +55,14 @@ class SmolChatter(SmolTool):
         self.current_chat_id = datetime.now().strftime("%Y%m%d_%H%M%S")
         self.chat_history = []
         self._original_chat_state = None
+        self._new_session()
+
+    def _new_session(self):
+        if self.is_ready():
+            self.state_cache.pop(self._session_id)
+        self._session_id = uuid.uuid4().hex
+        # State saved with the chat, loaded on the next turn so that loading a chat doesn't wait for the model
+        self._state_path = None
 
     def has_current_chat(self) -> bool:
         """Check if there are any messages in the current chat"""
@@ -78,6 +90,8 @@ class SmolChatter(SmolTool):
         filename = f"{self.chats_dir}/chat_{self.current_chat_id}.json"
         with open(filename, 'w') as f:
             json.dump(chat_data, f)
+        # Save the KV cache next to the chat, so that reopening it doesn't re-process the history
+        self.save_session_state(self._session_id, f"{self.chats_dir}/chat_{self.current_chat_id}.state")
             
         # Update original state to reflect saved state
         self._original_chat_state = [msg.to_dict() for msg in self.chat_history]
@@ -92,6 +106,8 @@ class SmolChatter(SmolTool):
                 self.chat_history = [ChatMessage.from_dict(msg) for msg in data['messages']]
                 # Store original state for modification tracking
                 self._original_chat_state = [msg.to_dict() for msg in self.chat_history]
+            self._new_session()
+            self._state_path = f"{self.chats_dir}/chat_{chat_id}.state"
         except FileNotFoundError:
             print(f"Chat {chat_id} not found")
 
@@ -113,11 +129,7 @@ class SmolChatter(SmolTool):
                 chats.append(chat_id)
         return sorted(chats, reverse=True)  # Most recent first
 
-    def _warm_up(self):
-        super()._warm_up()
-        self.clear_chat_history()
-
-    def process(self, text: str) -> Generator[str, None, None]:
+    def process(self, text: str) -> Generator[StreamChunk, None, None]:
         # Add user message to history
         self.chat_history.append(ChatMessage(
             role="user",
@@ -131,10 +143,15 @@ class SmolChatter(SmolTool):
         for msg in self.chat_history:
             messages.append({"role": msg.role, "content": msg.content})
 
+        if self._state_path is not None:
+            self.load_session_state(self._session_id, self._state_path)
+            self._state_path = None
+
         # Generate response
         response = ""
-        for chunk in self._create_chat_completion(messages, max_tokens=1024):
-            response = chunk
+        for chunk in self._create_chat_completion(messages, max_tokens=1024, session_id=self._session_id):
+            if chunk.done:
+                response = chunk.text
             yield chunk
         
         # Add assistant's response to history
@@ -149,6 +166,7 @@ class SmolChatter(SmolTool):
     
     def clear_chat_history(self):
         self.chat_history = []
+        self._new_session()
 
     def get_current_chat_id(self) -> str:
         """Get the ID of the current chat"""
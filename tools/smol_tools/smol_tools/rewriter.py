@@ -1,4 +1,4 @@
-from .base import SmolTool
+from .base import SmolTool, StreamChunk
 from typing import Generator
 
 class SmolRewriter(SmolTool):
@@ -10,7 +10,7 @@ class SmolRewriter(SmolTool):
             prefix_text="Rewrite the message below to make it more professional and approachable while maintaining its main points and key message. Do not add any new information or return any text other than the rewritten message\nThe message:"
         )
 
-    def process(self, text: str) -> Generator[str, None, None]:
+    def process(self, text: str) -> Generator[StreamChunk, None, None]:
         messages = [
             {"role": "system", "content": self.system_prompt},
             {"role": "user", "content": f"{self.prefix_text}\n{text}"}
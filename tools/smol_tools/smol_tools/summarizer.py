@@ -1,4 +1,4 @@
-from .base import SmolTool
+from .base import SmolTool, StreamChunk, messages_hash
 from typing import Generator, Optional
 from dataclasses import dataclass
 from datetime import datetime
@@ -19,8 +19,12 @@ class SmolSummarizer(SmolTool):
             model_filename="smollm2-1.7b-8k-dpo-f16.gguf",
             system_prompt="Concisely summarize the main points of the input text in up to three sentences, focusing on key information and events.",
         )
+        # Follow-up questions about a document share the prompt prefix up to the question, its
+        # llama.cpp state is kept for the current document only
+        self._qa_session_id = f"{self.__class__.__name__}-{id(self)}-qa"
+        self._qa_document_hash = None
 
-    def process(self, text: str, question: Optional[str] = None) -> Generator[str, None, None]:
+    def process(self, text: str, question: Optional[str] = None) -> Generator[StreamChunk, None, None]:
         if question is None:
             print("Summarizing text")
             prompt = f"{self.prefix_text}\n{text}"
@@ -35,6 +39,16 @@ class SmolSummarizer(SmolTool):
             messages = [
                 {"role": "user", "content": prompt},
             ]
+            document_hash = messages_hash([{"role": "user", "content": text}])
+            if document_hash != self._qa_document_hash:
+                # New document: the state of the previous one can't be reused anymore
+                self.state_cache.pop(self._qa_session_id)
+                self._qa_document_hash = document_hash
+            # Only the question (and what follows it) is evaluated, the document comes from the saved state
+            yield from self._create_chat_completion(
+                messages, max_tokens=1024, temperature=0.1, top_p=0.9,
+                session_id=self._qa_session_id, session_prefix_hash=document_hash
+            )
+            return
 
-        for chunk in self._create_chat_completion(messages, max_tokens=1024, temperature=0.1, top_p=0.9):
-            yield chunk
+        yield from self._create_chat_completion(messages, max_tokens=1024, temperature=0.1, top_p=0.9)
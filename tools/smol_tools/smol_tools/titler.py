@@ -1,4 +1,4 @@
-from .base import SmolTool
+from .base import SmolTool, StreamChunk
 from typing import Generator
 
 class SmolTitler(SmolTool):
@@ -10,7 +10,7 @@ class SmolTitler(SmolTool):
             prefix_text="Create a title for this conversation:",
         )
 
-    def process(self, text: str) -> Generator[str, None, None]:
+    def process(self, text: str) -> Generator[StreamChunk, None, None]:
         messages = [
             {"role": "user", "content": f"{self.prefix_text}\n{text}"}
         ]
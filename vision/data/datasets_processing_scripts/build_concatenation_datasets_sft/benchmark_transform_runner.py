@@ -0,0 +1,272 @@
+"""
+Checks and benchmark of `TransformRunner` and `ImageBytesCache` (`m4/utils/datasets/transform_runner.py`), used by
+`build_ds_sft.py`, on tiny synthetic source datasets built like the ones of `build_ds_sft.py`:
+- `from_files`: a dataset built in memory from image files (JPEG, PNG and BMP) with `convert_img_to_bytes`,
+- `decoded_{idx}`: datasets with a decoded `image` column, transformed with `example["images"] = [example["image"]]`,
+- `filtered`: a filter of `from_files`, and `merged`: the concatenation of all of them.
+
+The script checks that:
+- the texts are the ones of the previous build (`convert_img_to_bytes` re-encoding every image, and sequential
+  `datasets.map`), and the pixels are the ones of the image files (the previous build re-encodes the JPEG files),
+- the BMP files are encoded once, even when two datasets use the same file, and the JPEG and PNG files are not
+  re-encoded,
+- a second run only loads the cached results, and a change in the code of a transform only recomputes it and the
+  datasets depending on it,
+- the independent datasets are computed in parallel.
+It reports the time of each build, and the time spent per transform.
+
+Usage:
+    python data/datasets_processing_scripts/build_concatenation_datasets_sft/benchmark_transform_runner.py
+"""
+import argparse
+import os
+import tempfile
+import time
+from io import BytesIO
+
+import datasets
+import numpy as np
+from datasets import concatenate_datasets
+from PIL import Image
+
+from m4.utils.datasets.transform_runner import ImageBytesCache, TransformRunner
+
+
+FEATURES = datasets.Features(
+    {
+        "images": datasets.Sequence(datasets.Image(decode=True)),
+        "texts": [
+            {
+                "user": datasets.Value("string"),
+                "assistant": datasets.Value("string"),
+                "source": datasets.Value("string"),
+            }
+        ],
+    }
+)
+PROMPTS = ["Describe this image.", "Caption this image.", "What does this picture show?"]
+IMAGE_FORMATS = {"jpeg": "JPEG", "png": "PNG", "bmp": "BMP"}
+
+
+def previous_convert_img_to_bytes(img_path, format):
+    img = Image.open(img_path)
+    buffer = BytesIO()
+    img.save(buffer, format=format)
+    img_bytes = buffer.getvalue()
+    img.close()
+    return img_bytes
+
+
+def make_image_files(directory, num_images, image_size, seed):
+    rng = np.random.default_rng(seed)
+    paths = []
+    for idx in range(num_images):
+        extension = list(IMAGE_FORMATS)[idx % len(IMAGE_FORMATS)]
+        # Smooth gradients with noise, so that the images don't compress to almost nothing
+        pixels = np.linspace(0, 255, image_size, dtype=np.float32)[None, :, None] * rng.random((1, 1, 3))
+        pixels = np.clip(pixels + rng.normal(0, 20, (image_size, image_size, 3)), 0, 255).astype(np.uint8)
+        paths.append(os.path.join(directory, f"{idx}.{extension}"))
+        Image.fromarray(pixels).save(paths[-1], format=IMAGE_FORMATS[extension])
+    return paths
+
+
+# The transforms are the ones of `build_ds_sft.py`, without `random`, so that the builds can be compared
+def build_from_files(paths, convert_img_to_bytes):
+    return datasets.Dataset.from_dict(
+        {
+            "images": [[{"bytes": convert_img_to_bytes(img_path=path, format="png"), "path": None}] for path in paths],
+            "texts": [
+                [{"user": PROMPTS[idx % len(PROMPTS)], "assistant": f"Image {idx}.", "source": "FromFiles"}]
+                for idx in range(len(paths))
+            ],
+        },
+        features=FEATURES,
+    )
+
+
+def read_bytes(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def build_decoded(paths, idx_dataset):
+    # The images are stored as bytes without path, like in the datasets of the hub
+    return datasets.Dataset.from_dict(
+        {
+            "image": [{"bytes": read_bytes(path), "path": None} for path in paths],
+            "caption": [f"caption {idx_dataset} {idx}" for idx in range(len(paths))],
+        },
+        features=datasets.Features({"image": datasets.Image(), "caption": datasets.Value("string")}),
+    )
+
+
+def map_transform_decoded(example):
+    example["images"] = [example["image"]]
+    example["texts"] = [
+        {"user": PROMPTS[len(example["caption"]) % len(PROMPTS)], "assistant": example["caption"], "source": "Decoded"}
+    ]
+    return example
+
+
+def map_transform_decoded_changed(example):
+    example["images"] = [example["image"]]
+    example["texts"] = [{"user": PROMPTS[0], "assistant": example["caption"].upper(), "source": "Decoded"}]
+    return example
+
+
+def filter_even_images(example):
+    return int(example["texts"][0]["assistant"].split()[1].rstrip(".")) % 2 == 0
+
+
+def slow_identity(dataset, seconds):
+    # Stands for a transform waiting on I/O or on its own worker processes, which can overlap with the other ones
+    time.sleep(seconds)
+    return dataset
+
+
+def concatenate(*datasets_to_merge):
+    return concatenate_datasets(list(datasets_to_merge))
+
+
+def build_previous(paths, num_decoded, num_proc):
+    ds_from_files = build_from_files(paths, previous_convert_img_to_bytes)
+    results = {"from_files": ds_from_files, "filtered": ds_from_files.filter(filter_even_images)}
+    for idx_dataset in range(num_decoded):
+        ds_decoded = build_decoded(paths, idx_dataset)
+        results[f"decoded_{idx_dataset}"] = ds_decoded.map(
+            map_transform_decoded, remove_columns=ds_decoded.column_names, features=FEATURES, num_proc=num_proc
+        )
+    results["merged"] = concatenate(*results.values())
+    return results
+
+
+def build_with_runner(paths, num_decoded, num_proc, cache_dir, num_workers, map_transform, sleep_seconds=0.0):
+    image_bytes_cache = ImageBytesCache(cache_dir=os.path.join(cache_dir, "image_bytes"))
+    runner = TransformRunner(cache_dir=os.path.join(cache_dir, "transforms"), num_workers=num_workers)
+    runner.add_source(
+        "from_files", build_from_files, cache=True, paths=paths, convert_img_to_bytes=image_bytes_cache.get_bytes
+    )
+    runner.add_filter("filtered", "from_files", filter_even_images)
+    for idx_dataset in range(num_decoded):
+        runner.add_source(f"source_{idx_dataset}", build_decoded, cache=True, paths=paths, idx_dataset=idx_dataset)
+        runner.add_transform(
+            f"slow_{idx_dataset}", slow_identity, inputs=[f"source_{idx_dataset}"], cache=False, seconds=sleep_seconds
+        )
+        runner.add_map(
+            f"decoded_{idx_dataset}",
+            f"slow_{idx_dataset}",
+            map_transform,
+            decode_images=False,
+            remove_columns=["image", "caption"],
+            features=FEATURES,
+            num_proc=num_proc,
+        )
+    names = ["from_files", "filtered"] + [f"decoded_{idx_dataset}" for idx_dataset in range(num_decoded)]
+    runner.add_transform("merged", concatenate, inputs=names)
+    results = runner.run(names + ["merged"])
+    return results, runner, image_bytes_cache
+
+
+def decode_all(dataset):
+    return [
+        ([np.asarray(image.convert("RGB")) for image in example["images"]], example["texts"]) for example in dataset
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num_images", type=int, default=150)
+    parser.add_argument("--image_size", type=int, default=384)
+    parser.add_argument("--num_decoded", type=int, default=3)
+    parser.add_argument("--num_proc", type=int, default=None)
+    parser.add_argument("--num_workers", type=int, default=4)
+    parser.add_argument("--sleep_seconds", type=float, default=1.0)
+    args = parser.parse_args()
+    datasets.disable_progress_bars()
+
+    with tempfile.TemporaryDirectory() as directory:
+        paths = make_image_files(directory, args.num_images, args.image_size, seed=0)
+        original_pixels = [np.asarray(Image.open(path).convert("RGB")) for path in paths]
+        cache_dir = os.path.join(directory, "cache")
+
+        start = time.perf_counter()
+        previous = build_previous(paths, args.num_decoded, args.num_proc)
+        previous_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        results, runner, image_bytes_cache = build_with_runner(
+            paths, args.num_decoded, args.num_proc, cache_dir, args.num_workers, map_transform_decoded
+        )
+        cold_time = time.perf_counter() - start
+        print("First run:")
+        print(runner.format_report())
+
+        # Same texts, and the pixels of the files
+        for name, dataset in previous.items():
+            assert results[name].num_rows == dataset.num_rows, name
+            decoded = decode_all(results[name])
+            assert [texts for _, texts in decoded] == [texts for _, texts in decode_all(dataset)], name
+        for name in ["from_files"] + [f"decoded_{idx_dataset}" for idx_dataset in range(args.num_decoded)]:
+            for (images, _), pixels in zip(decode_all(results[name]), original_pixels):
+                assert np.array_equal(images[0], pixels), f"{name}: the pixels of the image files are changed"
+        num_previous_different = sum(
+            not np.array_equal(images[0], pixels)
+            for (images, _), pixels in zip(decode_all(previous["decoded_0"]), original_pixels)
+        )
+
+        # The BMP files are encoded once, the JPEG and PNG files are not re-encoded
+        num_bmp = sum(path.endswith(".bmp") for path in paths)
+        assert image_bytes_cache.stats["num_encoded"] == num_bmp, image_bytes_cache.stats
+        assert image_bytes_cache.stats["num_passthrough"] == len(paths) - num_bmp, image_bytes_cache.stats
+        image_bytes_cache.get_bytes(paths[2], format="png")
+        assert image_bytes_cache.stats["num_cached"] == 1, image_bytes_cache.stats
+
+        # A second run only loads the cached results
+        start = time.perf_counter()
+        _, warm_runner, _ = build_with_runner(
+            paths, args.num_decoded, args.num_proc, cache_dir, args.num_workers, map_transform_decoded
+        )
+        warm_time = time.perf_counter() - start
+        computed = {report.name for report in warm_runner.reports if report.status == "computed"}
+        assert computed == {f"slow_{idx_dataset}" for idx_dataset in range(args.num_decoded)}, computed
+
+        # A change in a transform only recomputes it and the datasets depending on it
+        _, changed_runner, _ = build_with_runner(
+            paths, args.num_decoded, args.num_proc, cache_dir, args.num_workers, map_transform_decoded_changed
+        )
+        computed = {report.name for report in changed_runner.reports if report.status == "computed"}
+        expected_computed = {"merged"}
+        for idx_dataset in range(args.num_decoded):
+            expected_computed |= {f"slow_{idx_dataset}", f"decoded_{idx_dataset}"}
+        assert computed == expected_computed, computed
+
+        # The independent datasets are computed in parallel
+        _, parallel_runner, _ = build_with_runner(
+            paths,
+            args.num_decoded,
+            args.num_proc,
+            cache_dir,
+            args.num_workers,
+            map_transform_decoded,
+            sleep_seconds=args.sleep_seconds,
+        )
+        slow_reports = [report for report in parallel_runner.reports if report.name.startswith("slow_")]
+        span = max(report.end_time for report in slow_reports) - min(report.start_time for report in slow_reports)
+        if args.num_workers >= args.num_decoded:
+            assert span < 2 * args.sleep_seconds, f"The independent datasets are computed one by one ({span:.2f}s)"
+
+    print(
+        f"previous build: {previous_time:7.2f}s, {num_previous_different}/{len(paths)} images of `decoded_0` with"
+        " pixels different from their files"
+    )
+    print(f"first run:      {cold_time:7.2f}s, image bytes cache {image_bytes_cache.stats}")
+    print(f"second run:     {warm_time:7.2f}s, all the transforms loaded from the cache")
+    print(
+        f"{args.num_decoded} independent transforms of {args.sleep_seconds:.1f}s each run in {span:.2f}s with"
+        f" {args.num_workers} workers"
+    )
+    print("All checks passed.")
+
+
+if __name__ == "__main__":
+    main()
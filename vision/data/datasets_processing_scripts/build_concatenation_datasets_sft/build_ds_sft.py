@@ -23,6 +23,8 @@ from datasets import concatenate_datasets, load_dataset, load_from_disk
 from PIL import Image, ImageDraw, ImageFile, ImageFont
 from tqdm import tqdm
 
+from m4.utils.datasets.transform_runner import ImageBytesCache, TransformRunner
+
 
 Image.MAX_IMAGE_PIXELS = None
 ImageFile.LOAD_TRUNCATED_IMAGES = True
@@ -30,6 +32,11 @@ ImageFile.LOAD_TRUNCATED_IMAGES = True
 
 NUM_PROC = 48
 
+# The images which are not JPEG or PNG are encoded once, and the results of the transforms are cached, keyed on their
+# code and inputs, so that rebuilding the datasets only recomputes the transforms that changed
+IMAGE_BYTES_CACHE = ImageBytesCache(cache_dir="/fsx/hugo/fine_tuning_datasets_cache/image_bytes")
+TRANSFORM_RUNNER = TransformRunner(cache_dir="/fsx/hugo/fine_tuning_datasets_cache/transforms")
+
 FEATURES = datasets.Features(
     {
         "images": datasets.Sequence(datasets.Image(decode=True)),
@@ -90,12 +97,7 @@ QUESTION_BRIEVETY_HINT_MULTI_TURN = [
 
 
 def convert_img_to_bytes(img_path, format):
-    img = Image.open(img_path)
-    buffer = BytesIO()
-    img.save(buffer, format=format)
-    img_bytes = buffer.getvalue()
-    img.close()
-    return img_bytes
+    return IMAGE_BYTES_CACHE.get_bytes(img_path=img_path, format=format)
 
 
 def _convert_to_rgb(image):
@@ -187,8 +189,13 @@ def map_transform_screen2words(example):
     return example
 
 
-ds_screen2words = ds_screen2words.map(
-    map_transform_screen2words, remove_columns=ds_screen2words.column_names, features=FEATURES, num_proc=NUM_PROC
+ds_screen2words = TRANSFORM_RUNNER.map(
+    ds_screen2words,
+    map_transform_screen2words,
+    decode_images=False,
+    remove_columns=ds_screen2words.column_names,
+    features=FEATURES,
+    num_proc=NUM_PROC,
 )
 
 ds_screen2words.save_to_disk("/fsx/hugo/fine_tuning_datasets/screen2words", num_proc=NUM_PROC)  # 15_743 examples
@@ -229,8 +236,13 @@ def map_transform_textcaps(example):
     return example
 
 
-ds_textcaps = ds_textcaps.map(
-    map_transform_textcaps, remove_columns=ds_textcaps.column_names, features=FEATURES, num_proc=NUM_PROC
+ds_textcaps = TRANSFORM_RUNNER.map(
+    ds_textcaps,
+    map_transform_textcaps,
+    decode_images=False,
+    remove_columns=ds_textcaps.column_names,
+    features=FEATURES,
+    num_proc=NUM_PROC,
 )
 
 ds_textcaps.save_to_disk("/fsx/hugo/fine_tuning_datasets/textcaps", num_proc=NUM_PROC)  # 21_953 examples
@@ -311,8 +323,13 @@ def map_transform_vqav2(example):
     return example
 
 
-ds_vqav2 = ds_vqav2.map(
-    map_transform_vqav2, remove_columns=ds_vqav2.column_names, features=FEATURES, num_proc=NUM_PROC
+ds_vqav2 = TRANSFORM_RUNNER.map(
+    ds_vqav2,
+    map_transform_vqav2,
+    decode_images=False,
+    remove_columns=ds_vqav2.column_names,
+    features=FEATURES,
+    num_proc=NUM_PROC,
 )
 
 ds_vqav2.save_to_disk("/fsx/hugo/fine_tuning_datasets/vqav2", num_proc=NUM_PROC)  # 443_757 examples
@@ -334,8 +351,13 @@ def map_transform_okvqa(example):
     return example
 
 
-ds_okvqa = ds_okvqa.map(
-    map_transform_okvqa, remove_columns=ds_okvqa.column_names, features=FEATURES, num_proc=NUM_PROC
+ds_okvqa = TRANSFORM_RUNNER.map(
+    ds_okvqa,
+    map_transform_okvqa,
+    decode_images=False,
+    remove_columns=ds_okvqa.column_names,
+    features=FEATURES,
+    num_proc=NUM_PROC,
 )
 
 ds_okvqa.save_to_disk("/fsx/hugo/fine_tuning_datasets/okvqa", num_proc=NUM_PROC)  # 9_009 examples
@@ -357,7 +379,9 @@ def map_transform_gqa(example):
     return example
 
 
-ds_gqa = ds_gqa.map(map_transform_gqa, remove_columns=ds_gqa.column_names, features=FEATURES, num_proc=NUM_PROC)
+ds_gqa = TRANSFORM_RUNNER.map(
+    ds_gqa, map_transform_gqa, remove_columns=ds_gqa.column_names, features=FEATURES, num_proc=NUM_PROC
+)
 
 ds_gqa.save_to_disk("/fsx/hugo/fine_tuning_datasets/gqa", num_proc=NUM_PROC)  # 943_000 examples
 
@@ -446,7 +470,9 @@ def map_transform_vsr(example):
     return example
 
 
-ds_vsr = ds_vsr.map(map_transform_vsr, remove_columns=ds_vsr.column_names, features=FEATURES, num_proc=NUM_PROC)
+ds_vsr = TRANSFORM_RUNNER.map(
+    ds_vsr, map_transform_vsr, remove_columns=ds_vsr.column_names, features=FEATURES, num_proc=NUM_PROC
+)
 ds_vsr = ds_vsr.filter(lambda example: example["images"] is not None, num_proc=NUM_PROC)
 
 ds_vsr.save_to_disk("/fsx/hugo/fine_tuning_datasets/vsr", num_proc=NUM_PROC)  # 3_354 examples
@@ -551,7 +577,14 @@ def map_transform_iam(example):
     return example
 
 
-ds_iam = ds_iam.map(map_transform_iam, remove_columns=ds_iam.column_names, features=FEATURES, num_proc=NUM_PROC)
+ds_iam = TRANSFORM_RUNNER.map(
+    ds_iam,
+    map_transform_iam,
+    decode_images=False,
+    remove_columns=ds_iam.column_names,
+    features=FEATURES,
+    num_proc=NUM_PROC,
+)
 
 ds_iam.save_to_disk("/fsx/hugo/fine_tuning_datasets/iam", num_proc=NUM_PROC)  # 5_663 examples
 
@@ -598,7 +631,8 @@ def map_transform_diagram_image_to_text(example):
     return example
 
 
-ds_diagram_image_to_text = ds_diagram_image_to_text.map(
+ds_diagram_image_to_text = TRANSFORM_RUNNER.map(
+    ds_diagram_image_to_text,
     map_transform_diagram_image_to_text,
     remove_columns=ds_diagram_image_to_text.column_names,
     features=FEATURES,
@@ -916,8 +950,13 @@ def map_transform_scienceqa(example):
     return example
 
 
-ds_scienceqa = ds_scienceqa.map(
-    map_transform_scienceqa, remove_columns=ds_scienceqa.column_names, features=FEATURES, num_proc=NUM_PROC
+ds_scienceqa = TRANSFORM_RUNNER.map(
+    ds_scienceqa,
+    map_transform_scienceqa,
+    decode_images=False,
+    remove_columns=ds_scienceqa.column_names,
+    features=FEATURES,
+    num_proc=NUM_PROC,
 )
 
 ds_scienceqa.save_to_disk("/fsx/hugo/fine_tuning_datasets/scienceqa", num_proc=NUM_PROC)  # 6_218 examples
@@ -1014,7 +1053,8 @@ def map_transform_nlvr2(example):
     return example
 
 
-ds_nlvr2 = ds_nlvr2.map(
+ds_nlvr2 = TRANSFORM_RUNNER.map(
+    ds_nlvr2,
     map_transform_nlvr2,
     remove_columns=ds_nlvr2.column_names,
     features=FEATURES,
@@ -1101,8 +1141,10 @@ def map_transform_hm(example):
     return example
 
 
-ds_hm = ds_hm.map(
+ds_hm = TRANSFORM_RUNNER.map(
+    ds_hm,
     map_transform_hm,
+    decode_images=False,
     remove_columns=ds_hm.column_names,
     features=FEATURES,
     num_proc=NUM_PROC,
@@ -1281,8 +1323,10 @@ def map_transform_datikz(example):
     return example
 
 
-ds_datikz = ds_datikz.map(
+ds_datikz = TRANSFORM_RUNNER.map(
+    ds_datikz,
     map_transform_datikz,
+    decode_images=False,
     remove_columns=ds_datikz.column_names,
     features=FEATURES,
     num_proc=NUM_PROC,
@@ -1332,8 +1376,10 @@ def map_transform_websight(example):
     return example
 
 
-ds_websight = ds_websight.map(
+ds_websight = TRANSFORM_RUNNER.map(
+    ds_websight,
     map_transform_websight,
+    decode_images=False,
     remove_columns=ds_websight.column_names,
     features=FEATURES,
     num_proc=NUM_PROC,
@@ -1408,8 +1454,10 @@ def map_transform_pathvqa(example):
     return example
 
 
-ds_pathvqa = ds_pathvqa.map(
+ds_pathvqa = TRANSFORM_RUNNER.map(
+    ds_pathvqa,
     map_transform_pathvqa,
+    decode_images=False,
     remove_columns=ds_pathvqa.column_names,
     features=FEATURES,
     num_proc=NUM_PROC,
@@ -1437,8 +1485,10 @@ def map_transform_vqarad(example):
     return example
 
 
-ds_vqarad = ds_vqarad.map(
+ds_vqarad = TRANSFORM_RUNNER.map(
+    ds_vqarad,
     map_transform_vqarad,
+    decode_images=False,
     remove_columns=ds_vqarad.column_names,
     features=FEATURES,
     num_proc=NUM_PROC,
@@ -1524,7 +1574,8 @@ def map_transform_plotqa(example):
     return example
 
 
-ds_plotqa = ds_plotqa.map(
+ds_plotqa = TRANSFORM_RUNNER.map(
+    ds_plotqa,
     map_transform_plotqa,
     features=FEATURES,
     num_proc=NUM_PROC,
@@ -1551,7 +1602,8 @@ def map_transform_visualmrc(example):
     return example
 
 
-ds_visualmrc = ds_visualmrc.map(
+ds_visualmrc = TRANSFORM_RUNNER.map(
+    ds_visualmrc,
     map_transform_visualmrc,
     features=FEATURES,
     num_proc=NUM_PROC,
@@ -1644,7 +1696,8 @@ def map_transform_orcamath(example):
     return example
 
 
-ds_orcamath = ds_orcamath.map(
+ds_orcamath = TRANSFORM_RUNNER.map(
+    ds_orcamath,
     map_transform_orcamath,
     remove_columns=ds_orcamath.column_names,
     features=FEATURES,
@@ -1681,7 +1734,8 @@ def map_transform_metamathqa(example):
     return example
 
 
-ds_metamathqa = ds_metamathqa.map(
+ds_metamathqa = TRANSFORM_RUNNER.map(
+    ds_metamathqa,
     map_transform_metamathqa,
     remove_columns=ds_metamathqa.column_names,
     features=FEATURES,
@@ -1719,7 +1773,8 @@ def map_transform_math_instruct(example):
     return example
 
 
-ds_math_instruct = ds_math_instruct.map(
+ds_math_instruct = TRANSFORM_RUNNER.map(
+    ds_math_instruct,
     map_transform_math_instruct,
     remove_columns=ds_math_instruct.column_names,
     features=FEATURES,
@@ -1757,7 +1812,8 @@ def map_transform_camel_ai_math(example):
     return example
 
 
-ds_camel_ai_math = ds_camel_ai_math.map(
+ds_camel_ai_math = TRANSFORM_RUNNER.map(
+    ds_camel_ai_math,
     map_transform_camel_ai_math,
     remove_columns=ds_camel_ai_math.column_names,
     features=FEATURES,
@@ -1795,7 +1851,8 @@ def map_transform_atlas_math_sets(example):
     return example
 
 
-ds_atlas_math_sets = ds_atlas_math_sets.map(
+ds_atlas_math_sets = TRANSFORM_RUNNER.map(
+    ds_atlas_math_sets,
     map_transform_atlas_math_sets,
     remove_columns=ds_atlas_math_sets.column_names,
     features=FEATURES,
@@ -1833,7 +1890,8 @@ def map_transform_goat(example):
     return example
 
 
-ds_goat = ds_goat.map(
+ds_goat = TRANSFORM_RUNNER.map(
+    ds_goat,
     map_transform_goat,
     remove_columns=ds_goat.column_names,
     features=FEATURES,
@@ -1871,7 +1929,8 @@ def map_transform_camel_ai_physics(example):
     return example
 
 
-ds_camel_ai_physics = ds_camel_ai_physics.map(
+ds_camel_ai_physics = TRANSFORM_RUNNER.map(
+    ds_camel_ai_physics,
     map_transform_camel_ai_physics,
     remove_columns=ds_camel_ai_physics.column_names,
     features=FEATURES,
@@ -1909,7 +1968,8 @@ def map_transform_camel_ai_biology(example):
     return example
 
 
-ds_camel_ai_biology = ds_camel_ai_biology.map(
+ds_camel_ai_biology = TRANSFORM_RUNNER.map(
+    ds_camel_ai_biology,
     map_transform_camel_ai_biology,
     remove_columns=ds_camel_ai_biology.column_names,
     features=FEATURES,
@@ -1947,7 +2007,8 @@ def map_transform_camel_ai_chemistry(example):
     return example
 
 
-ds_camel_ai_chemistry = ds_camel_ai_chemistry.map(
+ds_camel_ai_chemistry = TRANSFORM_RUNNER.map(
+    ds_camel_ai_chemistry,
     map_transform_camel_ai_chemistry,
     remove_columns=ds_camel_ai_chemistry.column_names,
     features=FEATURES,
@@ -1989,7 +2050,8 @@ def map_transform_dolly(example):
     return example
 
 
-ds_dolly = ds_dolly.map(
+ds_dolly = TRANSFORM_RUNNER.map(
+    ds_dolly,
     map_transform_dolly,
     remove_columns=ds_dolly.column_names,
     features=FEATURES,
@@ -2303,7 +2365,8 @@ def map_transform_llava_conv(example):
     return example
 
 
-ds_llava_conv = ds_llava_conv.map(
+ds_llava_conv = TRANSFORM_RUNNER.map(
+    ds_llava_conv,
     map_transform_llava_conv,
     remove_columns=ds_llava_conv.column_names,
     features=FEATURES,
@@ -2339,8 +2402,10 @@ def map_transform_lnqa(example):
     return example
 
 
-ds_lnqa = ds_lnqa.map(
+ds_lnqa = TRANSFORM_RUNNER.map(
+    ds_lnqa,
     map_transform_lnqa,
+    decode_images=False,
     remove_columns=ds_lnqa.column_names,
     features=FEATURES,
     num_proc=NUM_PROC,
@@ -2385,7 +2450,8 @@ def map_transform_sharegpt4o(example):
     return example
 
 
-ds_sharegpt4o = ds_sharegpt4o.map(
+ds_sharegpt4o = TRANSFORM_RUNNER.map(
+    ds_sharegpt4o,
     map_transform_sharegpt4o,
     remove_columns=ds_sharegpt4o.column_names,
     features=FEATURES,
@@ -2451,7 +2517,8 @@ def map_transform_geo170k(example):
     return example
 
 
-ds_geo170k = ds_geo170k.map(
+ds_geo170k = TRANSFORM_RUNNER.map(
+    ds_geo170k,
     map_transform_geo170k,
     remove_columns=ds_geo170k.column_names,
     features=FEATURES,
@@ -2576,8 +2643,10 @@ def map_transform_cord(example):
     return example
 
 
-ds_cord = ds_cord.map(
+ds_cord = TRANSFORM_RUNNER.map(
+    ds_cord,
     map_transform_cord,
+    decode_images=False,
     remove_columns=ds_cord.column_names,
     features=FEATURES,
     num_proc=NUM_PROC,
@@ -2666,7 +2735,8 @@ def map_transform_chartgemma(example):
     return example
 
 
-ds_chartgemma = ds_chartgemma.map(
+ds_chartgemma = TRANSFORM_RUNNER.map(
+    ds_chartgemma,
     map_transform_chartgemma,
     remove_columns=ds_chartgemma.column_names,
     features=FEATURES,
@@ -2751,8 +2821,8 @@ def map_transform_aokvqa(example):
         return example
 
 
-ds_aokvqa = ds_aokvqa.map(
-    map_transform_aokvqa, remove_columns=ds_aokvqa.column_names, features=FEATURES, num_proc=NUM_PROC
+ds_aokvqa = TRANSFORM_RUNNER.map(
+    ds_aokvqa, map_transform_aokvqa, remove_columns=ds_aokvqa.column_names, features=FEATURES, num_proc=NUM_PROC
 )
 
 ds_aokvqa.save_to_disk("/fsx/hugo/fine_tuning_datasets/aokvqa", num_proc=NUM_PROC)  # 17_056 examples
@@ -2774,8 +2844,8 @@ def map_transform_mimic_sd(example):
     return example
 
 
-ds_mimic_sd = ds_mimic_sd.map(
-    map_transform_mimic_sd, remove_columns=ds_mimic_sd.column_names, features=FEATURES, num_proc=NUM_PROC
+ds_mimic_sd = TRANSFORM_RUNNER.map(
+    ds_mimic_sd, map_transform_mimic_sd, remove_columns=ds_mimic_sd.column_names, features=FEATURES, num_proc=NUM_PROC
 )
 
 ds_mimic_sd.save_to_disk("/fsx/hugo/fine_tuning_datasets/mimic_sd", num_proc=NUM_PROC)  # 15_869 examples
@@ -2802,7 +2872,8 @@ def map_transform_mimic_cgd(example):
     return example
 
 
-ds_mimic_cgd = cgd_instructions.map(
+ds_mimic_cgd = TRANSFORM_RUNNER.map(
+    cgd_instructions,
     map_transform_mimic_cgd,
     remove_columns=cgd_instructions.column_names,
     features=FEATURES,
@@ -2870,7 +2941,9 @@ def map_transform_pgm(example):
     return example
 
 
-ds_pgm = ds_pgm.map(map_transform_pgm, remove_columns=ds_pgm.column_names, features=FEATURES, num_proc=NUM_PROC)
+ds_pgm = TRANSFORM_RUNNER.map(
+    ds_pgm, map_transform_pgm, remove_columns=ds_pgm.column_names, features=FEATURES, num_proc=NUM_PROC
+)
 
 ds_pgm.save_to_disk("/fsx/hugo/fine_tuning_datasets/pgm", num_proc=NUM_PROC)  # 1_200_000 examples
 
@@ -3023,8 +3096,8 @@ def map_transform_raven(example):
     return example
 
 
-ds_raven = ds_raven.map(
-    map_transform_raven, remove_columns=ds_raven.column_names, features=FEATURES, num_proc=NUM_PROC
+ds_raven = TRANSFORM_RUNNER.map(
+    ds_raven, map_transform_raven, remove_columns=ds_raven.column_names, features=FEATURES, num_proc=NUM_PROC
 )
 
 ds_raven.save_to_disk("/fsx/hugo/fine_tuning_datasets/raven", num_proc=NUM_PROC)  # 42_000 examples
@@ -3055,8 +3128,13 @@ def map_transform_textvqa(example):
     return example
 
 
-ds_textvqa = ds_textvqa.map(
-    map_transform_textvqa, remove_columns=ds_textvqa.column_names, features=FEATURES, num_proc=NUM_PROC
+ds_textvqa = TRANSFORM_RUNNER.map(
+    ds_textvqa,
+    map_transform_textvqa,
+    decode_images=False,
+    remove_columns=ds_textvqa.column_names,
+    features=FEATURES,
+    num_proc=NUM_PROC,
 )
 
 ds_textvqa.save_to_disk("/fsx/hugo/fine_tuning_datasets/textvqa", num_proc=NUM_PROC)  # 34602 examples
@@ -3095,8 +3173,10 @@ def map_transform_textvqa_new_prompt(example):
     return example
 
 
-ds_textvqa_new_prompt = ds_textvqa_new_prompt.map(
+ds_textvqa_new_prompt = TRANSFORM_RUNNER.map(
+    ds_textvqa_new_prompt,
     map_transform_textvqa_new_prompt,
+    decode_images=False,
     remove_columns=ds_textvqa_new_prompt.column_names,
     features=FEATURES,
     num_proc=NUM_PROC,
@@ -3129,8 +3209,13 @@ def map_transform_ocrvqa(example):
     return example
 
 
-ds_ocrvqa = ds_ocrvqa.map(
-    map_transform_ocrvqa, remove_columns=ds_ocrvqa.column_names, features=FEATURES, num_proc=NUM_PROC
+ds_ocrvqa = TRANSFORM_RUNNER.map(
+    ds_ocrvqa,
+    map_transform_ocrvqa,
+    decode_images=False,
+    remove_columns=ds_ocrvqa.column_names,
+    features=FEATURES,
+    num_proc=NUM_PROC,
 )
 ds_ocrvqa.save_to_disk("/fsx/hugo/fine_tuning_datasets/ocrvqa", num_proc=NUM_PROC)  # 166022 examples
 
@@ -3154,8 +3239,13 @@ def map_transform_docvqa(example):
     return example
 
 
-ds_docvqa = ds_docvqa.map(
-    map_transform_docvqa, remove_columns=ds_docvqa.column_names, features=FEATURES, num_proc=NUM_PROC
+ds_docvqa = TRANSFORM_RUNNER.map(
+    ds_docvqa,
+    map_transform_docvqa,
+    decode_images=False,
+    remove_columns=ds_docvqa.column_names,
+    features=FEATURES,
+    num_proc=NUM_PROC,
 )
 print(ds_docvqa)
 ds_docvqa.save_to_disk("/fsx/hugo/fine_tuning_datasets/docvqa", num_proc=NUM_PROC)  # 39463 examples
@@ -3190,8 +3280,10 @@ def map_transform_docvqa_new_prompt(example):
 
 ds_docvqa_new_prompt = ds_docvqa_new_prompt.filter(filter_large_images_docvqa_new_prompt, num_proc=NUM_PROC)
 
-ds_docvqa_new_prompt = ds_docvqa_new_prompt.map(
+ds_docvqa_new_prompt = TRANSFORM_RUNNER.map(
+    ds_docvqa_new_prompt,
     map_transform_docvqa_new_prompt,
+    decode_images=False,
     remove_columns=ds_docvqa_new_prompt.column_names,
     features=FEATURES,
     num_proc=NUM_PROC,
@@ -3218,8 +3310,13 @@ def map_transform_ds_clevr(example):
     return example
 
 
-ds_clevr = ds_clevr.map(
-    map_transform_ds_clevr, remove_columns=ds_clevr.column_names, features=FEATURES, num_proc=NUM_PROC
+ds_clevr = TRANSFORM_RUNNER.map(
+    ds_clevr,
+    map_transform_ds_clevr,
+    decode_images=False,
+    remove_columns=ds_clevr.column_names,
+    features=FEATURES,
+    num_proc=NUM_PROC,
 )
 print(ds_clevr)
 ds_clevr.save_to_disk("/fsx/hugo/fine_tuning_datasets/clevr", num_proc=NUM_PROC)  # 699989 examples / 263 shards
@@ -3302,8 +3399,13 @@ def map_transform_ds_pmcvqa(example):
     return example
 
 
-ds_pmcvqa = ds_pmcvqa.map(
-    map_transform_ds_pmcvqa, remove_columns=ds_pmcvqa.column_names, features=FEATURES, num_proc=NUM_PROC
+ds_pmcvqa = TRANSFORM_RUNNER.map(
+    ds_pmcvqa,
+    map_transform_ds_pmcvqa,
+    decode_images=False,
+    remove_columns=ds_pmcvqa.column_names,
+    features=FEATURES,
+    num_proc=NUM_PROC,
 )
 print(ds_pmcvqa)
 ds_pmcvqa.save_to_disk("/fsx/hugo/fine_tuning_datasets/ds_pmcvqa", num_proc=NUM_PROC)  # 329537 examples
@@ -3398,8 +3500,12 @@ def map_transform_sharegpt4v(example):
     return example
 
 
-ds_sharegpt4v = ds_sharegpt4v.map(
-    map_transform_sharegpt4v, remove_columns=ds_sharegpt4v.column_names, features=FEATURES, num_proc=NUM_PROC
+ds_sharegpt4v = TRANSFORM_RUNNER.map(
+    ds_sharegpt4v,
+    map_transform_sharegpt4v,
+    remove_columns=ds_sharegpt4v.column_names,
+    features=FEATURES,
+    num_proc=NUM_PROC,
 )
 print(ds_sharegpt4v)
 ds_sharegpt4v.save_to_disk("/fsx/hugo/fine_tuning_datasets/sharegpt4v", num_proc=NUM_PROC)  # 59027 examples
@@ -3463,7 +3569,14 @@ def map_transform_ds_dvqa(example):
     return example
 
 
-ds_dvqa = ds_dvqa.map(map_transform_ds_dvqa, remove_columns=ds_dvqa.column_names, features=FEATURES, num_proc=NUM_PROC)
+ds_dvqa = TRANSFORM_RUNNER.map(
+    ds_dvqa,
+    map_transform_ds_dvqa,
+    decode_images=False,
+    remove_columns=ds_dvqa.column_names,
+    features=FEATURES,
+    num_proc=NUM_PROC,
+)
 print(ds_dvqa)
 ds_dvqa.save_to_disk("/fsx/hugo/fine_tuning_datasets/dvqa", num_proc=NUM_PROC)  # 2325316 examples
 
@@ -3651,8 +3764,13 @@ def map_transform_ds_plotqa(example):
     return example
 
 
-ds_plotqa = ds_plotqa.map(
-    map_transform_ds_plotqa, remove_columns=ds_plotqa.column_names, features=FEATURES, num_proc=NUM_PROC
+ds_plotqa = TRANSFORM_RUNNER.map(
+    ds_plotqa,
+    map_transform_ds_plotqa,
+    decode_images=False,
+    remove_columns=ds_plotqa.column_names,
+    features=FEATURES,
+    num_proc=NUM_PROC,
 )
 print(ds_plotqa)
 ds_plotqa.save_to_disk("/fsx/hugo/fine_tuning_datasets/plotqa_occasional_multi_turn_hint", num_proc=NUM_PROC)
@@ -3745,8 +3863,13 @@ def filter_fn_ds_vismrc(example):
 
 
 ds_vismrc = ds_vismrc.filter(filter_fn_ds_vismrc, num_proc=NUM_PROC)
-ds_vismrc = ds_vismrc.map(
-    map_transform_ds_vismrc, remove_columns=ds_vismrc.column_names, features=FEATURES, num_proc=NUM_PROC
+ds_vismrc = TRANSFORM_RUNNER.map(
+    ds_vismrc,
+    map_transform_ds_vismrc,
+    decode_images=False,
+    remove_columns=ds_vismrc.column_names,
+    features=FEATURES,
+    num_proc=NUM_PROC,
 )
 print(ds_vismrc)
 ds_vismrc.save_to_disk("/fsx/hugo/fine_tuning_datasets/visual_mrc", num_proc=NUM_PROC)
@@ -3775,8 +3898,12 @@ def map_transform_openhermes(example):
     return example
 
 
-ds_openhermes = ds_openhermes.map(
-    map_transform_openhermes, remove_columns=ds_openhermes.column_names, features=FEATURES, num_proc=NUM_PROC
+ds_openhermes = TRANSFORM_RUNNER.map(
+    ds_openhermes,
+    map_transform_openhermes,
+    remove_columns=ds_openhermes.column_names,
+    features=FEATURES,
+    num_proc=NUM_PROC,
 )
 print(ds_openhermes)
 ds_openhermes.save_to_disk("/fsx/hugo/fine_tuning_datasets/openhermes", num_proc=NUM_PROC)
@@ -3811,7 +3938,9 @@ def map_transform_lima(example):
     return example
 
 
-ds_lima = ds_lima.map(map_transform_lima, remove_columns=ds_lima.column_names, features=FEATURES, num_proc=NUM_PROC)
+ds_lima = TRANSFORM_RUNNER.map(
+    ds_lima, map_transform_lima, remove_columns=ds_lima.column_names, features=FEATURES, num_proc=NUM_PROC
+)
 print(ds_lima)
 ds_lima.save_to_disk("/fsx/hugo/fine_tuning_datasets/lima", num_proc=NUM_PROC)
 
@@ -3862,7 +3991,14 @@ def map_transform_ds_tatqa(example):
     return example
 
 
-ds_tatqa = ds_tatqa.map(map_transform_ds_tatqa, remove_columns=ds_tatqa.column_names, features=FEATURES, num_proc=10)
+ds_tatqa = TRANSFORM_RUNNER.map(
+    ds_tatqa,
+    map_transform_ds_tatqa,
+    decode_images=False,
+    remove_columns=ds_tatqa.column_names,
+    features=FEATURES,
+    num_proc=10,
+)
 print(ds_tatqa)
 ds_tatqa.save_to_disk("/fsx/hugo/fine_tuning_datasets/tat_qa", num_proc=10)
 
@@ -3916,8 +4052,13 @@ def map_transform_ds_robut_wikisql(example):
     return example
 
 
-ds_robut_wikisql = ds_robut_wikisql.map(
-    map_transform_ds_robut_wikisql, remove_columns=ds_robut_wikisql.column_names, features=FEATURES, num_proc=NUM_PROC
+ds_robut_wikisql = TRANSFORM_RUNNER.map(
+    ds_robut_wikisql,
+    map_transform_ds_robut_wikisql,
+    decode_images=False,
+    remove_columns=ds_robut_wikisql.column_names,
+    features=FEATURES,
+    num_proc=NUM_PROC,
 )
 print(ds_robut_wikisql)
 ds_robut_wikisql.save_to_disk("/fsx/hugo/fine_tuning_datasets/robut_wikisql", num_proc=NUM_PROC)
@@ -3967,8 +4108,13 @@ def map_transform_ds_robut_wtq(example):
     return example
 
 
-ds_robut_wtq = ds_robut_wtq.map(
-    map_transform_ds_robut_wtq, remove_columns=ds_robut_wtq.column_names, features=FEATURES, num_proc=NUM_PROC
+ds_robut_wtq = TRANSFORM_RUNNER.map(
+    ds_robut_wtq,
+    map_transform_ds_robut_wtq,
+    decode_images=False,
+    remove_columns=ds_robut_wtq.column_names,
+    features=FEATURES,
+    num_proc=NUM_PROC,
 )
 print(ds_robut_wtq)
 ds_robut_wtq.save_to_disk("/fsx/hugo/fine_tuning_datasets/robut_wtq", num_proc=NUM_PROC)
@@ -4054,8 +4200,13 @@ def map_transform_ds_finqa(example):
     return example
 
 
-ds_finqa = ds_finqa.map(
-    map_transform_ds_finqa, remove_columns=ds_finqa.column_names, features=FEATURES, num_proc=NUM_PROC
+ds_finqa = TRANSFORM_RUNNER.map(
+    ds_finqa,
+    map_transform_ds_finqa,
+    decode_images=False,
+    remove_columns=ds_finqa.column_names,
+    features=FEATURES,
+    num_proc=NUM_PROC,
 )
 print(ds_finqa)
 ds_finqa.save_to_disk("/fsx/hugo/fine_tuning_datasets/finqa", num_proc=NUM_PROC)
@@ -4083,8 +4234,8 @@ def map_transform_ds_multihiertt(example):
 
 # don't take off images column
 columns_to_remove = ds_multihiertt.column_names[1:]
-ds_multihiertt = ds_multihiertt.map(
-    map_transform_ds_multihiertt, remove_columns=columns_to_remove, features=FEATURES, num_proc=10
+ds_multihiertt = TRANSFORM_RUNNER.map(
+    ds_multihiertt, map_transform_ds_multihiertt, remove_columns=columns_to_remove, features=FEATURES, num_proc=10
 )
 print(ds_multihiertt)
 ds_multihiertt.save_to_disk("/fsx/hugo/fine_tuning_datasets/multihiertt", num_proc=10)
@@ -4137,8 +4288,13 @@ def map_transform_ds_finqa(example):
     return example
 
 
-ds_hitab = ds_hitab.map(
-    map_transform_ds_finqa, remove_columns=ds_hitab.column_names, features=FEATURES, num_proc=NUM_PROC
+ds_hitab = TRANSFORM_RUNNER.map(
+    ds_hitab,
+    map_transform_ds_finqa,
+    decode_images=False,
+    remove_columns=ds_hitab.column_names,
+    features=FEATURES,
+    num_proc=NUM_PROC,
 )
 print(ds_hitab)
 ds_hitab.save_to_disk("/fsx/hugo/fine_tuning_datasets/hitab", num_proc=NUM_PROC)
@@ -4246,8 +4402,13 @@ def map_transform_ds_robut_sqa(example):
     return example
 
 
-ds_robut_sqa = ds_robut_sqa.map(
-    map_transform_ds_robut_sqa, remove_columns=ds_robut_sqa.column_names, features=FEATURES, num_proc=NUM_PROC
+ds_robut_sqa = TRANSFORM_RUNNER.map(
+    ds_robut_sqa,
+    map_transform_ds_robut_sqa,
+    decode_images=False,
+    remove_columns=ds_robut_sqa.column_names,
+    features=FEATURES,
+    num_proc=NUM_PROC,
 )
 print(ds_robut_sqa)
 ds_robut_sqa.save_to_disk("/fsx/hugo/fine_tuning_datasets/robut_sqa", num_proc=NUM_PROC)
@@ -4437,7 +4598,8 @@ def map_transform_ds_ny_cc_explanation(example):
     return example
 
 
-ds_ny_cc_explanation = ds_ny_cc_explanation.map(
+ds_ny_cc_explanation = TRANSFORM_RUNNER.map(
+    ds_ny_cc_explanation,
     map_transform_ds_ny_cc_explanation,
     remove_columns=ds_ny_cc_explanation.column_names,
     features=FEATURES,
@@ -4610,7 +4772,8 @@ def map_transform_ds_ny_cc_matching(example):
     return example
 
 
-ds_ny_cc_matching = ds_ny_cc_matching.map(
+ds_ny_cc_matching = TRANSFORM_RUNNER.map(
+    ds_ny_cc_matching,
     map_transform_ds_ny_cc_matching,
     remove_columns=ds_ny_cc_matching.column_names,
     features=FEATURES,
@@ -4813,7 +4976,8 @@ def map_transform_ds_ny_cc_ranking(example):
     return example
 
 
-ds_ny_cc_ranking = ds_ny_cc_ranking.map(
+ds_ny_cc_ranking = TRANSFORM_RUNNER.map(
+    ds_ny_cc_ranking,
     map_transform_ds_ny_cc_ranking,
     remove_columns=ds_ny_cc_ranking.column_names,
     features=FEATURES,
@@ -4850,6 +5014,15 @@ def map_transform_ln(example):
     return example
 
 
-ds_ln = ds_ln.map(map_transform_ln, remove_columns=ds_ln.column_names, features=FEATURES, num_proc=NUM_PROC)
+ds_ln = TRANSFORM_RUNNER.map(
+    ds_ln,
+    map_transform_ln,
+    decode_images=False,
+    remove_columns=ds_ln.column_names,
+    features=FEATURES,
+    num_proc=NUM_PROC,
+)
 print(ds_ln)
 ds_ln.save_to_disk("/fsx/hugo/fine_tuning_datasets/localized_narratives", num_proc=NUM_PROC)
+
+print(TRANSFORM_RUNNER.format_report())
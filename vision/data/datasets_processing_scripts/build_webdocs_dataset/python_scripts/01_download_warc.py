@@ -42,6 +42,18 @@ def get_args():
         default=4 * cpu_count(),
         help="Number of processes to use for the multiprocessing.",
     )
+    parser.add_argument(
+        "--num_threads",
+        type=int,
+        default=32,
+        help="Number of concurrent requests per process.",
+    )
+    parser.add_argument(
+        "--batch_size",
+        type=int,
+        default=1000,
+        help="Number of examples whose warc records are downloaded together.",
+    )
     args = parser.parse_args()
     return args
 
@@ -68,10 +80,12 @@ if __name__ == "__main__":
         metadata_dataset = metadata_dataset.add_column("warc_error", [""] * len(metadata_dataset))
     logger.info("Finished loading the metadata or previous warc dataset")
 
-    warc_downloader = WarcDownloader()
+    warc_downloader = WarcDownloader(num_threads=args.num_threads)
     logger.info("Starting downloading the warc files")
     warc_dataset = metadata_dataset.map(
-        warc_downloader,
+        warc_downloader.download_batch,
+        batched=True,
+        batch_size=args.batch_size,
         num_proc=args.num_proc,
         features=Features(
             {
@@ -1,96 +1,131 @@
 """
 srun --pty --cpus-per-task=96 bash -i
 conda activate /fsx/m4/conda/shared-m4-2023-03-10
+
+The documents are deduplicated on their urls without holding all the urls in memory:
+- `python 08_01_prepare_urldedup.py runs {idx_shard}`, one job per shard: the urls of the shard are hashed to 64-bit
+fingerprints, and saved sorted, with the WARC file of each document (the run of the shard).
+- `python 08_01_prepare_urldedup.py merge --max_memory_gb 32`, once all the runs are done: the runs are merged
+externally, by blocks fitting in the memory cap, to find the urls present in several documents. As before, only the
+documents coming from the most recent WARC file of a duplicated url are kept. The fingerprints of the duplicated urls
+of each shard are saved with the rank of the WARC filename to keep, and used by `08_02_urldedup.py`.
+
+The runs are built from the `_texts_only` shards, and `08_02_urldedup.py` filters the full shards. Like with the
+previous `dup_urls.json`, the documents are matched on the fingerprint of their url and their WARC filename, so the
+full shard doesn't need to have its rows in the same order as the `_texts_only` shard.
 """
 
 
+import argparse
 import json
+import logging
 import os
-from collections import Counter
 
 from datasets import load_from_disk
-from tqdm import tqdm
 
+from m4.sourcing.data_collection.processors.web_document_url_deduplication import (
+    merge_url_fingerprints_runs,
+    write_url_fingerprints_run_from_urls,
+)
 
-NUM_SHARDS = 200
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(levelname)s - %(name)s - %(message)s",
+    datefmt="%m/%d/%Y %H:%M:%S",
+)
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
 
 
+NUM_SHARDS = 200
+MAX_NUM_RETRIES_SYNC = 3
+
 PATH_WEB_DOCS_S3 = "s3://m4-datasets/webdocs/web_document_dataset_filtered_imgurldedup_nsfwfiltered_texts_only/"
 PATH_WEB_DOCS_LOCAL = "/scratch/web_docs_texts_only/"
 
-PATH_SAVE_DISK_DUP_URLS = "/scratch/dup_urls.json"
-PATH_SAVE_S3_DUP_URLS = "s3://m4-datasets/webdocs/dup_urls.json"
-
+PATH_URL_FINGERPRINTS_RUNS_S3 = "s3://m4-datasets/webdocs/url_fingerprints_runs/"
+PATH_URL_FINGERPRINTS_RUNS_LOCAL = "/scratch/url_fingerprints_runs/"
+
+PATH_SAVE_DISK_DUP_URLS = "/scratch/urldedup_dup_urls/"
+PATH_SAVE_S3_DUP_URLS = "s3://m4-datasets/webdocs/urldedup_dup_urls/"
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Find the documents to remove with the deduplication on urls.")
+    parser.add_argument(
+        "step",
+        type=str,
+        choices=["runs", "merge"],
+        help="`runs` to create the run of url fingerprints of a shard, `merge` to merge the runs of all the shards.",
+    )
+    parser.add_argument(
+        "idx_shard",
+        type=int,
+        nargs="?",
+        help="Index of the shard (between 0 and 199), for the step `runs`.",
+    )
+    parser.add_argument(
+        "--max_memory_gb",
+        type=float,
+        default=32,
+        help="Memory cap of the records buffered during the merge, in GB.",
+    )
+    args = parser.parse_args()
+    if (args.step == "runs") and (args.idx_shard is None):
+        parser.error("The step `runs` requires `idx_shard`")
+    return args
+
+
+def sync_s3(path_source, path_target):
+    command_sync_s3 = f"aws s3 sync {path_source} {path_target}"
+    for _ in range(MAX_NUM_RETRIES_SYNC):
+        os.system(command_sync_s3)
+
+
+def create_run(idx_shard):
+    logger.info(f"Starting loading the web docs of the shard {idx_shard}")
+    path_web_docs_local = os.path.join(PATH_WEB_DOCS_LOCAL, str(idx_shard))
+    sync_s3(os.path.join(PATH_WEB_DOCS_S3, str(idx_shard)), path_web_docs_local)
+    ds_shard = load_from_disk(path_web_docs_local)
+    logger.info("Finished loading the web docs")
+
+    logger.info("Starting creating the run of url fingerprints")
+    general_metadata = [json.loads(meta) for meta in ds_shard["general_metadata"]]
+    path_run = os.path.join(PATH_URL_FINGERPRINTS_RUNS_LOCAL, str(idx_shard))
+    write_url_fingerprints_run_from_urls(
+        urls=[meta["url"] for meta in general_metadata],
+        doc_warc_filenames=[meta["warc_filename"] for meta in general_metadata],
+        path_save_dir_run=path_run,
+    )
+    sync_s3(path_run, os.path.join(PATH_URL_FINGERPRINTS_RUNS_S3, str(idx_shard)))
+    logger.info("Finished creating the run of url fingerprints")
+
+
+def merge_runs(max_memory_gb):
+    logger.info("Starting downloading the runs of url fingerprints")
+    sync_s3(PATH_URL_FINGERPRINTS_RUNS_S3, PATH_URL_FINGERPRINTS_RUNS_LOCAL)
+    logger.info("Finished downloading the runs of url fingerprints")
+
+    stats = merge_url_fingerprints_runs(
+        paths_runs=[os.path.join(PATH_URL_FINGERPRINTS_RUNS_LOCAL, str(idx_shard)) for idx_shard in range(NUM_SHARDS)],
+        path_save_dir_dup_urls=PATH_SAVE_DISK_DUP_URLS,
+        max_memory_bytes=int(max_memory_gb * 10**9),
+    )
+    print(f"Total number of documents: {stats['num_docs']}")
+    # Total number of documents: 361_209_568
+    print(f"{stats['num_dup_urls']} URLs appear at least twice, for a total of {stats['num_docs_dup_urls']} documents")
+    # 80_236_663 URLs appear at least twice, for a total of 196_108_071 documents
+    # At most 196_108_071 - 80_236_663 = 115_871_408 documents are removed, more documents are kept for the urls
+    # present several times in their most recent WARC file
+    print(f"We can then remove {stats['num_removed']} documents")
 
-def unroll_list(list_):
-    list_ = [sub_el for el in list_ for sub_el in el]
-    return list_
+    sync_s3(PATH_SAVE_DISK_DUP_URLS, PATH_SAVE_S3_DUP_URLS)
 
 
 if __name__ == "__main__":
-    command_sync_s3 = f"aws s3 sync {PATH_WEB_DOCS_S3} {PATH_WEB_DOCS_LOCAL}"
-    os.system(command_sync_s3)
-    os.system(command_sync_s3)
-    os.system(command_sync_s3)
-
-    ds_shards = [
-        load_from_disk(os.path.join(PATH_WEB_DOCS_LOCAL, str(idx_shard))) for idx_shard in tqdm(range(NUM_SHARDS))
-    ]
-    all_urls = []
-    for idx_shard in tqdm(range(NUM_SHARDS)):
-        all_urls.extend([json.loads(meta)["url"] for meta in ds_shards[idx_shard]["general_metadata"]])
-    print(f"Total number of documents: {len(all_urls)}")
-    # Total number of documents: 361_209_568
-    del all_urls
-    del ds_shards
-
-    dup_urls = Counter(all_urls)
-    dup_urls = {k: v for k, v in dup_urls.items() if v > 1}
-    sum_dup_urls = sum(list(dup_urls.values()))
-    print(f"{len(dup_urls)} URLs appear at least twice, for a total of {sum_dup_urls} documents")
-    # 80_236_663 URLs appear at least twice, for a total of 196_108_071 documents
-    print(f"We can then remove {sum_dup_urls - len(dup_urls)} documents")
-    # We can then remove 115_871_408 documents
-
-    # This block of lines was done in multiprocessing, one shard per job (200 jobs), and 24 cpus per job
-    # The result is one dup_urls_to_warcfilename per job,
-    # saved at /fsx/hugo/trash/dup_urls_to_warcfilename/dup_urls_to_warcfilename_{idx_shard}.json,
-    # and we will have to merge them after
-    dup_urls_to_warcfilename = {}
-    for idx_shard in tqdm(range(NUM_SHARDS)):
-        ds_shard = load_from_disk(os.path.join(PATH_WEB_DOCS_LOCAL, str(idx_shard)), keep_in_memory=True)
-        urls_shard = [json.loads(meta)["url"] for meta in ds_shard["general_metadata"]]
-        for idx, url in enumerate(urls_shard):
-            if url in dup_urls:
-                dup_urls_to_warcfilename[url] = dup_urls_to_warcfilename.get(url, []) + [
-                    json.loads(ds_shard[idx]["general_metadata"])["warc_filename"]
-                ]
-
-    # We start from the result of the last operation which was done in multiple jobs
-    # We need to merge the different dup_urls_to_warcfilename since we created one per job
-    all_dup_urls_to_warcfilename = []
-    for idx_shard in tqdm(range(NUM_SHARDS)):
-        with open(f"/fsx/hugo/trash/dup_urls_to_warcfilename/dup_urls_to_warcfilename_{idx_shard}.json") as f:
-            all_dup_urls_to_warcfilename.append(json.load(f))
-    dup_urls_to_warcfilename = {
-        url: unroll_list(
-            [
-                all_dup_urls_to_warcfilename[idx_shard][url]
-                for idx_shard in range(NUM_SHARDS)
-                if url in all_dup_urls_to_warcfilename[idx_shard]
-            ]
-        )
-        for url in tqdm(dup_urls)
-    }
-    print(len(dup_urls_to_warcfilename))  # Check
-    print(sum([len(dup_urls_to_warcfilename[url]) for url in dup_urls_to_warcfilename]))  # Check
-
-    # We only keep the most recent document in a group with a common url, all the others will be deleted
-    dup_urls_to_warcfilename = {
-        url: sorted(warc_filenames)[-1] for url, warc_filenames in tqdm(dup_urls_to_warcfilename.items())
-    }
-
-    with open(PATH_SAVE_DISK_DUP_URLS, "w") as f:
-        json.dump(dup_urls_to_warcfilename, f)
-    command_sync_s3 = f"aws s3 cp {PATH_SAVE_DISK_DUP_URLS} {PATH_SAVE_S3_DUP_URLS}"
-    os.system(command_sync_s3)
+    args = get_args()
+    if args.step == "runs":
+        create_run(args.idx_shard)
+    else:
+        merge_runs(args.max_memory_gb)
@@ -1,3 +1,14 @@
+"""
+srun --pty --cpus-per-task=96 bash -i
+conda activate /fsx/m4/conda/shared-m4-2023-03-10
+
+`python 08_02_urldedup.py {idx_shard}` removes the documents of a duplicated url not coming from its most recent WARC
+file, with the duplicated urls saved for the shard by `08_01_prepare_urldedup.py merge`, and the documents without
+images. Each document is matched on the fingerprint of its url and its WARC filename, so the order of the rows doesn't
+matter.
+"""
+
+
 import json
 import logging
 import os
@@ -6,6 +17,11 @@ import sys
 from datasets import load_from_disk
 from PIL import Image, ImageFile
 
+from m4.sourcing.data_collection.processors.web_document_url_deduplication import (
+    is_url_dup_to_remove,
+    load_dup_urls,
+)
+
 
 # Useful to avoid DecompressionBombError and truncated image error
 Image.MAX_IMAGE_PIXELS = None
@@ -26,8 +42,9 @@ MAX_NUM_RETRIES_SYNC = 3
 IDX_JOB = sys.argv[1]
 PATH_SAVE_DISK_TMP_FILES = f"/scratch/storage_hugo_{IDX_JOB}/"
 
-PATH_DUP_URLS_S3 = "s3://m4-datasets/webdocs/dup_urls.json"
-PATH_DUP_URLS_LOCAL = os.path.join(PATH_SAVE_DISK_TMP_FILES, "dup_urls.json")
+# Created by `08_01_prepare_urldedup.py`
+PATH_DUP_URLS_S3 = "s3://m4-datasets/webdocs/urldedup_dup_urls/"
+PATH_DUP_URLS_LOCAL = os.path.join(PATH_SAVE_DISK_TMP_FILES, "dup_urls")
 
 PATH_WEB_DOCS_S3 = f"s3://m4-datasets/webdocs/web_document_dataset_filtered_imgurldedup_nsfwfiltered/{IDX_JOB}/"
 PATH_WEB_DOCS_LOCAL = os.path.join(PATH_SAVE_DISK_TMP_FILES, "web_docs")
@@ -43,17 +60,15 @@ PATH_SAVE_S3_WEB_DOCS_URL_DEDUP = os.path.join(
 
 
 class URLDeduplication:
-    def __init__(self, path_dup_urls):
+    def __init__(self, path_dup_urls, idx_shard):
         self.path_dup_urls = path_dup_urls
-        with open(path_dup_urls) as f:
-            self.dup_urls = json.load(f)
+        self.idx_shard = idx_shard
+        self.dup_urls = load_dup_urls(path_dup_urls, idx_shard)
 
     def __call__(self, example):
         general_metadata = json.loads(example["general_metadata"])
-        url, warc_filename = general_metadata["url"], general_metadata["warc_filename"]
-        if url in self.dup_urls:
-            if warc_filename != self.dup_urls[url]:
-                return False
+        if is_url_dup_to_remove(general_metadata["url"], general_metadata["warc_filename"], self.dup_urls):
+            return False
         # Bonus: removes documents without any images
         metadata = [meta for meta in json.loads(example["metadata"]) if meta]
         if not metadata:
@@ -61,7 +76,7 @@ class URLDeduplication:
         return True
 
     def __reduce__(self):
-        return self.__class__, (self.path_dup_urls,)
+        return self.__class__, (self.path_dup_urls, self.idx_shard)
 
 
 if __name__ == "__main__":
@@ -69,10 +84,11 @@ if __name__ == "__main__":
         os.system(f"rm -r {PATH_SAVE_DISK_TMP_FILES}")
     os.system(f"mkdir {PATH_SAVE_DISK_TMP_FILES}")
 
-    logger.info("Starting downloading the set of duplicated urls")
-    command_sync_s3 = f"aws s3 cp {PATH_DUP_URLS_S3} {PATH_DUP_URLS_LOCAL}"
-    os.system(command_sync_s3)
-    logger.info("Finished downloading the set of duplicated urls")
+    logger.info("Starting downloading the duplicated urls of the shard")
+    for filename in [f"{IDX_JOB}.npy", "warc_filenames.json"]:
+        command_sync_s3 = f"aws s3 cp {PATH_DUP_URLS_S3}{filename} {os.path.join(PATH_DUP_URLS_LOCAL, filename)}"
+        os.system(command_sync_s3)
+    logger.info("Finished downloading the duplicated urls of the shard")
 
     logger.info("Starting loading the web docs")
     command_sync_s3 = f"aws s3 sync {PATH_WEB_DOCS_S3} {PATH_WEB_DOCS_LOCAL}"
@@ -84,7 +100,7 @@ if __name__ == "__main__":
     logger.info("Finished loading the web docs")
 
     logger.info("Starting deduplicating documents on URLs")
-    url_deduplication = URLDeduplication(path_dup_urls=PATH_DUP_URLS_LOCAL)
+    url_deduplication = URLDeduplication(path_dup_urls=PATH_DUP_URLS_LOCAL, idx_shard=IDX_JOB)
     web_docs_dataset = web_docs_dataset.filter(url_deduplication, num_proc=NUM_PROC)
     logger.info("Finished deduplicating documents on URLs")
 
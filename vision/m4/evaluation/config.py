@@ -68,6 +68,11 @@ class TextGenerationParams:
     num_beams: int = 3
     no_repeat_ngram_size: int = 0
     max_new_tokens: int = 15
+    # Generate with the continuous batching `GenerationEngine` instead of `model.generate` (VLlama3 and VMistral
+    # models, not compatible with ZeRO-3)
+    use_generation_engine: bool = False
+    # Number of sequences decoded together by the engine (a prompt uses `num_beams` of them)
+    generation_engine_max_num_seqs: int = 32
 
 
 class ModelPrecision(Enum):
@@ -10,6 +10,7 @@ from scipy import stats
 from m4.evaluation.custom_metrics.utils import (
     VQANormalizationGtVisionLab,
     check_is_number,
+    compute_vqa_accuracy,
     convert_to_number,
     normalize_str_mmmu,
     parse_open_response_mmmu,
@@ -71,40 +72,7 @@ class OpenEndedVQAMetrics(evaluate.Metric):
         )
 
     def _compute_vqa_accuracy(self, generated_texts_unique, answers_unique, normalize_text_fn):
-        first_word_vqa_accuracy_scores = []
-        oe_accuracy_scores = []
-        for generated_text, answers_ in zip(generated_texts_unique, answers_unique):
-            generated_text = normalize_text_fn(generated_text)
-            generated_first_word = generated_text.split(" ")[0]
-            answers_ = [normalize_text_fn(answer_) for answer_ in answers_]
-
-            if len(answers_) == 1:
-                # This is the case for GQA for example
-                first_word_vqa_accuracy_scores.append((generated_first_word == answers_[0]) * 1.0)
-                oe_accuracy_scores.append((generated_text == answers_[0]) * 1.0)
-
-            else:
-                gt_first_word_acc = []
-                gt_oe_acc = []
-                for idx_ref in range(len(answers_)):
-                    other_answers_ = [other_answer for idx, other_answer in enumerate(answers_) if idx != idx_ref]
-
-                    matched_with_first_word = [
-                        other_answer for other_answer in other_answers_ if other_answer == generated_first_word
-                    ]
-                    matched_with_oe_text = [
-                        other_answer for other_answer in other_answers_ if other_answer == generated_text
-                    ]
-
-                    first_word_acc = min(1, len(matched_with_first_word) / 3)
-                    oe_acc = min(1, len(matched_with_oe_text) / 3)
-
-                    gt_first_word_acc.append(first_word_acc)
-                    gt_oe_acc.append(oe_acc)
-
-                first_word_vqa_accuracy_scores.append(sum(gt_first_word_acc) / len(gt_first_word_acc))
-                oe_accuracy_scores.append(sum(gt_oe_acc) / len(gt_oe_acc))
-        return first_word_vqa_accuracy_scores, oe_accuracy_scores
+        return compute_vqa_accuracy(generated_texts_unique, answers_unique, normalize_text_fn)
 
     def _compute_mmmu_style_vqa_accuracy(self, generated_texts_unique, answers_unique, normalize_text_fn, accept_mcq):
         oe_accuracy_scores = []
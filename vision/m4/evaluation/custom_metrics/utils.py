@@ -1,5 +1,7 @@
 import re
 import string
+from collections import Counter
+from functools import lru_cache
 
 from m4.sourcing.data_collection.processors import FilteringFunctions
 
@@ -147,6 +149,13 @@ NUMBERS_STRING_TO_INT = {
 }
 
 
+_TRANS_REMOVE_PUNCTUATION = str.maketrans(dict.fromkeys(string.punctuation.replace("'", ""), " "))
+
+# Normalized texts are memoized: the reference answers of VQA datasets repeat a lot ("yes", "no", "2", ...)
+NORMALIZATION_CACHE_SIZE = 2**20
+
+
+@lru_cache(maxsize=NORMALIZATION_CACHE_SIZE)
 def vqa_normalize_text(text: str) -> str:
     """Process a text
     Source: https://github.com/GT-Vision-Lab/VQA/blob/master/PythonEvaluationTools/vqaEvaluation/vqaEval.py
@@ -163,8 +172,7 @@ def vqa_normalize_text(text: str) -> str:
     text = text.replace("\n", " ")
     text = text.replace("\t", " ")
     text = text.replace("-", "")
-    trans_remove_punctuation = str.maketrans(dict.fromkeys(string.punctuation.replace("'", ""), " "))
-    text = text.translate(trans_remove_punctuation)
+    text = text.translate(_TRANS_REMOVE_PUNCTUATION)
     words = text.split(" ")
     for idx, word in enumerate(words):
         if word in NUMBERS_STRING_TO_INT:
@@ -344,40 +352,84 @@ class VQANormalizationGtVisionLab:
             "?",
             "!",
         ]
+        self.punct_set = frozenset(self.punct)
+        self.articles_set = frozenset(self.articles)
+        # Translation table used when a digit-comma-digit pattern is found: every punctuation is removed
+        self.remove_punct_table = str.maketrans(dict.fromkeys(self.punct, None))
+        self.cache = {}
 
     def processPunctuation(self, in_text):
-        out_text = in_text
-        for p in self.punct:
-            if (p + " " in in_text or " " + p in in_text) or (re.search(self.comma_strip, in_text) is not None):
-                out_text = out_text.replace(p, "")
+        # Same output as replacing the punctuations one by one as in the original implementation: each punctuation
+        # is removed or replaced by a space depending only on `in_text`, so all of them are handled in a single
+        # `str.translate`, and only the punctuations present in the text are looked at.
+        present_punct = self.punct_set.intersection(in_text)
+        if present_punct:
+            if self.comma_strip.search(in_text) is not None:
+                table = self.remove_punct_table
             else:
-                out_text = out_text.replace(p, " ")
-        out_text = self.period_strip.sub("", out_text, re.UNICODE)
+                table = {
+                    ord(p): "" if (p + " " in in_text or " " + p in in_text) else " " for p in present_punct
+                }
+            out_text = in_text.translate(table)
+        else:
+            out_text = in_text
+        if "." in out_text:
+            # `re.UNICODE` is passed as the `count` argument, as in the original implementation
+            out_text = self.period_strip.sub("", out_text, re.UNICODE)
         return out_text
 
     def processDigitArticle(self, in_text):
         out_text = []
-        tempText = in_text.lower().split()
-        for word in tempText:
-            word = self.manual_map.setdefault(word, word)
-            if word not in self.articles:
-                out_text.append(word)
-            else:
-                pass
-        for wordId, word in enumerate(out_text):
-            if word in self.contractions:
-                out_text[wordId] = self.contractions[word]
-        out_text = " ".join(out_text)
-        return out_text
+        for word in in_text.lower().split():
+            word = self.manual_map.get(word, word)
+            if word not in self.articles_set:
+                out_text.append(self.contractions.get(word, word))
+        return " ".join(out_text)
 
     def vqa_normalize_text(self, text):
-        text = text.replace("\n", " ")
-        text = text.replace("\t", " ")
-        text = text.strip()
-
-        text = self.processPunctuation(text)
-        text = self.processDigitArticle(text)
-        return text
+        normalized_text = self.cache.get(text)
+        if normalized_text is not None:
+            return normalized_text
+        normalized_text = text.replace("\n", " ")
+        normalized_text = normalized_text.replace("\t", " ")
+        normalized_text = normalized_text.strip()
+
+        normalized_text = self.processPunctuation(normalized_text)
+        normalized_text = self.processDigitArticle(normalized_text)
+        if len(self.cache) >= NORMALIZATION_CACHE_SIZE:
+            self.cache.clear()
+        self.cache[text] = normalized_text
+        return normalized_text
+
+
+def vqa_accuracy(prediction, answers, answer_counts):
+    """
+    VQA accuracy of a normalized prediction against the normalized reference answers: the average, over the
+    references left out one at a time, of min(1, number of other references equal to the prediction / 3).
+    `answer_counts` is `Counter(answers)`, which makes this O(k) instead of O(k^2) for k references. The terms are
+    summed in the same order as the leave-one-out computation, so the scores are exactly the same.
+    """
+    if len(answers) == 1:
+        # This is the case for GQA for example
+        return (prediction == answers[0]) * 1.0
+    num_matches = answer_counts.get(prediction, 0)
+    if num_matches == 0:
+        return 0.0
+    return sum(min(1, (num_matches - (answer == prediction)) / 3) for answer in answers) / len(answers)
+
+
+def compute_vqa_accuracy(generated_texts, answers, normalize_text_fn):
+    """First word and open-ended VQA accuracies of each generated text"""
+    first_word_vqa_accuracy_scores = []
+    oe_accuracy_scores = []
+    for generated_text, answers_ in zip(generated_texts, answers):
+        generated_text = normalize_text_fn(generated_text)
+        generated_first_word = generated_text.partition(" ")[0]
+        answers_ = [normalize_text_fn(answer_) for answer_ in answers_]
+        answer_counts = Counter(answers_)
+        first_word_vqa_accuracy_scores.append(vqa_accuracy(generated_first_word, answers_, answer_counts))
+        oe_accuracy_scores.append(vqa_accuracy(generated_text, answers_, answer_counts))
+    return first_word_vqa_accuracy_scores, oe_accuracy_scores
 
 
 NUMBER_WORD_TO_NUMBER_INT = {
@@ -8,7 +8,7 @@ import GPUtil
 import numpy as np
 import torch
 from accelerate import Accelerator, InitProcessGroupKwargs
-from accelerate.utils import broadcast_object_list
+from accelerate.utils import DistributedType, broadcast_object_list, extract_model_from_parallel
 from datasets import Value, load_dataset, load_from_disk
 from PIL import ImageFile
 from torch.utils.data import DataLoader
@@ -17,6 +17,7 @@ from transformers import CLIPModel, CLIPProcessor
 
 from m4.evaluation import custom_metrics
 from m4.evaluation.config import ShotSelectionMode
+from m4.evaluation.generation.engine import GenerationEngine
 from m4.evaluation.utils import get_prompt_template_id, split_batch
 from m4.training.utils import _convert_to_rgb
 
@@ -230,6 +231,20 @@ def in_contexter(task, accelerator, model, args):
         save_generations=save_generations,
         **metric_kwargs,
     )
+    generation_engine = None
+    if args.tasks.text_generation_params.use_generation_engine and (
+        "OpenEndedVQAInContext" in task.__class__.__name__ or "ImageCaptioningInContext" in task.__class__.__name__
+    ):
+        if (
+            accelerator.distributed_type == DistributedType.DEEPSPEED
+            and accelerator.state.deepspeed_plugin.zero_stage == 3
+        ):
+            # The processes would run different numbers of forward passes, which ZeRO-3 can't synchronize
+            raise ValueError("`use_generation_engine` is not compatible with ZeRO-3.")
+        generation_engine = GenerationEngine(
+            extract_model_from_parallel(model),
+            max_num_seqs=args.tasks.text_generation_params.generation_engine_max_num_seqs,
+        )
     for batch in tqdm(data_loader, desc="Compute scores:"):
         # Splits batches that get augmented by data_collator. Mostly usefull for classification tasks
         mini_batches = split_batch(batch, chunk_size=args.hparams.batch_size_per_gpu)
@@ -251,6 +266,7 @@ def in_contexter(task, accelerator, model, args):
                     "num_beams": args.tasks.text_generation_params.num_beams,
                     "no_repeat_ngram_size": args.tasks.text_generation_params.no_repeat_ngram_size,
                     "max_new_tokens": args.tasks.text_generation_params.max_new_tokens,
+                    "generation_engine": generation_engine,
                     **mini_batch,
                 }
             else:
@@ -43,6 +43,11 @@ class Hparams:
     length_penalty: float = 1.0
     # repetition_penalty
     repetition_penalty: float = 1.0
+    # Generate with the continuous batching `GenerationEngine` instead of `model.generate` (VLlama3 and VMistral
+    # models, not compatible with ZeRO-3)
+    use_generation_engine: bool = False
+    # Number of sequences decoded together by the engine (a prompt uses `num_beams` of them)
+    generation_engine_max_num_seqs: int = 32
 
     # General prompt kickstarting generation for all images and all models. Should start by an image token
     prompts: List[str] = list_field(
@@ -0,0 +1,504 @@
+"""
+Continuous batching generation engine for the models that keep the image tokens in their KV cache (VLlama3,
+VMistral).
+
+`model.generate` works on static padded batches: the whole batch waits for its longest generation, the padding
+tokens are attended to at every step, and with beam search the prompt and its images are encoded once per beam.
+The engine schedules requests instead:
+- the requests are admitted and retired at every decoding step, so a finished sequence immediately leaves room for
+  a waiting request;
+- the KV cache is a fixed number of slots (one per sequence) that are reused as soon as a sequence is done;
+- the prompt of a request (with its images) is processed once, and its KV is copied to the slots of the beam
+  hypotheses. The image hidden states can also be shared across requests with the same `image_key`.
+
+Greedy decoding and beam search follow the semantics of `generate` (`num_beams`, `no_repeat_ngram_size`,
+`max_new_tokens`, `min_length`, `bad_words_ids`, `repetition_penalty`, `length_penalty`, `early_stopping`), so the
+outputs are the same up to floating point differences between padded and unpadded batches.
+
+Usage:
+    engine = GenerationEngine(model)
+    request = engine.submit(input_ids, pixel_values=pixel_values, num_beams=3, max_new_tokens=15)
+    engine.run()
+    request.output_ids
+"""
+import inspect
+import logging
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import Hashable, List, Optional
+
+import torch
+from torch.nn.utils.rnn import pad_sequence
+from transformers.generation.logits_process import (
+    LogitsProcessorList,
+    MinLengthLogitsProcessor,
+    NoBadWordsLogitsProcessor,
+    NoRepeatNGramLogitsProcessor,
+    RepetitionPenaltyLogitsProcessor,
+)
+
+
+logger = logging.getLogger(__name__)
+
+# Models attending to the images with cross-attentions need the image states at every decoding step
+CROSS_ATTENTION_MODEL_TYPES = ["idefics"]
+
+
+@dataclass
+class GenerationRequest:
+    """A prompt to generate from, with its generation parameters. `output_ids` is set once `done`."""
+
+    input_ids: List[int]
+    pixel_values: Optional[torch.Tensor] = None
+    pixel_attention_mask: Optional[torch.Tensor] = None
+    image_hidden_states: Optional[torch.Tensor] = None
+    # Requests with the same `image_key` (and the same images) reuse the image hidden states of the first one
+    image_key: Optional[Hashable] = None
+    num_beams: int = 1
+    max_new_tokens: int = 20
+    min_length: int = 0
+    no_repeat_ngram_size: int = 0
+    repetition_penalty: float = 1.0
+    length_penalty: float = 1.0
+    early_stopping: bool = True
+    bad_words_ids: Optional[List[List[int]]] = None
+    output_ids: Optional[List[int]] = None
+    done: bool = False
+
+
+@dataclass
+class _RunningRequest:
+    request: GenerationRequest
+    logits_processor: LogitsProcessorList
+    # Slots reserved for the request, and slot of each of its sequences
+    reserved_slots: List[int]
+    slots: List[int]
+    # Prompt + generated tokens of each sequence
+    sequences: torch.LongTensor
+    beam_scores: Optional[torch.FloatTensor] = None
+    # Finished beam hypotheses, as (score, tokens)
+    hypotheses: List = field(default_factory=list)
+    worst_score: float = 1e9
+
+    @property
+    def prompt_length(self):
+        return len(self.request.input_ids)
+
+
+class SlotKVCache:
+    """
+    KV cache of a fixed number of sequences. Each slot holds the keys and values of one sequence; the tensors are
+    allocated at the first prefill (from the shapes of the model's cache) and grown along the sequence dimension when
+    a sequence gets longer than the capacity.
+    """
+
+    def __init__(self, num_slots, capacity_step=256):
+        self.num_slots = num_slots
+        self.capacity_step = capacity_step
+        self.keys = None
+        self.values = None
+        self.capacity = 0
+        self.lengths = [0] * num_slots
+        self.free_slots = list(reversed(range(num_slots)))
+
+    @property
+    def num_free_slots(self):
+        return len(self.free_slots)
+
+    def allocate(self, num_slots):
+        return [self.free_slots.pop() for _ in range(num_slots)]
+
+    def free(self, slots):
+        for slot in slots:
+            self.lengths[slot] = 0
+            self.free_slots.append(slot)
+
+    def ensure_capacity(self, past_key_values, length):
+        if self.keys is None:
+            _, num_heads, _, head_dim = past_key_values[0][0].shape
+            key, value = past_key_values[0]
+            self.capacity = self._round_capacity(length)
+            self.keys = [
+                key.new_zeros(self.num_slots, num_heads, self.capacity, head_dim) for _ in range(len(past_key_values))
+            ]
+            self.values = [
+                value.new_zeros(self.num_slots, num_heads, self.capacity, head_dim)
+                for _ in range(len(past_key_values))
+            ]
+        elif length > self.capacity:
+            new_capacity = self._round_capacity(max(length, 2 * self.capacity))
+            self.keys = [self._grow(tensor, new_capacity) for tensor in self.keys]
+            self.values = [self._grow(tensor, new_capacity) for tensor in self.values]
+            self.capacity = new_capacity
+
+    def _round_capacity(self, length):
+        return -(-length // self.capacity_step) * self.capacity_step
+
+    def _grow(self, tensor, new_capacity):
+        padding = tensor.new_zeros(*tensor.shape[:2], new_capacity - tensor.shape[2], tensor.shape[3])
+        return torch.cat([tensor, padding], dim=2)
+
+    def write_prompt(self, slot, past_key_values):
+        length = past_key_values[0][0].shape[2]
+        self.ensure_capacity(past_key_values, length)
+        for layer_keys, layer_values, (key, value) in zip(self.keys, self.values, past_key_values):
+            layer_keys[slot, :, :length] = key[0]
+            layer_values[slot, :, :length] = value[0]
+        self.lengths[slot] = length
+
+    def copy(self, src_slots, dst_slots):
+        """Copies the sequences of `src_slots` to `dst_slots` (which must not be among `src_slots`)."""
+        length = max(self.lengths[slot] for slot in src_slots)
+        src = torch.tensor(src_slots, device=self.keys[0].device)
+        dst = torch.tensor(dst_slots, device=self.keys[0].device)
+        for layer_keys, layer_values in zip(self.keys, self.values):
+            layer_keys[dst, :, :length] = layer_keys[src, :, :length]
+            layer_values[dst, :, :length] = layer_values[src, :, :length]
+        for src_slot, dst_slot in zip(src_slots, dst_slots):
+            self.lengths[dst_slot] = self.lengths[src_slot]
+
+    def gather(self, slots):
+        """
+        Past key values of the sequences of `slots`, right-padded to the longest one, and the attention mask of a
+        decoding step (the past positions of each sequence, plus the new token at the end).
+        """
+        lengths = torch.tensor([self.lengths[slot] for slot in slots], device=self.keys[0].device)
+        max_length = int(lengths.max())
+        index = torch.tensor(slots, device=self.keys[0].device)
+        past_key_values = tuple(
+            (layer_keys[index, :, :max_length], layer_values[index, :, :max_length])
+            for layer_keys, layer_values in zip(self.keys, self.values)
+        )
+        positions = torch.arange(max_length + 1, device=lengths.device)
+        attention_mask = (positions[None, :] < lengths[:, None]) | (positions[None, :] == max_length)
+        return past_key_values, attention_mask.long(), lengths
+
+    def append(self, slots, lengths, past_key_values):
+        """Writes the keys and values of the last position of `past_key_values` after the sequences of `slots`."""
+        self.ensure_capacity(past_key_values, int(lengths.max()) + 1)
+        index = torch.tensor(slots, device=self.keys[0].device)
+        for layer_keys, layer_values, (key, value) in zip(self.keys, self.values, past_key_values):
+            layer_keys[index, :, lengths] = key[:, :, -1]
+            layer_values[index, :, lengths] = value[:, :, -1]
+        for slot in slots:
+            self.lengths[slot] += 1
+
+
+class GenerationEngine:
+    """
+    Generates the submitted requests with continuous batching. `run` processes the queue until it is empty; the
+    requests can also be submitted between two calls of `step`.
+
+    Args:
+        model: a VLlama3 or VMistral model (unwrapped), in eval mode.
+        eos_token_id: defaults to the `eos_token_id` of the generation config of the model.
+        pad_token_id: used to pad the outputs of `generate`. Defaults to the one of the generation config.
+        max_num_seqs: number of sequences decoded together, i.e. of KV cache slots. A request uses `num_beams` slots.
+        max_cached_images: number of image hidden states kept for the requests with an `image_key`.
+    """
+
+    def __init__(self, model, eos_token_id=None, pad_token_id=None, max_num_seqs=32, max_cached_images=64):
+        if model.config.model_type in CROSS_ATTENTION_MODEL_TYPES:
+            raise ValueError(
+                f"The generation engine does not support {model.config.model_type} models: they attend to the images"
+                " with cross-attentions, which need the image states at every decoding step."
+            )
+        self.model = model
+        if eos_token_id is None:
+            eos_token_id = model.generation_config.eos_token_id
+        self.eos_token_ids = [eos_token_id] if isinstance(eos_token_id, int) else list(eos_token_id)
+        if pad_token_id is None:
+            pad_token_id = model.generation_config.pad_token_id
+        self.pad_token_id = pad_token_id if pad_token_id is not None else self.eos_token_ids[0]
+        self.max_num_seqs = max_num_seqs
+        self.kv_cache = SlotKVCache(max_num_seqs)
+        self.waiting = deque()
+        self.running = []
+        self.image_cache = OrderedDict()
+        self.max_cached_images = max_cached_images
+        # VLlama3 needs the `cache_position`s to build its causal mask, VMistral computes them from the cache
+        self._forward_takes_cache_position = "cache_position" in inspect.signature(model.forward).parameters
+        self.num_forward_passes = 0
+        self.num_decoded_tokens = 0
+
+    def submit(self, input_ids, **generation_kwargs):
+        """
+        Queues a request. `input_ids` is the unpadded prompt (list or 1D tensor), `pixel_values` and
+        `pixel_attention_mask` are the images of the prompt (without the batch dimension, or with a batch dimension
+        of 1). `generation_kwargs` are the fields of `GenerationRequest`.
+        """
+        if isinstance(input_ids, torch.Tensor):
+            input_ids = input_ids.tolist()
+        request = GenerationRequest(input_ids=list(input_ids), **generation_kwargs)
+        if request.num_beams > self.max_num_seqs:
+            raise ValueError(
+                f"A request with num_beams={request.num_beams} needs more than the max_num_seqs={self.max_num_seqs}"
+                " KV cache slots of the engine."
+            )
+        self.waiting.append(request)
+        return request
+
+    def has_unfinished_requests(self):
+        return bool(self.waiting or self.running)
+
+    def run(self):
+        while self.has_unfinished_requests():
+            self.step()
+
+    @torch.no_grad()
+    def step(self):
+        """Admits the waiting requests that fit in the free slots, then decodes one token of every sequence."""
+        while self.waiting and self.kv_cache.num_free_slots >= self.waiting[0].num_beams:
+            self._prefill(self.waiting.popleft())
+        if self.running:
+            self._decode()
+
+    @torch.no_grad()
+    def generate(self, input_ids, attention_mask=None, pixel_values=None, pixel_attention_mask=None, **kwargs):
+        """
+        Drop-in for `model.generate` on a left-padded batch: returns the generated tokens only (the equivalent of
+        `model.generate(...)[:, input_ids.shape[1]:]`), right-padded with `pad_token_id`.
+        """
+        requests = []
+        for idx in range(input_ids.shape[0]):
+            prompt = input_ids[idx] if attention_mask is None else input_ids[idx][attention_mask[idx].bool()]
+            requests.append(
+                self.submit(
+                    prompt,
+                    pixel_values=pixel_values[idx : idx + 1] if pixel_values is not None else None,
+                    pixel_attention_mask=(
+                        pixel_attention_mask[idx : idx + 1] if pixel_attention_mask is not None else None
+                    ),
+                    **kwargs,
+                )
+            )
+        self.run()
+        return self.stack_outputs(requests)
+
+    def stack_outputs(self, requests):
+        outputs = [torch.tensor(request.output_ids, dtype=torch.long) for request in requests]
+        return pad_sequence(outputs, batch_first=True, padding_value=self.pad_token_id).to(self.model.device)
+
+    def _get_logits_processor(self, request):
+        processors = LogitsProcessorList()
+        if request.repetition_penalty is not None and request.repetition_penalty != 1.0:
+            processors.append(RepetitionPenaltyLogitsProcessor(penalty=request.repetition_penalty))
+        if request.no_repeat_ngram_size is not None and request.no_repeat_ngram_size > 0:
+            processors.append(NoRepeatNGramLogitsProcessor(request.no_repeat_ngram_size))
+        if request.bad_words_ids:
+            processors.append(NoBadWordsLogitsProcessor(request.bad_words_ids, self.eos_token_ids))
+        if request.min_length is not None and request.min_length > 0:
+            processors.append(MinLengthLogitsProcessor(request.min_length, self.eos_token_ids))
+        return processors
+
+    def _forward(self, **model_inputs):
+        self.num_forward_passes += 1
+        outputs = self.model(use_cache=True, return_dict=True, **model_inputs)
+        past_key_values = outputs.past_key_values
+        if hasattr(past_key_values, "to_legacy_cache"):
+            past_key_values = past_key_values.to_legacy_cache()
+        return outputs, past_key_values
+
+    def _prefill(self, request):
+        device = self.model.device
+        input_ids = torch.tensor([request.input_ids], dtype=torch.long, device=device)
+        model_inputs = {
+            "input_ids": input_ids,
+            "attention_mask": torch.ones_like(input_ids),
+            "position_ids": torch.arange(input_ids.shape[1], device=device)[None, :],
+        }
+        if self._forward_takes_cache_position:
+            model_inputs["cache_position"] = torch.arange(input_ids.shape[1], device=device)
+
+        image_hidden_states = request.image_hidden_states
+        if image_hidden_states is None and request.image_key is not None and request.image_key in self.image_cache:
+            image_hidden_states = self.image_cache[request.image_key]
+            self.image_cache.move_to_end(request.image_key)
+        if image_hidden_states is not None:
+            model_inputs["image_hidden_states"] = image_hidden_states
+        elif request.pixel_values is not None:
+            pixel_values = request.pixel_values
+            pixel_attention_mask = request.pixel_attention_mask
+            # Images of a single prompt: add the batch dimension
+            if pixel_values.dim() == 4:
+                pixel_values = pixel_values[None]
+                if pixel_attention_mask is not None:
+                    pixel_attention_mask = pixel_attention_mask[None]
+            model_inputs["pixel_values"] = pixel_values.to(device)
+            if pixel_attention_mask is not None:
+                model_inputs["pixel_attention_mask"] = pixel_attention_mask.to(device)
+
+        outputs, past_key_values = self._forward(**model_inputs)
+        if (
+            request.image_key is not None
+            and request.image_key not in self.image_cache
+            and getattr(outputs, "image_hidden_states", None) is not None
+        ):
+            self.image_cache[request.image_key] = outputs.image_hidden_states
+            if len(self.image_cache) > self.max_cached_images:
+                self.image_cache.popitem(last=False)
+
+        # The prompt is processed once, in the first slot of the request. The other beam hypotheses get a copy
+        # of its KV when they are created.
+        reserved_slots = self.kv_cache.allocate(request.num_beams)
+        self.kv_cache.write_prompt(reserved_slots[0], past_key_values)
+        running_request = _RunningRequest(
+            request=request,
+            logits_processor=self._get_logits_processor(request),
+            reserved_slots=reserved_slots,
+            slots=[reserved_slots[0]],
+            sequences=input_ids,
+            beam_scores=torch.zeros(1, device=device) if request.num_beams > 1 else None,
+        )
+        self.running.append(running_request)
+        if self._select_next_tokens(running_request, outputs.logits[:, -1, :].float()):
+            self._retire(running_request)
+
+    def _decode(self):
+        slots = [slot for running_request in self.running for slot in running_request.slots]
+        next_input_ids = torch.cat([running_request.sequences[:, -1:] for running_request in self.running])
+        past_key_values, attention_mask, lengths = self.kv_cache.gather(slots)
+        model_inputs = {
+            "input_ids": next_input_ids,
+            "attention_mask": attention_mask,
+            "position_ids": lengths[:, None],
+            "past_key_values": past_key_values,
+        }
+        if self._forward_takes_cache_position:
+            max_length = attention_mask.shape[1] - 1
+            model_inputs["cache_position"] = torch.arange(max_length, max_length + 1, device=attention_mask.device)
+        outputs, past_key_values = self._forward(**model_inputs)
+        self.kv_cache.append(slots, lengths, past_key_values)
+        self.num_decoded_tokens += len(slots)
+
+        logits = outputs.logits[:, -1, :].float()
+        finished = []
+        start = 0
+        for running_request in self.running:
+            num_sequences = len(running_request.slots)
+            if self._select_next_tokens(running_request, logits[start : start + num_sequences]):
+                finished.append(running_request)
+            start += num_sequences
+        for running_request in finished:
+            self._retire(running_request)
+
+    def _select_next_tokens(self, running_request, logits):
+        """Appends the next tokens to the sequences of the request. Returns whether the request is done."""
+        if running_request.request.num_beams > 1:
+            return self._beam_search_step(running_request, logits)
+
+        request = running_request.request
+        scores = running_request.logits_processor(running_request.sequences, logits)
+        next_tokens = torch.argmax(scores, dim=-1)
+        running_request.sequences = torch.cat([running_request.sequences, next_tokens[:, None]], dim=-1)
+        num_generated = running_request.sequences.shape[1] - running_request.prompt_length
+        if next_tokens.item() in self.eos_token_ids or num_generated >= request.max_new_tokens:
+            request.output_ids = running_request.sequences[0, running_request.prompt_length :].tolist()
+            return True
+        return False
+
+    def _beam_search_step(self, running_request, logits):
+        # Same as `BeamSearchScorer.process` for a single input
+        request = running_request.request
+        num_beams = request.num_beams
+        prompt_length = running_request.prompt_length
+        sequences = running_request.sequences
+        # Length of the sequences once the next tokens are appended
+        cur_len = sequences.shape[1] + 1
+
+        scores = torch.nn.functional.log_softmax(logits, dim=-1)
+        scores = running_request.logits_processor(sequences, scores)
+        scores = scores + running_request.beam_scores[:, None]
+        vocab_size = scores.shape[-1]
+        num_candidates = max(2, 1 + len(self.eos_token_ids)) * num_beams
+        top_scores, top_ids = torch.topk(scores.view(-1), min(num_candidates, scores.numel()), sorted=True)
+        top_scores, top_ids = top_scores.tolist(), top_ids.tolist()
+
+        parents, next_tokens, next_scores = [], [], []
+        for rank, (score, token_id) in enumerate(zip(top_scores, top_ids)):
+            parent, token = divmod(token_id, vocab_size)
+            if token in self.eos_token_ids:
+                # Only the eos tokens among the `num_beams` best candidates end a hypothesis
+                if rank >= num_beams:
+                    continue
+                self._add_hypothesis(running_request, sequences[parent], score, cur_len - prompt_length)
+            else:
+                parents.append(parent)
+                next_tokens.append(token)
+                next_scores.append(score)
+            if len(next_tokens) == num_beams:
+                break
+
+        done = len(running_request.hypotheses) >= num_beams and (
+            request.early_stopping
+            or running_request.worst_score
+            >= max(top_scores) / (cur_len - prompt_length) ** request.length_penalty
+        )
+        if done:
+            self._finalize_beams(running_request)
+            return True
+
+        self._reorder_beams(running_request, parents)
+        device = sequences.device
+        running_request.sequences = torch.cat(
+            [sequences[parents], torch.tensor(next_tokens, device=device)[:, None]], dim=-1
+        )
+        running_request.beam_scores = torch.tensor(next_scores, device=device)
+        if cur_len - prompt_length >= request.max_new_tokens:
+            # Max length reached: the current beams are hypotheses too
+            for sequence, score in zip(running_request.sequences, next_scores):
+                self._add_hypothesis(running_request, sequence, score, sequence.shape[0] - prompt_length)
+            self._finalize_beams(running_request)
+            return True
+        return False
+
+    def _add_hypothesis(self, running_request, tokens, sum_logprobs, generated_len):
+        # Same as `BeamHypotheses.add`
+        num_beams = running_request.request.num_beams
+        score = sum_logprobs / (generated_len**running_request.request.length_penalty)
+        hypotheses = running_request.hypotheses
+        if len(hypotheses) < num_beams or score > running_request.worst_score:
+            hypotheses.append((score, tokens.clone()))
+            if len(hypotheses) > num_beams:
+                sorted_scores = sorted([(s, idx) for idx, (s, _) in enumerate(hypotheses)])
+                del hypotheses[sorted_scores[0][1]]
+                running_request.worst_score = sorted_scores[1][0]
+            else:
+                running_request.worst_score = min(score, running_request.worst_score)
+
+    def _finalize_beams(self, running_request):
+        request = running_request.request
+        best_hypothesis = sorted(running_request.hypotheses, key=lambda hypothesis: hypothesis[0])[-1][1]
+        output_ids = best_hypothesis[running_request.prompt_length :].tolist()
+        # Hypotheses ended by an eos token are stored without it
+        if len(output_ids) < request.max_new_tokens:
+            output_ids.append(self.eos_token_ids[0])
+        request.output_ids = output_ids
+
+    def _reorder_beams(self, running_request, parents):
+        """
+        Assigns a slot to each new beam: the first child of a beam keeps its slot, the other ones get a copy of the
+        KV of their parent in one of the slots not used anymore.
+        """
+        old_slots = running_request.slots
+        new_slots = [None] * len(parents)
+        used_slots = set()
+        for idx, parent in enumerate(parents):
+            if old_slots[parent] not in used_slots:
+                new_slots[idx] = old_slots[parent]
+                used_slots.add(old_slots[parent])
+        spare_slots = [slot for slot in running_request.reserved_slots if slot not in used_slots]
+        src_slots, dst_slots = [], []
+        for idx, parent in enumerate(parents):
+            if new_slots[idx] is None:
+                new_slots[idx] = spare_slots.pop()
+                src_slots.append(old_slots[parent])
+                dst_slots.append(new_slots[idx])
+        if src_slots:
+            self.kv_cache.copy(src_slots, dst_slots)
+        running_request.slots = new_slots
+
+    def _retire(self, running_request):
+        running_request.request.done = True
+        self.running.remove(running_request)
+        self.kv_cache.free(running_request.reserved_slots)
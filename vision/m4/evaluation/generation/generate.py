@@ -13,6 +13,7 @@ from PIL import Image
 from transformers import AutoTokenizer
 
 from m4.evaluation.generation.config import get_config
+from m4.evaluation.generation.engine import GenerationEngine
 from m4.models.__init__ import model_type_to_modeling_class
 from m4.training.utils import build_image_transform
 
@@ -90,6 +91,7 @@ def model_generation(
     repetition_penalty,
     add_special_tokens,
     output_file,
+    generation_engine=None,
 ):
     all_texts_gen = []
     all_image_paths_gen = []
@@ -119,26 +121,53 @@ def model_generation(
     )
     input_ids = torch.stack([tokens.input_ids[idx] for idx in range(len(prompts))]).to(model.device)
     attention_mask = torch.stack([tokens.attention_mask[idx] for idx in range(len(prompts))]).to(model.device)
-    for image, image_path in zip(all_images, all_image_paths):
-        example_images = [image] * len(prompts)
-        pixel_values = [torch.stack([image_transform(img) for img in example_images])]
-        pixel_values = torch.stack(pixel_values, dim=1).to(model.device)
-        with torch.no_grad():
-            generated_tokens = model.generate(
-                input_ids=input_ids,
-                attention_mask=attention_mask,
-                pixel_values=pixel_values,
-                num_beams=num_beams,
-                no_repeat_ngram_size=no_repeat_ngram_size,
-                max_new_tokens=max_new_tokens,
-                min_length=min_length,
-                bad_words_ids=bad_words_ids,
-                length_penalty=length_penalty,
-                use_cache=True,
-                early_stopping=True,
-                synced_gpus=True,
-                repetition_penalty=repetition_penalty,
+    if generation_engine is not None:
+        # All the generations are submitted at once, and each image is encoded once for all the prompts
+        all_requests = []
+        for image, image_path in zip(all_images, all_image_paths):
+            pixel_values = image_transform(image)[None, None]
+            all_requests.append(
+                [
+                    generation_engine.submit(
+                        prompt_input_ids[prompt_attention_mask.bool()],
+                        pixel_values=pixel_values,
+                        image_key=str(image_path),
+                        num_beams=num_beams,
+                        no_repeat_ngram_size=no_repeat_ngram_size,
+                        max_new_tokens=max_new_tokens,
+                        min_length=min_length,
+                        bad_words_ids=bad_words_ids,
+                        length_penalty=length_penalty,
+                        early_stopping=True,
+                        repetition_penalty=repetition_penalty,
+                    )
+                    for prompt_input_ids, prompt_attention_mask in zip(input_ids, attention_mask)
+                ]
             )
+        generation_engine.run()
+    for image_idx, (image, image_path) in enumerate(zip(all_images, all_image_paths)):
+        if generation_engine is not None:
+            generated_tokens = torch.cat([input_ids, generation_engine.stack_outputs(all_requests[image_idx])], dim=-1)
+        else:
+            example_images = [image] * len(prompts)
+            pixel_values = [torch.stack([image_transform(img) for img in example_images])]
+            pixel_values = torch.stack(pixel_values, dim=1).to(model.device)
+            with torch.no_grad():
+                generated_tokens = model.generate(
+                    input_ids=input_ids,
+                    attention_mask=attention_mask,
+                    pixel_values=pixel_values,
+                    num_beams=num_beams,
+                    no_repeat_ngram_size=no_repeat_ngram_size,
+                    max_new_tokens=max_new_tokens,
+                    min_length=min_length,
+                    bad_words_ids=bad_words_ids,
+                    length_penalty=length_penalty,
+                    use_cache=True,
+                    early_stopping=True,
+                    synced_gpus=True,
+                    repetition_penalty=repetition_penalty,
+                )
         if accelerator.is_main_process:
             tokens = [tokenizer.convert_ids_to_tokens(ex) for ex in generated_tokens]
             decoded_skip_special_tokens = repr(
@@ -196,6 +225,15 @@ def main():
     )
     model = prepare_model(model, accelerator)
     model.eval()
+    generation_engine = None
+    if config.hparams.use_generation_engine:
+        if (
+            accelerator.distributed_type == DistributedType.DEEPSPEED
+            and accelerator.state.deepspeed_plugin.zero_stage == 3
+        ):
+            # The processes would run different numbers of forward passes, which ZeRO-3 can't synchronize
+            raise ValueError("`use_generation_engine` is not compatible with ZeRO-3.")
+        generation_engine = GenerationEngine(model, max_num_seqs=config.hparams.generation_engine_max_num_seqs)
     generated_texts, corresponding_image_paths = model_generation(
         prompts=config.hparams.prompts,
         all_images=all_images,
@@ -215,6 +253,7 @@ def main():
         repetition_penalty=config.hparams.repetition_penalty,
         add_special_tokens=config.hparams.add_special_tokens,
         output_file=config.hparams.generation_output_file,
+        generation_engine=generation_engine,
     )
     if accelerator.is_main_process:
         for text, image_path in zip(generated_texts, corresponding_image_paths):
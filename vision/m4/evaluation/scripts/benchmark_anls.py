@@ -0,0 +1,102 @@
+"""
+Benchmark of the ANLS computation of `DocVQAMetrics` against the original pair-by-pair implementation, on
+synthetic DocVQA-like predictions. Checks that the scores are exactly the same.
+
+Usage:
+    python m4/evaluation/scripts/benchmark_anls.py --num_predictions 50000 --num_proc 4
+"""
+import argparse
+import random
+import string
+import time
+
+import Levenshtein
+
+from m4.evaluation.custom_metrics.doc_vqa_metrics import average_normalized_levenshtein_similarity
+
+
+def original_average_normalized_levenshtein_similarity(ground_truth, predicted_answers, tau=0.5):
+    total_score = 0
+    for a_i, o_q_i in zip(ground_truth, predicted_answers):
+        if o_q_i == "":
+            max_score = 0
+        else:
+            scores = []
+            for a_ij in a_i:
+                nl = Levenshtein.distance(a_ij, o_q_i) / max(len(a_ij), len(o_q_i))
+                scores.append(1 - nl if nl < tau else 0)
+            max_score = max(scores)
+        total_score += max_score
+    return total_score / len(ground_truth)
+
+
+def random_answer(rng):
+    kind = rng.random()
+    if kind < 0.3:
+        return str(rng.randint(0, 100_000))
+    if kind < 0.6:
+        return " ".join(
+            "".join(rng.choices(string.ascii_lowercase, k=rng.randint(2, 9))) for _ in range(rng.randint(1, 4))
+        )
+    return "".join(rng.choices(string.ascii_lowercase + string.digits + " .,-/", k=rng.randint(5, 60)))
+
+
+def perturb(rng, text):
+    chars = list(text)
+    for _ in range(rng.randint(0, max(1, len(chars) // 3))):
+        position = rng.randrange(len(chars) + 1)
+        operation = rng.random()
+        if operation < 0.33 and position < len(chars):
+            del chars[position]
+        elif operation < 0.66:
+            chars.insert(position, rng.choice(string.ascii_lowercase))
+        elif position < len(chars):
+            chars[position] = rng.choice(string.ascii_lowercase)
+    return "".join(chars)
+
+
+def make_predictions(num_predictions, seed):
+    rng = random.Random(seed)
+    ground_truth, predicted_answers = [], []
+    for _ in range(num_predictions):
+        answers = [random_answer(rng)]
+        answers += [perturb(rng, answers[0]) or answers[0] for _ in range(rng.randint(0, 2))]
+        kind = rng.random()
+        if kind < 0.4:
+            prediction = rng.choice(answers)
+        elif kind < 0.8:
+            prediction = perturb(rng, rng.choice(answers))
+        elif kind < 0.98:
+            prediction = random_answer(rng)
+        else:
+            prediction = ""
+        ground_truth.append(answers)
+        predicted_answers.append(prediction)
+    return ground_truth, predicted_answers
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num_predictions", type=int, default=50_000)
+    parser.add_argument("--num_proc", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    ground_truth, predicted_answers = make_predictions(args.num_predictions, args.seed)
+
+    start = time.perf_counter()
+    original_anls = original_average_normalized_levenshtein_similarity(ground_truth, predicted_answers)
+    original_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    anls = average_normalized_levenshtein_similarity(ground_truth, predicted_answers, num_proc=args.num_proc)
+    new_time = time.perf_counter() - start
+
+    print(f"original {original_time:7.2f}s, ANLS {original_anls!r}")
+    print(f"new      {new_time:7.2f}s, ANLS {anls!r} (num_proc={args.num_proc})")
+    assert anls == original_anls, "The ANLS differ"
+    print("Identical ANLS.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""
+Parity and throughput of the continuous batching `GenerationEngine` against `model.generate`, on CPU with a tiny
+random VLlama3 model and random images.
+
+Parity: each prompt is generated alone (no padding) with `model.generate`, and the outputs must be the same as the
+ones of the engine. Throughput: the prompts are generated by padded batches of `--batch_size` with
+`model.generate`, and by the engine with `--batch_size * num_beams` KV cache slots.
+
+Usage:
+    python m4/evaluation/scripts/benchmark_generation_engine.py --num_prompts 64 --num_beams 3
+"""
+import argparse
+import random
+import time
+
+import torch
+from transformers import AutoTokenizer
+
+from m4.evaluation.generation.engine import GenerationEngine
+from m4.models.vllama3.modeling_vllama3 import VLlama3ForCausalLM
+from m4.training.utils import FAKE_TOKEN_AROUND_IMAGE_V2, IMAGE_TOKEN
+
+
+WORDS = ["What", "is", "in", "the", "image", "?", "Describe", "colour", "of", "cat", "how", "many", "people", "Answer"]
+
+
+def make_prompts(tokenizer, model, num_prompts, seed):
+    rng = random.Random(seed)
+    image_seq_len = model.config.perceiver_config.resampler_n_latents
+    image_size = model.config.vision_config.image_size
+    generator = torch.Generator().manual_seed(seed)
+    prompts, all_pixel_values = [], []
+    for _ in range(num_prompts):
+        text = " ".join(rng.choice(WORDS) for _ in range(rng.randint(2, 30)))
+        prompt = f"{FAKE_TOKEN_AROUND_IMAGE_V2}{IMAGE_TOKEN * image_seq_len}{FAKE_TOKEN_AROUND_IMAGE_V2}{text}"
+        prompts.append(tokenizer(prompt, add_special_tokens=False).input_ids)
+        all_pixel_values.append(torch.rand(1, 1, 3, image_size, image_size, generator=generator))
+    return prompts, all_pixel_values
+
+
+def generate_alone(model, prompts, all_pixel_values, generation_kwargs):
+    outputs = []
+    for prompt, pixel_values in zip(prompts, all_pixel_values):
+        input_ids = torch.tensor([prompt])
+        generated_tokens = model.generate(
+            input_ids=input_ids,
+            attention_mask=torch.ones_like(input_ids),
+            pixel_values=pixel_values,
+            use_cache=True,
+            **generation_kwargs,
+        )
+        outputs.append(generated_tokens[0, input_ids.shape[1] :].tolist())
+    return outputs
+
+
+def generate_padded_batches(model, tokenizer, prompts, all_pixel_values, batch_size, generation_kwargs):
+    num_generated_tokens = 0
+    for start in range(0, len(prompts), batch_size):
+        batch = prompts[start : start + batch_size]
+        max_len = max(len(prompt) for prompt in batch)
+        input_ids = torch.tensor([[tokenizer.pad_token_id] * (max_len - len(prompt)) + prompt for prompt in batch])
+        attention_mask = torch.tensor([[0] * (max_len - len(prompt)) + [1] * len(prompt) for prompt in batch])
+        generated_tokens = model.generate(
+            input_ids=input_ids,
+            attention_mask=attention_mask,
+            pixel_values=torch.cat(all_pixel_values[start : start + batch_size]),
+            use_cache=True,
+            **generation_kwargs,
+        )
+        num_generated_tokens += generated_tokens[:, max_len:].numel()
+    return num_generated_tokens
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model_name", type=str, default="HuggingFaceM4/tiny-random-vllama3-m4")
+    parser.add_argument("--num_prompts", type=int, default=64)
+    parser.add_argument("--batch_size", type=int, default=16)
+    parser.add_argument("--num_beams", type=int, default=1)
+    parser.add_argument("--max_new_tokens", type=int, default=32)
+    parser.add_argument("--no_repeat_ngram_size", type=int, default=0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    torch.manual_seed(args.seed)
+    tokenizer = AutoTokenizer.from_pretrained(args.model_name)
+    model = VLlama3ForCausalLM.from_pretrained(args.model_name, torch_dtype=torch.float32).eval()
+    prompts, all_pixel_values = make_prompts(tokenizer, model, args.num_prompts, args.seed)
+    bad_words_ids = tokenizer([IMAGE_TOKEN, FAKE_TOKEN_AROUND_IMAGE_V2], add_special_tokens=False)["input_ids"]
+    generation_kwargs = {
+        "num_beams": args.num_beams,
+        "max_new_tokens": args.max_new_tokens,
+        "no_repeat_ngram_size": args.no_repeat_ngram_size,
+        "bad_words_ids": bad_words_ids,
+        "early_stopping": True,
+    }
+
+    with torch.no_grad():
+        reference_outputs = generate_alone(model, prompts, all_pixel_values, generation_kwargs)
+
+        start = time.perf_counter()
+        num_generated_tokens = generate_padded_batches(
+            model, tokenizer, prompts, all_pixel_values, args.batch_size, generation_kwargs
+        )
+        generate_time = time.perf_counter() - start
+
+    engine = GenerationEngine(model, max_num_seqs=args.batch_size * args.num_beams)
+    start = time.perf_counter()
+    requests = [
+        engine.submit(prompt, pixel_values=pixel_values, **generation_kwargs)
+        for prompt, pixel_values in zip(prompts, all_pixel_values)
+    ]
+    engine.run()
+    engine_time = time.perf_counter() - start
+
+    num_identical = sum(
+        request.output_ids == reference_output for request, reference_output in zip(requests, reference_outputs)
+    )
+    num_engine_tokens = sum(len(request.output_ids) for request in requests)
+    print(f"generate {generate_time:7.2f}s ({num_generated_tokens / generate_time:8.1f} tokens/s, with padding)")
+    print(
+        f"engine   {engine_time:7.2f}s ({num_engine_tokens / engine_time:8.1f} tokens/s,"
+        f" {engine.num_forward_passes} forward passes)"
+    )
+    print(f"{num_identical}/{len(prompts)} generations identical to `generate`")
+    assert num_identical == len(prompts), "The generations of the engine differ from the ones of `generate`"
+
+
+if __name__ == "__main__":
+    main()
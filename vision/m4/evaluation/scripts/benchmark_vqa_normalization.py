@@ -0,0 +1,172 @@
+"""
+Benchmark of the VQA normalization and accuracy against the original GT Vision Lab implementation, on synthetic
+VQAv2-like predictions (10 reference answers per question). Checks that the scores are exactly the same.
+
+Usage:
+    python m4/evaluation/scripts/benchmark_vqa_normalization.py --num_predictions 200000
+"""
+import argparse
+import random
+import re
+import time
+
+from m4.evaluation.custom_metrics.utils import VQANormalizationGtVisionLab, compute_vqa_accuracy
+
+
+ANSWERS = [
+    "yes",
+    "no",
+    "Yes",
+    "no.",
+    "2",
+    "two",
+    "3,000",
+    "1.5",
+    "10:30",
+    "none",
+    "the dog",
+    "a dog",
+    "dogs",
+    "red",
+    "red.",
+    "(red)",
+    "red/white",
+    "black and white",
+    "black & white",
+    "man's hat",
+    "cant tell",
+    "i don't know",
+    "left-side",
+    "tennis racket",
+    "on the table!",
+    'the "stop" sign',
+    "$5",
+    "10 ft",
+    "50 %",
+    "frisbee",
+]
+PREFIXES = ["", "", "", "The answer is ", "It is ", "I think it's "]
+
+
+class OriginalVQANormalizationGtVisionLab(VQANormalizationGtVisionLab):
+    """The implementation of https://github.com/GT-Vision-Lab/VQA, before the single-pass rewrite"""
+
+    def processPunctuation(self, in_text):
+        out_text = in_text
+        for p in self.punct:
+            if (p + " " in in_text or " " + p in in_text) or (re.search(self.comma_strip, in_text) is not None):
+                out_text = out_text.replace(p, "")
+            else:
+                out_text = out_text.replace(p, " ")
+        out_text = self.period_strip.sub("", out_text, re.UNICODE)
+        return out_text
+
+    def processDigitArticle(self, in_text):
+        out_text = []
+        tempText = in_text.lower().split()
+        for word in tempText:
+            word = self.manual_map.setdefault(word, word)
+            if word not in self.articles:
+                out_text.append(word)
+            else:
+                pass
+        for wordId, word in enumerate(out_text):
+            if word in self.contractions:
+                out_text[wordId] = self.contractions[word]
+        out_text = " ".join(out_text)
+        return out_text
+
+    def vqa_normalize_text(self, text):
+        text = text.replace("\n", " ")
+        text = text.replace("\t", " ")
+        text = text.strip()
+
+        text = self.processPunctuation(text)
+        text = self.processDigitArticle(text)
+        return text
+
+
+def original_compute_vqa_accuracy(generated_texts_unique, answers_unique, normalize_text_fn):
+    first_word_vqa_accuracy_scores = []
+    oe_accuracy_scores = []
+    for generated_text, answers_ in zip(generated_texts_unique, answers_unique):
+        generated_text = normalize_text_fn(generated_text)
+        generated_first_word = generated_text.split(" ")[0]
+        answers_ = [normalize_text_fn(answer_) for answer_ in answers_]
+
+        if len(answers_) == 1:
+            first_word_vqa_accuracy_scores.append((generated_first_word == answers_[0]) * 1.0)
+            oe_accuracy_scores.append((generated_text == answers_[0]) * 1.0)
+
+        else:
+            gt_first_word_acc = []
+            gt_oe_acc = []
+            for idx_ref in range(len(answers_)):
+                other_answers_ = [other_answer for idx, other_answer in enumerate(answers_) if idx != idx_ref]
+
+                matched_with_first_word = [
+                    other_answer for other_answer in other_answers_ if other_answer == generated_first_word
+                ]
+                matched_with_oe_text = [other_answer for other_answer in other_answers_ if other_answer == generated_text]
+
+                first_word_acc = min(1, len(matched_with_first_word) / 3)
+                oe_acc = min(1, len(matched_with_oe_text) / 3)
+
+                gt_first_word_acc.append(first_word_acc)
+                gt_oe_acc.append(oe_acc)
+
+            first_word_vqa_accuracy_scores.append(sum(gt_first_word_acc) / len(gt_first_word_acc))
+            oe_accuracy_scores.append(sum(gt_oe_acc) / len(gt_oe_acc))
+    return first_word_vqa_accuracy_scores, oe_accuracy_scores
+
+
+def make_predictions(num_predictions, num_answers, seed):
+    rng = random.Random(seed)
+    generated_texts, answers = [], []
+    for _ in range(num_predictions):
+        # Annotators mostly agree on a few answers
+        candidates = rng.sample(ANSWERS, 3)
+        answers.append([rng.choice(candidates) for _ in range(num_answers)])
+        generated_texts.append(rng.choice(PREFIXES) + rng.choice(candidates + [rng.choice(ANSWERS)]))
+    # A few single-answer questions, as in GQA
+    for idx in range(0, num_predictions, 50):
+        answers[idx] = answers[idx][:1]
+    return generated_texts, answers
+
+
+def run(label, compute_fn, normalize_text_fn, generated_texts, answers):
+    start = time.perf_counter()
+    scores = compute_fn(generated_texts, answers, normalize_text_fn)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<12} {elapsed:7.2f}s ({len(generated_texts) / elapsed:9.0f} predictions/s)")
+    return scores
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num_predictions", type=int, default=200_000)
+    parser.add_argument("--num_answers", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    generated_texts, answers = make_predictions(args.num_predictions, args.num_answers, args.seed)
+
+    original_scores = run(
+        "original",
+        original_compute_vqa_accuracy,
+        OriginalVQANormalizationGtVisionLab().vqa_normalize_text,
+        generated_texts,
+        answers,
+    )
+    scores = run(
+        "new", compute_vqa_accuracy, VQANormalizationGtVisionLab().vqa_normalize_text, generated_texts, answers
+    )
+
+    for name, original_metric_scores, metric_scores in zip(["first word", "open-ended"], original_scores, scores):
+        assert original_metric_scores == metric_scores, f"The {name} scores differ"
+        assert sum(original_metric_scores) / len(original_metric_scores) == sum(metric_scores) / len(metric_scores)
+        print(f"{name} VQA accuracy: {sum(metric_scores) / len(metric_scores):.6f} (identical)")
+
+
+if __name__ == "__main__":
+    main()
@@ -347,6 +347,21 @@ class Vgpt2ImageCaptioningInContext(BaseTaskImageCaptioning):
         bad_words = ["\n", "\n\n", self.image_token, self.token_around_image]
         bad_words_ids = self.tokenizer(bad_words, add_special_tokens=False)["input_ids"]
 
+        generation_engine = kwargs.get("generation_engine", None)
+        if generation_engine is not None:
+            # Continuous batching: the prompts are unpadded and each image is encoded once for all the beams
+            return generation_engine.generate(
+                input_ids=input_ids,
+                attention_mask=attention_mask,
+                pixel_values=pixel_values,
+                pixel_attention_mask=pixel_attention_mask,
+                num_beams=num_beams,
+                no_repeat_ngram_size=no_repeat_ngram_size,
+                max_new_tokens=max_new_tokens,
+                bad_words_ids=bad_words_ids,
+                early_stopping=True,
+            )
+
         unwrapped_model = extract_model_from_parallel(model)
         is_deepspeed_model = isinstance(model, DeepSpeedEngine)
         if is_deepspeed_model:
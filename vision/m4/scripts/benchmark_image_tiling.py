@@ -0,0 +1,98 @@
+"""
+Compares the tiles/sec of the per-image preprocessing (`image_splitting` + the siglip transform applied to every
+sub-image) with the batched one (`ImageTilePipeline` + `tile_normalizer`), on synthetic JPEGs.
+
+Usage:
+    python m4/scripts/benchmark_image_tiling.py --num_images 64 --resolution 3000x2000 --max_image_size 1536 \
+        --vision_encoder_max_image_size 384 --threads 0 4 8
+"""
+import argparse
+import io
+import time
+
+import numpy as np
+import torch
+from PIL import Image
+
+from m4.training.utils import ImageTilePipeline, VisionEncoderTypes, build_image_transform, image_splitting
+
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num_images", type=int, default=64)
+    parser.add_argument("--resolution", type=str, default="3000x2000", help="WIDTHxHEIGHT of the synthetic images")
+    parser.add_argument("--max_image_size", type=int, default=1536)
+    parser.add_argument("--vision_encoder_max_image_size", type=int, default=384)
+    parser.add_argument("--threads", type=int, nargs="+", default=[0, 4], help="Thread counts for the batched path")
+    parser.add_argument("--jpeg_draft", action="store_true", help="Enable the JPEG draft mode decoding")
+    return parser.parse_args()
+
+
+def make_jpegs(num_images, width, height):
+    rng = np.random.default_rng(0)
+    # Smooth gradients + a bit of noise, so that the JPEGs have a realistic size
+    x = np.linspace(0, 255, width, dtype=np.float32)[None, :, None]
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None, None]
+    jpegs = []
+    for _ in range(num_images):
+        pixels = (x * rng.random(3) + y * rng.random(3)) % 256
+        pixels += rng.normal(0, 8, size=pixels.shape)
+        buffer = io.BytesIO()
+        Image.fromarray(pixels.clip(0, 255).astype(np.uint8)).save(buffer, format="JPEG", quality=90)
+        jpegs.append(buffer.getvalue())
+    return jpegs
+
+
+def run(label, process_fn, jpegs, batch_size=16):
+    # Decoding is lazy, so opening the images is part of the measured time as it is during training
+    start = time.perf_counter()
+    num_tiles = 0
+    for idx in range(0, len(jpegs), batch_size):
+        num_tiles += process_fn([Image.open(io.BytesIO(jpeg)) for jpeg in jpegs[idx : idx + batch_size]]).shape[0]
+    elapsed = time.perf_counter() - start
+    print(f"{label:<28} {num_tiles:>6} tiles in {elapsed:7.2f}s -> {num_tiles / elapsed:8.1f} tiles/s")
+
+
+def main():
+    args = get_args()
+    width, height = (int(x) for x in args.resolution.split("x"))
+    jpegs = make_jpegs(args.num_images, width, height)
+    print(f"{len(jpegs)} JPEGs of {width}x{height}")
+
+    image_transform = build_image_transform(
+        max_image_size=args.vision_encoder_max_image_size,
+        image_size=None,
+        eval=True,
+        vision_encoder_type=VisionEncoderTypes.siglip,
+    )
+
+    def legacy(images):
+        tiles = []
+        for image in images:
+            frames, _, _ = image_splitting(
+                image,
+                vision_encoder_max_image_size=args.vision_encoder_max_image_size,
+                max_image_size=args.max_image_size,
+            )
+            tiles.extend(image_transform(frame) for frame in frames)
+        return torch.stack(tiles)
+
+    run("image_splitting + transform", legacy, jpegs)
+
+    for num_threads in args.threads:
+        pipeline = ImageTilePipeline(
+            vision_encoder_max_image_size=args.vision_encoder_max_image_size,
+            max_image_size=args.max_image_size,
+            num_threads=num_threads,
+            use_jpeg_draft=args.jpeg_draft,
+        )
+
+        def batched(images):
+            tiles = [tile for image_tiles, _, _ in pipeline.split(images) for tile in image_tiles]
+            return image_transform.tile_normalizer(tiles)
+
+        run(f"tile pipeline ({num_threads} threads)", batched, jpegs)
+
+
+if __name__ == "__main__":
+    main()
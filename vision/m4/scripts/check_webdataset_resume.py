@@ -0,0 +1,181 @@
+"""
+Checks that `IterableWrapperWebdataset` resumes exactly where it stopped: the batches yielded after restoring a saved
+`dataset_state` must be the ones of an uninterrupted run. The state is taken in the middle of a shard, with samples
+in the shuffle buffers and rows in the overflow batch, and goes through a pickle round-trip like a checkpoint.
+
+The shards are synthetic image-caption tars. The mapper is replaced by a light one drawing from the same random
+sources as the real mappers (`random`, `np.random` and `torch`), and yielding a variable number of rows with images
+of variable sizes, so that the overflow batches and their padding are exercised.
+
+Usage:
+    python m4/scripts/check_webdataset_resume.py --num_shards 3 --samples_per_shard 40 --num_resumes 5
+"""
+import argparse
+import io
+import os
+import pickle
+import random
+import tarfile
+import tempfile
+
+import numpy as np
+import torch
+from PIL import Image
+
+from m4.training.dataset import IterableWrapperWebdataset
+from m4.training.dataset_utils import get_webdataset
+from m4.training.types import DatasetNames, DatasetTypes
+
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num_shards", type=int, default=3)
+    parser.add_argument("--samples_per_shard", type=int, default=40)
+    parser.add_argument("--batch_size", type=int, default=4)
+    parser.add_argument("--mapper_batch_size", type=int, default=8)
+    parser.add_argument("--num_resumes", type=int, default=5, help="Number of batches to resume from")
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args()
+
+
+def write_shards(directory, num_shards, samples_per_shard, seed):
+    rng = np.random.default_rng(seed)
+    urls = []
+    for idx_shard in range(num_shards):
+        url = os.path.join(directory, f"shard_{idx_shard:03d}.tar")
+        with tarfile.open(url, "w") as tar:
+            for idx_sample in range(samples_per_shard):
+                key = f"{idx_shard:03d}_{idx_sample:05d}"
+                size = tuple(int(x) for x in rng.integers(8, 32, size=2))
+                image = Image.fromarray(rng.integers(0, 256, size=(*size, 3), dtype=np.uint8))
+                with io.BytesIO() as output:
+                    image.save(output, format="PNG")
+                    image_bytes = output.getvalue()
+                for fname, data in [(f"{key}.image", image_bytes), (f"{key}.text", f"caption {key}".encode())]:
+                    tarinfo = tarfile.TarInfo(fname)
+                    tarinfo.size = len(data)
+                    tar.addfile(tarinfo, io.BytesIO(data))
+        urls.append(url)
+    return urls
+
+
+def light_mapper(batch, prefix_seed):
+    """0 to 2 rows per sample, depending on the global random states, with the image of the sample."""
+    rows = []
+    for image, text in zip(batch["image"], batch["text"]):
+        for _ in range(random.randint(0, 2)):
+            input_ids = torch.tensor([ord(c) for c in text[-9:]] + [int(np.random.randint(1000))])
+            pixels = torch.from_numpy(np.array(image.convert("RGB"))).permute(2, 0, 1).float()
+            rows.append((input_ids, pixels + torch.rand(1)))
+    if not rows:
+        return {"input_ids": torch.zeros(0, 10, dtype=torch.long)}
+    max_height = max(pixels.shape[1] for _, pixels in rows)
+    max_width = max(pixels.shape[2] for _, pixels in rows)
+    pixel_values = torch.zeros(len(rows), 1, 3, max_height, max_width)
+    pixel_attention_mask = torch.zeros(len(rows), 1, max_height, max_width, dtype=torch.bool)
+    for idx, (_, pixels) in enumerate(rows):
+        pixel_values[idx, 0, :, : pixels.shape[1], : pixels.shape[2]] = pixels
+        pixel_attention_mask[idx, 0, : pixels.shape[1], : pixels.shape[2]] = True
+    return {
+        "input_ids": torch.stack([input_ids for input_ids, _ in rows]),
+        "pixel_values": pixel_values,
+        "pixel_attention_mask": pixel_attention_mask,
+    }
+
+
+def build_dataset(urls, args):
+    webdataset = get_webdataset(
+        urls=urls,
+        ds_type=DatasetTypes.IMAGE_CAPTION_PAIRS,
+        batch_size=args.mapper_batch_size,
+        shuffle_initial_urls_list=False,
+        shuffle_before_split_by_node_buffer_size=100,
+        shuffle_before_split_by_worker_buffer_size=100,
+        shuffle_after_tarfile_to_samples_buffer_size=16,
+        shuffle_after_batching_buffer_size=3,
+    )
+    dataset = IterableWrapperWebdataset(
+        webdataset,
+        tokenizer=None,
+        image_transform=None,
+        batch_size=args.batch_size,
+        seed=args.seed,
+        dataset_type=DatasetTypes.IMAGE_CAPTION_PAIRS,
+        dataset_name=DatasetNames.PMD,
+        image_seq_len=64,
+        rank=0,
+        world_size=1,
+        mapper_batch_size=args.mapper_batch_size,
+        shuffle_after_packing=True,
+    )
+    dataset.mapper = light_mapper
+    return dataset
+
+
+def run(dataset):
+    """The `(dataset_state, batch)` pairs of one epoch"""
+    dataset.set_epoch(0)
+    return [(dataset_state, batch) for _, _, dataset_state, batch in dataset]
+
+
+def assert_same_batches(batches, expected_batches, description):
+    assert len(batches) == len(expected_batches), (description, len(batches), len(expected_batches))
+    for idx, (batch, expected_batch) in enumerate(zip(batches, expected_batches)):
+        assert sorted(batch.keys()) == sorted(expected_batch.keys()), (description, idx)
+        for key in batch.keys():
+            assert torch.equal(batch[key], expected_batch[key]), (description, idx, key)
+
+
+def main():
+    args = get_args()
+    with tempfile.TemporaryDirectory(prefix="m4_webdataset_resume_") as directory:
+        urls = write_shards(directory, args.num_shards, args.samples_per_shard, args.seed)
+        # Different global random states before each run, they must not matter
+        random.seed(1)
+        np.random.seed(1)
+        reference = run(build_dataset(urls, args))
+        print(f"[INFO] {len(reference)} batches in the uninterrupted run")
+
+        # Resume from states taken in the middle of a shard
+        candidates = [
+            idx
+            for idx, (dataset_state, _) in enumerate(reference[:-1])
+            if dataset_state["webdataset_state"]["batch"]["reader"] is not None
+            and dataset_state["webdataset_state"]["batch"]["reader"]["offset"] > 0
+        ]
+        assert candidates, "No state was taken in the middle of a shard, use more samples per shard"
+        resume_indices = np.linspace(0, len(candidates) - 1, min(args.num_resumes, len(candidates))).astype(int)
+        num_with_overflow = 0
+        for idx in sorted({candidates[i] for i in resume_indices}):
+            dataset_state = pickle.loads(pickle.dumps(reference[idx][0]))
+            num_with_overflow += len(dataset_state["webdataset_state"]["overflow"]["sources"]) > 0
+            random.seed(2 + idx)
+            np.random.seed(2 + idx)
+            dataset = build_dataset(urls, args)
+            dataset.set_state(
+                worker_idx_tracker={
+                    dataset_state["worker_idx"]: (
+                        dataset_state["map_start_idx"],
+                        dataset_state["last_key_idx"],
+                        dataset_state["previous_overflow_batch"],
+                    )
+                },
+                start_worker_idx=0,
+                webdataset_state_tracker={dataset_state["worker_idx"]: dataset_state["webdataset_state"]},
+            )
+            resumed = run(dataset)
+            reader = dataset_state["webdataset_state"]["batch"]["reader"]
+            assert_same_batches(
+                [batch for _, batch in resumed], [batch for _, batch in reference[idx + 1 :]], f"resume after {idx}"
+            )
+            print(
+                f"[INFO] Resumed after batch {idx} ({os.path.basename(reader['url'])} at byte {reader['offset']}, "
+                f"{len(dataset_state['webdataset_state']['overflow']['sources'])} overflow rows): "
+                f"{len(resumed)} identical batches"
+            )
+        assert num_with_overflow > 0, "No resume had an overflow batch to rebuild"
+    print("All checks passed.")
+
+
+if __name__ == "__main__":
+    main()
@@ -65,6 +65,11 @@ def get_args():
         default=256,
         help="The number of threads used for downloading the pictures.",
     )
+    parser.add_argument(
+        "--use_img2dataset",
+        action="store_true",
+        help="Download the images with img2dataset instead of in the process.",
+    )
     parser.add_argument(
         "--number_sample_per_shard",
         type=int,
@@ -92,6 +97,12 @@ def get_args():
         default="./large_files/output_extraction/map_url_idx.json",
         help="The file to save the map to go from urls to indices of the dataset containing all images.",
     )
+    parser.add_argument(
+        "--path_save_dir_url_index",
+        type=str,
+        default="./large_files/output_extraction/url_index",
+        help="The directory to save the on-disk index from urls to indices of the dataset containing all images.",
+    )
     parser.add_argument(
         "--num_proc_urls_to_images",
         type=int,
@@ -177,6 +188,8 @@ if __name__ == "__main__":
         num_proc_urls_to_images=num_proc_urls_to_images,
         path_save_dir_sharded_dataset=path_save_dir_sharded_dataset,
         shard_size=shard_size,
+        use_img2dataset=args.use_img2dataset,
+        path_save_dir_url_index=args.path_save_dir_url_index,
     )
 
     web_document_extractor.html_to_web_documents()
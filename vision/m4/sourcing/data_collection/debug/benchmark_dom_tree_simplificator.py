@@ -0,0 +1,149 @@
+"""
+Benchmark of `DOMTreeSimplificator` against the original implementation (one traversal of the tree per rule, and
+restarting the traversal after each removal for the special divs and the unnesting). Checks that the simplified
+pages are byte-identical, and reports the pages per second and the peak memory of the python allocations of both.
+
+The pages are the `.html` files of `--html_dir`, or the first `--num_pages` pages of the dataset of
+`load_dataset_html`.
+
+Usage:
+    python m4/sourcing/data_collection/debug/benchmark_dom_tree_simplificator.py --html_dir fixture_pages
+    python m4/sourcing/data_collection/debug/benchmark_dom_tree_simplificator.py --num_pages 1000
+"""
+import argparse
+import time
+import tracemalloc
+from itertools import islice
+from pathlib import Path
+
+from m4.sourcing.data_collection.processors import DOMTreeSimplificator
+from m4.sourcing.data_collection.utils import get_media_src, load_dataset_html
+
+
+class OriginalDOMTreeSimplificator(DOMTreeSimplificator):
+    """The implementation before the rules were applied in a single traversal of the tree"""
+
+    def _simplify_tree(self, selectolax_tree):
+        if self.strip_special_divs:
+            selectolax_tree = self._strip_special_divs(selectolax_tree)
+        if self.remove_dates:
+            selectolax_tree = self._remove_dates(selectolax_tree)
+        if self.remove_empty_leaves:
+            selectolax_tree = self._remove_empty_leaves(selectolax_tree)
+        if self.unnest_nodes:
+            selectolax_tree = self._unnest_nodes(selectolax_tree)
+        return selectolax_tree
+
+    def _strip_special_divs(self, selectolax_tree):
+        special_div_ids = ["footer", "header", "navigation", "nav", "navbar", "menu"]
+        modification = True
+        while modification:
+            found_a_node = False
+            for node in selectolax_tree.root.traverse():
+                if node.tag == "div":
+                    attributes = node.attributes
+                    if (
+                        ("id" in attributes and attributes["id"] in special_div_ids)
+                        or ("class" in attributes and attributes["class"] in special_div_ids)
+                        or ("title" in attributes and attributes["title"] in special_div_ids)
+                    ):
+                        node.decompose()
+                        found_a_node = True
+                        break
+            if not found_a_node:
+                modification = False
+        return selectolax_tree
+
+    def _remove_dates(self, selectolax_tree):
+        nodes_to_remove = []
+        for node in selectolax_tree.root.traverse():
+            if node.tag == "div":
+                if node.attributes:
+                    if "class" in node.attributes:
+                        if node.attributes["class"]:
+                            if "date" in node.attributes["class"]:
+                                nodes_to_remove += [
+                                    child for child in node.iter(include_text=True) if child.tag == "-text"
+                                ]
+        for node in nodes_to_remove:
+            node.decompose()
+        return selectolax_tree
+
+    def _remove_empty_leaves(self, selectolax_tree):
+        modification = True
+        while modification:
+            nodes_to_remove = [
+                node
+                for node in selectolax_tree.root.traverse()
+                if (
+                    (node.tag not in self.media_tags)
+                    and (not [child for child in node.iter()])
+                    and (not node.text().strip())
+                    and (node.tag != "html")
+                )
+                or ((node.tag in self.media_tags) and not get_media_src(node))
+            ]
+            if nodes_to_remove:
+                for node in nodes_to_remove:
+                    node.decompose(recursive=False)
+            else:
+                modification = False
+        return selectolax_tree
+
+    def _unnest_nodes(self, selectolax_tree):
+        modification = True
+        while modification:
+            modification = False
+            for node in selectolax_tree.root.traverse():
+                children = [child for child in node.iter()]
+                if len(children) == 1:
+                    child = children[0]
+                    if node.tag == child.tag:
+                        text = node.text(deep=False).strip()
+                        if not text:
+                            node.replace_with(child)
+                            modification = True
+                            break
+        return selectolax_tree
+
+
+def load_pages(html_dir, num_pages):
+    if html_dir is not None:
+        return [path.read_text(errors="replace") for path in sorted(Path(html_dir).glob("*.html"))]
+    return [example["html"] for example in islice(load_dataset_html(), num_pages)]
+
+
+def run(label, dom_tree_simplificator, pages):
+    start = time.perf_counter()
+    outputs = [dom_tree_simplificator(html_str, type_return="str") for html_str in pages]
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    for html_str in pages:
+        dom_tree_simplificator(html_str, type_return="str")
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(f"{label:<10} {len(pages) / elapsed:8.1f} pages/s, peak python memory {peak_memory / 2**20:8.1f} MiB")
+    return outputs
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--html_dir", type=str, default=None)
+    parser.add_argument("--num_pages", type=int, default=1000)
+    args = parser.parse_args()
+
+    pages = load_pages(args.html_dir, args.num_pages)
+    print(f"{len(pages)} pages, {sum(len(page) for page in pages) / 2**20:.1f} MiB of html")
+
+    original_outputs = run("original", OriginalDOMTreeSimplificator(), pages)
+    outputs = run("fused", DOMTreeSimplificator(), pages)
+
+    num_different = sum(output != original_output for output, original_output in zip(outputs, original_outputs))
+    assert num_different == 0, f"{num_different} simplified pages differ"
+    print("Identical simplified pages.")
+
+
+if __name__ == "__main__":
+    main()
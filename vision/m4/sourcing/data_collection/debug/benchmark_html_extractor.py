@@ -0,0 +1,138 @@
+"""
+Benchmark of the fast path of `HtmlExtractor` (the payload decoded with its charset and given as is to selectolax)
+against the BeautifulSoup round trip, on the WARC records of `--path_warc_dataset`, or on synthetic WARC records
+(several charsets, pages with invalid bytes for the fallback, deep pages, line break tags in any case and spacing, in
+the text and in the attributes).
+
+Since the html is only used through selectolax, the parity is checked on what is extracted from it: the nodes of
+`DOMTreeSimplificator` followed by `PreExtractionSimplificator`. The extraction is reported in pages per second, alone
+and followed by the simplifications.
+
+Usage:
+    python m4/sourcing/data_collection/debug/benchmark_html_extractor.py --num_pages 2000
+    python m4/sourcing/data_collection/debug/benchmark_html_extractor.py --path_warc_dataset ./warc_dataset
+"""
+import argparse
+import io
+import random
+import time
+from itertools import islice
+
+from datasets import load_from_disk
+from warcio.statusandheaders import StatusAndHeaders
+from warcio.warcwriter import WARCWriter
+
+from m4.sourcing.data_collection.processors import DOMTreeSimplificator, HtmlExtractor, PreExtractionSimplificator
+
+
+PAGE_TEMPLATE = """<!DOCTYPE html>
+<html><head><meta charset="{charset}"><title>{title}</title></head>
+<body><div class="content"><h1>{title}</h1>{paragraphs}<img src="https://example.com/image_{idx}.jpg" alt="{title}">
+<ul>{items}</ul>{deep}</div><div id="footer">Footer</div></body></html>"""
+WORDS = ["voilà", "naïve", "café", "Straße", "año", "über", "“quotes”", "€ price", "data", "image", "&amp;", "<br>"]
+# The variants of the line break tags, that BeautifulSoup normalizes
+WORDS += ["<BR>", "<Br/>", "<br >", "<BR />", "<br\n/>", "</br>", "</BR >"]
+
+
+def make_page(rng, idx):
+    title = " ".join(rng.choices(WORDS, k=4))
+    paragraphs = "".join(
+        f"<p>{' '.join(rng.choices(WORDS, k=rng.randint(5, 60)))}</p>" for _ in range(rng.randint(1, 30))
+    )
+    items = "".join(f"<li>{rng.choice(WORDS)}" for _ in range(rng.randint(0, 10)))
+    depth = 5000 if rng.random() < 0.01 else rng.randint(0, 20)
+    deep = "<div>" * depth + "deep text" + "</div>" * depth
+    # The charset is filled in `make_warc`
+    return PAGE_TEMPLATE.format(
+        charset="{charset}", title=title, paragraphs=paragraphs, items=items, deep=deep, idx=idx
+    )
+
+
+def make_warc(page, charset, identified_charset, url):
+    payload = page.format(charset=charset).encode(charset, errors="replace")
+    if identified_charset == "invalid":
+        # Bytes that are not valid utf-8, for the fallback
+        payload = payload.replace(b"<h1>", b"<h1>\xff\xfe", 1)
+        identified_charset = "utf-8"
+    http_headers = StatusAndHeaders("200 OK", [("Content-Type", f"text/html; charset={charset}")], protocol="HTTP/1.1")
+    warc_headers = {"WARC-Identified-Content-Charset": identified_charset} if identified_charset else {}
+    with io.BytesIO() as stream:
+        writer = WARCWriter(stream, gzip=True)
+        record = writer.create_warc_record(
+            url, "response", payload=io.BytesIO(payload), http_headers=http_headers, warc_headers_dict=warc_headers
+        )
+        writer.write_record(record)
+        return stream.getvalue()
+
+
+def make_warcs(num_pages, seed):
+    rng = random.Random(seed)
+    warcs = []
+    for idx in range(num_pages):
+        charset, identified_charset = rng.choice(
+            [("utf-8", "utf-8")] * 6
+            + [("windows-1252", "windows-1252"), ("iso-8859-1", "ISO-8859-1"), ("shift_jis", "Shift_JIS")]
+            + [("utf-8", ""), ("utf-8", "invalid")]
+        )
+        warcs.append(make_warc(make_page(rng, idx), charset, identified_charset, f"https://example.com/{idx}"))
+    return warcs
+
+
+def extract_nodes(html_str, dom_tree_simplificator, pre_extraction_simplificator):
+    selectolax_tree = dom_tree_simplificator(html_str, type_return="selectolax_tree")
+    list_nodes = pre_extraction_simplificator(selectolax_tree, page_url="https://example.com/")
+    return [(node.tag, node.text, node.media_info) for node in list_nodes]
+
+
+def run(label, html_extractor, warcs):
+    start = time.perf_counter()
+    outputs = [html_extractor.get_html_from_warc(warc) for warc in warcs]
+    extraction_time = time.perf_counter() - start
+
+    dom_tree_simplificator = DOMTreeSimplificator()
+    pre_extraction_simplificator = PreExtractionSimplificator()
+    start = time.perf_counter()
+    list_nodes = [
+        extract_nodes(html_str, dom_tree_simplificator, pre_extraction_simplificator) if html_str else None
+        for html_str, _ in outputs
+    ]
+    simplification_time = time.perf_counter() - start
+
+    print(
+        f"{label:<12} {len(warcs) / extraction_time:8.1f} pages/s extraction,"
+        f" {len(warcs) / (extraction_time + simplification_time):8.1f} pages/s with the simplifications"
+    )
+    return outputs, list_nodes
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--path_warc_dataset", type=str, default=None)
+    parser.add_argument("--num_pages", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.path_warc_dataset is not None:
+        warc_dataset = load_from_disk(args.path_warc_dataset)
+        warcs = [example["warc"] for example in islice(warc_dataset, args.num_pages) if not example["warc_error"]]
+    else:
+        warcs = make_warcs(args.num_pages, args.seed)
+
+    original_outputs, original_list_nodes = run("beautifulsoup", HtmlExtractor(fast_path=False), warcs)
+    outputs, list_nodes = run("fast path", HtmlExtractor(fast_path=True), warcs)
+
+    num_different_html = sum(
+        html_str != original_html_str for (html_str, _), (original_html_str, _) in zip(outputs, original_outputs)
+    )
+    num_errors = [sum(bool(html_error) for _, html_error in outputs_) for outputs_ in [original_outputs, outputs]]
+    num_identical = sum(nodes == original_nodes for nodes, original_nodes in zip(list_nodes, original_list_nodes))
+    print(f"{len(warcs)} pages, {num_different_html} with an html different from the one of beautifulsoup")
+    print(f"Errors: {num_errors[0]} with beautifulsoup, {num_errors[1]} with the fast path")
+    print(f"{num_identical}/{len(warcs)} pages with identical extracted nodes")
+    assert num_errors[1] <= num_errors[0], "The fast path fails on more pages than beautifulsoup"
+    assert num_identical == len(warcs), "The fast path changes the extracted nodes"
+    print("All checks passed.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+"""
+Checks and benchmark of `ImageDownloader` against a local HTTP server serving synthetic images, with an injected
+latency and failures:
+- urls `/ok/...` are images (PNG of random sizes), `/flaky/...` fail with a 503 the first time and are images after,
+  `/missing/...` are 404, `/corrupt/...` are not images and `/slow/...` answer after the timeout. The first
+  `--num_large_urls` urls are `/large/...`, PNGs of random pixels of several MB, sent in writes of 64 KB so that
+  their body arrives in many network chunks.
+- the urls are spread on two hosts (`127.0.0.1` and `localhost`), and the server records the maximum number of
+  concurrent requests per host (except for the slow urls, which the server keeps serving after the client gave up).
+
+The script checks that every url gets one result with the expected outcome, that the images (the large ones included)
+decode and have the size of the resize mode, that a download stopped midway and restarted with the same index only downloads the remaining urls, and
+that the concurrency per host of the restarted download stays under `--max_requests_per_host`. It reports the urls
+per second.
+
+Usage:
+    python m4/sourcing/data_collection/debug/benchmark_image_downloader.py --num_urls 2000 --latency_ms 50
+"""
+import argparse
+import io
+import os
+import random
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from PIL import Image
+
+from m4.sourcing.data_collection.processors import ImageDownloader
+
+
+KINDS = ["ok"] * 16 + ["flaky", "missing", "corrupt", "slow"]
+WRITE_SIZE = 2**16
+
+
+def make_image(rng):
+    image = Image.new("RGB", (rng.randint(20, 600), rng.randint(20, 600)), tuple(rng.randint(0, 255) for _ in "rgb"))
+    with io.BytesIO() as output:
+        image.save(output, format="PNG")
+        return output.getvalue()
+
+
+def make_large_image(rng, image_size=1400):
+    # Random pixels don't compress: about 6 MB as PNG
+    image = Image.frombytes("RGB", (image_size, image_size), rng.randbytes(3 * image_size * image_size))
+    with io.BytesIO() as output:
+        image.save(output, format="PNG")
+        return output.getvalue()
+
+
+def make_handler(images, latency, slow_latency, concurrency):
+    lock = threading.Lock()
+    num_requests_per_url = Counter()
+    num_concurrent_requests = Counter()
+
+    class ImageServerHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True
+
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            host = self.headers.get("Host", "").split(":")[0]
+            kind = self.path.split("/")[1]
+            if kind == "slow":
+                host = "slow"
+            with lock:
+                num_requests_per_url[self.path] += 1
+                num_attempts = num_requests_per_url[self.path]
+                num_concurrent_requests[host] += 1
+                concurrency[host] = max(concurrency[host], num_concurrent_requests[host])
+            try:
+                time.sleep(slow_latency if kind == "slow" else latency)
+                if kind == "missing":
+                    self._send(404, b"Not found")
+                elif kind == "flaky" and num_attempts == 1:
+                    self._send(503, b"Unavailable")
+                elif kind == "corrupt":
+                    self._send(200, b"<html>not an image</html>")
+                else:
+                    self._send(200, images[self.path])
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+            finally:
+                with lock:
+                    num_concurrent_requests[host] -= 1
+
+        def _send(self, status, body):
+            self.send_response(status)
+            self.send_header("Content-Type", "image/png")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            for start in range(0, len(body), WRITE_SIZE):
+                self.wfile.write(body[start : start + WRITE_SIZE])
+                self.wfile.flush()
+                if len(body) > WRITE_SIZE:
+                    time.sleep(0.001)
+
+    return ImageServerHandler
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num_urls", type=int, default=2000)
+    parser.add_argument("--latency_ms", type=float, default=50)
+    parser.add_argument("--num_concurrent_requests", type=int, default=128)
+    parser.add_argument("--max_requests_per_host", type=int, default=16)
+    parser.add_argument("--image_size", type=int, default=256)
+    parser.add_argument("--resize_mode", type=str, default="center_crop")
+    parser.add_argument("--num_large_urls", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    timeout = 2
+    paths = [
+        f"/{'large' if idx < args.num_large_urls else rng.choice(KINDS)}/{idx}.png" for idx in range(args.num_urls)
+    ]
+    images = {path: make_image(rng) for path in paths if path.split("/")[1] in ["ok", "flaky", "slow"]}
+    images.update({path: make_large_image(rng) for path in paths if path.split("/")[1] == "large"})
+    concurrency = defaultdict(int)
+    server = ThreadingHTTPServer(
+        ("127.0.0.1", 0), make_handler(images, args.latency_ms / 1000, timeout + 1, concurrency)
+    )
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    port = server.server_address[1]
+    urls = [f"http://{rng.choice(['127.0.0.1', 'localhost'])}:{port}{path}" for path in paths]
+    expected_success = {url: url.split("/")[3] in ["ok", "flaky", "large"] for url in urls}
+
+    with tempfile.TemporaryDirectory() as directory:
+        path_index = os.path.join(directory, "completed_urls.txt")
+
+        def make_image_downloader():
+            return ImageDownloader(
+                image_size=args.image_size,
+                resize_mode=args.resize_mode,
+                num_concurrent_requests=args.num_concurrent_requests,
+                max_requests_per_host=args.max_requests_per_host,
+                timeout=timeout,
+                retry_backoff=0.1,
+                path_index=path_index,
+            )
+
+        # First run, stopped after half of the urls
+        start = time.perf_counter()
+        results = {}
+        image_downloader = make_image_downloader()
+        for url, image, error in image_downloader.download(urls):
+            results[url] = (image, error)
+            if len(results) == len(urls) // 2:
+                break
+        image_downloader.index.add(list(results))
+
+        # Second run, resuming from the index, once the server is done with the requests of the first run
+        time.sleep(args.latency_ms / 1000 + 0.5)
+        concurrency.clear()
+        image_downloader = make_image_downloader()
+        num_resumed_urls = 0
+        for url, image, error in image_downloader.download(urls):
+            assert url not in results, f"{url} was downloaded twice"
+            results[url] = (image, error)
+            num_resumed_urls += 1
+        elapsed = time.perf_counter() - start
+    server.shutdown()
+
+    assert set(results) == set(urls), f"{len(set(urls) - set(results))} urls without result"
+    assert num_resumed_urls == len(urls) - len(urls) // 2
+    for url, (image, error) in results.items():
+        assert (image is not None) == expected_success[url], f"{url}: {error}"
+        if image is not None:
+            with Image.open(io.BytesIO(image)) as decoded_image:
+                if args.resize_mode in ["center_crop", "border"]:
+                    assert decoded_image.size == (args.image_size, args.image_size)
+                elif args.resize_mode == "keep_ratio":
+                    assert min(decoded_image.size) == args.image_size
+    concurrency.pop("slow", None)
+    assert max(concurrency.values()) <= args.max_requests_per_host, dict(concurrency)
+
+    num_successes = sum(image is not None for image, _ in results.values())
+    errors = Counter(error.split(":")[0].split("(")[0] for image, error in results.values() if image is None)
+    print(f"{len(urls)} urls, {num_successes} images, errors: {dict(errors)}")
+    print(f"Max concurrent requests per host: {dict(concurrency)}, resumed on {num_resumed_urls} urls")
+    print(f"{elapsed:7.2f}s ({len(urls) / elapsed:8.1f} urls/s) with a latency of {args.latency_ms} ms")
+    print("All checks passed.")
+
+
+if __name__ == "__main__":
+    main()
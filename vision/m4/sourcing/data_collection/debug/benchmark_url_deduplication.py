@@ -0,0 +1,219 @@
+"""
+Checks and benchmark of the url deduplication by sorted runs of url fingerprints merged externally
+(`write_url_fingerprints_run` and `merge_url_fingerprints_runs`).
+
+- Parity: on `--num_docs_parity` documents with real urls, the documents removed must be the ones removed by the
+  previous `dup_urls.json` (`08_01_prepare_urldedup.py` and `08_02_urldedup.py`): for an url present several times,
+  only the documents from its most recent WARC file are kept. The runs are built from the shards, and the documents
+  are filtered with `is_url_dup_to_remove` on shuffled copies of the shards, like full shards whose rows wouldn't be
+  in the order of the `_texts_only` shards.
+- Scale: on `--num_docs` synthetic documents (100M by default) in `--num_shards` shards, generated without strings
+  so that the expected number of documents to remove is known: the url `u` is in `1 + u % 3` documents spread over
+  all the shards, each coming from a pseudo-random WARC file. The merge must find this number, the duplicated urls
+  saved for the shards must remove it, at least one document per url must be kept, and the peak of the python
+  allocations of the merge must stay under `--max_memory_mib`.
+
+Usage:
+    python m4/sourcing/data_collection/debug/benchmark_url_deduplication.py --num_docs 100000000 --num_shards 100
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+from collections import Counter
+
+import numpy as np
+
+from m4.sourcing.data_collection.processors.web_document_url_deduplication import (
+    DUP_URLS_WARC_FILENAMES_FILE,
+    is_url_dup_to_remove,
+    load_dup_urls,
+    merge_url_fingerprints_runs,
+    write_url_fingerprints_run,
+    write_url_fingerprints_run_from_urls,
+)
+
+
+NUM_WARC_FILENAMES = 10_000
+# Docs of a block of 3 urls: the urls `3 * block`, `3 * block + 1` and `3 * block + 2` are in 1, 2 and 3 documents
+URL_OFFSET_IN_BLOCK = np.array([0, 1, 1, 2, 2, 2])
+COPY_IN_BLOCK = np.array([0, 0, 1, 0, 1, 2])
+
+
+def splitmix64(values):
+    values = values.astype(np.uint64) + np.uint64(0x9E3779B97F4A7C15)
+    values = (values ^ (values >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    values = (values ^ (values >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return values ^ (values >> np.uint64(31))
+
+
+def warc_ranks(urls, copies):
+    return (splitmix64(urls * np.uint64(4) + copies.astype(np.uint64)) % np.uint64(NUM_WARC_FILENAMES)).astype("<u4")
+
+
+def make_synthetic_shard(idx_shard, shard_size, num_docs, multiplier, rng):
+    """The documents at positions `idx_shard * shard_size + position` in an affine permutation of all the documents"""
+    global_positions = np.arange(idx_shard * shard_size, min((idx_shard + 1) * shard_size, num_docs), dtype=np.int64)
+    # Index of the document in the enumeration of the urls and their copies (no overflow under 3B documents)
+    idx_docs = global_positions * pow(multiplier, -1, num_docs) % num_docs
+    urls = (3 * (idx_docs // 6) + URL_OFFSET_IN_BLOCK[idx_docs % 6]).astype(np.uint64)
+    ranks = warc_ranks(urls, COPY_IN_BLOCK[idx_docs % 6])
+    # The WARC filenames of a shard are in a random order, to check the ranks of the merge
+    shard_warc_filenames = np.array(rng.permutation(NUM_WARC_FILENAMES))
+    warc_ids = np.argsort(shard_warc_filenames)[ranks].astype("<u4")
+    warc_filenames = [f"CC-MAIN-{rank:06d}.warc.gz" for rank in shard_warc_filenames]
+    return splitmix64(urls), warc_ids, warc_filenames
+
+
+def count_removed(path_dup_urls, idx_shard, fingerprints, warc_ids, warc_filenames, warc_filename_to_rank):
+    """The number of documents of a synthetic shard removed with its duplicated urls, vectorized"""
+    dup_urls = np.load(os.path.join(path_dup_urls, f"{idx_shard}.npy"))
+    if not len(dup_urls):
+        return 0
+    idx_dup = np.minimum(np.searchsorted(dup_urls["fingerprint"], fingerprints), len(dup_urls) - 1)
+    is_dup = dup_urls["fingerprint"][idx_dup] == fingerprints
+    ranks = np.array([warc_filename_to_rank[name] for name in warc_filenames], dtype="<u4")[warc_ids]
+    return int((is_dup & (ranks != dup_urls["warc_rank"][idx_dup])).sum())
+
+
+def expected_num_removed(num_docs, chunk_size=10_000_000):
+    num_removed = 0
+    for start in range(0, num_docs // 2, chunk_size):
+        urls = np.arange(start, min(start + chunk_size, num_docs // 2), dtype=np.uint64)
+        num_copies = 1 + urls % np.uint64(3)
+        ranks = np.stack([warc_ranks(urls, np.full(len(urls), copy)) for copy in range(3)], axis=1).astype(np.int64)
+        ranks[np.arange(3)[None, :] >= num_copies[:, None]] = -1
+        num_removed += int(((ranks >= 0) & (ranks < ranks.max(axis=1, keepdims=True))).sum())
+    return num_removed
+
+
+def previous_url_deduplication(shards):
+    """The documents removed with `dup_urls.json`, as `(idx_shard, position)`"""
+    dup_urls = Counter(url for shard in shards for url, _ in shard)
+    dup_urls = {url for url, count in dup_urls.items() if count > 1}
+    dup_urls_to_warcfilename = {}
+    for shard in shards:
+        for url, warc_filename in shard:
+            if url in dup_urls:
+                dup_urls_to_warcfilename[url] = dup_urls_to_warcfilename.get(url, []) + [warc_filename]
+    dup_urls_to_warcfilename = {url: sorted(names)[-1] for url, names in dup_urls_to_warcfilename.items()}
+    return {
+        (idx_shard, position)
+        for idx_shard, shard in enumerate(shards)
+        for position, (url, warc_filename) in enumerate(shard)
+        if url in dup_urls_to_warcfilename and warc_filename != dup_urls_to_warcfilename[url]
+    }
+
+
+def check_parity(directory, num_docs, num_shards, seed):
+    rng = random.Random(seed)
+    num_urls = num_docs * 2 // 3
+    warc_filenames = [
+        f"crawl-data/CC-MAIN-2023-{rng.randint(1, 52):02d}/segments/{rng.randint(0, 10**6)}/warc/{idx}.warc.gz"
+        for idx in range(200)
+    ]
+    shards = [
+        [
+            (f"https://www.example-{url_id % 997}.com/page/{url_id}", rng.choice(warc_filenames))
+            for url_id in (rng.randrange(num_urls) for _ in range(num_docs // num_shards))
+        ]
+        for _ in range(num_shards)
+    ]
+    paths_runs = []
+    for idx_shard, shard in enumerate(shards):
+        paths_runs.append(os.path.join(directory, "parity_runs", str(idx_shard)))
+        write_url_fingerprints_run_from_urls(
+            [url for url, _ in shard], [warc_filename for _, warc_filename in shard], paths_runs[-1]
+        )
+    path_dup_urls = os.path.join(directory, "parity_dup_urls")
+    # A small memory cap, so that the merge goes through many blocks
+    merge_url_fingerprints_runs(paths_runs, path_dup_urls, max_memory_bytes=2**20)
+    # The documents are filtered in another order than the one of the runs
+    shards = [rng.sample(shard, len(shard)) for shard in shards]
+    removed = set()
+    for idx_shard, shard in enumerate(shards):
+        dup_urls = load_dup_urls(path_dup_urls, idx_shard)
+        removed.update(
+            (idx_shard, position)
+            for position, (url, warc_filename) in enumerate(shard)
+            if is_url_dup_to_remove(url, warc_filename, dup_urls)
+        )
+    expected_removed = previous_url_deduplication(shards)
+    assert removed == expected_removed, f"{len(removed ^ expected_removed)} documents differ"
+    print(
+        f"Parity: identical documents removed ({len(removed)}/{num_docs}) with the previous deduplication, on"
+        " shuffled shards."
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num_docs", type=int, default=100_000_000)
+    parser.add_argument("--num_shards", type=int, default=100)
+    parser.add_argument("--max_memory_mib", type=int, default=256)
+    parser.add_argument("--num_docs_parity", type=int, default=300_000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    num_docs = args.num_docs - args.num_docs % 6
+
+    with tempfile.TemporaryDirectory() as directory:
+        check_parity(directory, args.num_docs_parity, 20, args.seed)
+
+        rng = np.random.default_rng(args.seed)
+        multiplier = 1_000_003
+        while np.gcd(multiplier, num_docs) != 1:
+            multiplier += 2
+        shard_size = -(-num_docs // args.num_shards)
+        start = time.perf_counter()
+        paths_runs = []
+        for idx_shard in range(args.num_shards):
+            paths_runs.append(os.path.join(directory, "runs", str(idx_shard)))
+            write_url_fingerprints_run(
+                *make_synthetic_shard(idx_shard, shard_size, num_docs, multiplier, rng), paths_runs[-1]
+            )
+        runs_time = time.perf_counter() - start
+
+        path_dup_urls = os.path.join(directory, "dup_urls")
+        tracemalloc.start()
+        start = time.perf_counter()
+        stats = merge_url_fingerprints_runs(paths_runs, path_dup_urls, max_memory_bytes=args.max_memory_mib * 2**20)
+        merge_time = time.perf_counter() - start
+        _, merge_peak_memory = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        # The shards are generated again, with the same random WARC filenames, to filter them
+        with open(os.path.join(path_dup_urls, DUP_URLS_WARC_FILENAMES_FILE)) as f:
+            warc_filename_to_rank = {warc_filename: rank for rank, warc_filename in enumerate(json.load(f))}
+        rng = np.random.default_rng(args.seed)
+        num_removed_files = sum(
+            count_removed(
+                path_dup_urls,
+                idx_shard,
+                *make_synthetic_shard(idx_shard, shard_size, num_docs, multiplier, rng),
+                warc_filename_to_rank,
+            )
+            for idx_shard in range(args.num_shards)
+        )
+
+    expected = expected_num_removed(num_docs)
+    print(
+        f"Runs:  {runs_time:7.2f}s for {num_docs} documents in {args.num_shards} shards"
+        f" ({num_docs / runs_time / 1e6:.2f}M documents/s, fingerprints generated)"
+    )
+    print(
+        f"Merge: {merge_time:7.2f}s ({num_docs / merge_time / 1e6:.2f}M documents/s), peak python memory"
+        f" {merge_peak_memory / 2**20:.1f} MiB for a cap of {args.max_memory_mib} MiB"
+    )
+    print(json.dumps(stats))
+    assert stats["num_removed"] == num_removed_files == expected, (stats["num_removed"], num_removed_files, expected)
+    assert stats["num_dup_urls"] == 2 * (num_docs // 6), "Wrong number of duplicated urls"
+    assert stats["num_docs_dup_urls"] - stats["num_removed"] >= stats["num_dup_urls"], "A url lost all its documents"
+    assert merge_peak_memory <= args.max_memory_mib * 2**20, "The merge goes over the memory cap"
+    print(f"Scale: {expected} documents to remove, as expected.")
+
+
+if __name__ == "__main__":
+    main()
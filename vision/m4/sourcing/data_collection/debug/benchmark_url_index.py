@@ -0,0 +1,137 @@
+"""
+Checks and benchmark of the join of the web documents with their images through the on-disk `UrlIndex`, against the
+dict `map_url_idx`.
+
+- At scale: `--num_images` synthetic urls (some of them present several times) are indexed, and the images of
+  `--num_documents` documents (some of them not downloaded) are looked up one document at a time. The rows found
+  must be the ones of the dict, and the peak of the python allocations of building the index and joining must stay
+  under `--memory_budget_mib`, whatever the number of images. The peak of the dict is reported for comparison.
+- On a small dataset: `urls_to_images` must give the same web documents with the index as with the dict.
+
+Usage:
+    python m4/sourcing/data_collection/debug/benchmark_url_index.py --num_images 2000000 --num_documents 200000
+"""
+import argparse
+import hashlib
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+from datasets import Dataset, Features, Sequence, Value
+
+from m4.sourcing.data_collection.processors import UrlIndex
+from m4.sourcing.data_collection.processors.web_document_extractor import urls_to_images
+
+
+def make_url(key):
+    return f"https://img{key % 101}.example.com/{(key * 2654435761) % 2**32:08x}/{key}.jpg"
+
+
+def iter_image_urls(num_images):
+    # About 5% of the urls are present twice, at distant rows
+    num_keys = num_images * 19 // 20
+    for idx in range(num_images):
+        yield make_url((idx * 7919) % num_keys)
+
+
+def iter_documents(num_images, num_documents, seed):
+    # About 5% of the urls of the documents are not in the images
+    rng = random.Random(seed)
+    max_key = num_images * 21 // 20
+    for _ in range(num_documents):
+        yield [make_url(rng.randrange(max_key)) for _ in range(rng.randint(1, 8))]
+
+
+def join(map_url_idx, num_images, num_documents, seed):
+    """Looks up the images of the documents, and returns a digest of the rows found and the number of rows found"""
+    digest = hashlib.sha256()
+    num_found = 0
+    for urls in iter_documents(num_images, num_documents, seed):
+        rows = [map_url_idx.get(url) for url in urls]
+        num_found += sum(row is not None for row in rows)
+        digest.update(repr(rows).encode())
+    return digest.hexdigest(), num_found
+
+
+def check_urls_to_images(directory, seed):
+    rng = random.Random(seed)
+    num_images = 2000
+    image_urls = list(iter_image_urls(num_images))
+    dataset_images = Dataset.from_dict(
+        {"url": image_urls, "image": [f"image {idx}".encode() for idx in range(num_images)]},
+        features=Features({"url": Value("string"), "image": Value("binary")}),
+    )
+    documents = [
+        [url if rng.random() < 0.8 else None for url in urls] for urls in iter_documents(num_images, 500, seed)
+    ]
+    dataset = Dataset.from_dict(
+        {"texts": [[None] * len(urls) for urls in documents], "images": documents},
+        features=Features({"texts": Sequence(Value("string")), "images": Sequence(Value("string"))}),
+    )
+
+    map_url_idx = {url: idx for idx, url in enumerate(image_urls)}
+    url_index = UrlIndex.build(image_urls, len(image_urls), os.path.join(directory, "small_url_index"), chunk_size=300)
+    dataset_with_dict = urls_to_images(dataset, dataset_images, map_url_idx, num_proc=None)
+    dataset_with_index = urls_to_images(dataset, dataset_images, url_index, num_proc=None)
+    assert dataset_with_dict.to_dict() == dataset_with_index.to_dict(), "urls_to_images differs with the index"
+    print(f"urls_to_images: identical outputs on {len(dataset)} documents and {num_images} images.")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num_images", type=int, default=2_000_000)
+    parser.add_argument("--num_documents", type=int, default=200_000)
+    parser.add_argument("--chunk_size", type=int, default=200_000)
+    parser.add_argument("--memory_budget_mib", type=float, default=96)
+    parser.add_argument("--skip_dict", action="store_true", help="Don't build the dict, to save memory and time.")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        check_urls_to_images(directory, args.seed)
+
+        tracemalloc.start()
+        start = time.perf_counter()
+        url_index = UrlIndex.build(
+            iter_image_urls(args.num_images),
+            args.num_images,
+            os.path.join(directory, "url_index"),
+            chunk_size=args.chunk_size,
+        )
+        build_time = time.perf_counter() - start
+        start = time.perf_counter()
+        index_digest, num_found = join(url_index, args.num_images, args.num_documents, args.seed)
+        join_time = time.perf_counter() - start
+        _, index_peak_memory = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del url_index
+
+        print(
+            f"UrlIndex: build {build_time:7.2f}s, join {join_time:7.2f}s ({args.num_documents / join_time:8.1f}"
+            f" documents/s), peak python memory {index_peak_memory / 2**20:8.1f} MiB, {num_found} images found"
+        )
+        assert index_peak_memory <= args.memory_budget_mib * 2**20, "The index goes over the memory budget"
+
+    if not args.skip_dict:
+        tracemalloc.start()
+        start = time.perf_counter()
+        map_url_idx = {url: idx for idx, url in enumerate(iter_image_urls(args.num_images))}
+        build_time = time.perf_counter() - start
+        start = time.perf_counter()
+        dict_digest, dict_num_found = join(map_url_idx, args.num_images, args.num_documents, args.seed)
+        join_time = time.perf_counter() - start
+        _, dict_peak_memory = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        print(
+            f"dict:     build {build_time:7.2f}s, join {join_time:7.2f}s ({args.num_documents / join_time:8.1f}"
+            f" documents/s), peak python memory {dict_peak_memory / 2**20:8.1f} MiB, {dict_num_found} images found"
+        )
+        assert (index_digest, num_found) == (dict_digest, dict_num_found), "The index and the dict differ"
+        print("Identical rows with the index and the dict.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+"""
+Benchmark of the batched WARC download of `WarcDownloader.download_batch` against the per-record path of
+`WarcDownloader.__call__`, against a local stand-in of S3 serving synthetic WARC files.
+
+The stand-in is an HTTP server answering the ranged GETs on `/{bucket}/{key}` (the path-style requests of S3), after
+`--latency_ms`, and failing a fraction `--error_rate` of the requests with a 503 to exercise the retries. It can be
+used with `HTTPWarcBackend` (default) or with `S3WarcBackend` (`--backend s3`). The downloaded records are checked
+against the bytes of the files, and the records per second of both paths are reported.
+
+Usage:
+    python m4/sourcing/data_collection/debug/benchmark_warc_downloader.py --num_records 2000 --latency_ms 30
+"""
+import argparse
+import gzip
+import os
+import random
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from m4.sourcing.data_collection.processors import HTTPWarcBackend, S3WarcBackend, WarcDownloader
+
+
+BUCKET = "commoncrawl"
+
+
+def make_warc_record(rng, idx_record):
+    html = "<html><body>" + "".join(f"<p>Paragraph {i} of {idx_record}.</p>" for i in range(rng.randint(10, 1000)))
+    payload = f"HTTP/1.1 200 OK\r\nContent-Type: text/html\r\n\r\n{html}</body></html>".encode()
+    headers = (
+        "WARC/1.0\r\nWARC-Type: response\r\n"
+        f"WARC-Target-URI: https://example.com/{idx_record}\r\nContent-Length: {len(payload)}\r\n\r\n"
+    ).encode()
+    # Like in Common Crawl, each record is its own gzip member
+    return gzip.compress(headers + payload + b"\r\n\r\n")
+
+
+def make_warc_files(directory, num_files, num_records_per_file, seed):
+    """Writes the synthetic WARC files, and returns the pointers `(warc_filename, offset, length)` of their records"""
+    rng = random.Random(seed)
+    pointers = []
+    for idx_file in range(num_files):
+        warc_filename = f"crawl-data/CC-MAIN-2023-06/segments/0/warc/CC-MAIN-{idx_file:05d}.warc.gz"
+        os.makedirs(os.path.dirname(os.path.join(directory, warc_filename)), exist_ok=True)
+        offset = 0
+        with open(os.path.join(directory, warc_filename), "wb") as f:
+            for idx_record in range(num_records_per_file):
+                record = make_warc_record(rng, idx_record)
+                f.write(record)
+                pointers.append((warc_filename, offset, len(record)))
+                offset += len(record)
+    return pointers
+
+
+def make_stand_in_handler(directory, latency, error_rate, num_requests):
+    lock = threading.Lock()
+
+    class S3StandInHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True
+
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            with lock:
+                num_requests[0] += 1
+            time.sleep(latency)
+            key = self.path.split("?")[0].lstrip("/").split("/", 1)[1]
+            path = os.path.join(directory, key)
+            if random.random() < error_rate:
+                self._send(503, b"SlowDown")
+                return
+            if not os.path.isfile(path):
+                self._send(404, b"NoSuchKey")
+                return
+            with open(path, "rb") as f:
+                data = f.read()
+            range_header = self.headers.get("Range")
+            if range_header is None:
+                self._send(200, data)
+                return
+            start, end = (int(bound) for bound in range_header.removeprefix("bytes=").split("-"))
+            self._send(206, data[start : end + 1])
+
+        def _send(self, status, body):
+            self.send_response(status)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    return S3StandInHandler
+
+
+def make_example(record):
+    warc_filename, offset, length = record
+    return {
+        "warc_filename": warc_filename,
+        "warc_record_offset": offset,
+        "warc_record_length": length,
+        "warc": b"",
+        "warc_error": "",
+    }
+
+
+def make_batch(records):
+    return {
+        "warc_filename": [warc_filename for warc_filename, _, _ in records],
+        "warc_record_offset": [offset for _, offset, _ in records],
+        "warc_record_length": [length for _, _, length in records],
+        "warc": [b""] * len(records),
+        "warc_error": [""] * len(records),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num_records", type=int, default=2000)
+    parser.add_argument("--num_files", type=int, default=20)
+    parser.add_argument("--batch_size", type=int, default=1000)
+    parser.add_argument("--num_threads", type=int, default=32)
+    parser.add_argument("--latency_ms", type=float, default=30)
+    parser.add_argument("--error_rate", type=float, default=0.01)
+    parser.add_argument("--backend", type=str, default="http", choices=["http", "s3"])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        # Twice more records than needed, and a random half of them requested, so some are adjacent and some not
+        pointers = make_warc_files(directory, args.num_files, 2 * args.num_records // args.num_files, args.seed)
+        records = random.Random(args.seed).sample(pointers, args.num_records)
+        files = {}
+        for warc_filename, _, _ in records:
+            if warc_filename not in files:
+                with open(os.path.join(directory, warc_filename), "rb") as f:
+                    files[warc_filename] = f.read()
+        expected_warcs = [files[warc_filename][offset : offset + length] for warc_filename, offset, length in records]
+
+        num_requests = [0]
+        server = ThreadingHTTPServer(
+            ("127.0.0.1", 0),
+            make_stand_in_handler(directory, args.latency_ms / 1000, args.error_rate, num_requests),
+        )
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        endpoint_url = f"http://127.0.0.1:{server.server_address[1]}"
+        if args.backend == "s3":
+            os.environ.setdefault("AWS_ACCESS_KEY_ID", "stand-in")
+            os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "stand-in")
+            os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+            backend = S3WarcBackend(bucket=BUCKET, endpoint_url=endpoint_url, max_pool_connections=args.num_threads)
+        else:
+            backend = HTTPWarcBackend(base_url=f"{endpoint_url}/{BUCKET}", max_pool_connections=args.num_threads)
+        warc_downloader = WarcDownloader(backend=backend, num_threads=args.num_threads)
+
+        # The per-record path, as done by one process of `datasets.map`
+        start = time.perf_counter()
+        per_record_warcs = [warc_downloader(make_example(record))["warc"] for record in records]
+        per_record_time = time.perf_counter() - start
+        per_record_num_requests = num_requests[0]
+
+        num_requests[0] = 0
+        start = time.perf_counter()
+        batched_warcs = []
+        for idx in range(0, len(records), args.batch_size):
+            batched_warcs += warc_downloader.download_batch(make_batch(records[idx : idx + args.batch_size]))["warc"]
+        batched_time = time.perf_counter() - start
+        server.shutdown()
+
+    for label, warcs in [("per-record", per_record_warcs), ("batched", batched_warcs)]:
+        num_different = sum(warc != expected_warc for warc, expected_warc in zip(warcs, expected_warcs))
+        assert num_different == 0, f"{num_different} records of the {label} path differ from the WARC files"
+    print(f"Identical records ({len(records)} records, {sum(map(len, expected_warcs)) / 2**20:.1f} MiB).")
+    print(
+        f"per-record {per_record_time:7.2f}s ({len(records) / per_record_time:8.1f} records/s,"
+        f" {per_record_num_requests} requests)"
+    )
+    print(
+        f"batched    {batched_time:7.2f}s ({len(records) / batched_time:8.1f} records/s, {num_requests[0]} requests),"
+        f" x{per_record_time / batched_time:.1f}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""
+Stress test of `PreExtractionSimplificator` on a synthetic page of `--num_nodes` nodes nested `--depth` levels deep
+(by default 1M nodes and 50k levels, far beyond the recursion limit). Each level is a `div` containing a text, a few
+paragraphs, an image and the `div` of the next level. Reports the time and the peak memory of the python allocations
+of building the tree and extracting the texts and images.
+
+Usage:
+    python m4/sourcing/data_collection/debug/stress_pre_extraction_simplificator.py --num_nodes 1000000 --depth 50000
+"""
+import argparse
+import time
+import tracemalloc
+
+from m4.sourcing.data_collection.processors import PreExtractionSimplificator
+from m4.sourcing.data_collection.processors.pre_extraction_simplificator import Tree
+from m4.sourcing.data_collection.utils import make_selectolax_tree
+
+
+def make_deep_html(num_nodes, depth):
+    # A level has the div, its text, the image, and a paragraph and its text per paragraph
+    num_paragraphs = max(0, (num_nodes // depth - 3) // 2)
+    level = "<div>Level {idx}" + "<p>Some text in a paragraph.</p>" * num_paragraphs + '<img src="image_{idx}.png">'
+    opening = "".join(level.format(idx=idx) for idx in range(depth))
+    return f"<html><body>{opening}{'</div>' * depth}</body></html>"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num_nodes", type=int, default=1_000_000)
+    parser.add_argument("--depth", type=int, default=50_000)
+    args = parser.parse_args()
+
+    selectolax_tree = make_selectolax_tree(make_deep_html(args.num_nodes, args.depth))
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    tree = Tree(selectolax_tree.root, page_url="https://example.com/")
+    tree_time = time.perf_counter() - start
+    max_level = max(node.level for node in tree.traverse(post_order=True))
+    _, tree_peak_memory = tracemalloc.get_traced_memory()
+    del tree
+    tracemalloc.reset_peak()
+
+    start = time.perf_counter()
+    list_nodes = PreExtractionSimplificator()(selectolax_tree, page_url="https://example.com/")
+    simplification_time = time.perf_counter() - start
+    _, simplification_peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(
+        f"tree:           {tree_time:7.2f}s, peak python memory {tree_peak_memory / 2**20:8.1f} MiB,"
+        f" depth {max_level}"
+    )
+    print(
+        f"simplification: {simplification_time:7.2f}s, peak python memory"
+        f" {simplification_peak_memory / 2**20:8.1f} MiB, {len(list_nodes)} extracted nodes"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,6 @@
 import re
+from functools import lru_cache
+from itertools import islice
 
 from m4.sourcing.data_collection.utils import (
     INTERESTING_TAGS_SET,
@@ -10,6 +12,21 @@ from m4.sourcing.data_collection.utils import (
 )
 
 
+MULTIPLE_LINEBREAKS_RE = re.compile(r"[\n]{2,}")
+MULTIPLE_SPACES_RE = re.compile(r"[ ]{2,}")
+# Same as `<!--(?s).*?-->`, whose inline flag is not accepted anymore by python>=3.11 in the middle of a pattern
+HTML_COMMENTS_RE = re.compile(r"<!--.*?-->", re.DOTALL)
+LINE_BREAK_TAGS_RE = re.compile("<br>|<br/>|<br />|</br>")
+DIGITS_RE = re.compile(r"\d+")
+
+SPECIAL_DIV_IDS = frozenset(["footer", "header", "navigation", "nav", "navbar", "menu"])
+
+
+@lru_cache(maxsize=10_000)
+def is_interesting_tag(tag):
+    return DIGITS_RE.sub("", tag) in INTERESTING_TAGS_SET
+
+
 class DOMTreeSimplificator:
     def __init__(
         self,
@@ -46,6 +63,7 @@ class DOMTreeSimplificator:
         self.css_rules = css_rules
         self.css_rules_replace_with_text = css_rules_replace_with_text
         self.interesting_attributes_set_cat = interesting_attributes_set_cat
+        self.media_tags = MEDIA_CONTAIN_INTERESTING_ATTRIBUTES_SET[self.interesting_attributes_set_cat]
         if self.preserve_img_children and self.strip_tags:
             raise ValueError("`preserve_img_children` and `strip_tags` are incompatible.")
 
@@ -83,14 +101,8 @@ class DOMTreeSimplificator:
                 selectolax_tree
             )
 
-        if self.strip_special_divs:
-            selectolax_tree = self._strip_special_divs(selectolax_tree)
-        if self.remove_dates:
-            selectolax_tree = self._remove_dates(selectolax_tree)
-        if self.remove_empty_leaves:
-            selectolax_tree = self._remove_empty_leaves(selectolax_tree)
-        if self.unnest_nodes:
-            selectolax_tree = self._unnest_nodes(selectolax_tree)
+        if self.strip_special_divs or self.remove_dates or self.remove_empty_leaves or self.unnest_nodes:
+            selectolax_tree = self._simplify_tree(selectolax_tree)
         if self.remake_tree:
             selectolax_tree = self._remake_tree(selectolax_tree)
 
@@ -100,19 +112,19 @@ class DOMTreeSimplificator:
             return selectolax_tree
 
     def _strip_multiple_linebreaks(self, html_str):
-        html_str = re.sub(r"[\n]{2,}", "\n", html_str)
+        html_str = MULTIPLE_LINEBREAKS_RE.sub("\n", html_str)
         return html_str
 
     def _strip_multiple_spaces(self, html_str):
-        html_str = re.sub(r"[ ]{2,}", " ", html_str)
+        html_str = MULTIPLE_SPACES_RE.sub(" ", html_str)
         return html_str
 
     def _remove_html_comments(self, html_str):
-        html_str = re.sub(r"<!--(?s).*?-->", "", html_str)
+        html_str = HTML_COMMENTS_RE.sub("", html_str)
         return html_str
 
     def _replace_line_break_tags(self, html_str):
-        html_str = re.sub("<br>|<br/>|<br />|</br>", "#BR_TAG#", html_str)
+        html_str = LINE_BREAK_TAGS_RE.sub("#BR_TAG#", html_str)
         return html_str
 
     def _unwrap_html_tree(self, selectolax_tree):
@@ -127,7 +139,7 @@ class DOMTreeSimplificator:
         return selectolax_tree
 
     def _remove_digits_string(self, string):
-        string = re.sub(r"\d+", "", string)
+        string = DIGITS_RE.sub("", string)
         return string
 
     def _remove_nodes_matching_css_rules(self, selectolax_tree):
@@ -155,7 +167,7 @@ class DOMTreeSimplificator:
     ):
         def recursive_strip_and_preserve_interesting_children(current_node, nodes_to_remove):
             for node in current_node.iter():
-                if self._remove_digits_string(node.tag) not in INTERESTING_TAGS_SET:
+                if not is_interesting_tag(node.tag):
                     nodes_to_move = []
                     if node.child is not None:
                         for children_node in node.child.traverse():
@@ -181,12 +193,7 @@ class DOMTreeSimplificator:
         Strips all nodes with tags NOT in INTERESTING_TAGS_SET and has
         counterintuitively nothing to do with the STRIP_TAGS list
         """
-        strip_tags_l = [
-            node.tag
-            for node in selectolax_tree.root.traverse()
-            if self._remove_digits_string(node.tag) not in INTERESTING_TAGS_SET
-        ]
-        strip_tags_l = list(set(strip_tags_l))
+        strip_tags_l = list({node.tag for node in selectolax_tree.root.traverse() if not is_interesting_tag(node.tag)})
         selectolax_tree.strip_tags(strip_tags_l)
         return selectolax_tree
 
@@ -206,86 +213,61 @@ class DOMTreeSimplificator:
             node.decompose()
         return selectolax_tree
 
-    def _strip_special_divs(self, selectolax_tree):
-        special_div_ids = ["footer", "header", "navigation", "nav", "navbar", "menu"]
-        modification = True
-        while modification:
-            # Traverse the tree to find one node to remove, and remove it right then
-            # to avoid the recursivity problem with `decompose`
-            found_a_node = False
-            for node in selectolax_tree.root.traverse():
-                if node.tag == "div":
-                    attributes = node.attributes
-                    if (
-                        ("id" in attributes and attributes["id"] in special_div_ids)
-                        or ("class" in attributes and attributes["class"] in special_div_ids)
-                        or ("title" in attributes and attributes["title"] in special_div_ids)
-                    ):
-                        node.decompose()
-                        found_a_node = True
-                        break
-            if not found_a_node:
-                modification = False
-        return selectolax_tree
-
-    def _remove_dates(self, selectolax_tree):
-        nodes_to_remove = []
-        for node in selectolax_tree.root.traverse():
-            if node.tag == "div":
-                if node.attributes:
-                    if "class" in node.attributes:
-                        if node.attributes["class"]:
-                            if "date" in node.attributes["class"]:
-                                nodes_to_remove += [
-                                    child for child in node.iter(include_text=True) if child.tag == "-text"
-                                ]
-        for node in nodes_to_remove:
-            node.decompose()
-        return selectolax_tree
-
-    def _remove_empty_leaves(self, selectolax_tree):
+    def _simplify_tree(self, selectolax_tree):
         """
-        Function used to remove empty leaves iteratively, so it also ends up also removing nodes
-        that are higher up in the tree.
+        Strips the special divs, removes the dates and the empty leaves, and unnests the nodes in a single traversal
+        of the tree. The special divs and the dates are handled when reaching a node, and the empty leaves and the
+        unnesting once all the children of the node are simplified.
+
+        It gives the same tree as applying these rules one after the other on the whole tree until nothing changes:
+        whether a node is an empty leaf or can be unnested only depends on its subtree, simplifying a subtree can
+        only make it emptier, and unnesting a node replaces it by a node with the same tag.
         """
-        modification = True
-        while modification:
-            nodes_to_remove = [
-                node
-                for node in selectolax_tree.root.traverse()
-                if (
-                    (node.tag not in MEDIA_CONTAIN_INTERESTING_ATTRIBUTES_SET[self.interesting_attributes_set_cat])
-                    and (not [child for child in node.iter()])
-                    and (not node.text().strip())
-                    and (node.tag != "html")
-                )
-                or (
-                    (node.tag in MEDIA_CONTAIN_INTERESTING_ATTRIBUTES_SET[self.interesting_attributes_set_cat])
-                    and not get_media_src(node)
-                )
-            ]
-            if nodes_to_remove:
-                for node in nodes_to_remove:
-                    node.decompose(recursive=False)
-            else:
-                modification = False
+        stack = [(selectolax_tree.root, False)]
+        while stack:
+            node, children_simplified = stack.pop()
+            if not children_simplified:
+                if self.strip_special_divs and self._is_special_div(node):
+                    node.decompose()
+                    continue
+                if self.remove_dates and self._is_date_div(node):
+                    for child in [child for child in node.iter(include_text=True) if child.tag == "-text"]:
+                        child.decompose()
+                stack.append((node, True))
+                stack.extend((child, False) for child in reversed([child for child in node.iter()]))
+            elif self.remove_empty_leaves and self._is_empty_leaf(node):
+                node.decompose(recursive=False)
+            elif self.unnest_nodes:
+                # `islice`: only whether there is exactly one child matters
+                children = list(islice(node.iter(), 2))
+                if len(children) == 1 and children[0].tag == node.tag and not node.text(deep=False).strip():
+                    node.replace_with(children[0])
         return selectolax_tree
 
-    def _unnest_nodes(self, selectolax_tree):
-        modification = True
-        while modification:
-            modification = False
-            for node in selectolax_tree.root.traverse():
-                children = [child for child in node.iter()]
-                if len(children) == 1:
-                    child = children[0]
-                    if node.tag == child.tag:
-                        text = node.text(deep=False).strip()
-                        if not text:
-                            node.replace_with(child)
-                            modification = True
-                            break
-        return selectolax_tree
+    def _is_special_div(self, node):
+        if node.tag != "div":
+            return False
+        attributes = node.attributes
+        return (
+            ("id" in attributes and attributes["id"] in SPECIAL_DIV_IDS)
+            or ("class" in attributes and attributes["class"] in SPECIAL_DIV_IDS)
+            or ("title" in attributes and attributes["title"] in SPECIAL_DIV_IDS)
+        )
+
+    def _is_date_div(self, node):
+        if node.tag != "div":
+            return False
+        attributes = node.attributes
+        return bool(attributes and "class" in attributes and attributes["class"] and "date" in attributes["class"])
+
+    def _is_empty_leaf(self, node):
+        if node.tag in self.media_tags:
+            return not get_media_src(node)
+        if node.tag == "html":
+            return False
+        for _ in node.iter():
+            return False
+        return not node.text().strip()
 
     def _remake_tree(self, selectolax_tree):
         """It could be interesting to remake a tree after the
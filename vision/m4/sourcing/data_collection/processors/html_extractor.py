@@ -1,16 +1,41 @@
 import io
+import re
 import sys
+from contextlib import contextmanager
 
 from bs4 import BeautifulSoup
 from bs4.dammit import EncodingDetector
 from warcio.archiveiterator import WARCIterator
 
 
-# For `soup.decode_content` that can hit the limit
-sys.setrecursionlimit(10000)
+# An opening tag, with its quoted attribute values possibly containing `<` and `>`
+TAG_RE = re.compile(r"""<[a-zA-Z][^\s<>]*(?:"[^"]*"|'[^']*'|[^'"<>])*>""")
+LINE_BREAK_TAG_START_RE = re.compile(r"<(/?br)", re.IGNORECASE)
+# The variants of `<br>` (`<BR>`, `<Br/>`, `<br >`...) and `</br>`, that BeautifulSoup rewrites as `<br/>` and removes
+LINE_BREAK_TAG_RE = re.compile(r"<br\s*/?>", re.IGNORECASE)
+LINE_BREAK_END_TAG_RE = re.compile(r"</br\s*>", re.IGNORECASE)
+
+
+@contextmanager
+def recursion_limit(limit):
+    previous_limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(max(previous_limit, limit))
+    try:
+        yield
+    finally:
+        sys.setrecursionlimit(previous_limit)
 
 
 class HtmlExtractor:
+    """
+    Extracts the html of the response record of a WARC. With `fast_path`, the payload is decoded with its detected
+    charset and kept as is, since it is parsed by selectolax afterwards anyway. BeautifulSoup is only used for the
+    pages that can't be decoded this way, to re-serialize them.
+    """
+
+    def __init__(self, fast_path=True):
+        self.fast_path = fast_path
+
     def __call__(self, example):
         if example["html"] and not example["html_error"]:
             return example
@@ -51,13 +76,59 @@ class HtmlExtractor:
         if (not page) or (not encoding):
             return "", "Not page or encoding"
 
+        if self.fast_path:
+            html_str = self.decode_page(page=page, encoding=encoding)
+            if html_str is not None:
+                return html_str, ""
+
+        return self.get_html_with_beautifulsoup(page=page, encoding=encoding)
+
+    def decode_page(self, page, encoding):
+        """The page decoded with `encoding`, or None if it is not valid in this encoding or in utf-8"""
+        try:
+            html_str = page.decode(encoding)
+            html_str.encode()
+        except (LookupError, UnicodeError):
+            return None
+        html_str = self.escape_line_break_tags_in_tags(html_str)
+        html_str = self.normalize_line_break_tags(html_str)
+        if html_str.startswith("\ufeff"):
+            html_str = html_str[1:]
+        return html_str
+
+    def escape_line_break_tags_in_tags(self, html_str):
+        """
+        Escapes the `<br` and `</br` inside tags, in attribute values like `alt="a<br>b"`, as BeautifulSoup does. As
+        is, they would be replaced by `#BR_TAG#` in `DOMTreeSimplificator` and end up in the attributes.
+        """
+        if not LINE_BREAK_TAG_START_RE.search(html_str):
+            return html_str
+
+        def escape(match):
+            tag = match.group(0)
+            return tag[0] + LINE_BREAK_TAG_START_RE.sub(r"&lt;\1", tag[1:]) if "<" in tag[1:] else tag
+
+        return TAG_RE.sub(escape, html_str)
+
+    def normalize_line_break_tags(self, html_str):
+        """
+        Rewrites the line break tags like BeautifulSoup does: `<br>` in any case and spacing becomes `<br/>`, and
+        `</br>` is removed. `DOMTreeSimplificator` only recognizes the lowercase `<br>`, `<br/>`, `<br />` and `</br>`,
+        so the line breaks of `<BR>` would be lost otherwise.
+        """
+        html_str = LINE_BREAK_TAG_RE.sub("<br/>", html_str)
+        return LINE_BREAK_END_TAG_RE.sub("", html_str)
+
+    def get_html_with_beautifulsoup(self, page, encoding):
         try:
             soup = BeautifulSoup(page, "html.parser", from_encoding=encoding)
         except Exception as e:
             return "", str(e)
 
         try:
-            html_str = soup.decode_contents(formatter="html")
+            # `soup.decode_contents` can hit the recursion limit
+            with recursion_limit(10000):
+                html_str = soup.decode_contents(formatter="html")
         except Exception as e:
             return "", str(e)
 
@@ -0,0 +1,234 @@
+import asyncio
+import io
+import logging
+import os
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import cpu_count
+
+import aiohttp
+from PIL import Image
+
+
+logger = logging.getLogger(__name__)
+
+RESIZE_MODES = ["no", "keep_ratio", "center_crop", "border"]
+DOWNLOAD_CHUNK_SIZE = 2**16
+
+
+def resize_and_encode(image_bytes, image_size, resize_mode, encode_quality=95):
+    """
+    Resizes the image like img2dataset and encodes it in JPEG. Returns `(jpeg_bytes, error)`, `jpeg_bytes` being None
+    if the image can't be read.
+    - `keep_ratio`: the smallest side is resized to `image_size`, keeping the ratio.
+    - `center_crop`: same as `keep_ratio`, then the center square of side `image_size` is kept.
+    - `border`: the largest side is resized to `image_size`, keeping the ratio, and black borders are added to get
+    a square.
+    - `no`: the image is not resized.
+    """
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as image:
+            image = image.convert("RGB")
+        width, height = image.size
+        if resize_mode in ["keep_ratio", "center_crop"]:
+            scale = image_size / min(width, height)
+            image = image.resize((max(1, round(width * scale)), max(1, round(height * scale))), Image.LANCZOS)
+            if resize_mode == "center_crop":
+                left = (image.width - image_size) // 2
+                top = (image.height - image_size) // 2
+                image = image.crop((left, top, left + image_size, top + image_size))
+        elif resize_mode == "border":
+            scale = image_size / max(width, height)
+            image = image.resize((max(1, round(width * scale)), max(1, round(height * scale))), Image.LANCZOS)
+            bordered_image = Image.new("RGB", (image_size, image_size))
+            bordered_image.paste(image, ((image_size - image.width) // 2, (image_size - image.height) // 2))
+            image = bordered_image
+        with io.BytesIO() as output:
+            image.save(output, format="JPEG", quality=encode_quality)
+            return output.getvalue(), None
+    except Exception as e:
+        return None, repr(e)
+
+
+class CompletedUrlsIndex:
+    """
+    Append-only file of the urls whose download is done (succeeded or failed) and whose result is saved, to resume
+    the downloads after an interruption.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.urls = set()
+        if os.path.exists(path):
+            with open(path) as f:
+                self.urls = {line.rstrip("\n") for line in f if line.strip()}
+
+    def __contains__(self, url):
+        return url in self.urls
+
+    def __len__(self):
+        return len(self.urls)
+
+    def add(self, urls):
+        with open(self.path, "a") as f:
+            f.write("".join(f"{url}\n" for url in urls))
+            f.flush()
+            os.fsync(f.fileno())
+        self.urls.update(urls)
+
+
+class ImageDownloader:
+    """
+    Downloads images in the current process with asyncio, replacing a call to img2dataset.
+
+    The requests go through one aiohttp session, which reuses the connections, caches the DNS resolutions and limits
+    the number of requests in total (`num_concurrent_requests`) and per host (`max_requests_per_host`). The images are
+    resized and encoded in a pool of `num_encoding_workers` threads, or processes with `use_processes_for_encoding`.
+
+    `download` yields the results `(url, jpeg_bytes, error)` as they come. At most `max_pending` urls are being
+    downloaded or waiting to be consumed, so the downloads wait for the consumer. With `path_index`, the urls in the
+    index are skipped, and the consumer adds the urls to the index with `index.add` once their results are saved.
+    """
+
+    def __init__(
+        self,
+        image_size=256,
+        resize_mode="keep_ratio",
+        encode_quality=95,
+        num_concurrent_requests=128,
+        max_requests_per_host=16,
+        max_pending=1024,
+        timeout=10,
+        max_retries=1,
+        retry_backoff=1.0,
+        max_image_bytes=20 * 2**20,
+        dns_cache_ttl=600,
+        user_agent="Mozilla/5.0 (compatible; m4-image-downloader)",
+        num_encoding_workers=cpu_count(),
+        use_processes_for_encoding=False,
+        path_index=None,
+    ):
+        if resize_mode not in RESIZE_MODES:
+            raise ValueError(f"`resize_mode` should be one of {RESIZE_MODES}, got {resize_mode}")
+        self.image_size = image_size
+        self.resize_mode = resize_mode
+        self.encode_quality = encode_quality
+        self.num_concurrent_requests = num_concurrent_requests
+        self.max_requests_per_host = max_requests_per_host
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.max_image_bytes = max_image_bytes
+        self.dns_cache_ttl = dns_cache_ttl
+        self.user_agent = user_agent
+        self.num_encoding_workers = num_encoding_workers
+        self.use_processes_for_encoding = use_processes_for_encoding
+        self.index = CompletedUrlsIndex(path_index) if path_index is not None else None
+
+    def download(self, urls):
+        """Yields `(url, jpeg_bytes, error)` for the urls not in the index, in the order the downloads finish"""
+        urls = [url for url in dict.fromkeys(urls) if url and ((self.index is None) or (url not in self.index))]
+        results = queue.Queue()
+        state = {"started": threading.Event()}
+        thread = threading.Thread(target=lambda: asyncio.run(self._download_all(urls, results, state)), daemon=True)
+        thread.start()
+        state["started"].wait()
+        try:
+            while True:
+                result = results.get()
+                if result is None:
+                    break
+                if isinstance(result, BaseException):
+                    raise result
+                # The result is consumed, one more url can be downloaded
+                self._call_soon_in_loop(state, state["pending"].release)
+                yield result
+        finally:
+            if thread.is_alive():
+                self._call_soon_in_loop(state, state["task"].cancel)
+            thread.join()
+
+    @staticmethod
+    def _call_soon_in_loop(state, callback):
+        try:
+            state["loop"].call_soon_threadsafe(callback)
+        except RuntimeError:
+            # The loop is already closed, all the urls are downloaded
+            pass
+
+    async def _download_all(self, urls, results, state):
+        state["loop"] = asyncio.get_running_loop()
+        state["pending"] = asyncio.Semaphore(self.max_pending)
+        state["task"] = asyncio.current_task()
+        state["started"].set()
+
+        executor_class = ProcessPoolExecutor if self.use_processes_for_encoding else ThreadPoolExecutor
+        executor = executor_class(max_workers=self.num_encoding_workers)
+        connector = aiohttp.TCPConnector(
+            limit=self.num_concurrent_requests,
+            limit_per_host=self.max_requests_per_host,
+            ttl_dns_cache=self.dns_cache_ttl,
+        )
+        tasks = set()
+        try:
+            async with aiohttp.ClientSession(
+                connector=connector,
+                # Not a `total` timeout, which would include the time waiting for a connection of the pool
+                timeout=aiohttp.ClientTimeout(total=None, sock_connect=self.timeout, sock_read=self.timeout),
+                headers={"User-Agent": self.user_agent},
+            ) as session:
+                for url in urls:
+                    await state["pending"].acquire()
+                    task = asyncio.create_task(self._download_one(session, executor, url, results))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+                if tasks:
+                    await asyncio.gather(*tasks)
+        except asyncio.CancelledError:
+            for task in tasks:
+                task.cancel()
+        except Exception as e:
+            results.put(e)
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+            results.put(None)
+
+    async def _download_one(self, session, executor, url, results):
+        image_bytes, error = await self._fetch(session, url)
+        image = None
+        if image_bytes is not None:
+            image, error = await asyncio.get_running_loop().run_in_executor(
+                executor, resize_and_encode, image_bytes, self.image_size, self.resize_mode, self.encode_quality
+            )
+        results.put((url, image, error))
+
+    async def _fetch(self, session, url):
+        """Returns `(image_bytes, error)`, `image_bytes` being None if the download failed"""
+        error = None
+        for attempt in range(self.max_retries + 1):
+            retryable = True
+            try:
+                async with session.get(url) as response:
+                    if response.status == 200:
+                        if (response.content_length or 0) > self.max_image_bytes:
+                            return None, f"Image of {response.content_length} bytes"
+                        # `read(n)` only returns the bytes buffered so far, the body is read in chunks until EOF
+                        chunks = []
+                        num_bytes = 0
+                        async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                            num_bytes += len(chunk)
+                            if num_bytes > self.max_image_bytes:
+                                return None, f"Image of more than {self.max_image_bytes} bytes"
+                            chunks.append(chunk)
+                        return b"".join(chunks), None
+                    error = f"HTTP {response.status}"
+                    retryable = (response.status == 429) or (response.status >= 500)
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                error = repr(e)
+            if not retryable:
+                break
+            if attempt < self.max_retries:
+                await asyncio.sleep(self.retry_backoff * 2**attempt)
+        return None, error
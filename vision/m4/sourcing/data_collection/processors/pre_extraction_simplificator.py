@@ -1,4 +1,5 @@
 import re
+from array import array
 
 from m4.sourcing.data_collection.utils import (
     MEDIA_CONTAIN_INTERESTING_ATTRIBUTES_SET,
@@ -9,22 +10,104 @@ from m4.sourcing.data_collection.utils import (
 
 
 class Node:
-    def __init__(self, path_in_tree, media_info, text, children):
-        self.path_in_tree = path_in_tree
-        self.media_info = media_info
-        self.text = text
-        self.children = children
+    """
+    Node of a `Tree`. The node only holds its tree and its index in it: its data is stored in the arrays of the tree,
+    and its path in the tree is computed on demand from the parent indices.
+    """
+
+    __slots__ = ("tree", "index")
+
+    def __init__(self, tree, index):
+        self.tree = tree
+        self.index = index
+
+    @property
+    def _path_index(self):
+        # Index of the node whose path this node has, see `copy_path_from`
+        return self.tree.path_indices.get(self.index, self.index)
+
+    @property
+    def path_in_tree(self):
+        path_in_tree = self.tree.path_overrides.get(self.index)
+        if path_in_tree is not None:
+            return path_in_tree
+        return self.tree.get_path_in_tree(self._path_index)
+
+    @path_in_tree.setter
+    def path_in_tree(self, path_in_tree):
+        self.tree.path_indices.pop(self.index, None)
+        self.tree.path_overrides[self.index] = path_in_tree
+
+    def copy_path_from(self, other_node):
+        """Same as `self.path_in_tree = other_node.path_in_tree`, without building the path"""
+        if other_node.tree is not self.tree or other_node.index in other_node.tree.path_overrides:
+            self.path_in_tree = other_node.path_in_tree
+        else:
+            self.tree.path_overrides.pop(self.index, None)
+            self.tree.path_indices[self.index] = other_node._path_index
+
+    def tags_below_common_ancestor(self, other_node):
+        """
+        Tags of the two paths in the tree, from the first node where they differ. If one path is the beginning of
+        the other, all the tags of both paths.
+        """
+        if (
+            other_node.tree is self.tree
+            and self.index not in self.tree.path_overrides
+            and other_node.index not in self.tree.path_overrides
+        ):
+            return self.tree.get_tags_below_common_ancestor(self._path_index, other_node._path_index)
+        path_1 = self.path_in_tree
+        path_2 = other_node.path_in_tree
+        start_diff_path = 0
+        for i in range(min(len(path_1), len(path_2))):
+            if path_1[i] != path_2[i]:
+                start_diff_path = i
+                break
+        return [tag for tag, _ in path_1[start_diff_path:] + path_2[start_diff_path:]]
+
+    @property
+    def media_info(self):
+        return self.tree.media_infos.get(self.index)
+
+    @media_info.setter
+    def media_info(self, media_info):
+        self.tree.media_infos[self.index] = media_info
+
+    @property
+    def text(self):
+        return self.tree.texts[self.index]
+
+    @text.setter
+    def text(self, text):
+        self.tree.texts[self.index] = text
+
+    @property
+    def children(self):
+        return [Node(self.tree, index) for index in self.tree.get_children_indices(self.index)]
 
     @property
     def tag(self):
-        return self.path_in_tree[-1][0]
+        path_in_tree = self.tree.path_overrides.get(self.index)
+        if path_in_tree is not None:
+            return path_in_tree[-1][0]
+        return self.tree.tags[self._path_index]
 
     @property
     def level(self):
-        return len(self.path_in_tree)
+        path_in_tree = self.tree.path_overrides.get(self.index)
+        if path_in_tree is not None:
+            return len(path_in_tree)
+        return self.tree.depths[self._path_index] + 1
 
 
 class Tree:
+    """
+    Tree of the nodes of a selectolax tree, stored in flat arrays indexed by the position of the nodes in pre-order.
+    The tree is built and traversed iteratively, so deep pages don't hit the recursion limit, and its memory is
+    linear in the number of nodes.
+    """
+
     def __init__(
         self,
         selectolax_root_node,
@@ -33,47 +116,93 @@ class Tree:
     ):
         self.num_nodes = 0
         self.interesting_attributes_set_cat = interesting_attributes_set_cat
+        self.tags = []
+        self.parents = array("q")
+        self.depths = array("q")
+        # Index following the last node of the subtree of each node
+        self.subtree_ends = array("q")
+        self.texts = []
+        self.media_infos = {}
+        # Paths set on the nodes after the tree was built
+        self.path_indices = {}
+        self.path_overrides = {}
         self.tree = self.make_tree(selectolax_root_node, page_url)
 
-    def make_tree(self, selectolax_node, page_url, path_in_tree=[]):
-        tag = selectolax_node.tag
-        path_in_tree = path_in_tree + [[tag, self.num_nodes]]
-        self.num_nodes += 1
-
-        if tag in MEDIA_CONTAIN_INTERESTING_ATTRIBUTES_SET[self.interesting_attributes_set_cat]:
-            return Node(
-                path_in_tree=path_in_tree,
-                media_info=simplify_media_node(selectolax_node, page_url=page_url),
-                text="",
-                children=[],
-            )
-
-        elif tag == "-text":
-            return Node(
-                path_in_tree=path_in_tree,
-                media_info=None,
-                text=selectolax_node.text(deep=False, separator="", strip=False),
-                children=[],
-            )
-
-        return Node(
-            path_in_tree=path_in_tree,
-            media_info=None,
-            text="",
-            children=[
-                self.make_tree(child, page_url=page_url, path_in_tree=path_in_tree)
-                for child in selectolax_node.iter(include_text=True)
-            ],
-        )
+    def make_tree(self, selectolax_node, page_url):
+        media_tags = MEDIA_CONTAIN_INTERESTING_ATTRIBUTES_SET[self.interesting_attributes_set_cat]
+        # The tags are shared between the nodes instead of having one string per node
+        unique_tags = {}
+        root_index = self.num_nodes
+        stack = [(selectolax_node, -1)]
+        while stack:
+            selectolax_node, parent_index = stack.pop()
+            index = self.num_nodes
+            self.num_nodes += 1
+            tag = unique_tags.setdefault(selectolax_node.tag, selectolax_node.tag)
+            self.tags.append(tag)
+            self.parents.append(parent_index)
+            self.depths.append(self.depths[parent_index] + 1 if parent_index >= 0 else 0)
+            self.subtree_ends.append(index + 1)
+
+            if tag in media_tags:
+                self.media_infos[index] = simplify_media_node(selectolax_node, page_url=page_url)
+                self.texts.append("")
+            elif tag == "-text":
+                self.texts.append(selectolax_node.text(deep=False, separator="", strip=False))
+            else:
+                self.texts.append("")
+                children = [child for child in selectolax_node.iter(include_text=True)]
+                stack.extend((child, index) for child in reversed(children))
+
+        # The children come after their parent in pre-order
+        for index in range(self.num_nodes - 1, root_index, -1):
+            parent_index = self.parents[index]
+            if self.subtree_ends[index] > self.subtree_ends[parent_index]:
+                self.subtree_ends[parent_index] = self.subtree_ends[index]
+        return Node(self, root_index)
 
-    def traverse(self):
-        def traverse_recursive(node, list_nodes):
-            list_nodes.append(node)
-            for child_node in node.children:
-                traverse_recursive(child_node, list_nodes=list_nodes)
+    def get_children_indices(self, index):
+        child_index = index + 1
+        while child_index < self.subtree_ends[index]:
+            yield child_index
+            child_index = self.subtree_ends[child_index]
 
+    def get_path_in_tree(self, index):
+        path_in_tree = []
+        while index >= 0:
+            path_in_tree.append([self.tags[index], index])
+            index = self.parents[index]
+        path_in_tree.reverse()
+        return path_in_tree
+
+    def get_tags_below_common_ancestor(self, index_1, index_2):
+        tags = []
+        while self.depths[index_1] > self.depths[index_2]:
+            tags.append(self.tags[index_1])
+            index_1 = self.parents[index_1]
+        while self.depths[index_2] > self.depths[index_1]:
+            tags.append(self.tags[index_2])
+            index_2 = self.parents[index_2]
+        if not tags or index_1 != index_2:
+            while index_1 != index_2:
+                tags.append(self.tags[index_1])
+                tags.append(self.tags[index_2])
+                index_1 = self.parents[index_1]
+                index_2 = self.parents[index_2]
+            return tags
+        # One node is an ancestor of the other: the paths don't differ
+        return [tag for tag, _ in self.get_path_in_tree(index_1)] + tags
+
+    def traverse(self, post_order=False):
+        if not post_order:
+            return [Node(self, index) for index in range(self.num_nodes)]
         list_nodes = []
-        traverse_recursive(self.tree, list_nodes=list_nodes)
+        ancestors = []
+        for index in range(self.num_nodes):
+            while ancestors and self.subtree_ends[ancestors[-1]] <= index:
+                list_nodes.append(Node(self, ancestors.pop()))
+            ancestors.append(index)
+        list_nodes.extend(Node(self, index) for index in reversed(ancestors))
         return list_nodes
 
 
@@ -132,55 +261,53 @@ class PreExtractionSimplificator:
         return list_nodes
 
     def _merge_consecutive_text_nodes(self, list_nodes):
-        current_idx = 0
-        while current_idx <= len(list_nodes) - 1:
-            if list_nodes[current_idx].tag != "-text":
-                current_idx += 1
+        # The text nodes are merged into the first node of their run, and the nodes are added to a new list instead
+        # of being deleted from `list_nodes`, which would be quadratic in the number of nodes
+        merged_list_nodes = []
+        current_text_node = None
+        for node in list_nodes:
+            if node.tag != "-text":
+                if current_text_node is not None:
+                    current_text_node.path_in_tree = [["-text", 0]]
+                    current_text_node.text = current_text_node.text.strip()
+                    current_text_node = None
+                merged_list_nodes.append(node)
+            elif current_text_node is None:
+                current_text_node = node
+                merged_list_nodes.append(node)
             else:
-                if (current_idx == len(list_nodes) - 1) or (
-                    (current_idx + 1 <= len(list_nodes) - 1) and (list_nodes[current_idx + 1].tag != "-text")
-                ):
-                    list_nodes[current_idx].path_in_tree = [["-text", 0]]
-                    list_nodes[current_idx].text = list_nodes[current_idx].text.strip()
-                    current_idx += 1
+                seps = set()
+
+                text_1 = current_text_node.text
+                text_2 = node.text
+
+                for char in ["\n\n", "\n", " "]:
+                    if text_1.endswith(char):
+                        seps.add(char)
+                        text_1 = text_1[: -len(char)]
+                    if text_2.startswith(char):
+                        seps.add(char)
+                        text_2 = text_2[len(char) :]
+
+                for tag in current_text_node.tags_below_common_ancestor(node):
+                    if tag in TAG_TO_SEP:
+                        seps.add(TAG_TO_SEP[tag])
+
+                if "\n\n" in seps:
+                    sep = "\n\n"
+                elif "\n" in seps:
+                    sep = "\n"
+                elif " " in seps:
+                    sep = " "
                 else:
-                    seps = set()
-
-                    text_1 = list_nodes[current_idx].text
-                    text_2 = list_nodes[current_idx + 1].text
-
-                    for char in ["\n\n", "\n", " "]:
-                        if text_1.endswith(char):
-                            seps.add(char)
-                            text_1 = text_1[: -len(char)]
-                        if text_2.startswith(char):
-                            seps.add(char)
-                            text_2 = text_2[len(char) :]
-
-                    path_1 = list_nodes[current_idx].path_in_tree
-                    path_2 = list_nodes[current_idx + 1].path_in_tree
-
-                    start_diff_path = 0
-                    for i in range(min(len(path_1), len(path_2))):
-                        if path_1[i] != path_2[i]:
-                            start_diff_path = i
-                            break
-                    for tag, _ in path_1[start_diff_path:] + path_2[start_diff_path:]:
-                        if tag in TAG_TO_SEP:
-                            seps.add(TAG_TO_SEP[tag])
-
-                    if "\n\n" in seps:
-                        sep = "\n\n"
-                    elif "\n" in seps:
-                        sep = "\n"
-                    elif " " in seps:
-                        sep = " "
-                    else:
-                        sep = ""
-
-                    list_nodes[current_idx].path_in_tree = path_2
-                    list_nodes[current_idx].text = text_1 + sep + text_2
-                    del list_nodes[current_idx + 1]
+                    sep = ""
+
+                current_text_node.copy_path_from(node)
+                current_text_node.text = text_1 + sep + text_2
+        if current_text_node is not None:
+            current_text_node.path_in_tree = [["-text", 0]]
+            current_text_node.text = current_text_node.text.strip()
+        list_nodes = merged_list_nodes
 
         list_nodes = [
             node for node in list_nodes if (node.tag != "-text") or ((node.tag == "-text") and (node.text.strip()))
@@ -0,0 +1,157 @@
+import hashlib
+import json
+import logging
+import math
+import os
+import shutil
+
+import numpy as np
+
+
+logger = logging.getLogger(__name__)
+
+RECORD_DTYPE = np.dtype([("hash_high", "<u8"), ("hash_low", "<u8"), ("idx", "<i8")])
+INDEX_FILES = {"hash_high": "hashes_high.npy", "hash_low": "hashes_low.npy", "idx": "indices.npy"}
+INFO_FILE = "url_index_info.json"
+
+
+def hash_urls(urls):
+    """Returns the two halves of the 128-bit blake2b hashes of the urls, as two arrays of uint64"""
+    digests = b"".join(hashlib.blake2b(url.encode("utf-8"), digest_size=16).digest() for url in urls)
+    hashes = np.frombuffer(digests, dtype=">u8").reshape(-1, 2).astype("<u8")
+    return hashes[:, 0], hashes[:, 1]
+
+
+class UrlIndex:
+    """
+    On-disk index from the urls of a dataset of images to their row in this dataset, replacing the dict
+    `map_url_idx` so that the memory used to match the images with the web documents doesn't grow with the number
+    of images.
+
+    The index is three arrays sorted by the hash of the urls (the two halves of a 128-bit hash, and the row), saved
+    in `.npy` files and memory-mapped. A lookup is a binary search on the first half of the hash. Like for
+    `{url: idx for idx, url in enumerate(urls)}`, a url present several times is mapped to its last row.
+
+    The index is built with `UrlIndex.build` by an external sort: the hashes are written by chunks of `chunk_size`
+    urls in buckets on disk according to their first bits, then each bucket, of about `chunk_size` urls, is sorted in
+    memory and written at its place in the arrays.
+    """
+
+    def __init__(self, path_index):
+        self.path_index = path_index
+        with open(os.path.join(path_index, INFO_FILE)) as f:
+            self.num_urls = json.load(f)["num_urls"]
+        self._arrays = None
+
+    def __reduce__(self):
+        # The memory maps are opened again in each process
+        return (self.__class__, (self.path_index,))
+
+    def __len__(self):
+        return self.num_urls
+
+    def __contains__(self, url):
+        return self.get(url) is not None
+
+    @property
+    def arrays(self):
+        if self._arrays is None:
+            # Plain arrays on the memory maps, faster to index than `np.memmap`
+            self._arrays = {
+                name: np.asarray(np.load(os.path.join(self.path_index, filename), mmap_mode="r"))
+                for name, filename in INDEX_FILES.items()
+            }
+        return self._arrays
+
+    def get(self, url, default=None):
+        """Returns the row of `url` in the dataset of images, or `default` if the url isn't indexed"""
+        digest = hashlib.blake2b(url.encode("utf-8"), digest_size=16).digest()
+        hash_high, hash_low = int.from_bytes(digest[:8], "big"), int.from_bytes(digest[8:], "big")
+        hashes_high, hashes_low = self.arrays["hash_high"], self.arrays["hash_low"]
+        position = int(hashes_high.searchsorted(np.uint64(hash_high)))
+        idx = default
+        # Almost always at most one entry, or several for a url present several times in the dataset of images, the
+        # last one being the last row
+        while (position < self.num_urls) and (hashes_high[position] == hash_high):
+            if hashes_low[position] == hash_low:
+                idx = int(self.arrays["idx"][position])
+            position += 1
+        return idx
+
+    @staticmethod
+    def exists(path_index):
+        return os.path.exists(os.path.join(path_index, INFO_FILE))
+
+    @classmethod
+    def build(cls, urls, num_urls, path_index, chunk_size=1_000_000):
+        """
+        Builds the index of the iterable `urls`, the url of the row `idx` of the dataset of images being the `idx`-th
+        url, in the directory `path_index`. `num_urls` is the number of urls, used to choose the number of buckets.
+        """
+        logger.info(f"Starting building the url index of {num_urls} urls")
+        if os.path.exists(path_index):
+            shutil.rmtree(path_index)
+        path_buckets = os.path.join(path_index, "buckets")
+        os.makedirs(path_buckets)
+
+        num_bits = max(0, math.ceil(math.log2(max(1, num_urls) / chunk_size)))
+        num_buckets = 2**num_bits
+
+        def bucket_path(idx_bucket):
+            return os.path.join(path_buckets, f"{idx_bucket}.bin")
+
+        def write_chunk(chunk_urls, first_idx):
+            records = np.empty(len(chunk_urls), dtype=RECORD_DTYPE)
+            records["hash_high"], records["hash_low"] = hash_urls(chunk_urls)
+            records["idx"] = np.arange(first_idx, first_idx + len(chunk_urls))
+            if num_bits == 0:
+                idx_buckets = np.zeros(len(records), dtype=np.int64)
+            else:
+                idx_buckets = (records["hash_high"] >> np.uint64(64 - num_bits)).astype(np.int64)
+            order = np.argsort(idx_buckets, kind="stable")
+            bucket_bounds = np.concatenate([[0], np.cumsum(np.bincount(idx_buckets, minlength=num_buckets))])
+            records = records[order]
+            for idx_bucket in np.flatnonzero(np.diff(bucket_bounds)):
+                with open(bucket_path(idx_bucket), "ab") as f:
+                    records[bucket_bounds[idx_bucket] : bucket_bounds[idx_bucket + 1]].tofile(f)
+
+        # First pass: the hashes are spread in the buckets
+        total_num_urls = 0
+        chunk_urls = []
+        for url in urls:
+            chunk_urls.append(url)
+            if len(chunk_urls) == chunk_size:
+                write_chunk(chunk_urls, total_num_urls)
+                total_num_urls += len(chunk_urls)
+                chunk_urls = []
+        if chunk_urls:
+            write_chunk(chunk_urls, total_num_urls)
+            total_num_urls += len(chunk_urls)
+
+        # Second pass: each bucket is sorted, and the buckets are concatenated in the order of their hashes
+        arrays = {
+            name: np.lib.format.open_memmap(
+                os.path.join(path_index, filename), mode="w+", dtype=RECORD_DTYPE[name], shape=(total_num_urls,)
+            )
+            for name, filename in INDEX_FILES.items()
+        }
+        position = 0
+        for idx_bucket in range(num_buckets):
+            if not os.path.exists(bucket_path(idx_bucket)):
+                continue
+            records = np.fromfile(bucket_path(idx_bucket), dtype=RECORD_DTYPE)
+            records = records[np.lexsort((records["idx"], records["hash_low"], records["hash_high"]))]
+            for name, array in arrays.items():
+                array[position : position + len(records)] = records[name]
+            position += len(records)
+            os.remove(bucket_path(idx_bucket))
+        for array in arrays.values():
+            array.flush()
+        del arrays
+        shutil.rmtree(path_buckets)
+
+        # Written last, so that an interrupted build is not mistaken for an index
+        with open(os.path.join(path_index, INFO_FILE), "w") as f:
+            json.dump({"num_urls": total_num_urls, "num_buckets": num_buckets}, f)
+        logger.info("Finished building the url index")
+        return cls(path_index)
@@ -1,15 +1,247 @@
+import http.client
+import logging
+import queue
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
 import boto3
 from botocore.config import Config
-from botocore.exceptions import ClientError, ProxyConnectionError
+from botocore.exceptions import BotoCoreError, ClientError
+
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_S3_ERROR_CODES = {"SlowDown", "Throttling", "ThrottlingException", "RequestTimeout", "InternalError"}
+
+
+class WarcFetchError(Exception):
+    def __init__(self, message, retryable):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+class S3WarcBackend:
+    """
+    Ranged GETs on the objects of an S3 bucket (or of an S3-compatible server with `endpoint_url`). The client is
+    created lazily, once per process, and shared by the threads through its connection pool.
+    """
+
+    def __init__(self, bucket="commoncrawl", endpoint_url=None, max_pool_connections=32):
+        self.bucket = bucket
+        self.endpoint_url = endpoint_url
+        self.max_pool_connections = max_pool_connections
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                config_boto = Config(
+                    # region_name="us-east-1", # Location of the CC data, commenting this line since it doesn't help
+                    # The retries are done by `WarcRangeFetcher`
+                    retries={"max_attempts": 1, "mode": "standard"},
+                    max_pool_connections=self.max_pool_connections,
+                )
+                self._client = boto3.client("s3", endpoint_url=self.endpoint_url, config=config_boto)
+        return self._client
+
+    def fetch_range(self, warc_filename, start, end):
+        """Bytes `start` to `end` (inclusive) of `warc_filename`"""
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=warc_filename, Range=f"bytes={start}-{end}")
+            return response["Body"].read()
+        except ClientError as e:
+            status_code = e.response.get("ResponseMetadata", {}).get("HTTPStatusCode", 0)
+            retryable = (e.response.get("Error", {}).get("Code") in RETRYABLE_S3_ERROR_CODES) or status_code >= 500
+            raise WarcFetchError(repr(e), retryable=retryable) from e
+        except BotoCoreError as e:
+            raise WarcFetchError(repr(e), retryable=True) from e
+
+    # Needed to make multiprocessing work
+    def __reduce__(self):
+        return (self.__class__, (self.bucket, self.endpoint_url, self.max_pool_connections))
+
+
+class HTTPWarcBackend:
+    """
+    Ranged GETs on `{base_url}/{warc_filename}`, for the HTTP endpoint of Common Crawl, or an S3-compatible server with
+    `base_url` ending with the bucket. The keep-alive connections are kept in a pool shared by the threads.
+    """
+
+    def __init__(self, base_url="https://data.commoncrawl.org", max_pool_connections=32, timeout=60):
+        self.base_url = base_url
+        self.max_pool_connections = max_pool_connections
+        self.timeout = timeout
+        parsed_url = urlparse(base_url)
+        self.connection_class = (
+            http.client.HTTPSConnection if parsed_url.scheme == "https" else http.client.HTTPConnection
+        )
+        self.netloc = parsed_url.netloc
+        self.base_path = parsed_url.path.rstrip("/")
+        self._connections = queue.LifoQueue()
+
+    def _get_connection(self):
+        try:
+            return self._connections.get_nowait()
+        except queue.Empty:
+            return self.connection_class(self.netloc, timeout=self.timeout)
+
+    def _release_connection(self, connection):
+        if self._connections.qsize() < self.max_pool_connections:
+            self._connections.put(connection)
+        else:
+            connection.close()
+
+    def fetch_range(self, warc_filename, start, end):
+        """Bytes `start` to `end` (inclusive) of `warc_filename`"""
+        connection = self._get_connection()
+        try:
+            connection.request("GET", f"{self.base_path}/{warc_filename}", headers={"Range": f"bytes={start}-{end}"})
+            response = connection.getresponse()
+            body = response.read()
+        except (OSError, http.client.HTTPException) as e:
+            connection.close()
+            raise WarcFetchError(repr(e), retryable=True) from e
+        self._release_connection(connection)
+
+        if response.status == 206:
+            return body
+        if response.status == 200:
+            # The server ignored the range
+            return body[start : end + 1]
+        raise WarcFetchError(
+            f"HTTP {response.status} {response.reason} for {warc_filename}",
+            retryable=(response.status == 429) or (response.status >= 500),
+        )
+
+    # Needed to make multiprocessing work
+    def __reduce__(self):
+        return (self.__class__, (self.base_url, self.max_pool_connections, self.timeout))
+
+
+class WarcRangeFetcher:
+    """
+    Fetches WARC records given by `(warc_filename, warc_record_offset, warc_record_length)`. The records are grouped
+    by WARC file and the close byte ranges are coalesced into one request, of at most `max_coalesced_bytes`. The
+    requests are done by `num_threads` threads sharing the connection pool of the backend, and are retried with an
+    exponential backoff.
+    """
+
+    def __init__(
+        self,
+        backend,
+        num_threads=32,
+        max_coalesced_bytes=8 * 2**20,
+        max_gap_bytes=0,
+        max_retries=5,
+        retry_backoff=0.5,
+    ):
+        self.backend = backend
+        self.num_threads = num_threads
+        self.max_coalesced_bytes = max_coalesced_bytes
+        self.max_gap_bytes = max_gap_bytes
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self._executor = None
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.num_threads)
+        return self._executor
+
+    def coalesce(self, records):
+        """
+        Groups the records into ranges `(warc_filename, start, end, idx_records)` to request, `end` being inclusive.
+        """
+        sorted_idx_records = sorted(range(len(records)), key=lambda idx: (records[idx][0], records[idx][1]))
+        ranges = []
+        for idx in sorted_idx_records:
+            warc_filename, warc_record_offset, warc_record_length = records[idx]
+            record_end = warc_record_offset + warc_record_length - 1
+            if ranges:
+                range_filename, range_start, range_end, idx_records = ranges[-1]
+                if (
+                    (range_filename == warc_filename)
+                    and (warc_record_offset <= range_end + 1 + self.max_gap_bytes)
+                    and (max(range_end, record_end) - range_start + 1 <= self.max_coalesced_bytes)
+                ):
+                    idx_records.append(idx)
+                    ranges[-1] = (range_filename, range_start, max(range_end, record_end), idx_records)
+                    continue
+            ranges.append((warc_filename, warc_record_offset, record_end, [idx]))
+        return ranges
+
+    def fetch_range(self, warc_filename, start, end):
+        for attempt in range(self.max_retries + 1):
+            try:
+                return self.backend.fetch_range(warc_filename, start, end)
+            except WarcFetchError as e:
+                if not e.retryable or attempt == self.max_retries:
+                    raise
+                time.sleep(self.retry_backoff * 2**attempt * random.uniform(0.5, 1.5))
+
+    def _fetch_coalesced_range(self, records, warc_range):
+        warc_filename, start, end, idx_records = warc_range
+        try:
+            data = self.fetch_range(warc_filename, start, end)
+        except WarcFetchError as e:
+            return [(idx, b"", str(e)) for idx in idx_records]
+        results = []
+        for idx in idx_records:
+            _, warc_record_offset, warc_record_length = records[idx]
+            record_start = warc_record_offset - start
+            results.append((idx, data[record_start : record_start + warc_record_length], ""))
+        return results
+
+    def fetch_records(self, records):
+        """List of `(warc, warc_error)`, in the order of `records`"""
+        outputs = [None] * len(records)
+        ranges = self.coalesce(records)
+        for results in self.executor.map(lambda warc_range: self._fetch_coalesced_range(records, warc_range), ranges):
+            for idx, warc, warc_error in results:
+                outputs[idx] = (warc, warc_error)
+        return outputs
+
+    # Needed to make multiprocessing work
+    def __reduce__(self):
+        return (
+            self.__class__,
+            (
+                self.backend,
+                self.num_threads,
+                self.max_coalesced_bytes,
+                self.max_gap_bytes,
+                self.max_retries,
+                self.retry_backoff,
+            ),
+        )
 
 
 class WarcDownloader:
-    def __init__(self):
-        config_boto = Config(
-            # region_name="us-east-1", # Location of the CC data, commenting this line since it doesn't help
-            retries={"max_attempts": 10, "mode": "standard"}
+    """
+    Downloads the WARC records of the examples, either one example at a time with `__call__`, or a batch of examples
+    at a time with `download_batch` (to use with `datasets.map(batched=True)`), which fetches the records of the batch
+    concurrently with a `WarcRangeFetcher`.
+    """
+
+    def __init__(self, backend=None, num_threads=32, max_coalesced_bytes=8 * 2**20, max_gap_bytes=0, max_retries=5):
+        self.backend = backend if backend is not None else S3WarcBackend(max_pool_connections=num_threads)
+        self.num_threads = num_threads
+        self.max_coalesced_bytes = max_coalesced_bytes
+        self.max_gap_bytes = max_gap_bytes
+        self.max_retries = max_retries
+        self.fetcher = WarcRangeFetcher(
+            backend=self.backend,
+            num_threads=num_threads,
+            max_coalesced_bytes=max_coalesced_bytes,
+            max_gap_bytes=max_gap_bytes,
+            max_retries=max_retries,
         )
-        self.client = boto3.client("s3", config=config_boto)
 
     def __call__(self, example):
         if example["warc"] and not example["warc_error"]:
@@ -20,7 +252,6 @@ class WarcDownloader:
         warc_record_length = example["warc_record_length"]
 
         warc, warc_error = self.get_warc_from_metadata(
-            client=self.client,
             warc_filename=warc_filename,
             warc_record_offset=warc_record_offset,
             warc_record_length=warc_record_length,
@@ -29,17 +260,35 @@ class WarcDownloader:
         example["warc_error"] = warc_error
         return example
 
-    def get_warc_from_metadata(self, client, warc_filename, warc_record_offset, warc_record_length):
+    def download_batch(self, examples):
+        idx_to_download = [
+            idx
+            for idx, (warc, warc_error) in enumerate(zip(examples["warc"], examples["warc_error"]))
+            if not warc or warc_error
+        ]
+        records = [
+            (examples["warc_filename"][idx], examples["warc_record_offset"][idx], examples["warc_record_length"][idx])
+            for idx in idx_to_download
+        ]
+        examples["warc"] = list(examples["warc"])
+        examples["warc_error"] = list(examples["warc_error"])
+        for idx, (warc, warc_error) in zip(idx_to_download, self.fetcher.fetch_records(records)):
+            examples["warc"][idx] = warc
+            examples["warc_error"][idx] = warc_error
+        return examples
+
+    def get_warc_from_metadata(self, warc_filename, warc_record_offset, warc_record_length):
         try:
-            response = client.get_object(
-                Bucket="commoncrawl",
-                Key=warc_filename,
-                Range=f"bytes={warc_record_offset}-{warc_record_offset + warc_record_length - 1}",
+            warc = self.fetcher.fetch_range(
+                warc_filename, warc_record_offset, warc_record_offset + warc_record_length - 1
             )
-        except (ClientError, ProxyConnectionError) as e:
-            return b"", repr(e)
-        return response["Body"].read(), ""
+        except WarcFetchError as e:
+            return b"", str(e)
+        return warc, ""
 
     # Needed to make multiprocessing work
     def __reduce__(self):
-        return (self.__class__, ())
+        return (
+            self.__class__,
+            (self.backend, self.num_threads, self.max_coalesced_bytes, self.max_gap_bytes, self.max_retries),
+        )
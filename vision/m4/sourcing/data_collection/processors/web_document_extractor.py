@@ -7,10 +7,13 @@ import tarfile
 from copy import deepcopy
 
 import git
-from datasets import Dataset, Image, Sequence, Value, concatenate_datasets, load_from_disk
+from datasets import Dataset, Features, Image, Sequence, Value, concatenate_datasets, load_from_disk
 from pathos.multiprocessing import ProcessingPool as Pool
 from tqdm import tqdm
 
+from m4.sourcing.data_collection.processors.image_downloader import ImageDownloader
+from m4.sourcing.data_collection.processors.url_index import UrlIndex
+
 
 logging.basicConfig(
     level=logging.INFO,
@@ -128,6 +131,108 @@ def download_images(
     logger.info("Finished downloading the images")
 
 
+def save_dataset_images_shard(urls, images, path_save_dir_tmp_datasets_images, idx_shard):
+    dataset_images_shard = Dataset.from_dict(
+        {"url": urls, "image": images}, features=Features({"url": Value("string"), "image": Value("binary")})
+    )
+    dataset_images_shard.save_to_disk(os.path.join(path_save_dir_tmp_datasets_images, str(idx_shard)))
+
+
+def get_idx_dataset_images_shards(path_save_dir_tmp_datasets_images):
+    return sorted(
+        int(name)
+        for name in os.listdir(path_save_dir_tmp_datasets_images)
+        if name.isdigit() and os.path.isdir(os.path.join(path_save_dir_tmp_datasets_images, name))
+    )
+
+
+def download_images_in_process(
+    path_save_file_image_urls,
+    path_save_dir_tmp_datasets_images,
+    number_sample_per_shard,
+    image_size,
+    resize_mode,
+    num_proc,
+    thread_count,
+):
+    """
+    Downloads the images with an `ImageDownloader` in this process, instead of writing tars with img2dataset and
+    reading them back. The images are saved by shards of `number_sample_per_shard` downloads in datasets in
+    `path_save_dir_tmp_datasets_images`, and the urls of a shard are added to the index of the completed urls once it
+    is saved, so calling this function again resumes the downloads.
+    """
+    logger.info("Starting downloading the images")
+    with open(path_save_file_image_urls) as f:
+        image_urls = [url for url in f.read().split("\n") if url]
+    os.makedirs(path_save_dir_tmp_datasets_images, exist_ok=True)
+
+    image_downloader = ImageDownloader(
+        image_size=image_size,
+        # `resize_mode: no` is loaded as False from the yaml configs
+        resize_mode="no" if resize_mode is False else resize_mode,
+        num_concurrent_requests=thread_count,
+        num_encoding_workers=num_proc,
+        path_index=os.path.join(path_save_dir_tmp_datasets_images, "completed_urls.txt"),
+    )
+    idx_shards = get_idx_dataset_images_shards(path_save_dir_tmp_datasets_images)
+    idx_shard = idx_shards[-1] + 1 if idx_shards else 0
+    completed_urls, urls, images = [], [], []
+    num_successes = 0
+    for url, image, _ in tqdm(image_downloader.download(image_urls)):
+        completed_urls.append(url)
+        if image is not None:
+            urls.append(url)
+            images.append(image)
+        if len(completed_urls) == number_sample_per_shard:
+            save_dataset_images_shard(urls, images, path_save_dir_tmp_datasets_images, idx_shard)
+            image_downloader.index.add(completed_urls)
+            num_successes += len(urls)
+            idx_shard += 1
+            completed_urls, urls, images = [], [], []
+    if completed_urls:
+        save_dataset_images_shard(urls, images, path_save_dir_tmp_datasets_images, idx_shard)
+        image_downloader.index.add(completed_urls)
+        num_successes += len(urls)
+    logger.info(f"Finished downloading the images ({num_successes} new images)")
+
+
+def iter_dataset_images_urls(dataset_images, batch_size=100_000):
+    """Yields the urls of the dataset of images in the order of its rows, without loading the images"""
+    dataset_urls = dataset_images.remove_columns([name for name in dataset_images.column_names if name != "url"])
+    for start in range(0, len(dataset_urls), batch_size):
+        yield from dataset_urls[start : start + batch_size]["url"]
+
+
+def write_map_url_idx(urls, path_save_file_map_url_idx):
+    """
+    Writes the json of `{url: idx for idx, url in enumerate(urls)}` without building the dict. A url present several
+    times is written several times, and is mapped to its last row when the json is loaded, like in the dict.
+    """
+    with open(path_save_file_map_url_idx, "w") as f:
+        f.write("{")
+        for idx, url in enumerate(urls):
+            f.write(f"{', ' if idx > 0 else ''}{json.dumps(url)}: {idx}")
+        f.write("}")
+
+
+def create_dataset_images_from_shards(
+    path_save_dir_tmp_datasets_images,
+    path_save_file_map_url_idx,
+    path_save_dir_dataset_images,
+):
+    logger.info("Starting creating the dataset of all images")
+    datasets_images = [
+        load_from_disk(os.path.join(path_save_dir_tmp_datasets_images, str(idx_shard)))
+        for idx_shard in get_idx_dataset_images_shards(path_save_dir_tmp_datasets_images)
+    ]
+    dataset_images = concatenate_datasets(datasets_images)
+
+    write_map_url_idx(iter_dataset_images_urls(dataset_images), path_save_file_map_url_idx)
+    dataset_images.save_to_disk(path_save_dir_dataset_images)
+    logger.info("Finished creating the dataset of all images")
+    return dataset_images
+
+
 def create_dataset_images_from_tar(
     tar_paths,
     path_save_dir_tmp_datasets_images,
@@ -175,9 +280,7 @@ def create_dataset_images_from_tar(
     urls_indexed = pool.map(process_one_tar, args_pool)
     urls_indexed = [sub_el for el in urls_indexed for sub_el in el]
 
-    map_url_idx = {url: idx for idx, url in enumerate(urls_indexed)}
-    with open(path_save_file_map_url_idx, "w") as f:
-        json.dump(map_url_idx, f)
+    write_map_url_idx(urls_indexed, path_save_file_map_url_idx)
     datasets_images = [
         load_from_disk(os.path.join(path_save_dir_tmp_datasets_images, str(idx_tar)))
         for idx_tar in range(len(tar_paths))
@@ -207,6 +310,12 @@ def create_dataset_images(
 
 
 def urls_to_images(dataset, dataset_images, map_url_idx, num_proc, some_urls_are_already_retrieved=False):
+    """
+    Replaces the urls of the images of the web documents by the images of `dataset_images`. `map_url_idx` maps a url
+    to its row in `dataset_images`, and is a `UrlIndex` (or a dict, for small datasets). With a `UrlIndex`, the
+    documents are processed one at a time and their images are read at their row, so the memory used doesn't depend
+    on the number of images.
+    """
     if some_urls_are_already_retrieved:
         if "images_urls" not in dataset.features or "images" not in dataset.features:
             raise ValueError(
@@ -214,9 +323,14 @@ def urls_to_images(dataset, dataset_images, map_url_idx, num_proc, some_urls_are
             )
 
     def retrieve_image(url):
-        if url not in map_url_idx:
+        idx = map_url_idx.get(url)
+        if idx is None:
+            return None
+        example_image = dataset_images[idx]
+        # `UrlIndex` matches the urls on their hash
+        if example_image["url"] != url:
             return None
-        image = {"path": None, "bytes": dataset_images[map_url_idx[url]]["image"]}
+        image = {"path": None, "bytes": example_image["image"]}
         return image
 
     def func_urls_to_images_urls_in_images_col(example):
@@ -339,6 +453,8 @@ class CommonCrawlWebDocumentExtractor:
         num_proc_urls_to_images,
         path_save_dir_sharded_dataset,
         shard_size,
+        use_img2dataset=False,
+        path_save_dir_url_index=None,
     ):
         self.dataset = html_dataset
 
@@ -359,6 +475,10 @@ class CommonCrawlWebDocumentExtractor:
         self.num_proc_urls_to_images = num_proc_urls_to_images
         self.path_save_dir_sharded_dataset = path_save_dir_sharded_dataset
         self.shard_size = shard_size
+        self.use_img2dataset = use_img2dataset
+        if (path_save_dir_url_index is None) and (path_save_dir_dataset_images is not None):
+            path_save_dir_url_index = f"{path_save_dir_dataset_images.rstrip('/')}_url_index"
+        self.path_save_dir_url_index = path_save_dir_url_index
 
     def html_to_web_documents(self):
         self.dataset = html_to_web_documents(
@@ -374,28 +494,53 @@ class CommonCrawlWebDocumentExtractor:
         )
 
     def download_images(self):
-        download_images(
-            path_save_file_image_urls=self.path_save_file_image_urls,
-            path_save_dir_downloaded_images=self.path_save_dir_downloaded_images,
-            number_sample_per_shard=self.number_sample_per_shard,
-            image_size=self.image_size,
-            resize_mode=self.resize_mode,
-            num_proc=self.num_proc,
-            thread_count=self.thread_count,
-        )
+        if self.use_img2dataset:
+            download_images(
+                path_save_file_image_urls=self.path_save_file_image_urls,
+                path_save_dir_downloaded_images=self.path_save_dir_downloaded_images,
+                number_sample_per_shard=self.number_sample_per_shard,
+                image_size=self.image_size,
+                resize_mode=self.resize_mode,
+                num_proc=self.num_proc,
+                thread_count=self.thread_count,
+            )
+        else:
+            download_images_in_process(
+                path_save_file_image_urls=self.path_save_file_image_urls,
+                path_save_dir_tmp_datasets_images=self.path_save_dir_tmp_datasets_images,
+                number_sample_per_shard=self.number_sample_per_shard,
+                image_size=self.image_size,
+                resize_mode=self.resize_mode,
+                num_proc=self.num_proc,
+                thread_count=self.thread_count,
+            )
 
     def create_dataset_images(self):
-        self.dataset_images = create_dataset_images(
-            path_save_dir_downloaded_images=self.path_save_dir_downloaded_images,
-            path_save_dir_tmp_datasets_images=self.path_save_dir_tmp_datasets_images,
-            num_proc=self.num_proc,
-            path_save_file_map_url_idx=self.path_save_file_map_url_idx,
-            path_save_dir_dataset_images=self.path_save_dir_dataset_images,
+        if self.use_img2dataset:
+            self.dataset_images = create_dataset_images(
+                path_save_dir_downloaded_images=self.path_save_dir_downloaded_images,
+                path_save_dir_tmp_datasets_images=self.path_save_dir_tmp_datasets_images,
+                num_proc=self.num_proc,
+                path_save_file_map_url_idx=self.path_save_file_map_url_idx,
+                path_save_dir_dataset_images=self.path_save_dir_dataset_images,
+            )
+        else:
+            self.dataset_images = create_dataset_images_from_shards(
+                path_save_dir_tmp_datasets_images=self.path_save_dir_tmp_datasets_images,
+                path_save_file_map_url_idx=self.path_save_file_map_url_idx,
+                path_save_dir_dataset_images=self.path_save_dir_dataset_images,
+            )
+        # The rows of the images changed, the index is built again
+        self.build_url_index()
+
+    def build_url_index(self):
+        self.url_index = UrlIndex.build(
+            urls=iter_dataset_images_urls(self.dataset_images),
+            num_urls=len(self.dataset_images),
+            path_index=self.path_save_dir_url_index,
         )
 
     def urls_to_images(self, reload_files=False):
-        with open(self.path_save_file_map_url_idx) as f:
-            self.map_url_idx = json.load(f)
         # Useful when this method is called independently without
         # the previous ones, so we need to load some files
         if reload_files:
@@ -408,14 +553,18 @@ class CommonCrawlWebDocumentExtractor:
             try:
                 _ = self.dataset
                 _ = self.dataset_images
-                _ = self.map_url_idx
             except Exception:
                 print("Set `reload_files=True` if you're calling this method alone to define the missing variables")
 
+        if UrlIndex.exists(self.path_save_dir_url_index):
+            self.url_index = UrlIndex(self.path_save_dir_url_index)
+        else:
+            self.build_url_index()
+
         self.dataset = urls_to_images(
             dataset=self.dataset,
             dataset_images=self.dataset_images,
-            map_url_idx=self.map_url_idx,
+            map_url_idx=self.url_index,
             num_proc=self.num_proc_urls_to_images,
         )
 
@@ -0,0 +1,194 @@
+import hashlib
+import json
+import logging
+import os
+
+import numpy as np
+
+
+logger = logging.getLogger(__name__)
+
+# A document of a run: the fingerprint of its url and its WARC file (an id in the WARC filenames of the run, replaced
+# by the rank of the WARC filename among all the WARC filenames during the merge)
+RUN_DTYPE = np.dtype([("fingerprint", "<u8"), ("warc_id", "<u4")])
+# A duplicated url of a shard: its fingerprint, and the rank of the WARC filename of the documents to keep
+DUP_URL_DTYPE = np.dtype([("fingerprint", "<u8"), ("warc_rank", "<u4")])
+RUN_FILE = "fingerprints.npy"
+RUN_WARC_FILENAMES_FILE = "warc_filenames.json"
+# All the WARC filenames in alphabetical order, saved with the duplicated urls of the shards to read their ranks
+DUP_URLS_WARC_FILENAMES_FILE = "warc_filenames.json"
+# Number of bytes used during the merge per byte of record buffered, for the copies made to sort and group the records
+MERGE_MEMORY_FACTOR = 8
+
+
+def compute_url_fingerprints(urls):
+    """64-bit fingerprints of the urls (the first 8 bytes of their blake2b hash)"""
+    digests = b"".join(hashlib.blake2b(url.encode("utf-8"), digest_size=8).digest() for url in urls)
+    return np.frombuffer(digests, dtype="<u8").copy()
+
+
+def write_url_fingerprints_run(fingerprints, warc_ids, warc_filenames, path_save_dir_run):
+    """
+    Writes the run of a shard: the records of its documents sorted by fingerprint, the document `idx` of the shard
+    having the url fingerprint `fingerprints[idx]` and the WARC file `warc_filenames[warc_ids[idx]]`.
+    """
+    records = np.empty(len(fingerprints), dtype=RUN_DTYPE)
+    records["fingerprint"] = fingerprints
+    records["warc_id"] = warc_ids
+    records = records[np.argsort(records["fingerprint"], kind="stable")]
+    os.makedirs(path_save_dir_run, exist_ok=True)
+    np.save(os.path.join(path_save_dir_run, RUN_FILE), records)
+    with open(os.path.join(path_save_dir_run, RUN_WARC_FILENAMES_FILE), "w") as f:
+        json.dump(list(warc_filenames), f)
+
+
+def write_url_fingerprints_run_from_urls(urls, doc_warc_filenames, path_save_dir_run):
+    """Same as `write_url_fingerprints_run`, from the url and the WARC filename of each document of the shard"""
+    warc_filename_to_id = {}
+    warc_ids = np.fromiter(
+        (warc_filename_to_id.setdefault(name, len(warc_filename_to_id)) for name in doc_warc_filenames),
+        dtype="<u4",
+        count=len(doc_warc_filenames),
+    )
+    write_url_fingerprints_run(compute_url_fingerprints(urls), warc_ids, list(warc_filename_to_id), path_save_dir_run)
+
+
+def load_dup_urls(path_save_dir_dup_urls, idx_shard):
+    """
+    The duplicated urls of the shard `idx_shard` saved by `merge_url_fingerprints_runs`, as a dict from the fingerprint
+    of the url to the WARC filename of the documents to keep
+    """
+    with open(os.path.join(path_save_dir_dup_urls, DUP_URLS_WARC_FILENAMES_FILE)) as f:
+        warc_filenames = json.load(f)
+    dup_urls = np.load(os.path.join(path_save_dir_dup_urls, f"{idx_shard}.npy"))
+    return {
+        fingerprint: warc_filenames[warc_rank]
+        for fingerprint, warc_rank in zip(dup_urls["fingerprint"].tolist(), dup_urls["warc_rank"].tolist())
+    }
+
+
+def is_url_dup_to_remove(url, warc_filename, dup_urls):
+    """
+    Whether the document of `url` and `warc_filename` is to remove, `dup_urls` being the duplicated urls of its shard
+    given by `load_dup_urls`. The document is matched on its url and WARC filename, not on its position in the shard.
+    """
+    return dup_urls.get(int(compute_url_fingerprints([url])[0]), warc_filename) != warc_filename
+
+
+def merge_url_fingerprints_runs(paths_runs, path_save_dir_dup_urls, max_memory_bytes=2 * 2**30):
+    """
+    Merges the runs of the shards to find the urls present in several documents. Like the previous `dup_urls.json`,
+    only the documents of a duplicated url coming from its most recent WARC file (the last one in alphabetical order)
+    are kept. For the run `idx_run` of `paths_runs`, the duplicated urls of its documents are saved in
+    `{path_save_dir_dup_urls}/{idx_run}.npy`, sorted by fingerprint, with the rank of the WARC filename to keep among
+    the ones of `{path_save_dir_dup_urls}/warc_filenames.json`. They are read with `load_dup_urls`, and the documents
+    are matched on their url and WARC filename with `is_url_dup_to_remove`, whatever their order in the shard.
+
+    The runs are merged by blocks, so that the records buffered in memory don't exceed `max_memory_bytes`: at each
+    step, the records with a fingerprint lower than the smallest of the last fingerprints of the blocks are complete,
+    and are grouped by fingerprint. The memory used is bounded by `max_memory_bytes` and doesn't depend on the number
+    of urls (except for the WARC filenames, and the duplicated urls of one shard, deduplicated at the end). With 64-bit
+    fingerprints, the probability that two different urls of 400M documents collide is below 1%.
+    """
+    logger.info(f"Starting merging the {len(paths_runs)} runs of url fingerprints")
+    os.makedirs(path_save_dir_dup_urls, exist_ok=True)
+
+    # Rank of each WARC filename among all of them, in alphabetical order
+    run_warc_filenames = []
+    for path_run in paths_runs:
+        with open(os.path.join(path_run, RUN_WARC_FILENAMES_FILE)) as f:
+            run_warc_filenames.append(json.load(f))
+    warc_filenames = sorted({name for names in run_warc_filenames for name in names})
+    with open(os.path.join(path_save_dir_dup_urls, DUP_URLS_WARC_FILENAMES_FILE), "w") as f:
+        json.dump(warc_filenames, f)
+    warc_filename_to_rank = {warc_filename: rank for rank, warc_filename in enumerate(warc_filenames)}
+    run_ranks = [
+        np.array([warc_filename_to_rank[name] for name in names], dtype="<u4") for names in run_warc_filenames
+    ]
+    del run_warc_filenames, warc_filenames, warc_filename_to_rank
+
+    runs = [np.load(os.path.join(path_run, RUN_FILE), mmap_mode="r") for path_run in paths_runs]
+    block_size = max(1, max_memory_bytes // (MERGE_MEMORY_FACTOR * RUN_DTYPE.itemsize * max(1, len(runs))))
+    read_positions = [0] * len(runs)
+    buffers = [np.empty(0, dtype=RUN_DTYPE) for _ in runs]
+    paths_dup_urls = [os.path.join(path_save_dir_dup_urls, f"{idx_run}.bin") for idx_run in range(len(runs))]
+    for path_dup_urls in paths_dup_urls:
+        open(path_dup_urls, "wb").close()
+    stats = {"num_docs": sum(len(run) for run in runs), "num_dup_urls": 0, "num_docs_dup_urls": 0, "num_removed": 0}
+
+    def read_block(idx_run):
+        start = read_positions[idx_run]
+        block = np.array(runs[idx_run][start : start + block_size])
+        read_positions[idx_run] += len(block)
+        block["warc_id"] = run_ranks[idx_run][block["warc_id"]]
+        buffers[idx_run] = np.concatenate([buffers[idx_run], block]) if len(buffers[idx_run]) else block
+
+    def process(complete_blocks):
+        idx_runs = np.concatenate(
+            [np.full(len(block), idx_run, dtype=np.int32) for idx_run, block in complete_blocks]
+        )
+        records = np.concatenate([block for _, block in complete_blocks])
+        order = np.argsort(records["fingerprint"], kind="stable")
+        records, idx_runs = records[order], idx_runs[order]
+        fingerprints = records["fingerprint"]
+        starts = np.flatnonzero(np.concatenate([[True], fingerprints[1:] != fingerprints[:-1]]))
+        counts = np.diff(np.append(starts, len(records)))
+        max_ranks = np.maximum.reduceat(records["warc_id"], starts)
+        is_dup = counts > 1
+        stats["num_dup_urls"] += int(is_dup.sum())
+        stats["num_docs_dup_urls"] += int(counts[is_dup].sum())
+        is_dup, kept_ranks = np.repeat(is_dup, counts), np.repeat(max_ranks, counts)
+        stats["num_removed"] += int((is_dup & (records["warc_id"] < kept_ranks)).sum())
+        if not is_dup.any():
+            return
+        # A duplicated url is saved in the runs of its documents, once per document until the end of the merge
+        dup_urls = np.empty(int(is_dup.sum()), dtype=DUP_URL_DTYPE)
+        dup_urls["fingerprint"] = fingerprints[is_dup]
+        dup_urls["warc_rank"] = kept_ranks[is_dup]
+        dup_idx_runs = idx_runs[is_dup]
+        order = np.argsort(dup_idx_runs, kind="stable")
+        dup_urls, dup_idx_runs = dup_urls[order], dup_idx_runs[order]
+        bounds = np.searchsorted(dup_idx_runs, np.arange(len(runs) + 1))
+        for idx_run in np.flatnonzero(np.diff(bounds)):
+            with open(paths_dup_urls[idx_run], "ab") as f:
+                dup_urls[bounds[idx_run] : bounds[idx_run + 1]].tofile(f)
+
+    for idx_run in range(len(runs)):
+        read_block(idx_run)
+    while True:
+        unread_runs = [idx_run for idx_run in range(len(runs)) if read_positions[idx_run] < len(runs[idx_run])]
+        # The records under the bound are complete: all the records left in the runs are above it
+        bound = min(buffers[idx_run]["fingerprint"][-1] for idx_run in unread_runs) if unread_runs else None
+        complete_blocks = []
+        for idx_run, buffer in enumerate(buffers):
+            end = len(buffer) if bound is None else int(np.searchsorted(buffer["fingerprint"], bound, side="left"))
+            if end > 0:
+                complete_blocks.append((idx_run, buffer[:end]))
+                buffers[idx_run] = buffer[end:]
+        if complete_blocks:
+            process(complete_blocks)
+        elif bound is None:
+            break
+        else:
+            # All the buffered records have the fingerprint of the bound, the runs ending with it are read further
+            for idx_run in unread_runs:
+                if buffers[idx_run]["fingerprint"][-1] == bound:
+                    read_block(idx_run)
+            continue
+        for idx_run in unread_runs:
+            if len(buffers[idx_run]) == 0:
+                read_block(idx_run)
+
+    # The blocks are processed by increasing fingerprints, so the duplicated urls of a run are already sorted
+    for idx_run, path_dup_urls in enumerate(paths_dup_urls):
+        dup_urls = np.fromfile(path_dup_urls, dtype=DUP_URL_DTYPE)
+        if len(dup_urls):
+            fingerprints = dup_urls["fingerprint"]
+            dup_urls = dup_urls[np.concatenate([[True], fingerprints[1:] != fingerprints[:-1]])]
+        np.save(os.path.join(path_save_dir_dup_urls, f"{idx_run}.npy"), dup_urls)
+        os.remove(path_dup_urls)
+    logger.info(
+        f"Finished merging the runs of url fingerprints: {stats['num_dup_urls']} urls appear at least twice, for a"
+        f" total of {stats['num_docs_dup_urls']} documents, {stats['num_removed']} documents to remove"
+    )
+    return stats
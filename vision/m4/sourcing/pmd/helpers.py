@@ -1,22 +1,21 @@
 import json
-import socket
+import queue
 import ssl
-import urllib.error
-import urllib.parse
-import urllib.request
-import urllib.robotparser
+import threading
+from concurrent.futures import Future
 from dataclasses import fields
 from datetime import datetime
-from functools import lru_cache
 from multiprocessing.pool import ThreadPool
 from pathlib import Path
-from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, Union
 
 import PIL.Image
 from datasets import Dataset
 from datasets.utils.file_utils import DownloadConfig
 
+from m4.sourcing.pmd import get_m4_cache_dir
 from m4.sourcing.pmd.cache_path import cached_path
+from m4.sourcing.pmd.politeness import PolitenessService
 
 
 def json_serializer(o):
@@ -76,41 +75,20 @@ def compute_cache_path(cache_dir, hash):
     return str(cached_path.absolute())
 
 
-# LRU cache that caches exception as well ... let's see if this works.
-def lru_cache_with_exception(maxsize=128, typed=False):
-    _lru_cache = lru_cache(maxsize, typed)
-
-    def wrap_exception(unwrapped_function):
-        def func(*args, **kwargs):
-            try:
-                return unwrapped_function(*args, **kwargs), None
-            except BaseException as err:
-                return None, err
-
-        return func
-
-    def unwrap_exception(wrapped_function):
-        def func(*args, **kwargs):
-            result, exception = wrapped_function(*args, **kwargs)
-            if exception is not None:
-                raise exception
-            else:
-                return result
-
-        return func
-
-    def decorating_function(user_function):
-        return unwrap_exception(_lru_cache(wrap_exception(user_function)))
-
-    return decorating_function
-
-
 # https://stackoverflow.com/a/28052583
 ssl._create_default_https_context = ssl._create_unverified_context
 
 
 class M4HTTPClient:
-    def __init__(self, cache_dir: Path, retries: int, offline_mode: bool, user_agent: Optional[str] = None):
+    def __init__(
+        self,
+        cache_dir: Path,
+        retries: int,
+        offline_mode: bool,
+        user_agent: Optional[str] = None,
+        politeness_cache_dir: Optional[Path] = None,
+        min_delay_per_host: float = 0.0,
+    ):
         super(M4HTTPClient, self).__init__()
         # Hack found: https://github.com/igorbrigadir/DownloadConceptualCaptions/blob/efb16f028936e6c628b6ee435765d6e1771b0f2d/download_data.py#L13
         assert user_agent in ["Googlebot-Image/1.0", "Googlebot-Video/1.0", None]
@@ -124,40 +102,16 @@ class M4HTTPClient:
             use_etag=False,
         )
         self.offline_mode = offline_mode
+        # Shared by all the datasets, processes and runs using the same cache directory, so robots.txt of a host is
+        # fetched once
+        self.politeness = PolitenessService(
+            cache_dir=politeness_cache_dir if politeness_cache_dir is not None else get_m4_cache_dir() / "politeness",
+            user_agent=self.user_agent,
+            min_delay_per_host=min_delay_per_host,
+        )
 
     def check_robots_txt(self, url):
-        parsed_url = urllib.parse.urlparse(url)
-        robots_txt_url = f"{parsed_url.scheme}://{parsed_url.netloc}/robots.txt"
-        robots_parser = self.__get_robots_txt__(robots_txt_url)
-        return robots_parser.can_fetch(self.user_agent, url)
-
-    # TODO @thomasw21: Maybe lru if we're scared of it being too big at some point.
-    @lru_cache_with_exception(maxsize=None)
-    def __get_robots_txt__(self, robots_txt_url):
-        robots_parser = urllib.robotparser.RobotFileParser(robots_txt_url)
-
-        # equivalent to `robots_parser.read()` but with a timeout
-        try:
-            f = urllib.request.urlopen(robots_parser.url, timeout=10)
-        except urllib.error.HTTPError as err:
-            if err.code in (401, 403):
-                # robots.txt could not be queried to check
-                robots_parser.allow_all = True
-            elif err.code >= 400 and err.code < 500:
-                robots_parser.allow_all = True
-        except urllib.error.URLError as err:
-            if isinstance(err.reason, socket.timeout):
-                # We couldn't find robots.txt, we assume we can query the media.
-                robots_parser.allow_all = True
-            else:
-                # unknown exception
-                # print(robots_txt_url, err)
-                raise err
-        else:
-            raw = f.read()
-            robots_parser.parse(raw.decode("utf-8").splitlines())
-
-        return robots_parser
+        return self.politeness.can_fetch(url)
 
     def cache_path(self, url: str) -> Union[str, BaseException]:
         try:
@@ -186,6 +140,9 @@ class M4HTTPClient:
             if not self.check_robots_txt(url):
                 return RobotsDisallow("Unable to query the url due to `robots.txt` restrictions")
 
+            # Wait for the next slot of the host, according to its crawl delay
+            self.politeness.wait_for_slot(url)
+
             # Return file path or exception
             return cached_path(
                 url, compute_cache_path=compute_cache_path, download_config=self.datasets_download_config
@@ -228,12 +185,16 @@ class PickableMediaDownloadGenerator:
         dset: Dataset,
         batch_size: int,
         num_threads_per_proc: int,
+        politeness: Optional[PolitenessService] = None,
     ):
         self.download_media_url = download_media_url
         self.get_media_urls = get_media_urls
         self.dset = dset
         self.batch_size = batch_size
         self.num_threads_per_proc = num_threads_per_proc
+        # Typically `M4HTTPClient.politeness`. robots.txt are then fetched in the background, and a url is given to the
+        # threads once robots.txt of its host is known, so that the threads don't wait for slow hosts
+        self.politeness = politeness
 
         # This is used to trick the pickle algorithm as we load thread_pool and _media_iterator AFTER fingerprinting
         self._has_started = False
@@ -242,10 +203,45 @@ class PickableMediaDownloadGenerator:
 
     def load_media_iterator(self):
         self._thread_pool = ThreadPool(self.num_threads_per_proc)
-        self._media_iterator = self._thread_pool.imap(
-            self.download_media_url,
-            iterable=batch_iter(dset=self.dset, transform=self.get_media_urls, batch_size=self.batch_size),
-        )
+        media_urls = batch_iter(dset=self.dset, transform=self.get_media_urls, batch_size=self.batch_size)
+        if self.politeness is None:
+            self._media_iterator = self._thread_pool.imap(self.download_media_url, iterable=media_urls)
+        else:
+            self._media_iterator = self._iter_medias_when_robots_txt_ready(media_urls)
+
+    def _download_when_robots_txt_ready(self, media_url: str) -> Future:
+        result = Future()
+
+        def download():
+            try:
+                result.set_result(self.download_media_url(media_url))
+            except BaseException as e:
+                result.set_exception(e)
+
+        def submit(_=None):
+            self._thread_pool.apply_async(download)
+
+        if media_url:
+            self.politeness.add_robots_txt_callback(media_url, submit)
+        else:
+            submit()
+        return result
+
+    def _iter_medias_when_robots_txt_ready(self, media_urls: Iterator[str]):
+        """Same results and order as `imap`, which also hands all the urls to the pool as soon as possible"""
+        pending_results = queue.Queue()
+
+        def submit_all():
+            for media_url in media_urls:
+                pending_results.put(self._download_when_robots_txt_ready(media_url))
+            pending_results.put(None)
+
+        threading.Thread(target=submit_all, daemon=True).start()
+        while True:
+            result = pending_results.get()
+            if result is None:
+                break
+            yield result.result()
 
     def __iter__(self):
         return self
@@ -187,6 +187,7 @@ class DownloadImageLoaderBuilder(ABC):
             dset=shard,
             batch_size=1000,
             num_threads_per_proc=self.num_threads_per_proc,
+            politeness=self.http_client.politeness,
         ) as image_iterator:
             # fill new dataset with that image_path of exception
             shard = shard.map(
@@ -0,0 +1,261 @@
+"""
+robots.txt and politeness service shared by the workers downloading medias.
+
+The robots.txt of the hosts are fetched concurrently in a pool of threads, as soon as the urls are known, and cached
+on disk with a TTL so that the other workers (threads, processes, or later runs) reuse them instead of fetching them
+again. The requests to a host are spaced by its `Crawl-delay` (or `min_delay_per_host`), through a file per host
+locked with `fcntl`, so the spacing holds across the processes sharing the cache directory.
+"""
+import fcntl
+import hashlib
+import json
+import os
+import socket
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import urllib.robotparser
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Optional, Tuple, Union
+
+
+# Outcomes of a robots.txt fetch, saved in the cache
+ROBOTS_TXT_PARSED = "parsed"
+ROBOTS_TXT_ALLOW_ALL = "allow_all"
+ROBOTS_TXT_DISALLOW_ALL = "disallow_all"
+ROBOTS_TXT_ERROR = "error"
+
+
+class RobotsTxtError(Exception):
+    """Exception class when robots.txt could not be fetched for an unknown reason"""
+
+    pass
+
+
+def get_robots_txt_url(url: str) -> str:
+    parsed_url = urllib.parse.urlparse(url)
+    return f"{parsed_url.scheme}://{parsed_url.netloc}/robots.txt"
+
+
+def fetch_robots_txt(robots_txt_url: str, timeout: float) -> Dict:
+    """
+    Fetches robots.txt, and returns the entry to cache: the outcome (`status`), and the lines of robots.txt or the
+    error. Same rules as the previous per-process `M4HTTPClient.__get_robots_txt__`: a robots.txt in 4xx or timing out
+    while connecting allows everything, a robots.txt in 5xx disallows everything.
+    """
+    try:
+        f = urllib.request.urlopen(robots_txt_url, timeout=timeout)
+        raw = f.read()
+    except urllib.error.HTTPError as err:
+        if 400 <= err.code < 500:
+            # robots.txt could not be queried to check
+            return {"status": ROBOTS_TXT_ALLOW_ALL}
+        return {"status": ROBOTS_TXT_DISALLOW_ALL}
+    except urllib.error.URLError as err:
+        if isinstance(err.reason, socket.timeout):
+            # We couldn't find robots.txt, we assume we can query the media.
+            return {"status": ROBOTS_TXT_ALLOW_ALL}
+        return {"status": ROBOTS_TXT_ERROR, "error": repr(err)}
+    except Exception as err:
+        # Including a timeout while waiting for the response
+        return {"status": ROBOTS_TXT_ERROR, "error": repr(err)}
+
+    try:
+        return {"status": ROBOTS_TXT_PARSED, "lines": raw.decode("utf-8").splitlines()}
+    except UnicodeDecodeError as err:
+        return {"status": ROBOTS_TXT_ERROR, "error": repr(err)}
+
+
+def make_robots_parser(robots_txt_url: str, entry: Dict) -> Union[urllib.robotparser.RobotFileParser, RobotsTxtError]:
+    if entry["status"] == ROBOTS_TXT_ERROR:
+        return RobotsTxtError(f"Unable to fetch {robots_txt_url}: {entry['error']}")
+    robots_parser = urllib.robotparser.RobotFileParser(robots_txt_url)
+    if entry["status"] == ROBOTS_TXT_PARSED:
+        robots_parser.parse(entry["lines"])
+    elif entry["status"] == ROBOTS_TXT_ALLOW_ALL:
+        robots_parser.allow_all = True
+    else:
+        robots_parser.disallow_all = True
+    return robots_parser
+
+
+class PolitenessService:
+    """
+    Non-blocking robots.txt lookups and per-host rate limiting, shared through `cache_dir`.
+
+    - `prefetch(urls)` starts fetching (or loading from the disk cache) the robots.txt of the hosts of `urls` in the
+    background, and returns immediately.
+    - `lookup(url)` returns whether `url` can be fetched, or None if robots.txt of its host is not known yet, and
+    `add_robots_txt_callback(url, callback)` calls `callback` once it is known.
+    - `can_fetch(url)` waits for robots.txt of the host of `url` only, and returns whether `url` can be fetched.
+    - `wait_for_slot(url)` waits until a request to the host of `url` respects its delay between requests.
+
+    robots.txt are cached for `ttl` seconds, or `error_ttl` seconds when they could not be fetched.
+    """
+
+    def __init__(
+        self,
+        cache_dir: Path,
+        user_agent: Optional[str] = None,
+        timeout: float = 10,
+        ttl: float = 24 * 3600,
+        error_ttl: float = 3600,
+        num_threads: int = 32,
+        min_delay_per_host: float = 0.0,
+        max_crawl_delay: float = 10.0,
+    ):
+        self.cache_dir = Path(cache_dir)
+        self.user_agent = user_agent
+        self.timeout = timeout
+        self.ttl = ttl
+        self.error_ttl = error_ttl
+        self.num_threads = num_threads
+        self.min_delay_per_host = min_delay_per_host
+        self.max_crawl_delay = max_crawl_delay
+
+        # Created on first use, so that the service can be pickled before
+        self._lock = threading.Lock()
+        self._executor = None
+        # robots.txt url -> future of `(expiration_time, robots_parser_or_exception)`
+        self._robots_txt: Dict[str, Future] = {}
+
+    def __reduce__(self):
+        return (
+            self.__class__,
+            (
+                self.cache_dir,
+                self.user_agent,
+                self.timeout,
+                self.ttl,
+                self.error_ttl,
+                self.num_threads,
+                self.min_delay_per_host,
+                self.max_crawl_delay,
+            ),
+        )
+
+    # ---- robots.txt ----
+
+    def _get_cache_file(self, robots_txt_url: str) -> Path:
+        url_hash = hashlib.sha256(robots_txt_url.encode("utf-8")).hexdigest()
+        return self.cache_dir / "robots_txt" / url_hash[:2] / f"{url_hash}.json"
+
+    def _read_cache(self, robots_txt_url: str) -> Optional[Dict]:
+        try:
+            with open(self._get_cache_file(robots_txt_url)) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if entry.get("url") != robots_txt_url or entry["expiration_time"] <= time.time():
+            return None
+        return entry
+
+    def _write_cache(self, robots_txt_url: str, entry: Dict):
+        cache_file = self._get_cache_file(robots_txt_url)
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        # Written in a temporary file then renamed, so that the other workers never read a partial entry
+        with tempfile.NamedTemporaryFile("w", dir=cache_file.parent, suffix=".tmp", delete=False) as f:
+            json.dump(entry, f)
+        os.replace(f.name, cache_file)
+
+    def _load_robots_txt(
+        self, robots_txt_url: str
+    ) -> Tuple[float, Union[urllib.robotparser.RobotFileParser, BaseException]]:
+        entry = self._read_cache(robots_txt_url)
+        if entry is None:
+            entry = fetch_robots_txt(robots_txt_url, timeout=self.timeout)
+            ttl = self.error_ttl if entry["status"] == ROBOTS_TXT_ERROR else self.ttl
+            entry.update(url=robots_txt_url, expiration_time=time.time() + ttl)
+            try:
+                self._write_cache(robots_txt_url, entry)
+            except OSError:
+                # The entry is still cached in memory
+                pass
+        return entry["expiration_time"], make_robots_parser(robots_txt_url, entry)
+
+    def _get_future(self, robots_txt_url: str) -> Future:
+        with self._lock:
+            future = self._robots_txt.get(robots_txt_url)
+            if future is not None and future.done() and future.result()[0] <= time.time():
+                # Expired
+                future = None
+            if future is None:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.num_threads)
+                future = self._executor.submit(self._load_robots_txt, robots_txt_url)
+                self._robots_txt[robots_txt_url] = future
+            return future
+
+    def prefetch(self, urls: Iterable[str]):
+        for robots_txt_url in dict.fromkeys(get_robots_txt_url(url) for url in urls if url):
+            self._get_future(robots_txt_url)
+
+    def add_robots_txt_callback(self, url: str, callback: Callable[[Future], None]):
+        """Calls `callback` once robots.txt of the host of `url` is known, right away if it is already known"""
+        self._get_future(get_robots_txt_url(url)).add_done_callback(callback)
+
+    def get_robots_parser(self, url: str, timeout: Optional[float] = None) -> urllib.robotparser.RobotFileParser:
+        """Waits at most `timeout` seconds (forever if None) for robots.txt of the host of `url`"""
+        _, robots_parser = self._get_future(get_robots_txt_url(url)).result(timeout=timeout)
+        if isinstance(robots_parser, BaseException):
+            raise robots_parser
+        return robots_parser
+
+    def can_fetch(self, url: str) -> bool:
+        return self.get_robots_parser(url).can_fetch(self.user_agent, url)
+
+    def lookup(self, url: str) -> Optional[bool]:
+        try:
+            robots_parser = self.get_robots_parser(url, timeout=0)
+        except FutureTimeoutError:
+            return None
+        return robots_parser.can_fetch(self.user_agent, url)
+
+    # ---- Rate limiting ----
+
+    def get_delay(self, url: str) -> float:
+        """Delay between two requests to the host of `url`: its `Crawl-delay`, capped, or `min_delay_per_host`"""
+        try:
+            crawl_delay = self.get_robots_parser(url).crawl_delay(self.user_agent)
+        except RobotsTxtError:
+            crawl_delay = None
+        return max(self.min_delay_per_host, min(float(crawl_delay or 0), self.max_crawl_delay))
+
+    def wait_for_slot(self, url: str) -> float:
+        """Waits for the next slot of the host of `url` and reserves it. Returns the time waited"""
+        delay = self.get_delay(url)
+        if delay <= 0:
+            return 0.0
+
+        netloc = urllib.parse.urlparse(url).netloc
+        host_file = self.cache_dir / "hosts" / f"{hashlib.sha256(netloc.encode('utf-8')).hexdigest()}.next"
+        host_file.parent.mkdir(parents=True, exist_ok=True)
+        with open(host_file, "a+") as f:
+            # Exclusive between the threads and processes, as each call opens its own file description
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                content = f.read().strip()
+                now = time.time()
+                slot = max(now, float(content)) if content else now
+                f.seek(0)
+                f.truncate()
+                f.write(repr(slot + delay))
+                f.flush()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+        waiting_time = slot - now
+        if waiting_time > 0:
+            time.sleep(waiting_time)
+        return waiting_time
+
+    def close(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
@@ -0,0 +1,283 @@
+"""
+Checks and benchmark of `PolitenessService` (the robots.txt and politeness layer of `M4HTTPClient`) against local HTTP
+servers, one per simulated host:
+- `allow`: robots.txt disallows nothing, `missing`: robots.txt is a 404, `disallowing`: robots.txt disallows
+  `/private/`, `crawl_delay`: robots.txt also sets a `Crawl-delay`,
+- `slow`: robots.txt answers after the timeout, `failing`: robots.txt is a 500, `refused`: nothing listens on the port.
+
+The script checks that:
+- the decisions are the ones of the previous per-process robots.txt check of `M4HTTPClient`,
+- `lookup` doesn't wait for the slow host, and with `PickableMediaDownloadGenerator`, the urls of the other hosts are
+  decided before its timeout,
+- another worker (a process sharing the cache directory) doesn't fetch robots.txt again, until the TTL expires,
+- the crawl delay is read from robots.txt, and two processes requesting a host space their requests by the delay.
+It reports the time to decide all the urls, and the number of robots.txt requests, against the previous check.
+
+Usage:
+    python m4/sourcing/pmd/scripts/benchmark_politeness.py --num_urls_per_host 200
+"""
+import argparse
+import multiprocessing
+import socket
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import urllib.robotparser
+from collections import Counter, defaultdict
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from datasets import Dataset
+
+from m4.sourcing.pmd.helpers import PickableMediaDownloadGenerator
+from m4.sourcing.pmd.politeness import PolitenessService, RobotsTxtError
+
+
+USER_AGENT = "Googlebot-Image/1.0"
+ROBOTS_TXT = {
+    "allow": "User-agent: *\nDisallow:\n",
+    "disallowing": "User-agent: *\nDisallow: /private/\n",
+    "crawl_delay": "User-agent: *\nCrawl-delay: 2\nDisallow: /private/\n",
+}
+TIMEOUT = 1
+
+
+def make_handler(kind, latency, num_robots_txt_requests, request_times):
+    lock = threading.Lock()
+
+    class HostHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True
+
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            if self.path == "/robots.txt":
+                with lock:
+                    num_robots_txt_requests[kind] += 1
+                if kind == "slow":
+                    time.sleep(TIMEOUT + 1)
+                    self._send(200, ROBOTS_TXT["disallowing"].encode())
+                elif kind == "failing":
+                    self._send(500, b"Internal error")
+                elif kind == "missing":
+                    self._send(404, b"Not found")
+                else:
+                    time.sleep(latency)
+                    self._send(200, ROBOTS_TXT[kind].encode())
+                return
+            with lock:
+                request_times[kind].append(time.time())
+            self._send(200, b"media")
+
+        def _send(self, status, body):
+            try:
+                self.send_response(status)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+
+    return HostHandler
+
+
+def start_hosts(latency):
+    num_robots_txt_requests = Counter()
+    request_times = defaultdict(list)
+    netlocs = {}
+    for kind in ["allow", "missing", "disallowing", "crawl_delay", "slow", "failing"]:
+        server = ThreadingHTTPServer(
+            ("127.0.0.1", 0), make_handler(kind, latency, num_robots_txt_requests, request_times)
+        )
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        netlocs[kind] = f"127.0.0.1:{server.server_address[1]}"
+    # A port where nothing listens
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        netlocs["refused"] = f"127.0.0.1:{sock.getsockname()[1]}"
+    return netlocs, num_robots_txt_requests, request_times
+
+
+class OriginalRobotsTxtChecker:
+    """The previous check of `M4HTTPClient`: robots.txt fetched on first touch of a host, cached per process"""
+
+    def can_fetch(self, url):
+        parsed_url = urllib.parse.urlparse(url)
+        robots_parser = self.get_robots_txt(f"{parsed_url.scheme}://{parsed_url.netloc}/robots.txt")
+        if isinstance(robots_parser, BaseException):
+            raise robots_parser
+        return robots_parser.can_fetch(USER_AGENT, url)
+
+    # The exceptions are cached too
+    @lru_cache(maxsize=None)
+    def get_robots_txt(self, robots_txt_url):
+        robots_parser = urllib.robotparser.RobotFileParser(robots_txt_url)
+        try:
+            f = urllib.request.urlopen(robots_parser.url, timeout=TIMEOUT)
+        except urllib.error.HTTPError as err:
+            if err.code >= 400 and err.code < 500:
+                robots_parser.allow_all = True
+        except urllib.error.URLError as err:
+            if isinstance(err.reason, socket.timeout):
+                robots_parser.allow_all = True
+            else:
+                return err
+        except TimeoutError as err:
+            return err
+        else:
+            robots_parser.parse(f.read().decode("utf-8").splitlines())
+        return robots_parser
+
+
+def decide(checker, url):
+    try:
+        return "allowed" if checker.can_fetch(url) else "disallowed"
+    except (RobotsTxtError, urllib.error.URLError, TimeoutError):
+        return "error"
+
+
+def decide_all(checker, urls, num_threads, politeness=None):
+    """
+    Decides the urls through `PickableMediaDownloadGenerator`, with `politeness` for the service. Returns the decisions
+    in the order of the urls, the time each url was decided at, and the total time.
+    """
+    start = time.perf_counter()
+    decision_times = {}
+
+    def decide_and_time(url):
+        decision = decide(checker, url)
+        decision_times[url] = time.perf_counter() - start
+        return decision
+
+    dset = Dataset.from_dict({"image_url": urls})
+    with PickableMediaDownloadGenerator(
+        download_media_url=decide_and_time,
+        get_media_urls=lambda batch: batch["image_url"],
+        dset=dset,
+        batch_size=100,
+        num_threads_per_proc=num_threads,
+        politeness=politeness,
+    ) as media_iterator:
+        decisions = [next(media_iterator) for _ in range(len(dset))]
+    return dict(zip(urls, decisions)), decision_times, time.perf_counter() - start
+
+
+def other_worker(cache_dir, urls, queue):
+    politeness = PolitenessService(cache_dir=cache_dir, user_agent=USER_AGENT, timeout=TIMEOUT)
+    queue.put([decide(politeness, url) for url in urls])
+
+
+def crawl(cache_dir, url, num_requests, min_delay_per_host):
+    politeness = PolitenessService(
+        cache_dir=cache_dir, user_agent=USER_AGENT, timeout=TIMEOUT, min_delay_per_host=min_delay_per_host
+    )
+    for _ in range(num_requests):
+        politeness.wait_for_slot(url)
+        urllib.request.urlopen(url, timeout=TIMEOUT).read()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num_urls_per_host", type=int, default=200)
+    parser.add_argument("--num_threads", type=int, default=16)
+    parser.add_argument("--latency_ms", type=float, default=50)
+    args = parser.parse_args()
+
+    netlocs, num_robots_txt_requests, request_times = start_hosts(args.latency_ms / 1000)
+    urls = [
+        f"http://{netloc}/{'private' if idx % 2 else 'public'}/{idx}.jpg"
+        for idx in range(args.num_urls_per_host)
+        for netloc in netlocs.values()
+    ]
+    kind_of_netloc = {netloc: kind for kind, netloc in netlocs.items()}
+
+    def kind_of(url):
+        return kind_of_netloc[urllib.parse.urlparse(url).netloc]
+
+    # Previous check, robots.txt being fetched by the threads of the downloads
+    original_decisions, original_times, original_time = decide_all(OriginalRobotsTxtChecker(), urls, args.num_threads)
+    original_num_requests = sum(num_robots_txt_requests.values())
+    num_robots_txt_requests.clear()
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        politeness = PolitenessService(cache_dir=cache_dir, user_agent=USER_AGENT, timeout=TIMEOUT)
+
+        # Non-blocking lookups
+        politeness.prefetch(urls)
+        start = time.perf_counter()
+        assert politeness.lookup(f"http://{netlocs['slow']}/public/0.jpg") is None
+        assert time.perf_counter() - start < 0.1, "`lookup` waited for robots.txt"
+
+        decisions, decision_times, elapsed = decide_all(politeness, urls, args.num_threads, politeness=politeness)
+        num_requests = sum(num_robots_txt_requests.values())
+        assert decisions == original_decisions, [
+            (url, decision, original_decisions[url])
+            for url, decision in decisions.items()
+            if decision != original_decisions[url]
+        ][:5]
+        latest_fast_decision = max(time for url, time in decision_times.items() if kind_of(url) != "slow")
+        assert latest_fast_decision < TIMEOUT, f"The fast hosts waited for the slow one ({latest_fast_decision:.2f}s)"
+        assert num_requests == len(netlocs) - 1, dict(num_robots_txt_requests)
+
+        # Another worker reuses the cache on disk
+        context = multiprocessing.get_context("spawn")
+        queue = context.Queue()
+        process = context.Process(target=other_worker, args=(cache_dir, urls, queue))
+        process.start()
+        other_decisions = queue.get()
+        process.join()
+        assert other_decisions == [original_decisions[url] for url in urls]
+        assert sum(num_robots_txt_requests.values()) == num_requests, "robots.txt fetched again by another worker"
+
+        # The TTL expires, in memory and on disk
+        with tempfile.TemporaryDirectory() as expiring_cache_dir:
+            expiring_politeness = PolitenessService(
+                cache_dir=expiring_cache_dir, user_agent=USER_AGENT, ttl=0.5, timeout=TIMEOUT
+            )
+            allow_url = f"http://{netlocs['allow']}/public/0.jpg"
+            num_allow_requests = num_robots_txt_requests["allow"]
+            expiring_politeness.can_fetch(allow_url)
+            expiring_politeness.can_fetch(allow_url)
+            time.sleep(0.6)
+            expiring_politeness.can_fetch(allow_url)
+            expiring_politeness.close()
+        assert num_robots_txt_requests["allow"] == num_allow_requests + 2, "robots.txt not fetched after the TTL"
+
+        # Rate limiting across processes, with the crawl delay (only integers are understood by `urllib.robotparser`)
+        # or `min_delay_per_host`
+        assert politeness.get_delay(f"http://{netlocs['crawl_delay']}/public/0.jpg") == 2
+        min_delay_per_host = 0.2
+        allow_url = f"http://{netlocs['allow']}/public/0.jpg"
+        processes = [
+            context.Process(target=crawl, args=(cache_dir, allow_url, 5, min_delay_per_host)) for _ in range(2)
+        ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        times = sorted(request_times["allow"])
+        min_gap = min(end - start for start, end in zip(times, times[1:]))
+        assert len(times) == 10 and min_gap >= min_delay_per_host * 0.9, (len(times), min_gap)
+        politeness.close()
+
+    original_latest_fast_decision = max(time for url, time in original_times.items() if kind_of(url) != "slow")
+    print(
+        f"previous check:     {original_time:7.2f}s to decide {len(urls)} urls, {original_num_requests} robots.txt"
+        f" requests, latest decision of a fast host after {original_latest_fast_decision:.2f}s"
+    )
+    print(
+        f"PolitenessService:  {elapsed:7.2f}s to decide {len(urls)} urls, {num_requests} robots.txt requests, latest"
+        f" decision of a fast host after {latest_fast_decision:.2f}s"
+    )
+    print(f"Decisions: {dict(Counter(decisions.values()))}, requests spaced by at least {min_gap:.2f}s")
+    print("All checks passed.")
+
+
+if __name__ == "__main__":
+    main()
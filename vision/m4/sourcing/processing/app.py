@@ -2,17 +2,18 @@ import sqlite3
 import time
 from typing import List
 
-import numpy as np
 import pandas as pd
 import streamlit as st
 import tokenizers
 from datasets.fingerprint import Hasher
-from processing.custom.utils import create_database, get_ngrams
+from processing.extracting_ngrams.ngrams_index import NgramIndex
+from processing.extracting_ngrams.utils import create_database
 from transformers import AutoTokenizer
 
 
 SHARD_NAME = "4e47925f7c894bd8eb56e5dd1d778ec77bf2c90f6cee0e32e31615393391c67a"
 db_filepath = f"data/extracted_databases/{SHARD_NAME}.db"
+ngrams_index_dir = f"data/extracted_databases/{SHARD_NAME}.ngrams_index"
 
 
 # Load tokenizer
@@ -22,15 +23,6 @@ def load_tokenizer(tokenizer_name):
     return tokenizer
 
 
-def ngram_conv(ids: np.ndarray):
-    if len(ids) <= 4:
-        ngram = get_ngrams(ids, vocab_size, len(ids))
-        assert len(ngram) == 1
-    else:
-        ngram = get_ngrams(ids, vocab_size, 4)
-    return ngram
-
-
 # Load database
 # Following https://discuss.streamlit.io/t/caching-sqlite-db-connection-resulting-in-glitchy-rendering-of-the-page/19017 recommendation on caching
 @st.experimental_singleton
@@ -44,31 +36,38 @@ def load_database():
     return connection.cursor()
 
 
+@st.experimental_singleton
+def load_ngrams_index():
+    return NgramIndex(ngrams_index_dir)
+
+
 # Get n-grams
 def run_conv(text: str):
     ids = tokenizer(text, return_attention_mask=False, return_tensors="np")["input_ids"][0]
-    ngram_ids = ngram_conv(ids)
+    ngram_ids = ngrams_index.query_ngram_ids(ids).tolist()
     return ids, ngram_ids
 
 
 @st.cache()
 def run_query(ngram_ids: List[int]):
+    document_ids = ngrams_index.documents_containing_any(ngram_ids).tolist()
     results = []
-    for ngram in ngram_ids:
-        sql_query = f"""SELECT shard, ngrams.document, url
-                        FROM ngrams
-                        LEFT JOIN urls ON ngrams.document = urls.document
-                        WHERE ngrams={ngram}
+    for document_id in document_ids:
+        sql_query = f"""SELECT url
+                        FROM urls
+                        WHERE document={document_id}
                         ;"""
-        r = cur.execute(sql_query).fetchall()
-        results.extend(r)
-    return list(set(results))
+        urls = cur.execute(sql_query).fetchall()
+        # Only one shard for now
+        results.append((0, document_id, urls[0][0] if urls else None))
+    return results
 
 
 tokenizer = load_tokenizer("gpt2")
 vocab_size = tokenizer.vocab_size
 
 cur = load_database()
+ngrams_index = load_ngrams_index()
 
 
 # Header
@@ -0,0 +1,25 @@
+import argparse
+import logging
+
+from transformers import AutoTokenizer
+
+from ngrams_index import find_runs, merge_runs
+
+
+logging.basicConfig(level=logging.INFO)
+
+parser = argparse.ArgumentParser(description="Merge the ngrams runs into an inverted index")
+parser.add_argument("--runs_dir", type=str, required=True, help="The directory of the ngrams runs.")
+parser.add_argument("--index_dir", type=str, required=True, help="The directory where the index is written.")
+parser.add_argument(
+    "--block_size",
+    type=int,
+    default=10_000_000,
+    help="The number of (ngram, document) pairs merged at once.",
+)
+args = parser.parse_args()
+
+
+if __name__ == "__main__":
+    tokenizer = AutoTokenizer.from_pretrained("gpt2")
+    merge_runs(find_runs(args.runs_dir), args.index_dir, voc_size=tokenizer.vocab_size, block_size=args.block_size)
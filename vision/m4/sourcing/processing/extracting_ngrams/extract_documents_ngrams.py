@@ -1,11 +1,10 @@
 import argparse
 import logging
-import sys
 from typing import List
 
 from transformers import AutoTokenizer
 
-from utils import get_ngrams
+from ngrams_index import NgramRunWriter
 
 
 parser = argparse.ArgumentParser(description="Extract the ngrams")
@@ -16,44 +15,57 @@ parser.add_argument(
     default=1_000,
     help="The number of documents per subshard.",
 )
+parser.add_argument("--runs_dir", type=str, required=True, help="The directory where the ngrams runs are written.")
+parser.add_argument("--batch_size", type=int, default=256, help="The number of documents tokenized at once.")
+parser.add_argument(
+    "--max_pairs_in_memory",
+    type=int,
+    default=50_000_000,
+    help="The number of (ngram, document) pairs buffered before writing a run.",
+)
 args = parser.parse_args()
 
-SHARD_NAME = 0
+MAX_N = 4
 
 tokenizer = AutoTokenizer.from_pretrained("gpt2")
 vocab_size = tokenizer.vocab_size
 
 
-def process_document(text: str):
-    text = text.strip()
-    input_ids = tokenizer(text, return_attention_mask=False, return_tensors="np")["input_ids"][0]
-
-    # Dirty implem. TODO: update
-    ngrams = (
-        get_ngrams(ids=input_ids, voc_size=vocab_size, n=1)
-        + get_ngrams(ids=input_ids, voc_size=vocab_size, n=2)
-        + get_ngrams(ids=input_ids, voc_size=vocab_size, n=3)
-        + get_ngrams(ids=input_ids, voc_size=vocab_size, n=4)
-    )
-    return ngrams
+def process_batch(documents: List[str], doc_ids: List[int], writer: NgramRunWriter):
+    batch_input_ids = tokenizer([doc.strip() for doc in documents], return_attention_mask=False)["input_ids"]
+    valid_input_ids, valid_doc_ids = [], []
+    for input_ids, doc_id, doc in zip(batch_input_ids, doc_ids, documents):
+        # Same as before: a document too short to have 4-grams is invalid
+        if len(input_ids) < MAX_N:
+            logging.warning(f"Document nb {doc_id} is invalid. Skipping.\nDoc = {doc}.")
+            continue
+        valid_input_ids.append(input_ids)
+        valid_doc_ids.append(doc_id)
+    writer.add_documents(valid_input_ids, valid_doc_ids)
 
 
-def process_docs(documents: List[str], subshard_idx: int):
+def process_docs(documents, subshard_idx: int, writer: NgramRunWriter):
     doc_counter = subshard_idx * args.nb_docs_per_subshard + 1
+    batch, batch_doc_ids = [], []
     for doc in documents:
-        try:
-            ngrams = process_document(doc)
-            for id in ngrams:
-                print(f"{SHARD_NAME},{doc_counter},{id}")
-        except ValueError:
-            logging.warning(f"Document nb {doc_counter} is invalid. Skipping.\nDoc = {doc}.")
-            # TODO: get some way of logging number of skipped documents (not at the process level tough...)
+        batch.append(doc)
+        batch_doc_ids.append(doc_counter)
         doc_counter += 1
+        if len(batch) == args.batch_size:
+            process_batch(batch, batch_doc_ids, writer)
+            batch, batch_doc_ids = [], []
+    if len(batch) > 0:
+        process_batch(batch, batch_doc_ids, writer)
 
 
 if __name__ == "__main__":
     input_filepath = args.filepath
     subshard_idx = int(input_filepath.split(".")[-1])
-    with open(input_filepath, "r") as file:
-        process_docs(file, subshard_idx)
-    sys.stdout.flush()
+    with open(input_filepath, "r") as file, NgramRunWriter(
+        runs_dir=args.runs_dir,
+        run_prefix=f"subshard_{subshard_idx:05}",
+        voc_size=vocab_size,
+        max_n=MAX_N,
+        max_pairs_in_memory=args.max_pairs_in_memory,
+    ) as writer:
+        process_docs(file, subshard_idx, writer)
@@ -0,0 +1,302 @@
+"""
+Binary n-grams inverted index.
+
+Building the index is done in two steps:
+- `NgramRunWriter` gets the n-grams of batches of tokenized documents, and writes them as sorted and deduplicated
+  `(ngram, doc)` runs in binary files (one pass of numpy per batch of documents, no text is written).
+- `merge_runs` k-way merges the runs into an inverted index: the sorted unique n-grams, the offsets of their postings,
+  and the postings (the sorted ids of the documents containing each n-gram).
+
+`NgramIndex` memory-maps the index, and answers doc-frequency and containing-documents queries with binary searches.
+
+The n-grams ids are the ones of `utils.get_ngrams`: the n-gram [a, b, c] is mapped to (a+1) V**2 + (b+1) V + (c+1),
+which is computed with a rolling hash over the tokens. It is bijective for n <= 4 and V = 50_257 (GPT-2 vocabulary).
+"""
+import glob
+import json
+import logging
+import os
+from typing import Iterable, List, Optional, Sequence
+
+import numpy as np
+
+
+logger = logging.getLogger(__name__)
+
+RUN_DTYPE = np.dtype([("ngram", "<u8"), ("doc", "<u4")])
+NGRAMS_FILENAME = "ngrams.bin"
+OFFSETS_FILENAME = "offsets.bin"
+DOCS_FILENAME = "docs.bin"
+META_FILENAME = "meta.json"
+
+
+def get_ngram_ids(ids: np.ndarray, voc_size: int, n: int) -> np.ndarray:
+    """
+    Ids of the n-grams of `ids` (same mapping as `utils.get_ngrams`, not deduplicated), computed with a rolling hash.
+    """
+    ids = np.asarray(ids, dtype=np.uint64) + np.uint64(1)
+    if len(ids) < n:
+        return np.empty(0, dtype=np.uint64)
+    hashes = ids
+    for k in range(1, n):
+        hashes = hashes[:-1] * np.uint64(voc_size) + ids[k:]
+    return hashes
+
+
+def get_batch_ngrams(batch_ids: Sequence[np.ndarray], doc_ids: Sequence[int], voc_size: int, max_n: int = 4):
+    """
+    All the `(ngram, doc)` pairs (not deduplicated) of the 1 to `max_n`-grams of a batch of tokenized documents.
+
+    The documents are concatenated, and each order of n-grams is computed in one rolling pass over the concatenation.
+    The n-grams that cross a document boundary are dropped.
+
+    Returns:
+        `(ngrams, docs)`: `np.uint64` and `np.uint32` arrays of the same length.
+    """
+    lengths = np.fromiter((len(ids) for ids in batch_ids), dtype=np.int64, count=len(batch_ids))
+    if lengths.sum() == 0:
+        return np.empty(0, dtype=np.uint64), np.empty(0, dtype=np.uint32)
+    tokens = np.concatenate([np.asarray(ids, dtype=np.uint64) for ids in batch_ids]) + np.uint64(1)
+    token_docs = np.repeat(np.asarray(doc_ids, dtype=np.uint32), lengths)
+    # Position of each token in its document, to know which windows stay in one document
+    token_positions = np.arange(len(tokens)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    token_remaining = np.repeat(lengths, lengths) - token_positions
+
+    all_ngrams, all_docs = [], []
+    hashes = tokens
+    for n in range(1, max_n + 1):
+        if n > 1:
+            hashes = hashes[:-1] * np.uint64(voc_size) + tokens[n - 1 :]
+        valid = token_remaining[: len(hashes)] >= n
+        all_ngrams.append(hashes[valid])
+        all_docs.append(token_docs[: len(hashes)][valid])
+    return np.concatenate(all_ngrams), np.concatenate(all_docs)
+
+
+def _sort_and_deduplicate(ngrams: np.ndarray, docs: np.ndarray) -> np.ndarray:
+    order = np.lexsort((docs, ngrams))
+    run = np.empty(len(order), dtype=RUN_DTYPE)
+    run["ngram"] = ngrams[order]
+    run["doc"] = docs[order]
+    if len(run) > 1:
+        keep = np.ones(len(run), dtype=bool)
+        keep[1:] = (run["ngram"][1:] != run["ngram"][:-1]) | (run["doc"][1:] != run["doc"][:-1])
+        run = run[keep]
+    return run
+
+
+class NgramRunWriter:
+    """
+    Accumulates the n-grams of tokenized documents and flushes them as sorted `(ngram, doc)` runs once
+    `max_pairs_in_memory` pairs are buffered.
+
+    Args:
+        runs_dir (`str`): Directory of the run files.
+        run_prefix (`str`): Prefix of the run files, must be unique per writer (e.g. the subshard index).
+        voc_size (`int`): Size of the vocabulary of the tokenizer.
+        max_n (`int`): Largest order of n-grams to extract.
+        max_pairs_in_memory (`int`): Number of buffered pairs above which a run is written.
+    """
+
+    def __init__(
+        self, runs_dir: str, run_prefix: str, voc_size: int, max_n: int = 4, max_pairs_in_memory: int = 50_000_000
+    ):
+        self.runs_dir = runs_dir
+        self.run_prefix = run_prefix
+        self.voc_size = voc_size
+        self.max_n = max_n
+        self.max_pairs_in_memory = max_pairs_in_memory
+        os.makedirs(runs_dir, exist_ok=True)
+
+        self._ngrams: List[np.ndarray] = []
+        self._docs: List[np.ndarray] = []
+        self._num_pairs = 0
+        self.run_paths: List[str] = []
+
+    def add_documents(self, batch_ids: Sequence[np.ndarray], doc_ids: Sequence[int]):
+        ngrams, docs = get_batch_ngrams(batch_ids, doc_ids, voc_size=self.voc_size, max_n=self.max_n)
+        self._ngrams.append(ngrams)
+        self._docs.append(docs)
+        self._num_pairs += len(ngrams)
+        if self._num_pairs >= self.max_pairs_in_memory:
+            self.flush()
+
+    def flush(self):
+        if self._num_pairs == 0:
+            return
+        run = _sort_and_deduplicate(np.concatenate(self._ngrams), np.concatenate(self._docs))
+        run_path = os.path.join(self.runs_dir, f"{self.run_prefix}.{len(self.run_paths):05}.run")
+        # Written under a temporary name so that a killed job never leaves a truncated run
+        run.tofile(run_path + ".tmp")
+        os.replace(run_path + ".tmp", run_path)
+        self.run_paths.append(run_path)
+        self._ngrams, self._docs, self._num_pairs = [], [], 0
+
+    def close(self) -> List[str]:
+        self.flush()
+        return self.run_paths
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+
+
+def merge_runs(
+    run_paths: Iterable[str], index_dir: str, voc_size: int, max_n: int = 4, block_size: int = 10_000_000
+) -> dict:
+    """
+    K-way merges sorted runs into an inverted index in `index_dir`, reading at most about `block_size` pairs at a
+    time. Every step takes from each run the pairs up to the smallest of the last n-grams of the runs' blocks, so
+    that the merged block is sorted with respect to everything not read yet.
+
+    Returns:
+        The metadata of the index (also saved in `meta.json`).
+    """
+    runs = [np.memmap(path, dtype=RUN_DTYPE, mode="r") for path in run_paths if os.path.getsize(path) > 0]
+    positions = [0] * len(runs)
+    per_run_block_size = max(1, block_size // max(1, len(runs)))
+
+    os.makedirs(index_dir, exist_ok=True)
+    num_ngrams, num_postings = 0, 0
+    max_doc = -1
+    # The postings of the last n-gram of a block are held back, as the next blocks can have more of them
+    held_back = np.empty(0, dtype=RUN_DTYPE)
+    with open(os.path.join(index_dir, NGRAMS_FILENAME), "wb") as ngrams_file, open(
+        os.path.join(index_dir, OFFSETS_FILENAME), "wb"
+    ) as offsets_file, open(os.path.join(index_dir, DOCS_FILENAME), "wb") as docs_file:
+
+        def write_block(block):
+            nonlocal num_ngrams, num_postings
+            starts = np.flatnonzero(np.r_[True, block["ngram"][1:] != block["ngram"][:-1]])
+            block["ngram"][starts].tofile(ngrams_file)
+            (starts.astype(np.uint64) + np.uint64(num_postings)).tofile(offsets_file)
+            block["doc"].tofile(docs_file)
+            num_ngrams += len(starts)
+            num_postings += len(block)
+
+        while True:
+            active = [run_idx for run_idx, run in enumerate(runs) if positions[run_idx] < len(run)]
+            if len(active) == 0:
+                break
+            bound = min(
+                runs[run_idx]["ngram"][min(positions[run_idx] + per_run_block_size, len(runs[run_idx])) - 1]
+                for run_idx in active
+            )
+            pieces = [held_back]
+            for run_idx in active:
+                run, start = runs[run_idx], positions[run_idx]
+                stop = min(start + per_run_block_size, len(run))
+                stop = start + int(np.searchsorted(run["ngram"][start:stop], bound, side="right"))
+                pieces.append(np.asarray(run[start:stop]))
+                positions[run_idx] = stop
+            block = np.concatenate(pieces)
+            block = _sort_and_deduplicate(block["ngram"], block["doc"])
+            if len(block) == 0:
+                continue
+            max_doc = max(max_doc, int(block["doc"].max()))
+            last_start = int(np.searchsorted(block["ngram"], block["ngram"][-1], side="left"))
+            held_back = block[last_start:].copy()
+            if last_start > 0:
+                write_block(block[:last_start])
+        if len(held_back) > 0:
+            write_block(held_back)
+        np.asarray([num_postings], dtype=np.uint64).tofile(offsets_file)
+
+    meta = {
+        "voc_size": voc_size,
+        "max_n": max_n,
+        "num_ngrams": num_ngrams,
+        "num_postings": num_postings,
+        "max_doc": max_doc,
+    }
+    with open(os.path.join(index_dir, META_FILENAME), "w") as f:
+        json.dump(meta, f)
+    logger.info(f"Merged {len(runs)} runs into {num_ngrams} n-grams and {num_postings} postings in {index_dir}.")
+    return meta
+
+
+def find_runs(runs_dir: str) -> List[str]:
+    return sorted(glob.glob(os.path.join(runs_dir, "*.run")))
+
+
+class NgramIndex:
+    """
+    Memory-mapped inverted index built by `merge_runs`.
+
+    Example:
+        >>> index = NgramIndex("data/extracted_databases/shard.ngrams_index")
+        >>> ngram_ids = index.query_ngram_ids(tokenizer("NEW YORK")["input_ids"])
+        >>> index.doc_frequency(ngram_ids), index.documents_containing_any(ngram_ids)
+    """
+
+    def __init__(self, index_dir: str):
+        self.index_dir = index_dir
+        with open(os.path.join(index_dir, META_FILENAME)) as f:
+            self.meta = json.load(f)
+        self.voc_size = self.meta["voc_size"]
+        self.max_n = self.meta["max_n"]
+        self.ngrams = self._load(NGRAMS_FILENAME, np.uint64)
+        self.offsets = self._load(OFFSETS_FILENAME, np.uint64)
+        self.docs = self._load(DOCS_FILENAME, np.uint32)
+
+    def _load(self, filename, dtype):
+        path = os.path.join(self.index_dir, filename)
+        # `np.memmap` doesn't support empty files
+        if os.path.getsize(path) == 0:
+            return np.empty(0, dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode="r")
+
+    def __len__(self):
+        return len(self.ngrams)
+
+    def query_ngram_ids(self, ids: Sequence[int]) -> np.ndarray:
+        """
+        Ids of the n-grams to look up for a tokenized query: the query itself if it is at most a `max_n`-gram, the
+        overlapping `max_n`-grams of the query otherwise.
+        """
+        n = min(len(ids), self.max_n)
+        return np.unique(get_ngram_ids(np.asarray(ids), self.voc_size, n))
+
+    def _lookup(self, ngram_ids):
+        ngram_ids = np.atleast_1d(np.asarray(ngram_ids, dtype=np.uint64))
+        idx = np.searchsorted(self.ngrams, ngram_ids)
+        found = idx < len(self.ngrams)
+        found[found] = self.ngrams[idx[found]] == ngram_ids[found]
+        return idx, found
+
+    def doc_frequency(self, ngram_ids) -> np.ndarray:
+        """Number of documents containing each of `ngram_ids` (0 for unknown n-grams)."""
+        idx, found = self._lookup(ngram_ids)
+        frequencies = np.zeros(len(idx), dtype=np.int64)
+        frequencies[found] = (self.offsets[idx[found] + 1] - self.offsets[idx[found]]).astype(np.int64)
+        return frequencies
+
+    def documents(self, ngram_id: int) -> np.ndarray:
+        """Sorted ids of the documents containing `ngram_id`."""
+        idx, found = self._lookup(ngram_id)
+        if not found[0]:
+            return np.empty(0, dtype=np.uint32)
+        return np.asarray(self.docs[self.offsets[idx[0]] : self.offsets[idx[0] + 1]])
+
+    def documents_containing_any(self, ngram_ids) -> np.ndarray:
+        """Sorted ids of the documents containing at least one of `ngram_ids`."""
+        postings = [self.documents(ngram_id) for ngram_id in np.atleast_1d(ngram_ids)]
+        if len(postings) == 0:
+            return np.empty(0, dtype=np.uint32)
+        return np.unique(np.concatenate(postings))
+
+    def documents_containing_all(self, ngram_ids) -> np.ndarray:
+        """Sorted ids of the documents containing all of `ngram_ids`, intersecting from the rarest n-gram."""
+        ngram_ids = np.atleast_1d(np.asarray(ngram_ids, dtype=np.uint64))
+        if len(ngram_ids) == 0:
+            return np.empty(0, dtype=np.uint32)
+        result: Optional[np.ndarray] = None
+        for ngram_id in ngram_ids[np.argsort(self.doc_frequency(ngram_ids), kind="stable")]:
+            postings = self.documents(ngram_id)
+            result = postings if result is None else np.intersect1d(result, postings, assume_unique=True)
+            if len(result) == 0:
+                break
+        return result
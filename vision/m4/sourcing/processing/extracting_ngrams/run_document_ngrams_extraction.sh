@@ -20,8 +20,11 @@ split --lines $NB_DOCS_PER_SUBSHARD --numeric-suffixes $DATA_PATH/processed_dump
 # Extract ngrams in each documents
 find $DATA_PATH/processed_dumps/ | \
     grep "${DATA_PATH}/processed_dumps/${SHARD_NAME}.texts.[0-9]+*" | \
-    parallel --verbose -j $N_WORKERS --progress "TRANSFORMERS_OFFLINE=1 TRANSFORMERS_VERBOSITY=error python extract_documents_ngrams.py --filepath {} --nb_docs_per_subshard $NB_DOCS_PER_SUBSHARD" > \
-    $DATA_PATH/extracted_databases/$SHARD_NAME.ngrams.csv
+    parallel --verbose -j $N_WORKERS --progress "TRANSFORMERS_OFFLINE=1 TRANSFORMERS_VERBOSITY=error python extract_documents_ngrams.py --filepath {} --nb_docs_per_subshard $NB_DOCS_PER_SUBSHARD --runs_dir $DATA_PATH/extracted_databases/$SHARD_NAME.ngrams_runs"
+
+# Merge the sorted runs into the ngrams index
+TRANSFORMERS_OFFLINE=1 TRANSFORMERS_VERBOSITY=error python build_ngrams_index.py --runs_dir $DATA_PATH/extracted_databases/$SHARD_NAME.ngrams_runs --index_dir $DATA_PATH/extracted_databases/$SHARD_NAME.ngrams_index
+rm -r $DATA_PATH/extracted_databases/$SHARD_NAME.ngrams_runs
 
 # Remove the subshards
 find $DATA_PATH/processed_dumps/ | grep "${DATA_PATH}/processed_dumps/${SHARD_NAME}.texts.[0-9]+*" | xargs -d"\n" rm
@@ -9,6 +9,7 @@ import numpy as np
 def create_database(shard_name: str):
     """
     If the databse does not exist, create it
+    The ngrams are not in the database anymore, see `ngrams_index.NgramIndex`.
     TODO: update so that we can take in multiple shards
     """
     db_filepath = f"data/extracted_databases/{shard_name}.db"
@@ -20,26 +21,6 @@ def create_database(shard_name: str):
     connection = sqlite3.connect(db_filepath)
     cur = connection.cursor()
 
-    cur.execute(
-        """CREATE TABLE ngrams(
-            shard INT,
-            document INT,
-            ngrams INT
-        );"""
-    )
-    ngrams_csv_filepath = f"data/extracted_databases/{shard_name}.ngrams.csv"
-    with open(ngrams_csv_filepath) as ngrams_csv:
-        rows = csv.reader(ngrams_csv)
-        cur.executemany("INSERT INTO ngrams VALUES (?, ?, ?)", rows)
-    print("Added ngrams to the databse.")
-    cur.execute(
-        """
-        CREATE INDEX ngrams_index
-        ON ngrams (ngrams);
-        """
-    )
-    print("Created ngrams index.")
-
     cur.execute(
         """CREATE TABLE urls(
             document INT,
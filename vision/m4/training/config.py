@@ -267,6 +267,16 @@ class DatasetParams:
     min_image_size: int = 378
     max_image_size: int = 384
 
+    # Split the images of a mapped batch into uint8 tiles normalized as one batch (`ImageTilePipeline`), when the image
+    # transform supports it. The tiles skip the random scale up of `ConditionalResize`, so the training inputs are not
+    # exactly the ones of the per-image transform.
+    use_image_tile_pipeline: bool = False
+    # Number of threads used to decode, resize and split the images with `use_image_tile_pipeline`. 0 means no thread
+    # pool.
+    image_tile_threads: int = 0
+    # Decode the large JPEGs at a reduced scale with `use_image_tile_pipeline`. Faster, but changes the pixels.
+    image_tile_jpeg_draft: bool = False
+
     # Parameter has to be set later once the vision_config is known.
     vision_encoder_max_image_size: int = 0
 
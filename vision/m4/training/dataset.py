@@ -5,6 +5,7 @@ import copy
 import inspect
 import logging
 import os
+import random
 from dataclasses import asdict
 from functools import partial
 from pathlib import Path
@@ -13,13 +14,12 @@ from typing import Optional
 import datasets
 import numpy as np
 import torch
-import webdataset as wds
 from accelerate.state import AcceleratorState
 from PIL import Image, ImageFile
 from torch.utils.data import Sampler
 
 from m4.training.config import DataParams, DatasetParams, Parameters
-from m4.training.dataset_utils import check_webdataset_command, get_webdataset
+from m4.training.dataset_utils import ResumableWebDataset, check_webdataset_command, get_webdataset
 from m4.training.packing import (
     split_pack_and_pad_iqa_finetuning,
     split_pack_and_pad_ocr,
@@ -28,6 +28,7 @@ from m4.training.packing import (
     split_pack_and_pad_webdocs,
 )
 from m4.training.types import DatasetNames, DatasetTypes
+from m4.training.utils import ImageTilePipeline
 
 
 Image.MAX_IMAGE_PIXELS = None
@@ -114,6 +115,9 @@ def get_mapper(
     add_begin_of_doc_token: bool = True,
     add_end_of_doc_token: bool = True,
     max_num_images_per_document: Optional[int] = None,
+    use_image_tile_pipeline: bool = False,
+    image_tile_threads: int = 0,
+    image_tile_jpeg_draft: bool = False,
 ):
     mapper_kwargs = {
         "tokenizer": tokenizer,
@@ -149,6 +153,21 @@ def get_mapper(
         mapper_kwargs["max_num_samples_per_document"] = max_num_samples_per_document
         mapper_kwargs["max_num_images_per_document"] = max_num_images_per_document
 
+    if (
+        use_image_tile_pipeline
+        and split_fn is not split_pack_and_pad_iqa_finetuning
+        and getattr(image_transform, "tile_normalizer", None) is not None
+    ):
+        # The image transform can process the sub-images as a batch, so split them into uint8 arrays
+        mapper_kwargs["image_tile_pipeline"] = ImageTilePipeline(
+            vision_encoder_max_image_size=vision_encoder_max_image_size,
+            max_image_size=max_image_size,
+            pre_split_scale_up_max=pre_split_scale_up_max,
+            pre_split_scale_up_frequency=pre_split_scale_up_frequency,
+            num_threads=image_tile_threads,
+            use_jpeg_draft=image_tile_jpeg_draft,
+        )
+
     mapper_with_args = partial(split_fn, **mapper_kwargs)
     return mapper_with_args
 
@@ -456,7 +475,7 @@ def get_dataloader(
                 if select_n_examples is not None:
                     combined_dataset = combined_dataset.select(range(select_n_examples))
                 wrapper_dataset_class = IterableWrapperHFDataset
-            elif isinstance(dataset_list_or_combined, wds.pipeline.DataPipeline):
+            elif isinstance(dataset_list_or_combined, ResumableWebDataset):
                 combined_dataset = dataset_list_or_combined
                 wrapper_dataset_class = IterableWrapperWebdataset
             else:
@@ -649,6 +668,9 @@ class IterableWrapperHFDataset(torch.utils.data.IterableDataset):
         add_end_of_doc_token=True,
         shuffle_after_packing=False,
         max_num_images_per_document=None,
+        use_image_tile_pipeline=False,
+        image_tile_threads=0,
+        image_tile_jpeg_draft=False,
     ):
         self.dataset = dataset
         self.mapper = get_mapper(
@@ -670,6 +692,9 @@ class IterableWrapperHFDataset(torch.utils.data.IterableDataset):
             add_begin_of_doc_token=add_begin_of_doc_token,
             add_end_of_doc_token=add_end_of_doc_token,
             max_num_images_per_document=max_num_images_per_document,
+            use_image_tile_pipeline=use_image_tile_pipeline,
+            image_tile_threads=image_tile_threads,
+            image_tile_jpeg_draft=image_tile_jpeg_draft,
         )
         self.batch_size = batch_size
         self.shuffle = shuffle
@@ -896,6 +921,9 @@ class IterableWrapperWebdataset(torch.utils.data.IterableDataset):
         add_end_of_doc_token=True,
         shuffle_after_packing=False,
         max_num_images_per_document=None,
+        use_image_tile_pipeline=False,
+        image_tile_threads=0,
+        image_tile_jpeg_draft=False,
     ):
         self._webdataset = dataset
         self.dataset = iter(self._webdataset)
@@ -918,6 +946,9 @@ class IterableWrapperWebdataset(torch.utils.data.IterableDataset):
             add_begin_of_doc_token=add_begin_of_doc_token,
             add_end_of_doc_token=add_end_of_doc_token,
             max_num_images_per_document=max_num_images_per_document,
+            use_image_tile_pipeline=use_image_tile_pipeline,
+            image_tile_threads=image_tile_threads,
+            image_tile_jpeg_draft=image_tile_jpeg_draft,
         )
         self.batch_size = batch_size
         self.shuffle = shuffle
@@ -935,20 +966,25 @@ class IterableWrapperWebdataset(torch.utils.data.IterableDataset):
         # Resume Tracking --> Dict[worker_idx] -> Tuple[map_idx, key_idx]; `map_idx` lets us jumpstart!
         self.worker_idx_tracker = {}
         self.start_worker_idx = 0
+        # Dict[worker_idx] -> positions of the webdataset reader (see `dataset_state["webdataset_state"]`)
+        self.webdataset_state_tracker = {}
 
         self.dataset_name = dataset_name
 
-    def set_state(self, worker_idx_tracker, start_worker_idx):
+    def set_state(self, worker_idx_tracker, start_worker_idx, webdataset_state_tracker=None):
         self.worker_idx_tracker = worker_idx_tracker
         self.start_worker_idx = start_worker_idx
+        self.webdataset_state_tracker = dict(webdataset_state_tracker) if webdataset_state_tracker is not None else {}
 
     def reset_state(self):
         for key in self.worker_idx_tracker.keys():
             self.worker_idx_tracker[key] = (0, -1, {})
         self.start_worker_idx = 0
+        self.webdataset_state_tracker = {}
 
     def set_epoch(self, epoch):
         self.epoch = epoch
+        self._webdataset.set_epoch(epoch)
         self.dataset = iter(self._webdataset)  # Reset dataset iterator
 
     def state_dict(self):
@@ -990,6 +1026,124 @@ class IterableWrapperWebdataset(torch.utils.data.IterableDataset):
         worker_indices = indices[worker_id::worker_total_num]
         return worker_indices, worker_id
 
+    def _snapshot(self, i):
+        """Everything needed to pull and map the `i+1`-th batch again: reader position and random states."""
+        return {
+            "map_idx": i,
+            "reader": self._webdataset.state_dict(),
+            "rng_state": copy.deepcopy(self.rng.bit_generator.state),
+            "np_random_state": np.random.get_state(),
+            "random_state": random.getstate(),
+        }
+
+    def _restore_snapshot(self, snapshot):
+        self._webdataset.load_worker_state(snapshot["reader"])
+        self.dataset = iter(self._webdataset)
+        self.rng.bit_generator.state = snapshot["rng_state"]
+        np.random.set_state(snapshot["np_random_state"])
+        random.setstate(snapshot["random_state"])
+        return snapshot["map_idx"]
+
+    def _pull_and_map_batch(self, i, worker_id):
+        # Set seed for the worker according to worker index and the index and then reset it work
+        # This needs to be done so that torch random crop is deterministic
+        rng_state = torch.get_rng_state()
+        torch.manual_seed(f"{self.seed}{worker_id}{i}")
+        try:
+            next_batch = next(self.dataset)
+        except StopIteration:
+            torch.set_rng_state(rng_state)
+            return None, i
+        i += 1
+        curr_mapped_batch = self.mapper(
+            next_batch,
+            prefix_seed=(self.seed, self.epoch, self.rank, worker_id, i),
+        )
+        torch.set_rng_state(rng_state)
+        return curr_mapped_batch, i
+
+    @staticmethod
+    def _concat_mapped_batches(overflow_batch, curr_mapped_batch, pixel_shape=None):
+        """
+        Concatenates two mapped batches, padding the images to the largest number of images, height and width (or
+        to `pixel_shape` if it is larger).
+        """
+        keys = list(curr_mapped_batch.keys())
+        mapped_batch = {}
+
+        if "pixel_values" in overflow_batch or "pixel_values" in curr_mapped_batch:
+            total_batch_size = overflow_batch["input_ids"].size(0) + curr_mapped_batch["input_ids"].size(0)
+            max_num_images, max_height, max_width = pixel_shape if pixel_shape is not None else (0, 0, 0)
+            max_num_images = max(
+                max_num_images,
+                overflow_batch["pixel_values"].size(1) if "pixel_values" in overflow_batch else 0,
+                curr_mapped_batch["pixel_values"].size(1) if "pixel_values" in curr_mapped_batch else 0,
+            )
+            max_height = max(
+                max_height,
+                overflow_batch["pixel_values"].size(3) if "pixel_values" in overflow_batch else 0,
+                curr_mapped_batch["pixel_values"].size(3) if "pixel_values" in curr_mapped_batch else 0,
+            )
+            max_width = max(
+                max_width,
+                overflow_batch["pixel_values"].size(4) if "pixel_values" in overflow_batch else 0,
+                curr_mapped_batch["pixel_values"].size(4) if "pixel_values" in curr_mapped_batch else 0,
+            )
+            padded_image_tensor = torch.zeros(total_batch_size, max_num_images, 3, max_height, max_width)
+            padded_pixel_attention_masks = torch.zeros(
+                total_batch_size, max_num_images, max_height, max_width, dtype=torch.bool
+            )
+
+            start = 0
+            for batch in [overflow_batch, curr_mapped_batch]:
+                if "pixel_values" not in batch:
+                    start += batch["input_ids"].size(0)
+                    continue
+                px = batch["pixel_values"]
+                px_attn_mask = batch["pixel_attention_mask"]
+                end = start + px.size(0)
+                padded_image_tensor[start:end, : px.size(1), :, : px.size(3), : px.size(4)] = px
+                padded_pixel_attention_masks[start:end, : px.size(1), : px.size(3), : px.size(4)] = px_attn_mask
+                start += px.size(0)
+
+            mapped_batch["pixel_values"] = padded_image_tensor.contiguous()
+            mapped_batch["pixel_attention_mask"] = padded_pixel_attention_masks.contiguous()
+
+        for key in keys:
+            if key in ["pixel_values", "pixel_attention_mask"]:
+                continue
+            mapped_batch[key] = torch.cat([overflow_batch[key], curr_mapped_batch[key]], dim=0)
+        return mapped_batch
+
+    def _rebuild_overflow_batch(self, overflow_state, worker_id):
+        """
+        Rebuilds the overflow batch of a resume state by pulling and mapping again the batches its rows come from,
+        instead of saving the (large) tensors in the state.
+        """
+        overflow_batch, overflow_sources = {}, []
+        rows_per_batch = {}
+        for map_idx, row_idx in overflow_state["sources"]:
+            rows_per_batch.setdefault(map_idx, []).append(row_idx)
+        mapped_batches = {}
+        for map_idx in rows_per_batch.keys():
+            i = self._restore_snapshot(overflow_state["snapshots"][map_idx])
+            mapped_batches[map_idx], _ = self._pull_and_map_batch(i, worker_id)
+            if mapped_batches[map_idx] is None:
+                raise ValueError(f"Could not rebuild the overflow batch from the batch {map_idx}.")
+        # Keep the rows in their original order
+        for map_idx, row_idx in overflow_state["sources"]:
+            row = {key: value[row_idx : row_idx + 1] for key, value in mapped_batches[map_idx].items()}
+            overflow_batch = self._concat_mapped_batches(overflow_batch, row) if overflow_batch else row
+            overflow_sources.append((map_idx, row_idx))
+        if overflow_batch and overflow_state["pixel_shape"] is not None:
+            # Pad the images as they were in the original overflow batch
+            overflow_batch = self._concat_mapped_batches(
+                {key: value[:0] for key, value in overflow_batch.items()},
+                overflow_batch,
+                pixel_shape=overflow_state["pixel_shape"],
+            )
+        return overflow_batch, overflow_sources
+
     def __iter__(self):
         # Dummy dataset idx used for compatibility with CustomChainDataset
         dummy_dataset_idx = 0
@@ -999,6 +1153,13 @@ class IterableWrapperWebdataset(torch.utils.data.IterableDataset):
 
         # Relic from previous implementation - but needed for rng seed
         worker_id, worker_total_num = self._get_worker_id_and_worker_total_num()
+        self._webdataset.set_worker_info(
+            seed=self.seed,
+            rank=self.rank,
+            world_size=self.world_size,
+            worker_id=worker_id,
+            num_workers=worker_total_num,
+        )
 
         # Relic from previous implementation - but needed for rng seed
         map_start_idx, last_key_idx, overflow_batch = self.worker_idx_tracker.get(worker_id, (0, -1, {}))
@@ -1009,27 +1170,47 @@ class IterableWrapperWebdataset(torch.utils.data.IterableDataset):
         # Initialize rng_seed
         self.rng_seed = [self.seed, self.epoch, self.rank, worker_id, i]
         self.rng = np.random.default_rng(seed=self.rng_seed)
+
+        # Resume tracking: the rows of `overflow_batch` come from the batches `overflow_sources` (`(map_idx, row_idx)`)
+        # that can be pulled again from `snapshots[map_idx]`. Nothing is kept in memory but the reader positions.
+        overflow_sources, snapshots = [], {}
+        resume_until = None
+        webdataset_state = self.webdataset_state_tracker.pop(worker_id, None)
+        if webdataset_state is not None:
+            # Exact resume: rebuild the overflow the last yielded batch was taken from, jump back to the last mapped
+            # batch, and skip the part of it that was already yielded
+            overflow_batch, overflow_sources = self._rebuild_overflow_batch(webdataset_state["overflow"], worker_id)
+            snapshots = dict(webdataset_state["overflow"]["snapshots"])
+            i = self._restore_snapshot(webdataset_state["batch"])
+            resume_until = (map_start_idx, last_key_idx)
+            logger.info(
+                f"{self.dataset_name.name.lower()} resuming from {webdataset_state['batch']['reader']} "
+                f"(rank={self.rank} - worker_id={worker_id})"
+            )
+
         while True:
-            # Set seed for the worker according to worker index and the index and then reset it work
-            # This needs to be done so that torch random crop is deterministic
-            rng_state = torch.get_rng_state()
-            torch.manual_seed(f"{self.seed}{worker_id}{i}")
-            try:
-                next_batch = next(self.dataset)
-                i += 1
-            except StopIteration:
+            batch_snapshot = self._snapshot(i)
+            curr_mapped_batch, i = self._pull_and_map_batch(i, worker_id)
+            if curr_mapped_batch is None:
                 logger.info(
                     f"{self.dataset_name.name.lower()} has finished one epoch and is moving on to the next one."
                     f" (epoch={self.epoch} - rank={self.rank} - worker_id={worker_id})"
                 )
                 break
-            curr_mapped_batch = self.mapper(
-                next_batch,
-                prefix_seed=(self.seed, self.epoch, self.rank, worker_id, i),
-            )
-            torch.set_rng_state(rng_state)
             keys = list(curr_mapped_batch.keys())
             overflow_batch_keys = overflow_batch.keys()
+            snapshots[batch_snapshot["map_idx"]] = batch_snapshot
+            curr_sources = [(batch_snapshot["map_idx"], row_idx) for row_idx in range(len(curr_mapped_batch[keys[0]]))]
+            # What is needed to rebuild the overflow prepended to the current batch
+            incoming_overflow_state = {
+                "sources": list(overflow_sources),
+                "snapshots": {map_idx: snapshots[map_idx] for map_idx, _ in overflow_sources},
+                "pixel_shape": (
+                    tuple(overflow_batch["pixel_values"].shape[dim] for dim in (1, 3, 4))
+                    if "pixel_values" in overflow_batch
+                    else None
+                ),
+            }
 
             # Check if overflow from previous batches is left, if yes, add it to the current batch
             # Specifically, we should prepend this overflow batch so as it goes out first and
@@ -1042,48 +1223,12 @@ class IterableWrapperWebdataset(torch.utils.data.IterableDataset):
                         f"Overflow: {sorted(overflow_batch_keys)}, Mapping: {sorted(keys)}"
                     )
                 else:
-                    mapped_batch = {}
-
-                    if "pixel_values" in overflow_batch or "pixel_values" in curr_mapped_batch:
-                        total_batch_size = overflow_batch["input_ids"].size(0) + curr_mapped_batch["input_ids"].size(0)
-                        max_num_images = max(
-                            overflow_batch["pixel_values"].size(1) if "pixel_values" in overflow_batch else 0,
-                            curr_mapped_batch["pixel_values"].size(1) if "pixel_values" in curr_mapped_batch else 0,
-                        )
-                        max_height = max(
-                            overflow_batch["pixel_values"].size(3) if "pixel_values" in overflow_batch else 0,
-                            curr_mapped_batch["pixel_values"].size(3) if "pixel_values" in curr_mapped_batch else 0,
-                        )
-                        max_width = max(
-                            overflow_batch["pixel_values"].size(4) if "pixel_values" in overflow_batch else 0,
-                            curr_mapped_batch["pixel_values"].size(4) if "pixel_values" in curr_mapped_batch else 0,
-                        )
-                        padded_image_tensor = torch.zeros(total_batch_size, max_num_images, 3, max_height, max_width)
-                        padded_pixel_attention_masks = torch.zeros(
-                            total_batch_size, max_num_images, max_height, max_width, dtype=torch.bool
-                        )
-
-                        start = 0
-                        for batch in [overflow_batch, curr_mapped_batch]:
-                            if "pixel_values" not in batch:
-                                continue
-                            px = batch["pixel_values"]
-                            px_attn_mask = batch["pixel_attention_mask"]
-                            end = start + px.size(0)
-                            padded_image_tensor[start:end, :, :, : px.size(3), : px.size(4)] = px
-                            padded_pixel_attention_masks[start:end, :, : px.size(3), : px.size(4)] = px_attn_mask
-                            start += px.size(0)
-
-                        mapped_batch["pixel_values"] = padded_image_tensor.contiguous()
-                        mapped_batch["pixel_attention_mask"] = padded_pixel_attention_masks.contiguous()
-
-                    for key in keys:
-                        if key in ["pixel_values", "pixel_attention_mask"]:
-                            continue
-                        mapped_batch[key] = torch.cat([overflow_batch[key], curr_mapped_batch[key]], dim=0)
+                    mapped_batch = self._concat_mapped_batches(overflow_batch, curr_mapped_batch)
+                    mapped_batch_sources = overflow_sources + curr_sources
                     overflow_batch = {}
             else:
                 mapped_batch = curr_mapped_batch
+                mapped_batch_sources = curr_sources
 
             first_key = keys[0]
             mapped_batch_length = len(mapped_batch[first_key])
@@ -1094,12 +1239,14 @@ class IterableWrapperWebdataset(torch.utils.data.IterableDataset):
 
                 for key in mapped_batch.keys():
                     mapped_batch[key] = mapped_batch[key][indices, ...]
+                mapped_batch_sources = [mapped_batch_sources[idx] for idx in indices]
 
             if mapped_batch_length < self.batch_size:
                 # We need to add more data to this batch to make it of size `self.batch_size`
                 # Just setting mapped_batch to overflow_batch should be enough as the next iteration
                 # will add more data to it
                 overflow_batch = mapped_batch
+                overflow_sources = mapped_batch_sources
             else:
                 # Now, yield batches of size batch_size from the mapped batch
                 for key_idx in range(0, mapped_batch_length, self.batch_size):
@@ -1108,18 +1255,30 @@ class IterableWrapperWebdataset(torch.utils.data.IterableDataset):
                     self.rng = np.random.default_rng(seed=self.rng_seed)
 
                     overflow_batch = {key: mapped_batch[key][key_idx : key_idx + self.batch_size] for key in keys}
+                    overflow_sources = mapped_batch_sources[key_idx : key_idx + self.batch_size]
                     if len(overflow_batch[first_key]) != self.batch_size:
                         # Last batch
                         break
+                    elif resume_until is not None and (i, key_idx) <= resume_until:
+                        # Already yielded before the resume
+                        overflow_batch, overflow_sources = {}, []
                     else:
+                        resume_until = None
                         dataset_state = {
                             "worker_idx": worker_id,
                             "map_start_idx": i,
                             "last_key_idx": key_idx,
                             "previous_overflow_batch": {},
+                            "webdataset_state": {
+                                "batch": batch_snapshot,
+                                "overflow": incoming_overflow_state,
+                            },
                         }
                         yield dummy_dataset_idx, self.dataset_name.name.lower(), dataset_state, overflow_batch
-                        overflow_batch = {}
+                        overflow_batch, overflow_sources = {}, []
+
+            # Forget the snapshots of the batches that have no rows left to yield
+            snapshots = {map_idx: snapshots[map_idx] for map_idx, _ in overflow_sources}
 
 
 class CustomChainDataset(torch.utils.data.IterableDataset):
@@ -1194,8 +1353,11 @@ class CustomChainDataset(torch.utils.data.IterableDataset):
 
     def load_resume_states(self, resumable_states):
         for idx, d in enumerate(self.datasets):
-            worker_idx_tracker, start_worker_id = resumable_states[idx]
-            d.set_state(worker_idx_tracker, start_worker_id)
+            worker_idx_tracker, start_worker_id = resumable_states[idx][:2]
+            if isinstance(d, IterableWrapperWebdataset) and len(resumable_states[idx]) > 2:
+                d.set_state(worker_idx_tracker, start_worker_id, resumable_states[idx][2])
+            else:
+                d.set_state(worker_idx_tracker, start_worker_id)
             self.start_worker_id = start_worker_id
 
     def state_dict(self):
@@ -1339,12 +1501,14 @@ class DataLoaderForIterableWrapperDataset(torch.utils.data.DataLoader):
 
         self.worker_idx_tracker = [{} for i in range(self.dataset_count)]
         self.next_worker_idx = [0 for i in range(self.dataset_count)]
+        self.webdataset_state_tracker = [{} for i in range(self.dataset_count)]
         self.reset_state()
 
     def reset_state(self):
         for dataset_idx in range(self.dataset_count):
             self.worker_idx_tracker[dataset_idx] = {}
             self.next_worker_idx[dataset_idx] = 0
+            self.webdataset_state_tracker[dataset_idx] = {}
 
         # TODO: Aman: It looks like this has somewhat changed from last I checked. On slack, we
         # discussed to not have the states in the dataset themselves but just on the dataloader and
@@ -1365,6 +1529,8 @@ class DataLoaderForIterableWrapperDataset(torch.utils.data.DataLoader):
             dataset_state["last_key_idx"],
             dataset_state["previous_overflow_batch"],
         )
+        if "webdataset_state" in dataset_state:
+            self.webdataset_state_tracker[dataset_idx][dataset_state["worker_idx"]] = dataset_state["webdataset_state"]
 
         for dataset_idx in range(self.dataset_count):
             self.next_worker_idx[dataset_idx] = (dataset_state["worker_idx"] + 1) % self.num_workers
@@ -1377,11 +1543,19 @@ class DataLoaderForIterableWrapperDataset(torch.utils.data.DataLoader):
         self.dataset.load_resume_states(self.get_resume_states())
 
     def get_resume_state(self, dataset_idx):
-        return self.worker_idx_tracker[dataset_idx], self.next_worker_idx[dataset_idx]
+        return (
+            self.worker_idx_tracker[dataset_idx],
+            self.next_worker_idx[dataset_idx],
+            self.webdataset_state_tracker[dataset_idx],
+        )
 
     def get_resume_states(self):
         return [
-            [self.worker_idx_tracker[dataset_idx], self.next_worker_idx[dataset_idx]]
+            [
+                self.worker_idx_tracker[dataset_idx],
+                self.next_worker_idx[dataset_idx],
+                self.webdataset_state_tracker[dataset_idx],
+            ]
             for dataset_idx in range(self.dataset_count)
         ]
 
@@ -1390,6 +1564,7 @@ class DataLoaderForIterableWrapperDataset(torch.utils.data.DataLoader):
 
         state_dict["worker_idx_tracker"] = self.worker_idx_tracker
         state_dict["next_worker_idx"] = self.next_worker_idx
+        state_dict["webdataset_state_tracker"] = self.webdataset_state_tracker
 
         # recurse into its dataset
         state_dict["dataset"] = self.dataset.state_dict()
@@ -1399,6 +1574,10 @@ class DataLoaderForIterableWrapperDataset(torch.utils.data.DataLoader):
     def load_state_dict(self, state_dict):
         self.worker_idx_tracker = state_dict["worker_idx_tracker"]
         self.next_worker_idx = state_dict["next_worker_idx"]
+        # States saved before the resumable webdataset reader don't have this key
+        self.webdataset_state_tracker = state_dict.get(
+            "webdataset_state_tracker", [{} for i in range(self.dataset_count)]
+        )
 
         # recurse into its dataset
         self.dataset.load_state_dict(state_dict["dataset"])
@@ -1,13 +1,19 @@
 """
 This file defines the data decoding logic (i.e. from web tar hosted on s3 to samples feedable to packing)
 """
+import copy
 import io
+import itertools
 import json
 import logging
 import random
+import tarfile
+from collections import defaultdict
 
 import fitz
+import numpy as np
 import PIL.Image
+import torch
 import webdataset as wds
 from webdataset.tariterators import group_by_keys, tar_file_expander, url_opener
 
@@ -344,11 +350,348 @@ def _decode_image_and_text_sft(data, handler=log_and_continue):
 decode_image_and_text_sft = wds.filters.pipelinefilter(_decode_image_and_text_sft)
 
 
+# Resumable reading
+def _sample_key(fname):
+    return fname.strip("./").split(".")[0]
+
+
+def _open_url(url, offset=0):
+    """Opens `url` (path or `pipe:` command) positioned at byte `offset`."""
+    stream = wds.gopen(url, "rb")
+    if offset > 0:
+        try:
+            seekable = stream.seekable()
+        except (AttributeError, ValueError):
+            seekable = False
+        if seekable:
+            stream.seek(offset)
+        else:
+            # Pipes can't seek, skipping the bytes is still much cheaper than decoding the samples again
+            remaining = offset
+            while remaining > 0:
+                chunk = stream.read(min(remaining, 1 << 20))
+                if not chunk:
+                    raise EOFError(f"{url} is shorter than the resume offset {offset}")
+                remaining -= len(chunk)
+    return stream
+
+
+def iter_tar_groups(url, offset=0):
+    """
+    Reads the tar at `url` from the member header at byte `offset` and yields `(group_offset, next_offset, files)` for
+    each group of contiguous members sharing the same key (i.e. each sample). `group_offset` is the offset of the first
+    member of the group and `next_offset` the offset of the first member of the next group (None at the end of the
+    tar), so that reading can be resumed from there. `files` has the same format as `tar_file_expander`'s outputs.
+    """
+    stream = _open_url(url, offset)
+    try:
+        tar = tarfile.open(fileobj=stream, mode="r|")
+        group_key, group_offset, files = None, None, []
+        for tarinfo in tar:
+            fname = tarinfo.name
+            if not tarinfo.isreg() or fname is None:
+                continue
+            if "/" not in fname and fname.startswith(meta_prefix) and fname.endswith(meta_suffix):
+                continue
+            # Offsets in a stream opened at `offset` are relative to it
+            member_offset = offset + tarinfo.offset
+            key = _sample_key(fname)
+            if len(files) > 0 and key != group_key:
+                yield group_offset, member_offset, files
+                files = []
+            if len(files) == 0:
+                group_key, group_offset = key, member_offset
+            files.append({"fname": fname, "data": tar.extractfile(tarinfo).read(), "__url__": url})
+        if len(files) > 0:
+            yield group_offset, None, files
+    finally:
+        stream.close()
+
+
+def _pop_random(buffer, rng):
+    idx = rng.integers(len(buffer))
+    buffer[idx], buffer[-1] = buffer[-1], buffer[idx]
+    return buffer.pop()
+
+
+class ResumableWebDataset:
+    """
+    Webdataset reading pipeline (urls -> tar -> samples -> decoded samples -> batches) whose position can be saved and
+    restored exactly, without reading again what was already consumed.
+
+    The state of a worker (see `state_dict`) is:
+    - the url being read and the byte offset of the next tar member to read in it,
+    - the state of the random generator used by the shuffle buffers,
+    - the positions (url, offset) of the samples in the samples shuffle buffer, and the positions of the samples of
+      the batches in the batches shuffle buffer. On resume, only these few samples are read again.
+
+    The urls shuffles use full permutations seeded by `(seed, epoch)` (identical on all the nodes, so that splitting by
+    node gives disjoint shards) and `(seed, epoch, rank)`, the shuffle buffers a generator seeded by
+    `(seed, epoch, rank, worker_id)`. `set_worker_info` has to be called with the worker id that is saved along the
+    state, so that a state is always restored in the worker that reads the same urls.
+
+    Args:
+        urls (`List[str]`): Paths or `pipe:` commands of the tar shards.
+        group_fn: Function turning the list of files of a sample into a sample (e.g. `group_by_keys_interleaved`).
+        decode_ops (`List`): Pipeline filters applied to each sample. A sample can be decoded into several ones.
+        batch_size (`int`): Number of decoded samples per batch. The last batch can be smaller.
+        shuffle_urls_before_split_by_node (`bool`): Shuffle the urls before splitting them between the nodes.
+        shuffle_urls_before_split_by_worker (`bool`): Shuffle the urls of a node before splitting them between workers.
+        shuffle_samples_buffer_size (`int`, *optional*): Size of the samples shuffle buffer. No shuffle if None.
+        shuffle_batches_buffer_size (`int`, *optional*): Size of the batches shuffle buffer. No shuffle if None.
+    """
+
+    def __init__(
+        self,
+        urls,
+        group_fn,
+        decode_ops,
+        batch_size,
+        shuffle_urls_before_split_by_node=False,
+        shuffle_urls_before_split_by_worker=False,
+        shuffle_samples_buffer_size=None,
+        shuffle_batches_buffer_size=None,
+        handler=log_and_continue,
+    ):
+        self.urls = list(urls)
+        self.group_fn = group_fn
+        self.decode_ops = decode_ops
+        self.batch_size = batch_size
+        self.shuffle_urls_before_split_by_node = shuffle_urls_before_split_by_node
+        self.shuffle_urls_before_split_by_worker = shuffle_urls_before_split_by_worker
+        self.shuffle_samples_buffer_size = shuffle_samples_buffer_size
+        self.shuffle_batches_buffer_size = shuffle_batches_buffer_size
+        self.handler = handler
+
+        self.seed = 0
+        self.epoch = 0
+        # Defaults to the torch distributed / dataloader worker info if `set_worker_info` is not called
+        self.rank, self.world_size, self.worker_id, self.num_workers = None, None, None, None
+
+        self._resume_state = None
+        # References to the structures of the running iteration, to build the state from
+        self._live = None
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def set_worker_info(self, seed, rank, world_size, worker_id, num_workers):
+        self.seed = seed
+        self.rank, self.world_size = rank, world_size
+        self.worker_id, self.num_workers = worker_id, num_workers
+
+    def load_worker_state(self, state):
+        """`state` (from `state_dict`) is restored at the next `iter`. None restarts from the start of the epoch."""
+        self._resume_state = state
+
+    def state_dict(self):
+        """Position of this worker after the last batch yielded, None if nothing was read yet."""
+        if self._live is None:
+            return copy.deepcopy(self._resume_state)
+        state, rng, sample_buffer, pending, batch_buffer = self._live
+        return {
+            "epoch": self.epoch,
+            "url_idx": state["url_idx"],
+            "url": state["url"],
+            "offset": state["offset"],
+            "rng_state": copy.deepcopy(rng.bit_generator.state),
+            "sample_buffer": [position for position, _ in sample_buffer],
+            "pending": copy.copy(pending["position"]) if pending["num_consumed"] < pending["num_outputs"] else None,
+            "pending_num_consumed": pending["num_consumed"],
+            "batch_buffer": [[provenance for provenance, _ in batch] for batch in batch_buffer],
+        }
+
+    def _get_split_info(self):
+        rank, world_size = self.rank, self.world_size
+        if rank is None or world_size is None:
+            rank, world_size, _, _ = wds.utils.pytorch_worker_info()
+        worker_id, num_workers = self.worker_id, self.num_workers
+        if worker_id is None or num_workers is None:
+            worker_info = torch.utils.data.get_worker_info()
+            worker_id, num_workers = (0, 1) if worker_info is None else (worker_info.id, worker_info.num_workers)
+        return rank, world_size, worker_id, num_workers
+
+    def _get_worker_urls(self, rank, world_size, worker_id, num_workers):
+        urls = list(self.urls)
+        if self.shuffle_urls_before_split_by_node:
+            np.random.default_rng([self.seed, self.epoch]).shuffle(urls)
+        urls = urls[rank::world_size]
+        if self.shuffle_urls_before_split_by_worker:
+            np.random.default_rng([self.seed, self.epoch, rank]).shuffle(urls)
+        return urls[worker_id::num_workers]
+
+    def _group(self, files):
+        return next(iter(self.group_fn(iter(files))), None)
+
+    def _decode(self, sample):
+        data = iter([sample])
+        for op in self.decode_ops:
+            data = op(data)
+        return list(data)
+
+    def _read_samples_at(self, positions):
+        """Returns {(url, offset): sample} for the samples starting at `positions`, reading each url once."""
+        offsets_per_url = defaultdict(set)
+        for url, offset in positions:
+            offsets_per_url[url].add(offset)
+        samples = {}
+        for url, offsets in offsets_per_url.items():
+            remaining = set(offsets)
+            try:
+                for group_offset, _, files in iter_tar_groups(url, min(offsets)):
+                    if group_offset in remaining:
+                        samples[(url, group_offset)] = self._group(files)
+                        remaining.discard(group_offset)
+                        if len(remaining) == 0:
+                            break
+            except Exception as exn:
+                if not self.handler(exn):
+                    raise
+        return samples
+
+    def _decoded_outputs_at(self, provenances):
+        """Returns the decoded samples designated by `(url, offset, output_idx)` provenances."""
+        raw_samples = self._read_samples_at({(url, offset) for url, offset, _ in provenances})
+        decoded = {
+            position: self._decode(sample) if sample is not None else []
+            for position, sample in raw_samples.items()
+        }
+        outputs = []
+        for url, offset, output_idx in provenances:
+            position_outputs = decoded.get((url, offset), [])
+            if output_idx < len(position_outputs):
+                outputs.append(((url, offset, output_idx), position_outputs[output_idx]))
+            else:
+                logger.warning(f"Could not restore the sample at offset {offset} of {url}, skipping it.")
+        return outputs
+
+    def __iter__(self):
+        self._live = None
+        return self._iterate()
+
+    def _iterate(self):
+        rank, world_size, worker_id, num_workers = self._get_split_info()
+        urls = self._get_worker_urls(rank, world_size, worker_id, num_workers)
+        rng = np.random.default_rng([self.seed, self.epoch, rank, worker_id])
+
+        state = {"url_idx": 0, "url": urls[0] if len(urls) > 0 else None, "offset": 0}
+        sample_buffer, batch_buffer = [], []
+        pending = {"position": None, "num_consumed": 0, "num_outputs": 0}
+        restored_pending = []
+
+        resume_state, self._resume_state = self._resume_state, None
+        if resume_state is not None and resume_state["epoch"] != self.epoch:
+            logger.warning(
+                f"Ignoring the webdataset state of epoch {resume_state['epoch']} at epoch {self.epoch}, starting over."
+            )
+            resume_state = None
+        if resume_state is not None:
+            url_idx = resume_state["url_idx"]
+            if url_idx < len(urls) and resume_state["url"] is not None and urls[url_idx] != resume_state["url"]:
+                # The list of urls has changed, look for the url we were reading
+                url_idx = urls.index(resume_state["url"]) if resume_state["url"] in urls else len(urls)
+                logger.warning(f"Resuming from {resume_state['url']} at index {url_idx} of the list of urls.")
+            state["url_idx"] = url_idx
+            state["url"] = urls[url_idx] if url_idx < len(urls) else None
+            state["offset"] = resume_state["offset"]
+            rng.bit_generator.state = resume_state["rng_state"]
+
+            positions = [tuple(position) for position in resume_state["sample_buffer"]]
+            if resume_state["pending"] is not None:
+                positions.append(tuple(resume_state["pending"]))
+            raw_samples = self._read_samples_at(positions)
+            sample_buffer = [
+                (position, raw_samples[position])
+                for position in positions[: len(resume_state["sample_buffer"])]
+                if raw_samples.get(position) is not None
+            ]
+            if resume_state["pending"] is not None and raw_samples.get(positions[-1]) is not None:
+                restored_pending = [(positions[-1], raw_samples[positions[-1]], resume_state["pending_num_consumed"])]
+            batch_buffer = [
+                self._decoded_outputs_at([tuple(provenance) for provenance in batch])
+                for batch in resume_state["batch_buffer"]
+            ]
+
+        self._live = (state, rng, sample_buffer, pending, batch_buffer)
+
+        def read_samples():
+            while state["url_idx"] < len(urls):
+                url_idx = state["url_idx"]
+                url = urls[url_idx]
+                try:
+                    for group_offset, next_offset, files in iter_tar_groups(url, state["offset"]):
+                        # Move the position past this sample before handing it over
+                        if next_offset is None:
+                            state["url_idx"], state["offset"] = url_idx + 1, 0
+                            state["url"] = urls[url_idx + 1] if url_idx + 1 < len(urls) else None
+                        else:
+                            state["offset"] = next_offset
+                        sample = self._group(files)
+                        if sample is not None:
+                            yield (url, group_offset), sample
+                except Exception as exn:
+                    if not self.handler(exn):
+                        raise
+                if state["url_idx"] == url_idx:
+                    # Empty or broken tar
+                    state["url_idx"], state["offset"] = url_idx + 1, 0
+                    state["url"] = urls[url_idx + 1] if url_idx + 1 < len(urls) else None
+
+        def shuffle_samples(samples):
+            if self.shuffle_samples_buffer_size is None:
+                yield from samples
+                return
+            for item in samples:
+                sample_buffer.append(item)
+                if len(sample_buffer) >= self.shuffle_samples_buffer_size:
+                    yield _pop_random(sample_buffer, rng)
+            while len(sample_buffer) > 0:
+                yield _pop_random(sample_buffer, rng)
+
+        def decode_samples(samples):
+            for position, sample, num_consumed in itertools.chain(
+                restored_pending, ((position, sample, 0) for position, sample in samples)
+            ):
+                outputs = self._decode(sample)
+                pending["position"], pending["num_outputs"] = position, len(outputs)
+                for output_idx in range(num_consumed, len(outputs)):
+                    pending["num_consumed"] = output_idx + 1
+                    yield (*position, output_idx), outputs[output_idx]
+
+        def batch_samples(samples):
+            batch = []
+            for item in samples:
+                batch.append(item)
+                if len(batch) == self.batch_size:
+                    yield batch
+                    batch = []
+            if len(batch) > 0:
+                yield batch
+
+        def shuffle_batches(batches):
+            if self.shuffle_batches_buffer_size is None:
+                yield from batch_buffer
+                batch_buffer.clear()
+                yield from batches
+                return
+            for batch in batches:
+                batch_buffer.append(batch)
+                if len(batch_buffer) >= self.shuffle_batches_buffer_size:
+                    yield _pop_random(batch_buffer, rng)
+            while len(batch_buffer) > 0:
+                yield _pop_random(batch_buffer, rng)
+
+        for batch in shuffle_batches(batch_samples(decode_samples(shuffle_samples(read_samples())))):
+            if len(batch) > 0:
+                yield collate_dicts([sample for _, sample in batch])
+
+
 # General
 def _get_web_dataset(
     urls,
-    tar_to_samples_ops,
-    decode_and_batch_ops,
+    group_fn,
+    decode_ops,
+    batch_size,
     shuffle_initial_urls_list=False,
     shuffle_before_split_by_node_buffer_size=100,
     shuffle_before_split_by_worker_buffer_size=100,
@@ -358,28 +701,22 @@ def _get_web_dataset(
     if shuffle_initial_urls_list:
         random.shuffle(urls)
 
-    pipeline_list = [wds.SimpleShardList(urls)]
-
-    if shuffle_before_split_by_node_buffer_size is not None:
-        pipeline_list.append(wds.shuffle(shuffle_before_split_by_node_buffer_size))
-
-    pipeline_list.append(wds.split_by_node)
-
-    if shuffle_before_split_by_worker_buffer_size is not None:
-        pipeline_list.append(wds.shuffle(shuffle_before_split_by_worker_buffer_size))
-
-    pipeline_list.extend(tar_to_samples_ops)
-
-    if shuffle_after_tarfile_to_samples_buffer_size is not None:
-        pipeline_list.append(wds.shuffle(shuffle_after_tarfile_to_samples_buffer_size))
+    # The urls are shuffled with full (seeded) permutations, the buffer sizes only enable them
+    dataset = ResumableWebDataset(
+        urls,
+        group_fn=group_fn,
+        decode_ops=decode_ops,
+        batch_size=batch_size,
+        shuffle_urls_before_split_by_node=shuffle_before_split_by_node_buffer_size is not None,
+        shuffle_urls_before_split_by_worker=shuffle_before_split_by_worker_buffer_size is not None,
+        shuffle_samples_buffer_size=shuffle_after_tarfile_to_samples_buffer_size,
+        shuffle_batches_buffer_size=shuffle_after_batching_buffer_size,
+    )
+    return dataset
 
-    pipeline_list.extend(decode_and_batch_ops)
 
-    if shuffle_after_batching_buffer_size is not None:
-        pipeline_list.append(wds.shuffle(shuffle_after_batching_buffer_size))
-
-    dataset = wds.DataPipeline(pipeline_list)
-    return dataset
+def _group_pair_files(files, handler=log_and_continue):
+    return group_by_keys(files, keys=split_keep_2, handler=handler)
 
 
 def get_webdataset(
@@ -393,101 +730,37 @@ def get_webdataset(
     shuffle_after_batching_buffer_size,
 ):
     if ds_type == DatasetTypes.WEB_DOCUMENTS:
-        tar_to_samples_ops = [
-            wds.split_by_worker,
-            tarfile_to_webdocument_samples(),
-        ]
-        decode_and_batch_ops = [
+        group_fn = group_by_keys_interleaved
+        decode_ops = [
             collate_texts_and_images_webdocument(),
             decode_image_and_text_webdocument(),
-            wds.batched(batch_size, collation_fn=collate_dicts, partial=True),
         ]
-        return _get_web_dataset(
-            urls,
-            tar_to_samples_ops,
-            decode_and_batch_ops,
-            shuffle_initial_urls_list,
-            shuffle_before_split_by_node_buffer_size,
-            shuffle_before_split_by_worker_buffer_size,
-            shuffle_after_tarfile_to_samples_buffer_size,
-            shuffle_after_batching_buffer_size,
-        )
     elif ds_type == DatasetTypes.IMAGE_CAPTION_PAIRS:
-        tar_to_samples_ops = [
-            wds.split_by_worker,
-            tarfile_to_pair_samples(handler=log_and_continue),
-        ]
-        decode_and_batch_ops = [
-            decode_image_and_text_pairs(),
-            wds.batched(batch_size, collation_fn=collate_dicts, partial=True),
-        ]
-        return _get_web_dataset(
-            urls,
-            tar_to_samples_ops,
-            decode_and_batch_ops,
-            shuffle_initial_urls_list,
-            shuffle_before_split_by_node_buffer_size,
-            shuffle_before_split_by_worker_buffer_size,
-            shuffle_after_tarfile_to_samples_buffer_size,
-            shuffle_after_batching_buffer_size,
-        )
+        group_fn = _group_pair_files
+        decode_ops = [decode_image_and_text_pairs()]
     elif ds_type == DatasetTypes.OCR:
-        tar_to_samples_ops = [
-            wds.split_by_worker,
-            tarfile_to_pair_samples(handler=log_and_continue),
-        ]
-        decode_and_batch_ops = [
-            decode_ocr_documents(),
-            wds.batched(batch_size, collation_fn=collate_dicts, partial=True),
-        ]
-        return _get_web_dataset(
-            urls,
-            tar_to_samples_ops,
-            decode_and_batch_ops,
-            shuffle_initial_urls_list,
-            shuffle_before_split_by_node_buffer_size,
-            shuffle_before_split_by_worker_buffer_size,
-            shuffle_after_tarfile_to_samples_buffer_size,
-            shuffle_after_batching_buffer_size,
-        )
+        group_fn = _group_pair_files
+        decode_ops = [decode_ocr_documents()]
     elif (ds_type == DatasetTypes.VQAV2_TASK_FINETUNING) or (ds_type == DatasetTypes.DOCVQA):
-        tar_to_samples_ops = [
-            wds.split_by_worker,
-            tarfile_to_pair_samples(handler=log_and_continue),
-        ]
-        decode_and_batch_ops = [
-            decode_iqa_triplets(),
-            wds.batched(batch_size, collation_fn=collate_dicts, partial=True),
-        ]
-        return _get_web_dataset(
-            urls,
-            tar_to_samples_ops,
-            decode_and_batch_ops,
-            shuffle_initial_urls_list,
-            shuffle_before_split_by_node_buffer_size,
-            shuffle_before_split_by_worker_buffer_size,
-            shuffle_after_tarfile_to_samples_buffer_size,
-            shuffle_after_batching_buffer_size,
-        )
+        group_fn = _group_pair_files
+        decode_ops = [decode_iqa_triplets()]
     elif ds_type == DatasetTypes.SFT:
-        tar_to_samples_ops = [
-            wds.split_by_worker,
-            tarfile_to_webdocument_samples(),
-        ]
-        decode_and_batch_ops = [
+        group_fn = group_by_keys_interleaved
+        decode_ops = [
             collate_texts_and_images_webdocument(),
             decode_image_and_text_sft(),
-            wds.batched(batch_size, collation_fn=collate_dicts, partial=True),
         ]
-        return _get_web_dataset(
-            urls,
-            tar_to_samples_ops,
-            decode_and_batch_ops,
-            shuffle_initial_urls_list,
-            shuffle_before_split_by_node_buffer_size,
-            shuffle_before_split_by_worker_buffer_size,
-            shuffle_after_tarfile_to_samples_buffer_size,
-            shuffle_after_batching_buffer_size,
-        )
     else:
         raise ValueError(f"Unknown dataset type: {ds_type}")
+
+    return _get_web_dataset(
+        urls,
+        group_fn,
+        decode_ops,
+        batch_size,
+        shuffle_initial_urls_list,
+        shuffle_before_split_by_node_buffer_size,
+        shuffle_before_split_by_worker_buffer_size,
+        shuffle_after_tarfile_to_samples_buffer_size,
+        shuffle_after_batching_buffer_size,
+    )
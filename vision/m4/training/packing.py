@@ -8,6 +8,7 @@ from typing import List
 
 import numpy as np
 import torch
+from PIL import Image
 
 from m4.training.utils import END_OF_UTTERANCE_TOKEN, FAKE_TOKEN_AROUND_IMAGE_V2, IMAGE_TOKEN, image_splitting
 
@@ -23,24 +24,8 @@ _MIN_LENGTH_DOCUMENTS_TO_PACK = (
 RANDOM_LINE_BREAK_PROB = 0.05
 
 
-def get_splitted_images_and_corresponding_text(
-    image,
-    vision_encoder_max_image_size,
-    max_image_size,
-    pre_split_scale_up_max,
-    pre_split_scale_up_frequency,
-    image_seq_len,
-    scale_up_factor=None,
-):
-    splitted_images_array, image_rows, image_cols = image_splitting(
-        image=image,
-        vision_encoder_max_image_size=vision_encoder_max_image_size,
-        max_image_size=max_image_size,
-        pre_split_scale_up_max=pre_split_scale_up_max,
-        pre_split_scale_up_frequency=pre_split_scale_up_frequency,
-        scale_up_factor=scale_up_factor,
-    )
-    if len(splitted_images_array) > 1:
+def get_splitted_images_text(image_rows, image_cols, num_splitted_images, image_seq_len):
+    if num_splitted_images > 1:
         text_splitted_images = ""
         for n_h in range(image_rows):
             for n_w in range(image_cols):
@@ -63,9 +48,80 @@ def get_splitted_images_and_corresponding_text(
             + f"{IMAGE_TOKEN}" * image_seq_len
             + f"{FAKE_TOKEN_AROUND_IMAGE_V2}"
         )
+    return text_splitted_images
+
+
+def get_splitted_images_and_corresponding_text(
+    image,
+    vision_encoder_max_image_size,
+    max_image_size,
+    pre_split_scale_up_max,
+    pre_split_scale_up_frequency,
+    image_seq_len,
+    scale_up_factor=None,
+):
+    splitted_images_array, image_rows, image_cols = image_splitting(
+        image=image,
+        vision_encoder_max_image_size=vision_encoder_max_image_size,
+        max_image_size=max_image_size,
+        pre_split_scale_up_max=pre_split_scale_up_max,
+        pre_split_scale_up_frequency=pre_split_scale_up_frequency,
+        scale_up_factor=scale_up_factor,
+    )
+    text_splitted_images = get_splitted_images_text(image_rows, image_cols, len(splitted_images_array), image_seq_len)
     return splitted_images_array, text_splitted_images
 
 
+def get_batch_splitted_images_and_corresponding_text(
+    images,
+    vision_encoder_max_image_size,
+    max_image_size,
+    pre_split_scale_up_max,
+    pre_split_scale_up_frequency,
+    image_seq_len,
+    image_tile_pipeline=None,
+):
+    """
+    `get_splitted_images_and_corresponding_text` over a list of images. With an `image_tile_pipeline`, the images
+    are split (concurrently if the pipeline has threads) into uint8 arrays that `transform_splitted_images` normalizes
+    as a single batch. The random pre-split scale up is drawn in the order of `images` in both cases.
+    """
+    if image_tile_pipeline is None:
+        return [
+            get_splitted_images_and_corresponding_text(
+                image=image,
+                vision_encoder_max_image_size=vision_encoder_max_image_size,
+                max_image_size=max_image_size,
+                pre_split_scale_up_max=pre_split_scale_up_max,
+                pre_split_scale_up_frequency=pre_split_scale_up_frequency,
+                image_seq_len=image_seq_len,
+            )
+            for image in images
+        ]
+    return [
+        (
+            splitted_images_array,
+            get_splitted_images_text(image_rows, image_cols, len(splitted_images_array), image_seq_len),
+        )
+        for splitted_images_array, image_rows, image_cols in image_tile_pipeline.split(images)
+    ]
+
+
+def transform_splitted_images(image_transform, splitted_images):
+    """
+    Applies `image_transform` to a list of sub-images and returns the list of tensors. Sub-images coming from an
+    `ImageTilePipeline` (numpy arrays) go through the batched `image_transform.tile_normalizer`.
+    """
+    if len(splitted_images) == 0:
+        return []
+    if isinstance(splitted_images[0], np.ndarray):
+        tile_normalizer = getattr(image_transform, "tile_normalizer", None)
+        if tile_normalizer is not None:
+            return list(tile_normalizer(splitted_images))
+        return [image_transform(Image.fromarray(image)) for image in splitted_images]
+    return [image_transform(image) for image in splitted_images]
+
+
 def remove_extra_images(
     input_ids_: List[int],
     images_: List[torch.FloatTensor],
@@ -462,6 +518,7 @@ def split_pack_and_pad_webdocs(
     pre_split_scale_up_max=1.0,
     pre_split_scale_up_frequency=0.0,
     max_num_samples_per_document=10,
+    image_tile_pipeline=None,
     prefix_seed=(0, 0),
     add_begin_of_doc_token=True,
     add_end_of_doc_token=True,
@@ -593,6 +650,23 @@ def split_pack_and_pad_webdocs(
 
         for s_r_ims, s_r_txts in zip(splitted_raw_images, splitted_raw_texts):
             images, web_text = [], ""
+            # Split all the images kept below at once, in the same order as the loop
+            splitted_images_and_texts = iter(
+                get_batch_splitted_images_and_corresponding_text(
+                    images=[
+                        image
+                        for image, text in zip(s_r_ims, s_r_txts)
+                        if image is not None
+                        and (text is None or (FAKE_TOKEN_AROUND_IMAGE_V2 not in text and IMAGE_TOKEN not in text))
+                    ],
+                    vision_encoder_max_image_size=vision_encoder_max_image_size,
+                    max_image_size=max_image_size,
+                    pre_split_scale_up_max=pre_split_scale_up_max,
+                    pre_split_scale_up_frequency=pre_split_scale_up_frequency,
+                    image_seq_len=image_seq_len,
+                    image_tile_pipeline=image_tile_pipeline,
+                )
+            )
             for image, text in zip(s_r_ims, s_r_txts):
                 if text is None and image is None:
                     continue
@@ -600,16 +674,9 @@ def split_pack_and_pad_webdocs(
                     continue
 
                 if image is not None:
-                    splitted_image_array, text_splitted_images = get_splitted_images_and_corresponding_text(
-                        image=image,
-                        vision_encoder_max_image_size=vision_encoder_max_image_size,
-                        max_image_size=max_image_size,
-                        pre_split_scale_up_max=pre_split_scale_up_max,
-                        pre_split_scale_up_frequency=pre_split_scale_up_frequency,
-                        image_seq_len=image_seq_len,
-                    )
+                    splitted_image_array, text_splitted_images = next(splitted_images_and_texts)
                     web_text += text_splitted_images
-                    images.extend([image_transform(img) for img in splitted_image_array])
+                    images.extend(transform_splitted_images(image_transform, splitted_image_array))
                     last_was_image = True
                 elif text is not None:
                     if last_was_image:
@@ -911,6 +978,7 @@ def split_pack_and_pad_pairs(
     vision_encoder_max_image_size=384,
     pre_split_scale_up_max=1.0,
     pre_split_scale_up_frequency=0.0,
+    image_tile_pipeline=None,
     prefix_seed=(0, 0),
     add_begin_of_doc_token=True,
     add_end_of_doc_token=True,
@@ -937,20 +1005,25 @@ def split_pack_and_pad_pairs(
     filtered_image_batch = []
     filtered_input_ids = []
 
-    for image, text in zip(image_batch, text_batch):
-        if text is None or image is None:
-            continue
-        if (text is not None) and ((FAKE_TOKEN_AROUND_IMAGE_V2 in text) or (IMAGE_TOKEN in text)):
-            continue
+    kept_pairs = [
+        (image, text)
+        for image, text in zip(image_batch, text_batch)
+        if text is not None
+        and image is not None
+        and FAKE_TOKEN_AROUND_IMAGE_V2 not in text
+        and IMAGE_TOKEN not in text
+    ]
+    splitted_images_and_texts = get_batch_splitted_images_and_corresponding_text(
+        images=[image for image, _ in kept_pairs],
+        vision_encoder_max_image_size=vision_encoder_max_image_size,
+        max_image_size=max_image_size,
+        pre_split_scale_up_max=pre_split_scale_up_max,
+        pre_split_scale_up_frequency=pre_split_scale_up_frequency,
+        image_seq_len=image_seq_len,
+        image_tile_pipeline=image_tile_pipeline,
+    )
 
-        splitted_image_array, sample_text = get_splitted_images_and_corresponding_text(
-            image=image,
-            vision_encoder_max_image_size=vision_encoder_max_image_size,
-            max_image_size=max_image_size,
-            pre_split_scale_up_max=pre_split_scale_up_max,
-            pre_split_scale_up_frequency=pre_split_scale_up_frequency,
-            image_seq_len=image_seq_len,
-        )
+    for (_, text), (splitted_image_array, sample_text) in zip(kept_pairs, splitted_images_and_texts):
 
         # Remove trailing and leading whitespaces, including newlines and tabs
         text = text.strip()
@@ -967,7 +1040,7 @@ def split_pack_and_pad_pairs(
         if len(sample_input_ids) > max_seq_len:
             continue
 
-        filtered_image_batch.append([image_transform(image) for image in splitted_image_array])
+        filtered_image_batch.append(transform_splitted_images(image_transform, splitted_image_array))
 
         filtered_input_ids.append(sample_input_ids)
 
@@ -1023,6 +1096,7 @@ def split_pack_and_pad_ocr(
     vision_encoder_max_image_size=384,
     pre_split_scale_up_max=1.0,
     pre_split_scale_up_frequency=0.0,
+    image_tile_pipeline=None,
     prefix_seed=(0, 0),
     add_begin_of_doc_token=True,
     add_end_of_doc_token=True,
@@ -1082,18 +1156,20 @@ def split_pack_and_pad_ocr(
         curr_image_sublist = []
         curr_text_sublist = []
         curr_image_sublist_text = ""
-        for i, (curr_image, curr_text) in enumerate(zip(image_list, text_list)):
+        splitted_images_and_texts = get_batch_splitted_images_and_corresponding_text(
+            images=image_list[: len(text_list)],
+            vision_encoder_max_image_size=vision_encoder_max_image_size,
+            max_image_size=max_image_size,
+            pre_split_scale_up_max=pre_split_scale_up_max,
+            pre_split_scale_up_frequency=pre_split_scale_up_frequency,
+            image_seq_len=image_seq_len,
+            image_tile_pipeline=image_tile_pipeline,
+        )
+        for i, (curr_text, (splitted_image_array, curr_image_text)) in enumerate(
+            zip(text_list, splitted_images_and_texts)
+        ):
             curr_text_sublist.append(curr_text)
 
-            splitted_image_array, curr_image_text = get_splitted_images_and_corresponding_text(
-                image=curr_image,
-                vision_encoder_max_image_size=vision_encoder_max_image_size,
-                max_image_size=max_image_size,
-                pre_split_scale_up_max=pre_split_scale_up_max,
-                pre_split_scale_up_frequency=pre_split_scale_up_frequency,
-                image_seq_len=image_seq_len,
-            )
-
             sample_input_ids = tokenize_text_sublist(
                 curr_text_sublist=curr_text_sublist,
                 curr_image_sublist_text=curr_image_sublist_text,
@@ -1116,7 +1192,7 @@ def split_pack_and_pad_ocr(
                     curr_image_text="",
                     tokenizer=tokenizer,
                 )
-                filtered_image_batch.append([image_transform(image) for image in curr_image_sublist])
+                filtered_image_batch.append(transform_splitted_images(image_transform, curr_image_sublist))
                 filtered_input_ids.append(sample_input_ids)
 
                 # Current text sublist is now only the last element of the previous sublist. We tokenize the new text sublist as we now need to check if it is longer than max_seq_len,
@@ -1142,7 +1218,7 @@ def split_pack_and_pad_ocr(
                         + sample_input_ids[chunk_start_index : chunk_start_index + max_len_input_ids_chunk]
                     )
                 for sample in list_sample_input_ids:
-                    filtered_image_batch.append([image_transform(image) for image in splitted_image_array])
+                    filtered_image_batch.append(transform_splitted_images(image_transform, splitted_image_array))
                     filtered_input_ids.append(sample)
 
                 # reset the sublists for the next iteration
@@ -1155,7 +1231,7 @@ def split_pack_and_pad_ocr(
                 curr_image_sublist.extend(splitted_image_array)
                 curr_image_sublist_text += curr_image_text
                 if i + 1 == len_text_list or len(curr_image_sublist) == MAX_NUM_IMAGES_AFTER_SPLIT:
-                    filtered_image_batch.append([image_transform(image) for image in curr_image_sublist])
+                    filtered_image_batch.append(transform_splitted_images(image_transform, curr_image_sublist))
                     filtered_input_ids.append(sample_input_ids)
                     curr_image_sublist = []
                     curr_text_sublist = []
@@ -1301,6 +1377,7 @@ def split_pack_and_pad_sft(
     vision_encoder_max_image_size=384,
     pre_split_scale_up_max=1.0,
     pre_split_scale_up_frequency=0.0,
+    image_tile_pipeline=None,
     prefix_seed=(0, 0),
     add_begin_of_doc_token=True,
     add_end_of_doc_token=True,
@@ -1344,15 +1421,17 @@ def split_pack_and_pad_sft(
                 continue
 
         images_text = ""
-        for idx_image, image in enumerate(images):
-            images[idx_image], text_splitted_images = get_splitted_images_and_corresponding_text(
-                image=image,
-                vision_encoder_max_image_size=vision_encoder_max_image_size,
-                max_image_size=max_image_size,
-                pre_split_scale_up_max=pre_split_scale_up_max,
-                pre_split_scale_up_frequency=pre_split_scale_up_frequency,
-                image_seq_len=image_seq_len,
-            )
+        splitted_images_and_texts = get_batch_splitted_images_and_corresponding_text(
+            images=images,
+            vision_encoder_max_image_size=vision_encoder_max_image_size,
+            max_image_size=max_image_size,
+            pre_split_scale_up_max=pre_split_scale_up_max,
+            pre_split_scale_up_frequency=pre_split_scale_up_frequency,
+            image_seq_len=image_seq_len,
+            image_tile_pipeline=image_tile_pipeline,
+        )
+        for idx_image, (splitted_image_array, text_splitted_images) in enumerate(splitted_images_and_texts):
+            images[idx_image] = splitted_image_array
             images_text += text_splitted_images
 
         images = [sub_el for el in images for sub_el in el]
@@ -1386,7 +1465,7 @@ def split_pack_and_pad_sft(
 
         if len(sample_input_ids) > max_seq_len:
             continue
-        filtered_image_batch.append([image_transform(im) for im in images])
+        filtered_image_batch.append(transform_splitted_images(image_transform, images))
         filtered_input_ids.append(sample_input_ids)
 
     input_ids_to_pack = filtered_input_ids
@@ -3,7 +3,9 @@ import gc
 import json
 import logging
 import math
+import os
 import signal
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
 from enum import Enum
 from functools import partial
@@ -391,14 +393,24 @@ def build_image_transform(
             transformed_img = transforms.Compose(ops_to_compose)(img=img)
             return transformed_img
 
+        # Both resize paths above output (size, size) squares, so tiles coming from `image_splitting_to_arrays`
+        # can be resized and normalized as one batch.
+        transform.tile_normalizer = TileNormalizer(
+            size=max_image_size if max_image_size is not None else image_size,
+            mean=[0.5, 0.5, 0.5],
+            std=[0.5, 0.5, 0.5],
+            interpolation=Image.BILINEAR,
+        )
+
     else:
         raise ValueError("Wrong `vision_encoder_type`.")
 
     return transform
 
 
-def image_splitting(
-    image,
+def get_image_split_size(
+    width,
+    height,
     vision_encoder_max_image_size,
     max_image_size,
     pre_split_scale_up_max=1.0,
@@ -406,16 +418,10 @@ def image_splitting(
     scale_up_factor=None,
 ):
     """
-    Image splitting strategy.
-    1) If one side of the original image is larger than `max_image_size`, resize it to `max_image_size` while preserving the aspect ratio.
-    2) Divide the resulting image into `ceil(height / vision_encoder_max_image_size)` x `ceil(width / vision_encoder_max_image_size)`
-    sub-images of approximately the same size each (up to the fact that `vision_encoder_max_image_size` does not divide `height` or
-    `width`).
-    3) [Optional] For all the crops and the original image, resize the largest side to `vision_encoder_max_image_size`, while preserving the aspect ratio.
-    4) Returns the list of the crops and the original image, in addition to the number of splits for the height and the width.
+    Computes the (width, height) an image of size (`width`, `height`) is resized to before being split
+    (steps 1 and 2 of `image_splitting`). This is where the random pre-split scale up is drawn, so it has to
+    be called in the same order as the images are processed to keep runs reproducible.
     """
-
-    width, height = image.size
     aspect_ratio = width / height
 
     if (scale_up_factor is not None) and (scale_up_factor != 1):
@@ -468,31 +474,72 @@ def image_splitting(
         # For some reasons it can happen (rarely) during a training. Don't know the cause.
         width, height = vision_encoder_max_image_size, vision_encoder_max_image_size
 
+    return width, height
+
+
+def _get_crop_boxes(width, height, vision_encoder_max_image_size):
+    """
+    Returns the (start_x, start_y, end_x, end_y) boxes of the sub-images in row-major order, along with the
+    number of splits for the height and the width.
+    """
+    # Calculate the number of splits
+    num_splits_w = math.ceil(width / vision_encoder_max_image_size)
+    num_splits_h = math.ceil(height / vision_encoder_max_image_size)
+    # Calculate the optimal width and height for the sub-images
+    optimal_width = math.ceil(width / num_splits_w)
+    optimal_height = math.ceil(height / num_splits_h)
+
+    boxes = []
+    # Iterate through each row and column
+    for r in range(num_splits_h):
+        for c in range(num_splits_w):
+            # Calculate the starting point of the crop
+            start_x = c * optimal_width
+            start_y = r * optimal_height
+
+            # Calculate the ending point of the crop
+            end_x = min(start_x + optimal_width, width)
+            end_y = min(start_y + optimal_height, height)
+            boxes.append((start_x, start_y, end_x, end_y))
+    return boxes, num_splits_h, num_splits_w
+
+
+def image_splitting(
+    image,
+    vision_encoder_max_image_size,
+    max_image_size,
+    pre_split_scale_up_max=1.0,
+    pre_split_scale_up_frequency=0.0,
+    scale_up_factor=None,
+):
+    """
+    Image splitting strategy.
+    1) If one side of the original image is larger than `max_image_size`, resize it to `max_image_size` while preserving the aspect ratio.
+    2) Divide the resulting image into `ceil(height / vision_encoder_max_image_size)` x `ceil(width / vision_encoder_max_image_size)`
+    sub-images of approximately the same size each (up to the fact that `vision_encoder_max_image_size` does not divide `height` or
+    `width`).
+    3) [Optional] For all the crops and the original image, resize the largest side to `vision_encoder_max_image_size`, while preserving the aspect ratio.
+    4) Returns the list of the crops and the original image, in addition to the number of splits for the height and the width.
+    """
+
+    width, height = get_image_split_size(
+        *image.size,
+        vision_encoder_max_image_size=vision_encoder_max_image_size,
+        max_image_size=max_image_size,
+        pre_split_scale_up_max=pre_split_scale_up_max,
+        pre_split_scale_up_frequency=pre_split_scale_up_frequency,
+        scale_up_factor=scale_up_factor,
+    )
+
     image = image.resize((width, height), Image.LANCZOS)
 
     frames = []
     if height > vision_encoder_max_image_size or width > vision_encoder_max_image_size:
-        # Calculate the number of splits
-        num_splits_w = math.ceil(width / vision_encoder_max_image_size)
-        num_splits_h = math.ceil(height / vision_encoder_max_image_size)
-        # Calculate the optimal width and height for the sub-images
-        optimal_width = math.ceil(width / num_splits_w)
-        optimal_height = math.ceil(height / num_splits_h)
-
-        # Iterate through each row and column
-        for r in range(num_splits_h):
-            for c in range(num_splits_w):
-                # Calculate the starting point of the crop
-                start_x = c * optimal_width
-                start_y = r * optimal_height
-
-                # Calculate the ending point of the crop
-                end_x = min(start_x + optimal_width, width)
-                end_y = min(start_y + optimal_height, height)
-
-                # Crop the image
-                crop = image.crop((start_x, start_y, end_x, end_y))
-                frames.append(crop)
+        boxes, num_splits_h, num_splits_w = _get_crop_boxes(width, height, vision_encoder_max_image_size)
+        for box in boxes:
+            # Crop the image
+            crop = image.crop(box)
+            frames.append(crop)
 
         # For the global image at the end, we resize it to match the vision_encoder_max_image_size, for cpu memory efficiency
         image = image.resize((vision_encoder_max_image_size, vision_encoder_max_image_size), Image.LANCZOS)
@@ -505,6 +552,142 @@ def image_splitting(
     return frames, num_splits_h, num_splits_w
 
 
+def image_splitting_to_arrays(
+    image,
+    vision_encoder_max_image_size,
+    split_size,
+    use_jpeg_draft=False,
+):
+    """
+    Same splitting as `image_splitting`, but producing uint8 RGB arrays instead of PIL images, for the batched
+    tile pipeline (`TileNormalizer`):
+    - with `use_jpeg_draft`, if the image is a not-yet-decoded JPEG much larger than the target, it is decoded at a
+      reduced scale (draft mode), which is faster but changes the pixels,
+    - the image is resized once (LANCZOS) into a single (height, width, 3) buffer and converted to RGB,
+    - the sub-images are slices (views) of that buffer, no crop copies are made.
+
+    `split_size` is the (width, height) returned by `get_image_split_size`. Draft decoding only kicks in when the
+    image is at least twice as large as the target in both dimensions, so the LANCZOS resize still has enough
+    resolution to work with. With `use_jpeg_draft=False` the pixels are identical to `image_splitting`'s
+    followed by `_convert_to_rgb`.
+    """
+    width, height = split_size
+    if use_jpeg_draft and getattr(image, "format", None) == "JPEG" and image.mode in ("RGB", "L"):
+        # No-op if the image was already loaded
+        image.draft(image.mode, (2 * width, 2 * height))
+    resized = image.resize((width, height), Image.LANCZOS)
+    buffer = np.asarray(_convert_to_rgb(resized))
+
+    frames = []
+    if height > vision_encoder_max_image_size or width > vision_encoder_max_image_size:
+        boxes, num_splits_h, num_splits_w = _get_crop_boxes(width, height, vision_encoder_max_image_size)
+        frames = [buffer[start_y:end_y, start_x:end_x] for start_x, start_y, end_x, end_y in boxes]
+        # The global image is resized from the split-size image, as in `image_splitting`
+        global_image = resized.resize((vision_encoder_max_image_size, vision_encoder_max_image_size), Image.LANCZOS)
+        frames.append(np.asarray(_convert_to_rgb(global_image)))
+    else:
+        num_splits_h, num_splits_w = 0, 0
+        frames.append(buffer)
+
+    return frames, num_splits_h, num_splits_w
+
+
+class TileNormalizer(object):
+    """
+    Batched equivalent of `Resize((size, size)) -> ToTensor -> Normalize` for a list of uint8 RGB arrays.
+
+    Tiles already at the target size are copied as is, the others are resized with PIL (same interpolation as the
+    per-image transform). The conversion to float and the normalization then run once on the whole
+    (num_tiles, 3, size, size) batch instead of once per tile.
+    """
+
+    def __init__(self, size, mean, std, interpolation=Image.BILINEAR):
+        self.size = size
+        self.mean = torch.tensor(mean, dtype=torch.float32).view(1, 3, 1, 1)
+        self.std = torch.tensor(std, dtype=torch.float32).view(1, 3, 1, 1)
+        self.interpolation = interpolation
+
+    def __call__(self, tiles):
+        batch = np.empty((len(tiles), self.size, self.size, 3), dtype=np.uint8)
+        for idx, tile in enumerate(tiles):
+            if tile.shape[0] == self.size and tile.shape[1] == self.size:
+                batch[idx] = tile
+            else:
+                batch[idx] = np.asarray(
+                    Image.fromarray(tile).resize((self.size, self.size), resample=self.interpolation)
+                )
+        pixel_values = torch.from_numpy(batch).permute(0, 3, 1, 2).float().div_(255)
+        return pixel_values.sub_(self.mean).div_(self.std)
+
+
+class ImageTilePipeline(object):
+    """
+    Splits a batch of images into uint8 tiles (see `image_splitting_to_arrays`).
+
+    The split sizes (and the random pre-split scale up) are computed sequentially in the calling thread so that the
+    results do not depend on the scheduling, then the decoding and resizing run in a thread pool of `num_threads`
+    threads (PIL releases the GIL while decoding and resizing). With `num_threads=0` everything runs in the
+    calling thread.
+    """
+
+    def __init__(
+        self,
+        vision_encoder_max_image_size,
+        max_image_size,
+        pre_split_scale_up_max=1.0,
+        pre_split_scale_up_frequency=0.0,
+        num_threads=0,
+        use_jpeg_draft=False,
+    ):
+        self.vision_encoder_max_image_size = vision_encoder_max_image_size
+        self.max_image_size = max_image_size
+        self.pre_split_scale_up_max = pre_split_scale_up_max
+        self.pre_split_scale_up_frequency = pre_split_scale_up_frequency
+        self.num_threads = num_threads
+        self.use_jpeg_draft = use_jpeg_draft
+        self._executor = None
+        self._executor_pid = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_executor"] = None
+        state["_executor_pid"] = None
+        return state
+
+    @property
+    def executor(self):
+        # Dataloader workers are forked, each of them needs its own threads
+        if self._executor is None or self._executor_pid != os.getpid():
+            self._executor = ThreadPoolExecutor(max_workers=self.num_threads, thread_name_prefix="image-tiles")
+            self._executor_pid = os.getpid()
+        return self._executor
+
+    def _split(self, image, split_size):
+        return image_splitting_to_arrays(
+            image,
+            vision_encoder_max_image_size=self.vision_encoder_max_image_size,
+            split_size=split_size,
+            use_jpeg_draft=self.use_jpeg_draft,
+        )
+
+    def split(self, images, scale_up_factor=None):
+        """Returns one `(tiles, num_splits_h, num_splits_w)` tuple per image."""
+        split_sizes = [
+            get_image_split_size(
+                *image.size,
+                vision_encoder_max_image_size=self.vision_encoder_max_image_size,
+                max_image_size=self.max_image_size,
+                pre_split_scale_up_max=self.pre_split_scale_up_max,
+                pre_split_scale_up_frequency=self.pre_split_scale_up_frequency,
+                scale_up_factor=scale_up_factor,
+            )
+            for image in images
+        ]
+        if self.num_threads > 0 and len(images) > 1:
+            return list(self.executor.map(self._split, images, split_sizes))
+        return [self._split(image, split_size) for image, split_size in zip(images, split_sizes)]
+
+
 def get_tokenizer(
     tokenizer_name: str,
     tokenizer_add_tokens,
@@ -1,11 +1,13 @@
+import io
 import json
 import logging
 import math
 import os
-import shutil
 import subprocess
+import tarfile
+import time
 import uuid
-from functools import partial
+from concurrent.futures import ThreadPoolExecutor
 
 # import PIL.Image
 from pathlib import Path
@@ -31,121 +33,87 @@ def check_img_exception(img):
         return True
 
 
+# Each `get_*_example_files` function returns the list of `(file name, file bytes)` of an example, in the order they
+# are written in the tar, along with the number of images saved and the number of images in the example.
+# The file names and contents are the ones the `m4.training.dataset_utils` decoding expects.
+def _encode_image(image):
+    buffer = io.BytesIO()
+    image.save(buffer, "jpeg")
+    return buffer.getvalue()
+
+
 # Utils for web documents
-def save_web_document_example_in_files(example, idx, saving_dir):
+def get_web_document_example_files(example, idx):
     example_id = f"{idx}_{str(uuid.uuid4())}"
     saved = 0
     num_img = 0
-    file_paths = []
+    files = []
 
     for i, (text, image) in enumerate(zip(example["texts"], example["images"])):
         if text is not None and text != "":
-            text_file_path = saving_dir / f"{example_id}.{i}.text.txt"
-            with open(text_file_path, "w") as f:
-                f.write(text)
-            file_paths.append(text_file_path)
+            files.append((f"{example_id}.{i}.text.txt", text.encode("utf-8")))
         elif image is not None and image != "":
             num_img += 1
             image = _convert_to_rgb(image)
             if check_img_exception(image):
                 logger.info(f"Example {idx} has image with exception")
                 continue
-            image_path = saving_dir / f"{example_id}.{i}.image.jpeg"
-            image.save(image_path, "jpeg")
+            files.append((f"{example_id}.{i}.image.jpeg", _encode_image(image)))
             saved += 1
-            file_paths.append(image_path)
-    if saved == 0:
-        for file_path in file_paths:
-            os.remove(file_path)
-        return {"saved": saved, "num_img": num_img}
-
-    if len(file_paths) == 0:
-        return {"saved": saved, "num_img": num_img}
-
-    metadata_file_path = saving_dir / f"{example_id}.metadata.txt"
-    with open(metadata_file_path, "w") as f:
-        f.write("\n".join([path.name for path in file_paths]))
-    return {"saved": saved, "num_img": num_img}
-
-
-def save_web_document_example_in_files_with_num_shards(
-    example, idx, saving_dir, num_examples_per_shard, save_shard_prefix
-):
-    shard_idx = idx // num_examples_per_shard
-    saving_dir_shard = saving_dir / f"shard_{save_shard_prefix}{shard_idx}"
+    if saved == 0 or len(files) == 0:
+        return [], saved, num_img
 
-    return save_web_document_example_in_files(example, idx, saving_dir_shard)
+    files.append((f"{example_id}.metadata.txt", "\n".join([name for name, _ in files]).encode("utf-8")))
+    return files, saved, num_img
 
 
 # Utils for image caption pairs
-def save_image_caption_pair_example_in_files(example, idx, saving_dir):
+def get_image_caption_pair_example_files(example, idx):
     image = example["image"]
     if image is None:
         logger.info(f"Example {idx} has None as image")
-        return {"saved": 0, "num_img": 1}
+        return [], 0, 1
 
     image = _convert_to_rgb(image)
     if check_img_exception(image):
         logger.info(f"Example {idx} has image with exception")
-        return {"saved": 0, "num_img": 1}
+        return [], 0, 1
 
     example_id = f"{idx}_{str(uuid.uuid4())}"
-    image_path = saving_dir / f"{example_id}.image.jpeg"
-    image.save(image_path, "jpeg")
-    text_file_path = saving_dir / f"{example_id}.text.txt"
-    with open(text_file_path, "w") as f:
-        f.write(example["text"])
-    return {"saved": 1, "num_img": 1}
-
-
-def save_image_caption_pair_example_in_files_with_num_shards(
-    example, idx, saving_dir, num_examples_per_shard, save_shard_prefix
-):
-    shard_idx = idx // num_examples_per_shard
-    saving_dir_shard = saving_dir / f"shard_{save_shard_prefix}{shard_idx}"
-
-    return save_image_caption_pair_example_in_files(example, idx, saving_dir_shard)
+    files = [
+        (f"{example_id}.image.jpeg", _encode_image(image)),
+        (f"{example_id}.text.txt", example["text"].encode("utf-8")),
+    ]
+    return files, 1, 1
 
 
 # Utils for image/question/answer triplets (in particular for specific fine-tuning)
-def save_image_question_answer_triplet_example_in_files(example, idx, saving_dir):
+def get_image_question_answer_triplet_example_files(example, idx):
     image = example["image"]
     if image is None:
         logger.info(f"Example {idx} has None as image")
-        return {"saved": 0, "num_img": 1}
+        return [], 0, 1
 
     image = _convert_to_rgb(image)
     if check_img_exception(image):
         logger.info(f"Example {idx} has image with exception")
-        return {"saved": 0, "num_img": 1}
+        return [], 0, 1
 
     example_id = f"{idx}_{str(uuid.uuid4())}"
-    image_path = saving_dir / f"{example_id}.image.jpeg"
-    image.save(image_path, "jpeg")
-    question_file_path = saving_dir / f"{example_id}.question.txt"
-    with open(question_file_path, "w") as f:
-        f.write(example["question"])
-    answer_file_path = saving_dir / f"{example_id}.answer.txt"
-    with open(answer_file_path, "w") as f:
-        f.write(example["answer"])
-    return {"saved": 1, "num_img": 1}
-
-
-def save_image_question_answer_triplet_example_in_files_with_num_shards(
-    example, idx, saving_dir, num_examples_per_shard, save_shard_prefix
-):
-    shard_idx = idx // num_examples_per_shard
-    saving_dir_shard = saving_dir / f"shard_{save_shard_prefix}{shard_idx}"
-
-    return save_image_question_answer_triplet_example_in_files(example, idx, saving_dir_shard)
+    files = [
+        (f"{example_id}.image.jpeg", _encode_image(image)),
+        (f"{example_id}.question.txt", example["question"].encode("utf-8")),
+        (f"{example_id}.answer.txt", example["answer"].encode("utf-8")),
+    ]
+    return files, 1, 1
 
 
 # Utils for sft datasets now that they are all under the same format
-def save_sft_example_in_files(example, idx, saving_dir):
+def get_sft_example_files(example, idx):
     example_id = f"{idx}_{str(uuid.uuid4())}"
     saved = 0
     num_img = 0
-    file_paths = []
+    files = []
 
     for i, image in enumerate(example["images"]):
         num_img += 1
@@ -153,74 +121,69 @@ def save_sft_example_in_files(example, idx, saving_dir):
         if check_img_exception(image):
             logger.info(f"Example {idx} has image with exception")
             continue
-        if check_img_exception(image):
-            logger.info(f"Example {idx} has image with exception")
-            continue
-        image_path = saving_dir / f"{example_id}.{i}.image.jpeg"
-        image.save(image_path, "jpeg")
+        files.append((f"{example_id}.{i}.image.jpeg", _encode_image(image)))
         saved += 1
-        file_paths.append(image_path)
 
     for i, text in enumerate(example["texts"]):
-        text_file_path = saving_dir / f"{example_id}.{i + num_img}.text.txt"
-        with open(text_file_path, "w") as f:
-            json.dump(text, f)  # Dump the user/assistant dict as a string into a text file
-        file_paths.append(text_file_path)
-
-    if len(file_paths) == 0:
-        return {"saved": saved, "num_img": num_img}
-
-    metadata_file_path = saving_dir / f"{example_id}.metadata.txt"
-    with open(metadata_file_path, "w") as f:
-        f.write("\n".join([path.name for path in file_paths]))
-    return {"saved": saved, "num_img": num_img}
-
+        # Dump the user/assistant dict as a string
+        files.append((f"{example_id}.{i + num_img}.text.txt", json.dumps(text).encode("utf-8")))
 
-def save_sft_example_in_files_with_num_shards(example, idx, saving_dir, num_examples_per_shard, save_shard_prefix):
-    shard_idx = idx // num_examples_per_shard
-    shard_idx_padded = str(shard_idx).zfill(7)
-    saving_dir_shard = saving_dir / f"shard_{save_shard_prefix}{shard_idx_padded}"
+    if len(files) == 0:
+        return [], saved, num_img
 
-    return save_sft_example_in_files(example, idx, saving_dir_shard)
+    files.append((f"{example_id}.metadata.txt", "\n".join([name for name, _ in files]).encode("utf-8")))
+    return files, saved, num_img
 
 
 # General utils
-def save_example_in_files(example, idx, saving_dir, ds_type):
+def get_example_files(example, idx, ds_type):
     if ds_type == DatasetTypes.WEB_DOCUMENTS:
-        saved = save_web_document_example_in_files(example, idx, saving_dir)
+        return get_web_document_example_files(example, idx)
     elif ds_type == DatasetTypes.IMAGE_CAPTION_PAIRS:
-        saved = save_image_caption_pair_example_in_files(example, idx, saving_dir)
+        return get_image_caption_pair_example_files(example, idx)
     elif (ds_type == DatasetTypes.DOCVQA) or (ds_type == DatasetTypes.VQAV2_TASK_FINETUNING):
-        saved = save_image_question_answer_triplet_example_in_files(example, idx, saving_dir)
+        return get_image_question_answer_triplet_example_files(example, idx)
     elif ds_type == DatasetTypes.SFT:
-        saved = save_sft_example_in_files(example, idx, saving_dir)
+        return get_sft_example_files(example, idx)
     else:
         raise ValueError(f"Unsupported dataset type {ds_type}")
-    return saved
 
 
-def save_example_in_files_with_num_shards(
-    example, idx, saving_dir, ds_type, num_examples_per_shard, save_shard_prefix
-):
-    if ds_type == DatasetTypes.WEB_DOCUMENTS:
-        saved = save_web_document_example_in_files_with_num_shards(
-            example, idx, saving_dir, num_examples_per_shard, save_shard_prefix
-        )
-    elif ds_type == DatasetTypes.IMAGE_CAPTION_PAIRS:
-        saved = save_image_caption_pair_example_in_files_with_num_shards(
-            example, idx, saving_dir, num_examples_per_shard, save_shard_prefix
-        )
-    elif (ds_type == DatasetTypes.DOCVQA) or (ds_type == DatasetTypes.VQAV2_TASK_FINETUNING):
-        saved = save_image_question_answer_triplet_example_in_files_with_num_shards(
-            example, idx, saving_dir, num_examples_per_shard, save_shard_prefix
-        )
-    elif ds_type == DatasetTypes.SFT:
-        saved = save_sft_example_in_files_with_num_shards(
-            example, idx, saving_dir, num_examples_per_shard, save_shard_prefix
-        )
-    else:
-        raise ValueError(f"Unsupported dataset type {ds_type}")
-    return saved
+def write_examples_to_tar(ds, indices, tar_file, ds_type):
+    """
+    Streams the examples `ds[indices]` into the tar `tar_file`, without going through intermediate files.
+    The members are named `./{file name}` like with `tar -C shard_dir .`, and all the files of an example are
+    contiguous. The tar is written to a temporary file and renamed at the end, so a partial tar is never uploaded.
+    Returns `(tar_file or None if no example was saved, num_saved, num_images)`.
+    """
+    tmp_tar_file = tar_file.parent / f"{tar_file.name}.tmp"
+    num_saved, num_images, num_members = 0, 0, 0
+    mtime = time.time()
+    with tarfile.open(tmp_tar_file, "w") as tar:
+        for idx in indices:
+            files, saved, num_img = get_example_files(ds[idx], idx, ds_type)
+            num_saved += saved
+            num_images += num_img
+            for name, data in files:
+                tar_info = tarfile.TarInfo(name=f"./{name}")
+                tar_info.size = len(data)
+                tar_info.mtime = mtime
+                tar_info.mode = 0o644
+                tar.addfile(tar_info, io.BytesIO(data))
+                num_members += 1
+
+    if num_members == 0:
+        tmp_tar_file.unlink()
+        return None, num_saved, num_images
+    os.replace(tmp_tar_file, tar_file)
+    return tar_file, num_saved, num_images
+
+
+def upload_tar_to_s3(tar_file, s3_uri):
+    s3_uri_file = f"{s3_uri}/{tar_file.name}"
+    sync_cmd = ["s5cmd", "cp", str(tar_file), s3_uri_file]
+    subprocess.run(sync_cmd, check=True)
+    return s3_uri_file
 
 
 def export_dataset_all_shard_idx_to_tar(
@@ -234,7 +197,15 @@ def export_dataset_all_shard_idx_to_tar(
     save_shard_prefix: str = "",
     shard_idx: Optional[int] = None,
     save_shard_idx: Optional[str] = None,
+    num_upload_threads: int = 4,
 ):
+    """
+    Exports the concatenation of `hf_datasets_paths` into webdataset tar shards in `saving_dir`.
+
+    The shards are written in parallel by `num_proc` processes, each of them streaming its examples directly into
+    its tar. Each shard is uploaded to `s3_uri` (if specified) in a background thread as soon as it is written, while
+    the next shards are still being written.
+    """
     if save_shard_idx is not None:
         raise NotImplementedError("Use of `save_shard_idx` has been deprecated.")
 
@@ -242,6 +213,9 @@ def export_dataset_all_shard_idx_to_tar(
         # by default the value of num_proc will be the minimum between 6 and the number of cpus
         num_proc = min(6, os.cpu_count())
 
+    saving_dir = Path(saving_dir)
+    saving_dir.mkdir(parents=True, exist_ok=True)
+
     logger.info("Start loading the dataset")
     dataset_list = [load_hf_dataset(str(hf_dataset_path)) for hf_dataset_path in hf_datasets_paths]
     ds = concatenate_datasets(dataset_list)
@@ -266,79 +240,53 @@ def export_dataset_all_shard_idx_to_tar(
     num_examples_per_shard = len(ds) // num_shards
     num_shards = len(ds) // num_examples_per_shard
     logger.info(f"Number of shards: {num_shards} and number of examples per shard: {num_examples_per_shard}")
+    logger.info(f"The dataset has {len(ds)} examples and the columns are {ds.column_names}")
 
     if shard_idx is None:
-        for idx in range(num_shards + 1):
-            idx_leading_0s = str(idx).zfill(7)
-            saving_dir_shard = saving_dir / f"shard_{save_shard_prefix}{idx_leading_0s}"
-            saving_dir_shard.mkdir(parents=True, exist_ok=True)
-
-        logger.info(f"The dataset has {len(ds)} examples and the columns are {ds.column_names}")
-        ds_saved = ds.map(
-            partial(
-                save_example_in_files_with_num_shards,
-                saving_dir=saving_dir,
-                ds_type=ds_type,
-                num_examples_per_shard=num_examples_per_shard,
-                save_shard_prefix=save_shard_prefix,
-            ),
-            with_indices=True,
-            num_proc=num_proc,
-            load_from_cache_file=False,
-            remove_columns=ds.column_names,
-        )
+        # The last shard gets the remaining `len(ds) % num_examples_per_shard` examples
+        shards = [
+            (
+                range(idx * num_examples_per_shard, min((idx + 1) * num_examples_per_shard, len(ds))),
+                saving_dir / f"shard_{save_shard_prefix}{str(idx).zfill(7)}.tar",
+            )
+            for idx in range(num_shards + 1)
+        ]
     else:
         ds = ds.shard(num_shards=num_shards, index=shard_idx)
-        saving_dir_shard = saving_dir / f"shard_{save_shard_prefix}{shard_idx}"
-        saving_dir_shard.mkdir(parents=True, exist_ok=True)
-
-        logger.info(f"The dataset has {len(ds)} examples and the columns are {ds.column_names}")
-        ds_saved = ds.map(
-            partial(save_example_in_files, saving_dir=saving_dir_shard, ds_type=ds_type),
-            with_indices=True,
-            num_proc=num_proc,
-            load_from_cache_file=False,
-        )
+        shards = [(range(len(ds)), saving_dir / f"shard_{save_shard_prefix}{shard_idx}.tar")]
+    shards = [(indices, tar_file) for indices, tar_file in shards if len(indices) > 0]
+
+    def write_shard(shard):
+        indices, tar_file = shard
+        return write_examples_to_tar(ds, indices, tar_file, ds_type)
+
+    num_images, num_saved = 0, 0
+    upload_futures = []
+    pool = Pool(num_proc)
+    with ThreadPoolExecutor(max_workers=num_upload_threads) as upload_executor:
+        # `imap` yields the shards as they are written, so shard N is uploaded while the next ones are being written
+        for tar_file, shard_num_saved, shard_num_images in pool.imap(write_shard, shards):
+            num_saved += shard_num_saved
+            num_images += shard_num_images
+            if tar_file is None:
+                continue
+            logger.info(f"{tar_file} written")
+            if s3_uri is not None:
+                upload_futures.append(upload_executor.submit(upload_tar_to_s3, tar_file, s3_uri))
+        for future in upload_futures:
+            logger.info(f"{future.result()} uploaded")
+    pool.close()
+    pool.join()
+    pool.clear()
+
     finished_file_path = saving_dir / f"shard_{save_shard_prefix}_finished.txt"
     finished_file_path.touch()
 
-    num_images = sum(ds_saved["num_img"])
-    num_saved = sum(ds_saved["saved"])
     logger.info(
         f"Shard {save_shard_prefix} has {num_images} images and out of {num_saved} saved"
-        f" ({num_saved / num_images * 100:.2f}"
+        f" ({num_saved / max(num_images, 1) * 100:.2f}"
     )
 
-    def tar_shard_and_send_to_s3(saving_dir_shard):
-        # check if the shard exists and is not empty
-        if not os.path.exists(saving_dir_shard) or not os.listdir(saving_dir_shard):
-            return
-
-        tar_file = saving_dir_shard.parent / f"{saving_dir_shard.name}.tar"
-
-        # Create tar file
-        tar_cmd = ["tar", "--sort=name", "-cf", str(tar_file), "-C", str(saving_dir_shard), "."]
-        subprocess.run(tar_cmd, check=True)
-
-        # Remove original directory
-        shutil.rmtree(saving_dir_shard, ignore_errors=True)
-
-        # Upload to S3 if necessary
-        if s3_uri is not None:
-            s3_uri_file = f"{s3_uri}/{tar_file.name}"
-            sync_cmd = ["s5cmd", "cp", str(tar_file), s3_uri_file]
-            subprocess.run(sync_cmd, check=True)
-
-        return
-
-    if shard_idx is None:
-        args_pool = [saving_dir / f"shard_{save_shard_prefix}{str(idx).zfill(7)}" for idx in range(num_shards + 1)]
-    else:
-        args_pool = [saving_dir / f"shard_{save_shard_prefix}{shard_idx}"]
-    pool = Pool(num_proc)
-    results = pool.amap(tar_shard_and_send_to_s3, args_pool)
-    results = results.get()
-
     return 0
 
 
@@ -0,0 +1,352 @@
+"""
+Cached and parallel execution of the transforms building the SFT datasets (`build_ds_sft.py`).
+
+- `ImageBytesCache` returns the bytes of an image file in a given format. JPEG and PNG files are returned as they are,
+the other formats are encoded once and cached on disk, keyed on the hash of the content of the file.
+- `TransformRunner` runs a DAG of datasets: sources, and transforms (`map`, `filter`, or any function) of other
+datasets. The result of each transform is saved in `cache_dir`, keyed on the hash of its code and parameters and on
+the fingerprints of its inputs, so that a rebuild only recomputes the transforms whose code or inputs changed. The
+datasets that don't depend on each other are computed in parallel, and the time spent per transform is reported.
+"""
+import copy
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from io import BytesIO
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Union
+
+import datasets
+from datasets import Dataset, load_from_disk
+from datasets.fingerprint import Hasher
+from PIL import Image
+
+
+logger = logging.getLogger(__name__)
+
+
+# Formats already accepted as they are by `datasets.Image`, with the first bytes of their files
+PASSTHROUGH_IMAGE_FORMATS = {"jpeg": [b"\xff\xd8\xff"], "png": [b"\x89PNG\r\n\x1a\n"]}
+
+
+def get_image_format(image_bytes: bytes) -> Optional[str]:
+    for image_format, signatures in PASSTHROUGH_IMAGE_FORMATS.items():
+        if any(image_bytes.startswith(signature) for signature in signatures):
+            return image_format
+    return None
+
+
+class ImageBytesCache:
+    """
+    Bytes of image files, for the `images` column of the SFT datasets. Without `cache_dir`, the encoded images are only
+    cached in memory.
+    """
+
+    def __init__(self, cache_dir: Optional[Union[str, Path]] = None):
+        self.cache_dir = Path(cache_dir) if cache_dir is not None else None
+        self._memory_cache: Dict[str, bytes] = {}
+        self.stats = {"num_passthrough": 0, "num_cached": 0, "num_encoded": 0}
+
+    def __reduce__(self):
+        return self.__class__, (self.cache_dir,)
+
+    def _get_cache_file(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / key
+
+    def get_bytes(self, img_path: Union[str, Path], format: str) -> bytes:
+        with open(img_path, "rb") as f:
+            image_bytes = f.read()
+        # Re-encoding a JPEG or a PNG only loses quality (JPEG) or time (PNG), the pixels decoded are the same
+        if get_image_format(image_bytes) is not None:
+            self.stats["num_passthrough"] += 1
+            return image_bytes
+
+        key = f"{hashlib.sha256(image_bytes).hexdigest()}.{format.lower()}"
+        if key in self._memory_cache:
+            self.stats["num_cached"] += 1
+            return self._memory_cache[key]
+        if self.cache_dir is not None:
+            try:
+                with open(self._get_cache_file(key), "rb") as f:
+                    encoded_bytes = f.read()
+                self.stats["num_cached"] += 1
+                return encoded_bytes
+            except OSError:
+                pass
+
+        with Image.open(BytesIO(image_bytes)) as img:
+            buffer = BytesIO()
+            img.save(buffer, format=format)
+        encoded_bytes = buffer.getvalue()
+        self.stats["num_encoded"] += 1
+        if self.cache_dir is None:
+            self._memory_cache[key] = encoded_bytes
+        else:
+            cache_file = self._get_cache_file(key)
+            cache_file.parent.mkdir(parents=True, exist_ok=True)
+            # Written in a temporary file then renamed, so that the other processes never read a partial image
+            with tempfile.NamedTemporaryFile("wb", dir=cache_file.parent, suffix=".tmp", delete=False) as f:
+                f.write(encoded_bytes)
+            os.replace(f.name, cache_file)
+        return encoded_bytes
+
+
+def disable_image_decoding(feature):
+    """The same feature, with the images kept as `{"bytes", "path"}` dicts instead of being decoded"""
+    if isinstance(feature, datasets.Image):
+        return datasets.Image(decode=False)
+    if isinstance(feature, dict):
+        return {key: disable_image_decoding(sub_feature) for key, sub_feature in feature.items()}
+    if isinstance(feature, (list, tuple)):
+        return [disable_image_decoding(feature[0])]
+    if hasattr(feature, "feature"):
+        feature = copy.deepcopy(feature)
+        feature.feature = disable_image_decoding(feature.feature)
+    return feature
+
+
+def without_image_decoding(dataset: Dataset) -> Dataset:
+    for column_name, feature in dataset.features.items():
+        new_feature = disable_image_decoding(feature)
+        if new_feature != feature:
+            dataset = dataset.cast_column(column_name, new_feature)
+    return dataset
+
+
+@dataclass
+class TransformNode:
+    name: str
+    # Called with the datasets of `inputs`, in this order, and `params`
+    function: Callable[..., Dataset]
+    inputs: List[str] = field(default_factory=list)
+    params: Dict = field(default_factory=dict)
+    # The function whose code is hashed for the cache, when `function` is a wrapper around it
+    hashed_function: Optional[Callable] = None
+    cache: bool = True
+    kind: str = "transform"
+
+
+@dataclass
+class TransformReport:
+    name: str
+    kind: str
+    status: str
+    seconds: float
+    num_rows: int
+    start_time: float
+    end_time: float
+
+
+def get_function_name(function: Callable) -> str:
+    # "<lambda>" for the lambdas
+    return getattr(function, "__name__", type(function).__name__).strip("<>")
+
+
+def _map(dataset, function, decode_images, **map_kwargs):
+    if not decode_images:
+        dataset = without_image_decoding(dataset)
+    return dataset.map(function, **map_kwargs)
+
+
+def _filter(dataset, function, decode_images, **filter_kwargs):
+    if decode_images:
+        return dataset.filter(function, **filter_kwargs)
+    filtered_dataset = without_image_decoding(dataset).filter(function, **filter_kwargs)
+    # The images of the result are decoded again, like the ones of `dataset`
+    for column_name, feature in dataset.features.items():
+        if filtered_dataset.features[column_name] != feature:
+            filtered_dataset = filtered_dataset.cast_column(column_name, feature)
+    return filtered_dataset
+
+
+class TransformRunner:
+    """
+    Registers the datasets with `add_source`, `add_map`, `add_filter` or `add_transform`, then computes them with
+    `run`. `map` and `filter` apply a cached transform right away, for the scripts building their datasets one after
+    the other.
+
+    `num_proc` is not part of the cache keys, so it can change between two runs. The transforms using `random` are
+    cached as well: their results are the ones of the first run, until their code or inputs change.
+    """
+
+    def __init__(self, cache_dir: Union[str, Path], num_workers: int = 4):
+        self.cache_dir = Path(cache_dir)
+        self.num_workers = num_workers
+        self.nodes: Dict[str, TransformNode] = {}
+        self.reports: List[TransformReport] = []
+        self._lock = threading.Lock()
+        self._start_time = time.perf_counter()
+
+    # ---- DAG ----
+
+    def add_transform(
+        self,
+        name: str,
+        transform: Callable[..., Dataset],
+        inputs: Optional[List[str]] = None,
+        cache: bool = True,
+        **params,
+    ):
+        """`transform(*input_datasets, **params)` gives the dataset `name`"""
+        if name in self.nodes:
+            raise ValueError(f"A dataset is already named {name}")
+        for input_name in inputs or []:
+            if input_name not in self.nodes:
+                raise ValueError(f"Unknown input {input_name} of {name}, the inputs have to be added first")
+        self.nodes[name] = TransformNode(
+            name=name, function=transform, inputs=list(inputs or []), params=params, cache=cache
+        )
+
+    def add_source(self, name: str, load_function: Callable[..., Dataset], cache: bool = False, **params):
+        """
+        `load_function(**params)` gives the dataset. Not cached by default, as `load_dataset` and `load_from_disk` are
+        cached already and have stable fingerprints. The sources built in memory (`Dataset.from_dict`) should be
+        cached, to get a fingerprint that doesn't change between two runs.
+        """
+        self.add_transform(name, load_function, cache=cache, **params)
+        self.nodes[name].kind = "source"
+
+    def add_map(self, name: str, input_name: str, function: Callable, decode_images: bool = True, **map_kwargs):
+        """`decode_images=False` gives the images to `function` as `{"bytes", "path"}` dicts, without decoding them"""
+        self.add_transform(
+            name, _map, inputs=[input_name], function=function, decode_images=decode_images, **map_kwargs
+        )
+        self.nodes[name].hashed_function = function
+        self.nodes[name].kind = "map"
+
+    def add_filter(self, name: str, input_name: str, function: Callable, decode_images: bool = True, **filter_kwargs):
+        self.add_transform(
+            name, _filter, inputs=[input_name], function=function, decode_images=decode_images, **filter_kwargs
+        )
+        self.nodes[name].hashed_function = function
+        self.nodes[name].kind = "filter"
+
+    def run(self, names: Optional[List[str]] = None) -> Dict[str, Dataset]:
+        """Computes the datasets `names` (all of them by default) and the ones they depend on"""
+        needed = set()
+        to_visit = list(names if names is not None else self.nodes)
+        while to_visit:
+            name = to_visit.pop()
+            if name not in needed:
+                needed.add(name)
+                to_visit.extend(self.nodes[name].inputs)
+
+        results: Dict[str, Dataset] = {}
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.num_workers) as executor:
+            while len(results) < len(needed):
+                for name in self.nodes:
+                    ready = all(input_name in results for input_name in self.nodes[name].inputs)
+                    if name in needed and name not in results and name not in running.values() and ready:
+                        node = self.nodes[name]
+                        input_datasets = [results[input_name] for input_name in node.inputs]
+                        running[executor.submit(self._compute_node, node, input_datasets)] = name
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    # Raises the exception of the transform, if any
+                    results[running.pop(future)] = future.result()
+        return {name: results[name] for name in (names if names is not None else self.nodes)}
+
+    # ---- Sequential use ----
+
+    def map(
+        self,
+        dataset: Dataset,
+        function: Callable,
+        name: Optional[str] = None,
+        decode_images: bool = True,
+        **map_kwargs,
+    ):
+        """`dataset.map(function, **map_kwargs)`, cached in `{cache_dir}/{name}` (`function.__name__` by default)"""
+        node = TransformNode(
+            name=name or get_function_name(function),
+            function=_map,
+            inputs=["dataset"],
+            params=dict(function=function, decode_images=decode_images, **map_kwargs),
+            hashed_function=function,
+            kind="map",
+        )
+        return self._compute_node(node, [dataset])
+
+    def filter(
+        self,
+        dataset: Dataset,
+        function: Callable,
+        name: Optional[str] = None,
+        decode_images: bool = True,
+        **filter_kwargs,
+    ):
+        node = TransformNode(
+            name=name or get_function_name(function),
+            function=_filter,
+            inputs=["dataset"],
+            params=dict(function=function, decode_images=decode_images, **filter_kwargs),
+            hashed_function=function,
+            kind="filter",
+        )
+        return self._compute_node(node, [dataset])
+
+    # ---- Execution ----
+
+    def get_cache_key(self, node: TransformNode, input_datasets: List[Dataset]) -> str:
+        hasher = Hasher()
+        hasher.update(node.kind)
+        hasher.update(node.hashed_function if node.hashed_function is not None else node.function)
+        hasher.update({key: value for key, value in node.params.items() if key not in ["function", "num_proc"]})
+        for dataset in input_datasets:
+            hasher.update(dataset._fingerprint)
+        return hasher.hexdigest()
+
+    def _compute_node(self, node: TransformNode, input_datasets: List[Dataset]) -> Dataset:
+        start_time = time.perf_counter()
+        path_cache = self.cache_dir / node.name / self.get_cache_key(node, input_datasets) if node.cache else None
+        if path_cache is not None and (path_cache / "state.json").exists():
+            status = "cached"
+            dataset = load_from_disk(str(path_cache))
+        else:
+            status = "computed"
+            logger.info(f"Starting computing {node.name}")
+            dataset = node.function(*input_datasets, **node.params)
+            if path_cache is not None:
+                # Saved in a temporary directory then renamed, so that an interrupted run never leaves a partial result
+                path_tmp = path_cache.parent / f"{path_cache.name}.tmp"
+                shutil.rmtree(path_tmp, ignore_errors=True)
+                dataset.save_to_disk(str(path_tmp), num_proc=node.params.get("num_proc"))
+                shutil.rmtree(path_cache, ignore_errors=True)
+                os.replace(path_tmp, path_cache)
+                dataset = load_from_disk(str(path_cache))
+            logger.info(f"Finished computing {node.name}")
+        end_time = time.perf_counter()
+        with self._lock:
+            self.reports.append(
+                TransformReport(
+                    name=node.name,
+                    kind=node.kind,
+                    status=status,
+                    seconds=end_time - start_time,
+                    num_rows=dataset.num_rows,
+                    start_time=start_time - self._start_time,
+                    end_time=end_time - self._start_time,
+                )
+            )
+        return dataset
+
+    def format_report(self) -> str:
+        """The time spent per transform, the longest first"""
+        lines = [f"{'transform':<40} {'kind':<9} {'status':<9} {'seconds':>9} {'rows':>11}"]
+        for report in sorted(self.reports, key=lambda report: -report.seconds):
+            lines.append(
+                f"{report.name:<40} {report.kind:<9} {report.status:<9} {report.seconds:>9.2f} {report.num_rows:>11_}"
+            )
+        num_cached = sum(report.status == "cached" for report in self.reports)
+        lines.append(
+            f"{len(self.reports)} transforms ({num_cached} cached), {sum(r.seconds for r in self.reports):.2f}s in"
+            " total"
+        )
+        return "\n".join(lines)
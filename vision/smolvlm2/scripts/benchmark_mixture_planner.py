@@ -0,0 +1,246 @@
+"""
+Usage:
+    python scripts/benchmark_mixture_planner.py --samples_per_source 20000 --model_max_length 4096 --packed
+
+Generates synthetic JSON/JSONL annotation files (text, image, multi-image and video sources with very different
+lengths), plans a mixture on them with `plan_mixture`, then checks the plan against the samples that training
+would really draw:
+  - the planned YAML is sampled like `SupervisedDataset._apply_sampling_strategy` (seeded shuffle, ceil),
+    and the token share of each modality must be within --tolerance of its target,
+  - the relative fractions of the sources of a modality are the ones of the input YAML,
+  - the predicted padding efficiency must match the one of the real greedy packing/padding of the sampled lengths,
+  - a second run reads every histogram from the cache, and touching one file only re-scans that file,
+  - two entries on the same file with different names (so different video durations) get their own histograms.
+It also reports the token shares of the sample-count planning of `create_mixture.py` for the same targets.
+"""
+
+import argparse
+import json
+import math
+import os
+import random
+import tempfile
+import time
+
+import numpy as np
+import yaml
+
+from smolvlm.datasets.mixture_planner import (
+    BatchConfig,
+    TokenCountConfig,
+    TokenCounter,
+    load_annotations,
+    pack_lengths,
+    parse_sampling_fraction,
+    plan_mixture,
+)
+
+WORDS = ["the", "image", "shows", "a", "video", "of", "people", "walking", "on", "street", "describe", "what"]
+# name, modality, file extension, (min, max) words per answer, images per sample, initial sampling strategy
+SOURCES = [
+    ("synthetic:text_short", "text", "json", (5, 60), 0, "all"),
+    ("synthetic:text_long", "text", "jsonl", (200, 2500), 0, "random:50%"),
+    ("synthetic:image_sized", "image", "json", (5, 100), 1, "all"),
+    ("synthetic:image_unsized", "image", "jsonl", (5, 40), 1, "random:25%"),
+    ("synthetic:multiimage", "multiimage", "json", (20, 200), 3, "all"),
+    ("synthetic:video_10_30_s", "video", "json", (5, 80), 1, "all"),
+    ("synthetic:video_60_180_s", "video", "jsonl", (10, 120), 1, "random:50%"),
+]
+
+
+def make_sample(rng, modality, words_range, num_images, idx):
+    answer = " ".join(rng.choice(WORDS) for _ in range(rng.randint(*words_range)))
+    question = "<image>\nWhat is shown?" if modality in ("image", "multiimage") else "What happens?"
+    sample = {"id": idx, "conversations": [{"from": "human", "value": question}, {"from": "gpt", "value": answer}]}
+    if modality in ("image", "multiimage"):
+        sample["image"] = [f"images/{idx}_{i}.jpg" for i in range(num_images)]
+        if num_images == 1:
+            sample["image"] = sample["image"][0]
+    if modality == "video":
+        sample["video"] = f"videos/{idx}.mp4"
+        if rng.random() < 0.5:
+            sample["duration"] = rng.uniform(2, 200)
+    return sample
+
+
+def make_sources(directory, samples_per_source, seed):
+    rng = random.Random(seed)
+    entries = []
+    for idx_source, (name, modality, extension, words_range, num_images, strategy) in enumerate(SOURCES):
+        num_samples = max(1, int(samples_per_source * rng.uniform(0.3, 1.5)))
+        samples = [make_sample(rng, modality, words_range, num_images, idx) for idx in range(num_samples)]
+        if name == "synthetic:image_sized":
+            for sample in samples:
+                sample["height"], sample["width"] = rng.choice([(384, 384), (480, 640), (1080, 1920), (2000, 800)])
+        json_path = os.path.join(directory, f"{name.split(':')[1]}.{extension}")
+        with open(json_path, "w") as f:
+            if extension == "json":
+                json.dump(samples, f)
+            else:
+                f.write("\n".join(json.dumps(s) for s in samples))
+        entries.append({
+            "json_path": json_path, "sampling_strategy": strategy, "name": name, "path": "synthetic",
+            "modality": modality,
+        })
+    return {"datasets": entries}
+
+
+def apply_sampling_strategy(samples, strategy):
+    """Same as `SupervisedDataset._apply_sampling_strategy`."""
+    kind, amount_str = strategy.split(":")
+    pct = float(amount_str.strip("%"))
+    sampling_number = max(1, math.ceil(len(samples) * pct / 100.0))
+    samples = list(samples)
+    random.seed(42)
+    random.shuffle(samples)
+    return samples[:sampling_number]
+
+
+def sampled_lengths(mixture, counter, max_length, seed):
+    """The (modality, text tokens, visual tokens) of the samples of a planned mixture, in training order."""
+    rng = np.random.default_rng(seed)
+    lengths = []
+    for entry in mixture["datasets"]:
+        counts = np.array([counter.count_sample(s, entry) for s in load_annotations(entry["json_path"])])
+        usable = counts[counts.sum(axis=1) <= max_length]
+        sampled = np.array([counter.count_sample(s, entry) for s in apply_sampling_strategy(
+            load_annotations(entry["json_path"]), entry["sampling_strategy"])])
+        # Over-length samples are replaced by another sample of their source.
+        over = sampled.sum(axis=1) > max_length
+        sampled[over] = usable[rng.integers(0, len(usable), size=int(over.sum()))]
+        lengths.extend((entry["modality"], int(t), int(v)) for t, v in sampled)
+    return lengths
+
+
+def token_shares(lengths):
+    totals = {}
+    for modality, text_tokens, visual_tokens in lengths:
+        totals[modality] = totals.get(modality, 0) + text_tokens + visual_tokens
+    total = sum(totals.values())
+    return {modality: tokens / total for modality, tokens in totals.items()}
+
+
+def real_padding_efficiency(lengths, batch_config, seed):
+    lengths = np.array([t + v for _, t, v in lengths])
+    if batch_config.packed:
+        items = pack_lengths(lengths, batch_config.model_max_length)
+    else:
+        items = np.random.default_rng(seed).permutation(lengths)
+    num_batches = len(items) // batch_config.per_device_batch_size
+    batches = items[: num_batches * batch_config.per_device_batch_size].reshape(num_batches, -1)
+    return batches.sum() / (batches.max(axis=1) * batches.shape[1]).sum()
+
+
+def create_mixture_sampling(mixture, target_percents):
+    """The sample-count planning of `create_mixture.py`: each source sampled at the percent of its modality."""
+    planned = json.loads(json.dumps(mixture))
+    for entry in planned["datasets"]:
+        entry["sampling_strategy"] = f"random:{target_percents[entry['modality']]}%"
+    return planned
+
+
+def run_plan(mixture, target_percents, counter, batch_config, cache_dir):
+    planned = json.loads(json.dumps(mixture))
+    start = time.perf_counter()
+    report = plan_mixture(planned, target_percents, counter, batch_config, cache_dir=cache_dir)
+    return planned, report, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check and benchmark the token-budget mixture planner.")
+    parser.add_argument("--samples_per_source", type=int, default=20000)
+    parser.add_argument("--model_max_length", type=int, default=4096)
+    parser.add_argument("--per_device_batch_size", type=int, default=4)
+    parser.add_argument("--packed", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.01, help="Tolerance on the token shares.")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    target_percents = {"text": 14.0, "image": 50.0, "multiimage": 5.0, "video": 31.0}
+    targets = {modality: percent / 100.0 for modality, percent in target_percents.items()}
+    counter = TokenCounter(TokenCountConfig())
+    batch_config = BatchConfig(
+        per_device_batch_size=args.per_device_batch_size,
+        gradient_accumulation_steps=8,
+        num_devices=64,
+        model_max_length=args.model_max_length,
+        packed=args.packed,
+    )
+
+    with tempfile.TemporaryDirectory(prefix="smolvlm_mixture_bench_") as directory:
+        mixture = make_sources(directory, args.samples_per_source, args.seed)
+        with open(os.path.join(directory, "input.yaml"), "w") as f:
+            yaml.safe_dump(mixture, f, sort_keys=False)
+        cache_dir = os.path.join(directory, "cache")
+
+        planned, report, cold_time = run_plan(mixture, target_percents, counter, batch_config, cache_dir)
+        assert report["num_scanned"] == len(SOURCES), report["num_scanned"]
+
+        # The planned YAML goes through yaml like `build_datasets` reads it.
+        path_planned = os.path.join(directory, "planned.yaml")
+        with open(path_planned, "w") as f:
+            yaml.safe_dump(planned, f, sort_keys=False)
+        with open(path_planned) as f:
+            planned = yaml.safe_load(f)
+
+        # Token shares of the samples really drawn.
+        lengths = sampled_lengths(planned, counter, args.model_max_length, args.seed)
+        shares = token_shares(lengths)
+        for modality, target in targets.items():
+            assert abs(shares[modality] - target) <= args.tolerance, (modality, shares[modality], target)
+        assert abs(len(lengths) - sum(g["samples"] for g in report["groups"].values())) == 0
+
+        # Relative fractions inside a modality, unless a source is capped at 100%.
+        fractions = {}
+        for entry, planned_entry in zip(mixture["datasets"], planned["datasets"]):
+            _, base = parse_sampling_fraction(entry["sampling_strategy"], 1)
+            _, fraction = parse_sampling_fraction(planned_entry["sampling_strategy"], 1)
+            fractions.setdefault(entry["modality"], []).append((base, fraction))
+        for modality, pairs in fractions.items():
+            uncapped = [fraction / base for base, fraction in pairs if fraction < 1.0]
+            if len(uncapped) > 1:
+                assert max(uncapped) / min(uncapped) < 1.001, (modality, pairs)
+
+        # Predicted vs real padding efficiency.
+        real_efficiency = real_padding_efficiency(lengths, batch_config, args.seed)
+        predicted_efficiency = report["batches"]["padding_efficiency"]
+        assert abs(real_efficiency - predicted_efficiency) < 0.03, (real_efficiency, predicted_efficiency)
+
+        # Cache: a second run reads everything, touching a file only re-scans it.
+        _, warm_report, warm_time = run_plan(mixture, target_percents, counter, batch_config, cache_dir)
+        assert warm_report["num_cached"] == len(SOURCES) and warm_report["num_scanned"] == 0, warm_report
+        os.utime(mixture["datasets"][0]["json_path"], ns=(time.time_ns(), time.time_ns() + 10**9))
+        _, touched_report, _ = run_plan(mixture, target_percents, counter, batch_config, cache_dir)
+        assert touched_report["num_scanned"] == 1, touched_report["num_scanned"]
+
+        # Two entries on the same file with different names (video durations) get their own histograms.
+        video_path = next(e["json_path"] for e in mixture["datasets"] if e["name"] == "synthetic:video_60_180_s")
+        reused = {"datasets": [
+            {"json_path": video_path, "sampling_strategy": "all", "name": name, "modality": "video"}
+            for name in ["synthetic:video_60_180_s", "synthetic:video_0_4_s"]
+        ]}
+        _, reused_report, _ = run_plan(reused, {"video": 100.0}, counter, batch_config, cache_dir)
+        long_videos, short_videos = (s["visual_tokens"] / s["sampled"] for s in reused_report["sources"])
+        assert reused_report["num_cached"] == 1 and reused_report["num_scanned"] == 1, reused_report
+        assert short_videos < long_videos, (short_videos, long_videos)
+
+        # The sample-count planning of `create_mixture.py`.
+        count_lengths = sampled_lengths(
+            create_mixture_sampling(mixture, target_percents), counter, args.model_max_length, args.seed
+        )
+        count_shares = token_shares(count_lengths)
+
+    print(f"{'modality':<12} {'target':>8} {'planned':>8} {'sampled':>8} {'by count':>9}")
+    for modality, target in targets.items():
+        print(f"{modality:<12} {target:>8.2%} {report['groups'][modality]['share']:>8.2%} "
+              f"{shares[modality]:>8.2%} {count_shares[modality]:>9.2%}")
+    print(f"{len(lengths)} samples, {sum(t + v for _, t, v in lengths)} tokens "
+          f"(planned {report['total_tokens']:.0f})")
+    print(f"padding efficiency: predicted {predicted_efficiency:.2%}, real {real_efficiency:.2%} "
+          f"({'packed' if args.packed else 'padded'}), tokens/step {report['batches']['tokens_per_step']:.0f}")
+    print(f"first plan: {cold_time:.2f}s ({len(SOURCES)} sources scanned), cached plan: {warm_time:.2f}s")
+    print("All checks passed.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Usage:
+    python scripts/benchmark_video_loading.py --num_videos 8 --seconds 60 --resolution 1280x720 \
+         --max_frames 64 --target_fps 1.0 --target_size 384
+
+Generates synthetic MP4s locally (OpenCV `mp4v`), then compares the frames/sec of:
+  - legacy:  single-threaded decord `get_batch` + per-frame PIL conversion (the old `load_video`),
+  - service (cold): `VideoFrameService` with threaded, keyframe-chunked decode and resize-on-decode,
+  - service (warm): same service, second epoch served from the on-disk frame cache.
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import cv2
+import numpy as np
+from decord import VideoReader, cpu
+from PIL import Image
+
+from smolvlm.datasets.dataset import _sample_uniform_frames
+from smolvlm.datasets.frame_service import VideoFrameService
+
+
+def make_synthetic_video(path, seconds, fps, width, height, seed):
+    rng = np.random.default_rng(seed)
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), fps, (width, height))
+    base = rng.integers(0, 255, size=(height, width, 3), dtype=np.uint8)
+    for i in range(int(seconds * fps)):
+        # Moving gradient + noise so the encoder produces real P-frames
+        frame = np.roll(base, shift=4 * i, axis=1)
+        cv2.putText(frame, str(i), (20, 60), cv2.FONT_HERSHEY_SIMPLEX, 2, (255, 255, 255), 3)
+        writer.write(frame)
+    writer.release()
+
+
+def legacy_load(path, max_frames, target_fps):
+    vr = VideoReader(path, num_threads=1, ctx=cpu(0))
+    native_fps = vr.get_avg_fps() or 30.0
+    frames_idx, _ = _sample_uniform_frames(len(vr), native_fps, max_frames, target_fps, 1.0)
+    frames = vr.get_batch(frames_idx).asnumpy()
+    return [Image.fromarray(arr).convert("RGB") for arr in frames]
+
+
+def run(label, load_fn, paths):
+    start = time.perf_counter()
+    n_frames = sum(len(load_fn(p)) for p in paths)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<16} {n_frames:>6} frames in {elapsed:7.2f}s -> {n_frames / elapsed:8.1f} frames/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark video frame loading on synthetic MP4s.")
+    parser.add_argument("--num_videos", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=60.0)
+    parser.add_argument("--fps", type=float, default=30.0)
+    parser.add_argument("--resolution", type=str, default="1280x720")
+    parser.add_argument("--max_frames", type=int, default=64)
+    parser.add_argument("--target_fps", type=float, default=1.0)
+    parser.add_argument("--target_size", type=int, default=384)
+    parser.add_argument("--decode_threads", type=int, default=2)
+    parser.add_argument("--max_workers", type=int, default=4)
+    parser.add_argument("--workdir", type=str, default=None, help="Defaults to a temporary directory.")
+    args = parser.parse_args()
+
+    width, height = (int(x) for x in args.resolution.split("x"))
+    workdir = args.workdir or tempfile.mkdtemp(prefix="smolvlm_video_bench_")
+    video_dir = os.path.join(workdir, "videos")
+    cache_dir = os.path.join(workdir, "frame_cache")
+    os.makedirs(video_dir, exist_ok=True)
+    shutil.rmtree(cache_dir, ignore_errors=True)
+
+    paths = []
+    for i in range(args.num_videos):
+        path = os.path.join(video_dir, f"synthetic_{i:03d}.mp4")
+        if not os.path.exists(path):
+            make_synthetic_video(path, args.seconds, args.fps, width, height, seed=i)
+        paths.append(path)
+    print(f"{len(paths)} videos of {args.seconds}s @ {args.fps}fps {width}x{height} in {video_dir}")
+
+    service = VideoFrameService(
+        target_size=args.target_size,
+        decode_threads=args.decode_threads,
+        max_workers=args.max_workers,
+        cache_dir=cache_dir,
+    )
+
+    def service_load(path):
+        frames, _, _ = service.load_video(
+            path,
+            lambda total, native_fps: _sample_uniform_frames(total, native_fps, args.max_frames, args.target_fps, 1.0),
+            cache_params={"sampler": "uniform", "fps": args.target_fps, "max_frames": args.max_frames, "skip_secs": 1.0},
+        )
+        return frames
+
+    run("legacy", lambda p: legacy_load(p, args.max_frames, args.target_fps), paths)
+    run("service (cold)", service_load, paths)
+    run("service (warm)", service_load, paths)
+
+    if args.workdir is None:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+"""
+Usage:
+    python scripts/check_label_masking.py --model_names HuggingFaceTB/SmolVLM2-256M-Video-Instruct \
+         HuggingFaceTB/SmolVLM2-2.2B-Instruct --num_conversations 200
+
+Checks that the vectorized `LabelMasker` (smolvlm/datasets/label_masking.py) gives the same labels as the
+previous sequential masking of `SupervisedDataset`, on samples built like `SupervisedDataset._get_item` does:
+conversations rendered with the real chat template of each processor and encoded with their images.
+The conversations mix single and multi-turn chats, images or no images, system turns, user texts containing
+"User:" / "System:", truncated samples without their last "<end_of_utterance>", and placeholders split
+into several tokens. Every combination of mask_system_tokens / mask_user_tokens is compared, and the time
+per sample of both implementations is reported.
+"""
+
+import argparse
+import random
+import re
+import time
+from typing import List
+
+import numpy as np
+import torch
+from PIL import Image
+from transformers import AutoProcessor
+
+from smolvlm.constants import IGNORE_INDEX, DEFAULT_IMAGE_TOKEN, DEFAULT_VIDEO_TOKEN
+from smolvlm.datasets.dataset import DEFAULT_SYSTEM_MESSAGE
+from smolvlm.datasets.label_masking import LabelMasker
+
+WORDS = ["the", "cat", "sits", "on", "a", "mat", "User:", "System:", "Assistant:", "image", "<end", "of", "42", "é"]
+
+# -------------------------------------------------------------------
+# Previous sequential masking, as it was in smolvlm/datasets/dataset.py.
+# -------------------------------------------------------------------
+
+def previous_find_global_img_patterns(tokens: List[str]) -> List[int]:
+    mask_positions = []
+    for i in range(len(tokens) - 4):
+        if (
+            tokens[i] == '<'
+            and tokens[i+1] == 'global'
+            and tokens[i+2] == '-'
+            and tokens[i+3] == 'img'
+            and tokens[i+4] == '>'
+        ):
+            mask_positions.extend([i, i+1, i+2, i+3, i+4])
+    return mask_positions
+
+def previous_find_row_col_patterns(tokens: List[str]) -> List[int]:
+    pattern = re.compile(r'^< row _ [1-9] _ col _ [1-9] >$')
+    mask_positions = []
+    for i in range(len(tokens) - 8):
+        group = tokens[i : i + 9]
+        if pattern.fullmatch(" ".join(group)):
+            mask_positions.extend(range(i, i + 9))
+    return mask_positions
+
+def previous_search_subsequence(sequence, pattern, start=0):
+    seq_list = sequence.tolist()
+    pat_len = len(pattern)
+    if pat_len == 0:
+        return -1
+    for i in range(start, len(seq_list) - pat_len + 1):
+        if seq_list[i : i + pat_len] == pattern:
+            return i
+    return -1
+
+def previous_mask_role_tokens(input_ids, labels, tokenizer, role_str):
+    role_ids = tokenizer.encode(role_str, add_special_tokens=False)
+    end_ids = tokenizer.encode("<end_of_utterance>", add_special_tokens=False)
+    start_pos = 0
+    while True:
+        role_start = previous_search_subsequence(input_ids, role_ids, start=start_pos)
+        if role_start == -1:
+            break
+        role_end = previous_search_subsequence(input_ids, end_ids, start=role_start + len(role_ids))
+        if role_end == -1:
+            role_end = len(input_ids)
+        labels[role_start:role_end] = IGNORE_INDEX
+        start_pos = role_end + len(end_ids)
+
+def previous_mask_special_tokens(input_ids, labels, tokenizer):
+    labels[input_ids == tokenizer.pad_token_id] = IGNORE_INDEX
+    if DEFAULT_IMAGE_TOKEN in tokenizer.additional_special_tokens:
+        labels[input_ids == tokenizer.convert_tokens_to_ids(DEFAULT_IMAGE_TOKEN)] = IGNORE_INDEX
+    if DEFAULT_VIDEO_TOKEN in tokenizer.additional_special_tokens:
+        labels[input_ids == tokenizer.convert_tokens_to_ids(DEFAULT_VIDEO_TOKEN)] = IGNORE_INDEX
+    if '<global-img>' in tokenizer.get_vocab():
+        labels[input_ids == tokenizer.convert_tokens_to_ids('<global-img>')] = IGNORE_INDEX
+    image_patches = re.compile(r'<row_\d+_col_\d+>')
+    patch_tokens = [token for token in tokenizer.get_vocab() if image_patches.fullmatch(token)]
+    if len(patch_tokens) > 0:
+        for token_id in tokenizer.convert_tokens_to_ids(patch_tokens):
+            labels[input_ids == token_id] = IGNORE_INDEX
+    tokens = tokenizer.convert_ids_to_tokens(input_ids)
+    for pos in previous_find_global_img_patterns(tokens) + previous_find_row_col_patterns(tokens):
+        labels[pos] = IGNORE_INDEX
+
+def previous_labels(input_ids, tokenizer, mask_system_tokens, mask_user_tokens):
+    labels = input_ids.clone()
+    previous_mask_special_tokens(input_ids, labels, tokenizer)
+    if mask_system_tokens:
+        previous_mask_role_tokens(input_ids, labels, tokenizer, "System:")
+    if mask_user_tokens:
+        previous_mask_role_tokens(input_ids, labels, tokenizer, "User:")
+    return labels
+
+# -------------------------------------------------------------------
+# Samples rendered with the chat template of the processor.
+# -------------------------------------------------------------------
+
+def make_text(rng):
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 40)))
+
+def make_conversation(rng):
+    """A conversation in the OpenAI format of `SupervisedDataset`, and its images."""
+    images = []
+    conversation = []
+    if rng.random() < 0.8:
+        conversation.append({"role": "system", "content": [{"type": "text", "text": DEFAULT_SYSTEM_MESSAGE}]})
+    for idx_turn in range(rng.randint(1, 4)):
+        content = []
+        if idx_turn == 0 and rng.random() < 0.7:
+            for _ in range(rng.randint(1, 3)):
+                size = (rng.randint(32, 1200), rng.randint(32, 1200))
+                images.append(Image.new("RGB", size, tuple(rng.randint(0, 255) for _ in "rgb")))
+                content.append({"type": "image"})
+        content.append({"type": "text", "text": make_text(rng)})
+        conversation.append({"role": "user", "content": content})
+        conversation.append({"role": "assistant", "content": [{"type": "text", "text": make_text(rng)}]})
+    return conversation, images
+
+def split_placeholder_ids(tokenizer, rng):
+    """Ids of "<global-img>" or "<row_i_col_j>" split into several tokens, if the tokenizer has the pieces."""
+    if rng.random() < 0.5:
+        pieces = ["<", "global", "-", "img", ">"]
+    else:
+        pieces = ["<", "row", "_", str(rng.randint(1, 9)), "_", "col", "_", str(rng.randint(1, 9)), ">"]
+    vocab = tokenizer.get_vocab()
+    if not all(piece in vocab for piece in pieces):
+        return []
+    return [vocab[piece] for piece in pieces]
+
+def make_input_ids(processor, rng):
+    conversation, images = make_conversation(rng)
+    text = processor.apply_chat_template(conversation, add_generation_prompt=False)
+    if images:
+        encoded = processor(text=text, images=images, return_tensors="pt", padding=False)
+    else:
+        # Same ids as the processor without images, which some versions of Idefics3Processor don't accept
+        encoded = processor.tokenizer(text=text, return_tensors="pt", padding=False)
+    input_ids = encoded["input_ids"][0]
+    if rng.random() < 0.2:
+        split_ids = split_placeholder_ids(processor.tokenizer, rng)
+        position = rng.randint(0, len(input_ids))
+        split_ids = torch.tensor(split_ids, dtype=input_ids.dtype)
+        input_ids = torch.cat([input_ids[:position], split_ids, input_ids[position:]])
+    if rng.random() < 0.2:
+        # Truncated sample: the last turn has no "<end_of_utterance>"
+        input_ids = input_ids[: rng.randint(1, len(input_ids))]
+    return input_ids
+
+# -------------------------------------------------------------------
+# Main.
+# -------------------------------------------------------------------
+
+def check_model(model_name, num_conversations, seed):
+    processor = AutoProcessor.from_pretrained(model_name)
+    tokenizer = processor.tokenizer
+    rng = random.Random(seed)
+    samples = [make_input_ids(processor, rng) for _ in range(num_conversations)]
+    num_masked = 0
+    times = {"previous": 0.0, "vectorized": 0.0}
+    for mask_system_tokens in (True, False):
+        for mask_user_tokens in (True, False):
+            label_masker = LabelMasker(
+                tokenizer, mask_system_tokens=mask_system_tokens, mask_user_tokens=mask_user_tokens
+            )
+            for input_ids in samples:
+                start = time.perf_counter()
+                expected = previous_labels(input_ids, tokenizer, mask_system_tokens, mask_user_tokens)
+                times["previous"] += time.perf_counter() - start
+                start = time.perf_counter()
+                labels = label_masker(input_ids)
+                times["vectorized"] += time.perf_counter() - start
+                if not torch.equal(labels, expected):
+                    diff = np.flatnonzero((labels != expected).numpy())
+                    raise AssertionError(
+                        f"{model_name} (mask_system_tokens={mask_system_tokens}, mask_user_tokens={mask_user_tokens}): "
+                        f"labels differ at positions {diff[:20].tolist()} of "
+                        f"{tokenizer.decode(input_ids)!r}"
+                    )
+                num_masked += int((labels == IGNORE_INDEX).sum())
+    num_runs = 4 * len(samples)
+    num_tokens = sum(len(input_ids) for input_ids in samples)
+    print(f"[INFO] {model_name}: identical labels on {len(samples)} samples x 4 masking settings "
+          f"({num_tokens} tokens, {num_masked} masked labels)")
+    print(f"    previous:   {1000 * times['previous'] / num_runs:8.3f} ms/sample")
+    print(f"    vectorized: {1000 * times['vectorized'] / num_runs:8.3f} ms/sample")
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Check the parity of LabelMasker with the previous sequential masking."
+    )
+    parser.add_argument("--model_names", nargs="+",
+                        default=["HuggingFaceTB/SmolVLM2-256M-Video-Instruct", "HuggingFaceTB/SmolVLM2-2.2B-Instruct"],
+                        help="Processors (hub names or local paths) whose chat templates and tokenizers are checked.")
+    parser.add_argument("--num_conversations", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    for model_name in args.model_names:
+        check_model(model_name, args.num_conversations, args.seed)
+    print("All checks passed.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+"""
+Usage:
+    python scripts/plan_mixture.py scripts/mixtures/onevision_less_mammoth.yaml --output_yaml planned.yaml \
+         --target_shares text=14 image=50 multiimage=5 video=31 \
+         --tokenizer HuggingFaceTB/SmolVLM2-2.2B-Instruct --data_folder /fsx/data \
+         --model_max_length 16384 --per_device_batch_size 1 --gradient_accumulation_steps 4 --num_devices 256 --packed
+
+Plans the sampling strategies of a mixture by training tokens instead of sample counts:
+  - each source is scanned once to build a histogram of its text and visual token lengths,
+    cached in --cache_dir (re-scanned only when the annotation file or the counting arguments change),
+  - the sampling fractions are solved so that each group (--group_by, the modality by default) gets its
+    target share of the training tokens, keeping the relative fractions of the input YAML inside a group,
+  - the planned YAML is written for `build_datasets` (--data_mixture), with a report of the tokens per group,
+    the predicted tokens/step and the padding/packing efficiency.
+
+Without --tokenizer the text tokens are estimated from the number of characters. Without image sizes in the
+annotations (`height`/`width`) or --data_folder, the images are counted as square images of --image_target_size.
+"""
+
+import argparse
+import json
+import sys
+
+import yaml
+from tabulate import tabulate
+
+from smolvlm.datasets.mixture_planner import BatchConfig, TokenCountConfig, TokenCounter, plan_mixture
+
+# -------------------------------------------------------------------
+# YAML load/write functions.
+# -------------------------------------------------------------------
+
+def load_yaml(file_path):
+    with open(file_path, 'r', encoding='utf-8') as f:
+        return yaml.safe_load(f)
+
+def write_yaml(data, file_path):
+    with open(file_path, 'w', encoding='utf-8') as f:
+        yaml.safe_dump(data, f, sort_keys=False)
+
+def parse_target_shares(values):
+    """
+    Parse "group=percent" pairs, for example ["text=14", "image=50"] -> {"text": 14.0, "image": 50.0}.
+    """
+    shares = {}
+    for value in values:
+        if "=" not in value:
+            raise argparse.ArgumentTypeError(f"Expected group=percent, got {value}")
+        group, percent = value.split("=", 1)
+        shares[group.strip().lower()] = float(percent)
+    return shares
+
+# -------------------------------------------------------------------
+# Report.
+# -------------------------------------------------------------------
+
+def format_tokens(tokens):
+    for unit, scale in (("B", 1e9), ("M", 1e6), ("K", 1e3)):
+        if tokens >= scale:
+            return f"{tokens / scale:.2f}{unit}"
+    return f"{tokens:.0f}"
+
+def print_report(report, batch_config, verbose):
+    rows = []
+    for group, tokens in report["groups"].items():
+        total = tokens["text_tokens"] + tokens["visual_tokens"]
+        rows.append([
+            group,
+            tokens["samples"],
+            format_tokens(tokens["text_tokens"]),
+            format_tokens(tokens["visual_tokens"]),
+            format_tokens(total),
+            f"{total / max(tokens['samples'], 1):.0f}",
+            f"{tokens['target_share']:.2%}",
+            f"{tokens['share']:.2%}",
+        ])
+    print(tabulate(
+        rows,
+        headers=["Group", "Samples", "Text", "Visual", "Tokens", "Tokens/sample", "Target", "Planned"],
+        tablefmt="github",
+    ))
+    print(f"[INFO] Planned tokens per epoch: {format_tokens(report['total_tokens'])} "
+          f"({report['num_scanned']} sources scanned, {report['num_cached']} read from the cache)")
+
+    over_length = [s for s in report["sources"] if s["over_length_share"] > 0 and s["sampled"]]
+    if over_length:
+        print(f"[WARN] {len(over_length)} sources have samples longer than {batch_config.model_max_length} tokens, "
+              "they are replaced by other samples of their source in training:")
+        for source in sorted(over_length, key=lambda s: -s["over_length_share"])[:10]:
+            print(f"    {source['name']}: {source['over_length_share']:.2%}")
+    dropped = [s["name"] for s in report["sources"] if not s["sampled"]]
+    if dropped:
+        print(f"[INFO] {len(dropped)} sources with a share of 0 are removed from the mixture.")
+
+    if verbose:
+        print(tabulate(
+            [[s["name"], s["group"], s["num_samples"], s["sampled"], s["sampling_strategy"],
+              format_tokens(s["text_tokens"] + s["visual_tokens"])] for s in report["sources"]],
+            headers=["Source", "Group", "Samples", "Sampled", "Strategy", "Tokens"],
+            tablefmt="github",
+        ))
+
+    batches = report["batches"]
+    mode = "packed" if batch_config.packed else "padded"
+    print(f"[INFO] Predicted batches ({mode}, simulated on {batches['simulated_samples']} samples):")
+    print(f"    tokens/step:        {format_tokens(batches['tokens_per_step'])} "
+          f"(padded to {format_tokens(batches['padded_tokens_per_step'])})")
+    print(f"    padding efficiency: {batches['padding_efficiency']:.2%}")
+    if batch_config.packed:
+        print(f"    samples/pack:       {batches['samples_per_item']:.2f}")
+        print(f"    pack fill:          {batches['packing_fill']:.2%} of {batch_config.model_max_length} tokens")
+    print(f"    steps/epoch:        {batches['steps_per_epoch']:.0f}")
+
+# -------------------------------------------------------------------
+# Main.
+# -------------------------------------------------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description=(
+        "Plan the sampling strategies of a mixture YAML to reach target shares of the training tokens, "
+        "from cached token length histograms of the sources."
+    ))
+    parser.add_argument("input_yaml", help="Path to input YAML file.")
+    parser.add_argument("--output_yaml", default="planned_datasets.yaml", help="Path to output YAML file.")
+    parser.add_argument("--target_shares", nargs="+", default=["text=14", "image=50", "multiimage=5", "video=31"],
+                        help="Target percentage of the training tokens per group, as group=percent.")
+    parser.add_argument("--group_by", default="modality", help="Key of the dataset entries defining the groups.")
+    parser.add_argument("--total_tokens", type=float, default=None,
+                        help="Tokens per epoch to plan for. Defaults to the most reachable with the target shares.")
+    parser.add_argument("--cache_dir", default=".cache/mixture_histograms",
+                        help="Directory of the cached histograms of the sources.")
+    parser.add_argument("--report_json", default=None, help="Optional path to write the report as JSON.")
+    parser.add_argument("--verbose", action="store_true", help="Print the plan of every source.")
+    # Token counting.
+    parser.add_argument("--tokenizer", default=None, help="Tokenizer to count the text tokens with.")
+    parser.add_argument("--chars_per_token", type=float, default=3.6,
+                        help="Characters per token to estimate the text tokens without --tokenizer.")
+    parser.add_argument("--tokens_per_turn", type=int, default=5, help="Chat template tokens added per turn.")
+    parser.add_argument("--data_folder", default=None, help="Root folder of the images, to read their sizes.")
+    parser.add_argument("--image_seq_len", type=int, default=64, help="Tokens per image view (tile or frame).")
+    parser.add_argument("--tile_size", type=int, default=384, help="Size of the image tiles.")
+    parser.add_argument("--image_target_size", type=int, default=1536)
+    parser.add_argument("--max_frames", type=int, default=25)
+    parser.add_argument("--fps", type=float, default=1.0)
+    parser.add_argument("--bin_size", type=int, default=64, help="Width of the histogram bins, in tokens.")
+    # Batches.
+    parser.add_argument("--model_max_length", type=int, default=16384)
+    parser.add_argument("--per_device_batch_size", type=int, default=1)
+    parser.add_argument("--gradient_accumulation_steps", type=int, default=1)
+    parser.add_argument("--num_devices", type=int, default=1)
+    parser.add_argument("--packed", action="store_true")
+    parser.add_argument("--num_simulated_samples", type=int, default=200_000)
+    args = parser.parse_args()
+
+    counter = TokenCounter(TokenCountConfig(
+        tokenizer=args.tokenizer,
+        chars_per_token=args.chars_per_token,
+        tokens_per_turn=args.tokens_per_turn,
+        image_seq_len=args.image_seq_len,
+        tile_size=args.tile_size,
+        image_target_size=args.image_target_size,
+        max_frames=args.max_frames,
+        fps=args.fps,
+        data_folder=args.data_folder,
+        bin_size=args.bin_size,
+    ))
+    batch_config = BatchConfig(
+        per_device_batch_size=args.per_device_batch_size,
+        gradient_accumulation_steps=args.gradient_accumulation_steps,
+        num_devices=args.num_devices,
+        model_max_length=args.model_max_length,
+        packed=args.packed,
+        num_simulated_samples=args.num_simulated_samples,
+    )
+
+    data = load_yaml(args.input_yaml)
+    try:
+        report = plan_mixture(
+            data,
+            target_shares=parse_target_shares(args.target_shares),
+            counter=counter,
+            batch_config=batch_config,
+            group_by=args.group_by,
+            total_tokens=args.total_tokens,
+            cache_dir=args.cache_dir,
+            progress=lambda path, cached: print(f"[INFO] {'Cached' if cached else 'Scanned'} {path}"),
+        )
+    except ValueError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+    write_yaml(data, args.output_yaml)
+    print(f"[INFO] Planned YAML written to {args.output_yaml}")
+    print_report(report, batch_config, args.verbose)
+    if args.report_json:
+        with open(args.report_json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"[INFO] Report written to {args.report_json}")
+
+if __name__ == "__main__":
+    main()
@@ -7,9 +7,6 @@ import json
 import logging
 from typing import Any, Dict, List, Optional, Tuple
 
-import decord
-from decord import VideoReader, cpu
-decord.bridge.set_bridge("torch")
 from num2words import num2words
 import datetime
 import re
@@ -20,12 +17,11 @@ from torch.utils.data import Dataset
 from PIL import Image, ImageFile
 
 from smolvlm.constants import (
-    IGNORE_INDEX,
     DATA_IMAGE_TOKEN,
-    DEFAULT_IMAGE_TOKEN,
     DATA_VIDEO_TOKEN,
-    DEFAULT_VIDEO_TOKEN,
 )
+from smolvlm.datasets.frame_service import VideoFrameService, get_default_frame_service
+from smolvlm.datasets.label_masking import LabelMasker
 from smolvlm.train.args import DataArguments, TrainingArguments, ModelArguments
 from smolvlm.utils import mprint
 
@@ -220,59 +216,49 @@ def load_video(
     max_frames: int = 100,
     target_fps: float = 2.0,
     frames_per_clip: int =1,   
-) -> Tuple[List[Image.Image], List[str]]:
+    frame_service: Optional[VideoFrameService] = None,
+) -> Tuple[List[np.ndarray], List[str], float]:
     """
-    Loads a video from `path` using decord, sampling up to `max_frames` frames.
-    After deduplicating indices (e.g., to handle rounding collisions), each frame
-    is decoded into a PIL Image (in RGB mode). Timestamps are generated in "MM:SS" format
+    Loads a video from `path` through the `VideoFrameService`, sampling up to `max_frames` clips
+    of `frames_per_clip` frames. Each frame is decoded into an RGB uint8 array (repeated indices
+    are decoded once). Timestamps are generated per clip in "MM:SS to MM:SS" format
     based on the frame index over `native_fps`.
 
     Args:
         path (str): Path to the video file (e.g., MP4).
-        max_frames (int): Hard cap on how many frames we ever pick in total.
+        max_frames (int): Hard cap on how many clips we ever pick in total.
         target_fps (float): Target approximate sampling rate in frames per second.
+        frames_per_clip (int): Number of frames in each clip.
+        frame_service (VideoFrameService, optional): Decoder/cache to use. Defaults to a
+            native-size service without cache.
     
     Returns:
-        Tuple[List[Image.Image], List[str]]:
-          - A list of PIL.Image objects corresponding to each selected frame.
-          - A list of parallel timestamps ("MM:SS" strings), one per selected frame.
+        Tuple[List[np.ndarray], List[str], float]:
+          - A list of (H, W, 3) uint8 arrays corresponding to each selected frame.
+          - A list of clip timestamps ("MM:SS to MM:SS" strings), one per clip.
+          - The video duration in seconds.
     """
-    try:
-        # Use decord with single-thread and CPU context
-        vr = VideoReader(path, num_threads=1, ctx=cpu(0))
-    except Exception as e:
-        raise RuntimeError(f"Failed to open video '{path}': {e}")
-
-    total_frames = len(vr)
-    if total_frames == 0:
-        raise RuntimeError(f"Video '{path}' has 0 frames.")
-
-    # Fallback to 30 if native_fps is None or zero
-    native_fps = vr.get_avg_fps() or 30.0
-    duration_seconds = total_frames / native_fps
-
-    frames_idx, clip_times = sample_clip_indices(
-        frames_per_clip=frames_per_clip,       
-        video_duration=duration_seconds,
-        sampling_fps=target_fps,
-        video_fps=native_fps,
-        max_clips=max_frames     # as an example usage
+    frame_service = frame_service or get_default_frame_service()
+
+    def sampler(total_frames: int, native_fps: float) -> Tuple[List[int], List[str]]:
+        frames_idx, clip_times = sample_clip_indices(
+            frames_per_clip=frames_per_clip,       
+            video_duration=total_frames / native_fps,
+            sampling_fps=target_fps,
+            video_fps=native_fps,
+            max_clips=max_frames     # as an example usage
+        )
+        # Build timestamps (MM:SS) for each clip
+        timestamps = []
+        for (start, end) in clip_times:
+            timestamps.append(f"{int(start // 60):02d}:{int(start % 60):02d} to {int(end // 60):02d}:{int(end % 60):02d}")
+        return frames_idx, timestamps
+
+    return frame_service.load_video(
+        path,
+        sampler,
+        cache_params={"sampler": "clip", "fps": target_fps, "max_frames": max_frames, "frames_per_clip": frames_per_clip},
     )
-    # Read frames from decord
-    try:
-        frames_tensor = vr.get_batch(frames_idx).cpu().numpy()  # (N, H, W, C)
-    except Exception as e:
-        raise RuntimeError(f"Failed to read frames from '{path}': {e}")
-
-    # Convert to PIL Images
-    frames_out = [Image.fromarray(arr).convert("RGB") for arr in frames_tensor]
-
-    # Build timestamps (MM:SS) for each selected frame index
-    timestamps = []
-    for (start, end) in clip_times:
-        timestamps.append(f"{int(start // 60):02d}:{int(start % 60):02d} to {int(end // 60):02d}:{int(end % 60):02d}")
-
-    return frames_out, timestamps, duration_seconds
 
 # Video Loader from sampled videos
 ##############################################################################
@@ -282,7 +268,8 @@ def load_image_directory_as_frames(
     target_fps: float = 1.0,
     max_frames: int = 50,
     frames_per_clip: int = 1,
-) -> Tuple[List[Image.Image], List[str]]:
+    frame_service: Optional[VideoFrameService] = None,
+) -> Tuple[List[np.ndarray], List[str], float]:
     """
     Treats a directory of images as if they were consecutive frames in a 
     pseudo-video recorded at `source_fps`, then samples frames to achieve 
@@ -293,16 +280,20 @@ def load_image_directory_as_frames(
         source_fps (float): The framerate at which these images were presumably captured.
         target_fps (float): The approximate sampling rate we want in the output.
         max_frames (int): Hard limit on how many frames we return.
+        frames_per_clip (int): Number of frames in each clip.
+        frame_service (VideoFrameService, optional): Loads the sampled images concurrently.
 
     Returns:
-        (frames, timestamps):
-          frames: List of loaded PIL.Image (RGB),
-          timestamps: Parallel list of "MM:SS" strings indicating each frame's approximate time.
+        (frames, timestamps, duration_seconds):
+          frames: List of loaded RGB uint8 arrays,
+          timestamps: List of "MM:SS to MM:SS" strings, one per clip.
+          duration_seconds: Duration of the pseudo-video.
 
     Raises:
         RuntimeError: If `folder_path` doesn't exist or has no valid images,
                       or if we fail to load any frames after sampling.
     """
+    frame_service = frame_service or get_default_frame_service()
     if not os.path.isdir(folder_path):
         raise RuntimeError(f"Path '{folder_path}' is not a directory.")
 
@@ -354,17 +345,9 @@ def load_image_directory_as_frames(
     if not frame_indices:
         frame_indices = [0]  # at least one
         
-    # 5) Load frames
-    frames = []
-    for idx in frame_indices:
-        img_path = os.path.join(folder_path, sorted_files[idx])
-        try:
-            img = Image.open(img_path).convert("RGB")
-            frames.append(img)
-        except Exception as e:
-            logger.error(f"Failed to load image '{img_path}': {e}")
-            # We skip the broken image
-            continue
+    # 5) Load frames (concurrently); broken images are skipped
+    loaded = frame_service.load_images([os.path.join(folder_path, sorted_files[idx]) for idx in frame_indices])
+    frames = [img for img in loaded if img is not None]
     
     timestamps = []
     for (start, end) in clip_times:
@@ -385,139 +368,6 @@ def load_single_image(img_path: str) -> Image.Image:
     return img
 
 
-##############################################################################
-# Helper Functions for Masking
-##############################################################################
-def find_global_img_patterns(tokens: List[str]) -> List[int]:
-    mask_positions = []
-    for i in range(len(tokens) - 4):
-        if (
-            tokens[i] == '<'
-            and tokens[i+1] == 'global'
-            and tokens[i+2] == '-'
-            and tokens[i+3] == 'img'
-            and tokens[i+4] == '>'
-        ):
-            mask_positions.extend([i, i+1, i+2, i+3, i+4])
-    return mask_positions
-
-
-def find_row_col_patterns(tokens: List[str]) -> List[int]:
-    pattern = re.compile(r'^< row _ [1-9] _ col _ [1-9] >$')
-    mask_positions = []
-    for i in range(len(tokens) - 8):
-        # Slice out exactly 9 tokens (e.g. <, row, _, 1, _, col, _, 1, >)
-        group = tokens[i : i + 9]
-        if pattern.fullmatch(" ".join(group)):
-            mask_positions.extend(range(i, i + 9))
-    return mask_positions
-
-
-def _search_subsequence(
-    sequence: torch.Tensor,
-    pattern: List[int],
-    start: int = 0
-) -> int:
-    """
-    Searches for the first occurrence of 'pattern' in 'sequence'
-    starting at offset 'start'. Returns the index of that occurrence,
-    or -1 if not found.
-    """
-    # Convert input_ids to a Python list
-    seq_list = sequence.tolist()
-    pat_len = len(pattern)
-    if pat_len == 0:
-        return -1
-
-    # Simple forward search
-    for i in range(start, len(seq_list) - pat_len + 1):
-        if seq_list[i : i + pat_len] == pattern:
-            return i
-    return -1
-
-
-def _mask_system_tokens(
-    input_ids: torch.Tensor,
-    labels: torch.Tensor,
-    tokenizer
-):
-    """
-    Identifies every occurrence of "System:" in `input_ids` (tokenized form),
-    then masks (sets to IGNORE_INDEX) from the first token of "System:" up to 
-    the next "<end_of_utterance>" marker or the end of the entire sequence.
-
-    Args:
-        input_ids (torch.Tensor): The token IDs for the conversation.
-        labels (torch.Tensor): A copy of `input_ids` that we modify in-place 
-           to set certain spans to IGNORE_INDEX.
-        tokenizer: The tokenizer.
-    """ 
-    system_str = "System:"
-    end_str    = "<end_of_utterance>"
-
-    system_ids = tokenizer.encode(system_str, add_special_tokens=False)
-    end_ids    = tokenizer.encode(end_str,   add_special_tokens=False)
-
-    start_pos = 0
-    while True:
-        # 1) find next "System:"
-        sys_start = _search_subsequence(input_ids, system_ids, start=start_pos)
-        if sys_start == -1:
-            break  # no more occurrences
-
-        # 2) find next "<end_of_utterance>" after that
-        sys_end = _search_subsequence(input_ids, end_ids, start=sys_start + len(system_ids))
-        if sys_end == -1:
-            sys_end = len(input_ids)  # if not found, go to end of sequence
-
-        # 3) Mask [sys_start .. sys_end) in 'labels'
-        labels[sys_start:sys_end] = IGNORE_INDEX
-
-        # 4) Move forward
-        start_pos = sys_end + len(end_ids)
-
-
-def _mask_user_tokens(
-    input_ids: torch.Tensor,
-    labels: torch.Tensor,
-    tokenizer
-):
-    """
-    Identifies every occurrence of "User:" in `input_ids`,
-    then masks (sets to IGNORE_INDEX) from that token to the next "<end_of_utterance>" 
-    or the end of the sequence. This removes the user's text from the training labels,
-    so the model won't try to predict user text.
-
-    Args:
-        input_ids (torch.Tensor): The token IDs for the conversation.
-        labels (torch.Tensor): A copy of `input_ids` that we modify in-place 
-           to set certain spans to IGNORE_INDEX.
-        tokenizer: The tokenizer.
-    """
-    user_str = "User:"
-    end_str  = "<end_of_utterance>"
-
-    user_ids = tokenizer.encode(user_str, add_special_tokens=False)
-    end_ids  = tokenizer.encode(end_str,  add_special_tokens=False)
-
-    start_pos = 0
-    while True:
-        # 1) find next "User:"
-        usr_start = _search_subsequence(input_ids, user_ids, start=start_pos)
-        if usr_start == -1:
-            break  # no more occurrences
-
-        # 2) find next "<end_of_utterance>" after that
-        usr_end = _search_subsequence(input_ids, end_ids, start=usr_start + len(user_ids))
-        if usr_end == -1:
-            usr_end = len(input_ids)
-
-        # 3) Mask [usr_start .. usr_end) in 'labels'
-        labels[usr_start:usr_end] = IGNORE_INDEX
-
-        # 4) Move forward
-        start_pos = usr_end + len(end_ids)
-        
 ##############################################################################
 # Dataset
 ##############################################################################
@@ -550,6 +400,11 @@ class SupervisedDataset(Dataset):
         
         self.processor = processor
         self.tokenizer = processor.tokenizer
+        self.label_masker = LabelMasker(
+            self.tokenizer,
+            mask_system_tokens=self.mask_system_tokens,
+            mask_user_tokens=self.mask_user_tokens,
+        )
         self.data_args = data_args
         self.training_args = training_args
         
@@ -560,6 +415,13 @@ class SupervisedDataset(Dataset):
         self.video_target_size = getattr(data_args, "video_target_size", 384)
         self.image_target_size = getattr(data_args, "image_target_size", 1536)
         self.data_folder = getattr(data_args, "data_folder", "")
+        self.frame_service = VideoFrameService(
+            target_size=self.video_target_size,
+            decode_threads=getattr(data_args, "video_decode_threads", 2),
+            max_workers=getattr(data_args, "video_io_workers", 4),
+            cache_dir=getattr(data_args, "video_cache_dir", None),
+            cache_max_bytes=int(getattr(data_args, "video_cache_max_gb", 50.0) * 1024**3),
+        )
 
         subdir = dataset_args.get("path", "")
         self.mm_path = os.path.join(self.data_folder, subdir)
@@ -693,14 +555,16 @@ class SupervisedDataset(Dataset):
                         source_fps=self.source_fps,
                         target_fps=self.target_fps,
                         max_frames=self.max_frames,
-                        frames_per_clip=self.frames_per_clip
+                        frames_per_clip=self.frames_per_clip,
+                        frame_service=self.frame_service,
                     )
                 else:
                     frames, timestamps, duration_seconds = load_video(
                         path,
                         max_frames=self.max_frames,
                         target_fps=self.target_fps,
-                        frames_per_clip=self.frames_per_clip
+                        frames_per_clip=self.frames_per_clip,
+                        frame_service=self.frame_service,
                     )
                     
         elif content_type == "image" or content_type == "multiimage":
@@ -782,16 +646,9 @@ class SupervisedDataset(Dataset):
         input_ids = encoded["input_ids"][0]
         attention_mask = encoded["attention_mask"][0]
 
-        # Start all labels as input_ids
-        labels = input_ids.clone()
-        self._mask_special_tokens(input_ids, labels)
+        # Start all labels as input_ids, then mask special tokens and system/user turns
+        labels = self.label_masker(input_ids)
 
-        if self.mask_system_tokens:
-            _mask_system_tokens(input_ids, labels, self.tokenizer)
-            
-        if self.mask_user_tokens:
-            _mask_user_tokens(input_ids, labels, self.tokenizer)
-            
         out = {
             "input_ids": input_ids,
             "attention_mask": attention_mask,
@@ -935,33 +792,4 @@ class SupervisedDataset(Dataset):
         return conversation
 
     def _mask_special_tokens(self, input_ids: torch.Tensor, labels: torch.Tensor):
-        labels[input_ids == self.tokenizer.pad_token_id] = IGNORE_INDEX
-        
-        if DEFAULT_IMAGE_TOKEN in self.tokenizer.additional_special_tokens:
-            image_id = self.tokenizer.convert_tokens_to_ids(DEFAULT_IMAGE_TOKEN)
-            labels[input_ids == image_id] = IGNORE_INDEX
-
-        if DEFAULT_VIDEO_TOKEN in self.tokenizer.additional_special_tokens:
-            image_id = self.tokenizer.convert_tokens_to_ids(DEFAULT_VIDEO_TOKEN)
-            labels[input_ids == image_id] = IGNORE_INDEX
-
-        if '<global-img>' in self.tokenizer.get_vocab():
-            global_img_id = self.tokenizer.convert_tokens_to_ids('<global-img>')
-            labels[input_ids == global_img_id] = IGNORE_INDEX
-        
-        image_patches = re.compile(r'<row_\d+_col_\d+>')
-        patch_tokens = [token for token in self.tokenizer.get_vocab() if image_patches.fullmatch(token)]
-        if len(patch_tokens) > 0:
-            row_token_ids = self.tokenizer.convert_tokens_to_ids(patch_tokens)
-            for token_id in row_token_ids:
-                labels[input_ids == token_id] = IGNORE_INDEX
-                
-        # Possibly also ignore custom placeholders
-        tokens = self.tokenizer.convert_ids_to_tokens(input_ids)
-        positions_to_mask = find_global_img_patterns(tokens) + find_row_col_patterns(tokens)
-        if len(positions_to_mask) > 0:
-            logger.warn(f"found {len} global image + row col tokens not tokenized correctly!")
-            
-        for pos in positions_to_mask:
-            labels[pos] = IGNORE_INDEX
-            
\ No newline at end of file
+        self.label_masker.mask_special_tokens(input_ids, labels)
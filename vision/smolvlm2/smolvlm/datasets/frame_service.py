@@ -0,0 +1,393 @@
+import os
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from PIL import Image, ImageFile
+
+logger = logging.getLogger(__name__)
+ImageFile.LOAD_TRUNCATED_IMAGES = True
+Image.MAX_IMAGE_PIXELS = 1000000000
+
+# A sampler receives (total_frames, native_fps) and returns the frame indices to
+# decode (duplicates allowed, any order) plus one timestamp string per frame/clip.
+FrameSampler = Callable[[int, float], Tuple[List[int], List[str]]]
+
+
+##############################################################################
+# helper functions
+##############################################################################
+def _resized_hw(height: int, width: int, longest_edge: Optional[int]) -> Tuple[int, int]:
+    """
+    Returns the (height, width) obtained by downscaling so that the longest edge is
+    at most `longest_edge`, keeping the aspect ratio. Never upscales: the processor
+    still does the final resize, we only avoid decoding pixels it would throw away.
+    """
+    if not longest_edge or max(height, width) <= longest_edge:
+        return height, width
+    scale = longest_edge / float(max(height, width))
+    return max(1, int(round(height * scale))), max(1, int(round(width * scale)))
+
+
+def _probe_video_hw(path: str) -> Optional[Tuple[int, int]]:
+    """
+    Reads the (height, width) of a video from its container header without decoding
+    a frame. Returns None if the probe fails, in which case we decode at native size.
+    """
+    try:
+        import cv2
+
+        cap = cv2.VideoCapture(path)
+        try:
+            width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+            height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        finally:
+            cap.release()
+    except Exception:
+        return None
+    if width <= 0 or height <= 0:
+        return None
+    return height, width
+
+
+def _to_numpy(batch) -> np.ndarray:
+    # decord returns torch tensors when the torch bridge is set, and decord NDArrays otherwise.
+    if hasattr(batch, "asnumpy"):
+        return batch.asnumpy()
+    return batch.cpu().numpy()
+
+
+def _split_on_keyframes(indices: List[int], key_indices: Sequence[int], num_chunks: int) -> List[List[int]]:
+    """
+    Splits sorted unique frame `indices` into at most `num_chunks` contiguous groups whose
+    boundaries fall on keyframes, so that no two groups need to decode the same GOP.
+    """
+    if num_chunks <= 1 or len(key_indices) == 0:
+        return [indices]
+
+    # GOP id of every requested frame = index of the last keyframe <= frame
+    gop_ids = np.searchsorted(np.asarray(key_indices), np.asarray(indices), side="right") - 1
+    boundaries = np.flatnonzero(np.diff(gop_ids)) + 1
+    if len(boundaries) == 0:
+        return [indices]
+
+    # Pick GOP boundaries closest to an even split of the requested frames
+    targets = np.linspace(0, len(indices), num_chunks + 1)[1:-1]
+    cuts = sorted({int(boundaries[np.abs(boundaries - t).argmin()]) for t in targets})
+    chunks, prev = [], 0
+    for cut in cuts + [len(indices)]:
+        if cut > prev:
+            chunks.append(indices[prev:cut])
+            prev = cut
+    return chunks
+
+
+def _load_frame_file(path: str, longest_edge: Optional[int]) -> np.ndarray:
+    img = Image.open(path)
+    if longest_edge:
+        # `thumbnail` only downscales and uses JPEG draft mode (DCT scaling) when the
+        # target is much smaller than the stored image.
+        img.thumbnail((longest_edge, longest_edge), resample=Image.BICUBIC)
+    return np.asarray(img.convert("RGB"))
+
+
+##############################################################################
+# On-disk cache
+##############################################################################
+class FrameCache:
+    """
+    Bounded on-disk cache of sampled video frames. Each entry is an uncompressed `.npz`
+    holding the uint8 frames (N, H, W, 3), the timestamps and the video duration.
+    Entries are evicted oldest-access-first once the directory exceeds `max_bytes`.
+
+    The cache directory can be shared by all dataloader workers and ranks on a node:
+    writes go through a temporary file and an atomic rename.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._size: Optional[int] = None
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def key(self, path: str, **params: Any) -> str:
+        # Include size and mtime so that a re-encoded video invalidates its entries
+        stat = os.stat(path)
+        parts = [os.path.abspath(path), str(stat.st_size), str(int(stat.st_mtime))]
+        parts += [f"{k}={params[k]}" for k in sorted(params)]
+        return hashlib.sha1("|".join(parts).encode("utf-8")).hexdigest()
+
+    def _entry_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], key + ".npz")
+
+    def get(self, key: str) -> Optional[Tuple[np.ndarray, List[str], float]]:
+        entry_path = self._entry_path(key)
+        try:
+            with np.load(entry_path, allow_pickle=False) as data:
+                frames = data["frames"]
+                timestamps = data["timestamps"].tolist()
+                duration = float(data["duration"])
+            os.utime(entry_path)  # bump for LRU eviction
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Dropping unreadable frame cache entry '{entry_path}': {e}")
+            try:
+                os.remove(entry_path)
+            except OSError:
+                pass
+            return None
+        return frames, timestamps, duration
+
+    def put(self, key: str, frames: np.ndarray, timestamps: List[str], duration: float):
+        entry_path = self._entry_path(key)
+        os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+        tmp_path = f"{entry_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                np.savez(
+                    f,
+                    frames=frames,
+                    timestamps=np.asarray(timestamps, dtype=np.str_),
+                    duration=np.float64(duration),
+                )
+            os.replace(tmp_path, entry_path)
+        except OSError as e:
+            logger.warning(f"Failed to write frame cache entry '{entry_path}': {e}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return
+
+        with self._lock:
+            if self._size is None:
+                self._size = self._disk_usage()
+            else:
+                self._size += os.path.getsize(entry_path)
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _list_entries(self) -> List[Tuple[float, int, str]]:
+        entries = []
+        for root, _, files in os.walk(self.cache_dir):
+            for fname in files:
+                if not fname.endswith(".npz"):
+                    continue
+                fpath = os.path.join(root, fname)
+                try:
+                    stat = os.stat(fpath)
+                except FileNotFoundError:
+                    continue  # evicted by another worker
+                entries.append((stat.st_mtime, stat.st_size, fpath))
+        return entries
+
+    def _disk_usage(self) -> int:
+        return sum(size for _, size, _ in self._list_entries())
+
+    def _evict(self):
+        # Other workers write to the same directory, so re-scan instead of trusting our tally.
+        # Evict down to 90% of the budget to avoid re-scanning on every put.
+        entries = sorted(self._list_entries())
+        total = sum(size for _, size, _ in entries)
+        budget = int(self.max_bytes * 0.9)
+        for _, size, fpath in entries:
+            if total <= budget:
+                break
+            try:
+                os.remove(fpath)
+            except FileNotFoundError:
+                pass
+            total -= size
+        self._size = total
+
+
+##############################################################################
+# Frame service
+##############################################################################
+class VideoFrameService:
+    """
+    Decodes sampled video frames (or frame directories) into uint8 numpy arrays that can
+    be handed directly to the HF processor.
+
+    - Frames are resized during decode so that the longest edge is at most `target_size`
+      (decord scales inside the decoder, JPEG frames use draft mode).
+    - Long videos are split into keyframe-aligned chunks decoded concurrently in a thread
+      pool, each chunk by its own `VideoReader` using `decode_threads` decoder threads.
+    - If `cache_dir` is set, sampled frames are stored in a bounded on-disk cache keyed by
+      (path, sampling params, target size) so that repeated epochs skip decoding.
+
+    The thread pool is created lazily and re-created after a fork, so a single instance can
+    be built in the main process and used from dataloader workers.
+
+    Args:
+        target_size (int, optional): Longest edge of the decoded frames. None keeps native size.
+        decode_threads (int): Number of decoder threads per `VideoReader`.
+        max_workers (int): Size of the thread pool used for chunked decode and image loading.
+        cache_dir (str, optional): Directory of the on-disk frame cache. None disables caching.
+        cache_max_bytes (int): Size budget of the on-disk frame cache.
+        min_frames_per_chunk (int): Do not split a video decode into chunks smaller than this.
+    """
+
+    def __init__(
+        self,
+        target_size: Optional[int] = None,
+        decode_threads: int = 2,
+        max_workers: int = 4,
+        cache_dir: Optional[str] = None,
+        cache_max_bytes: int = 50 * 1024**3,
+        min_frames_per_chunk: int = 8,
+    ):
+        self.target_size = target_size
+        self.decode_threads = decode_threads
+        self.max_workers = max(1, max_workers)
+        self.min_frames_per_chunk = min_frames_per_chunk
+        self.cache = FrameCache(cache_dir, cache_max_bytes) if cache_dir else None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._executor_pid: Optional[int] = None
+
+    def __getstate__(self):
+        # Executors cannot be pickled (spawned dataloader workers), rebuild it on first use
+        state = self.__dict__.copy()
+        state["_executor"] = None
+        state["_executor_pid"] = None
+        return state
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        if self._executor is None or self._executor_pid != os.getpid():
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="frame-service")
+            self._executor_pid = os.getpid()
+        return self._executor
+
+    def _open_reader(self, path: str, hw: Optional[Tuple[int, int]]):
+        from decord import VideoReader, cpu
+
+        if hw is None:
+            return VideoReader(path, num_threads=self.decode_threads, ctx=cpu(0))
+        height, width = hw
+        return VideoReader(path, num_threads=self.decode_threads, ctx=cpu(0), width=width, height=height)
+
+    def _decode_chunk(self, path: str, hw: Optional[Tuple[int, int]], indices: List[int]) -> np.ndarray:
+        vr = self._open_reader(path, hw)
+        return _to_numpy(vr.get_batch(indices))
+
+    def load_video(
+        self,
+        path: str,
+        sampler: FrameSampler,
+        cache_params: Optional[Dict[str, Any]] = None,
+    ) -> Tuple[List[np.ndarray], List[str], float]:
+        """
+        Loads the frames chosen by `sampler` from the video at `path`.
+
+        Args:
+            path (str): Path to the video file (e.g., MP4).
+            sampler (FrameSampler): Maps (total_frames, native_fps) to (frame indices, timestamps).
+            cache_params (Dict[str, Any], optional): Parameters that fully determine the sampler
+                output (e.g. fps, max_frames). Required to use the on-disk cache.
+
+        Returns:
+            (frames, timestamps, duration_seconds):
+              frames: List of (H, W, 3) uint8 arrays, one per sampled index,
+              timestamps: The sampler's timestamps,
+              duration_seconds: Video duration computed from the native fps.
+        """
+        cache_key = None
+        if self.cache is not None and cache_params is not None:
+            cache_key = self.cache.key(path, size=self.target_size, **cache_params)
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                frames, timestamps, duration_seconds = cached
+                return list(frames), timestamps, duration_seconds
+
+        hw = None
+        if self.target_size:
+            native_hw = _probe_video_hw(path)
+            if native_hw is not None and max(native_hw) > self.target_size:
+                hw = _resized_hw(*native_hw, self.target_size)
+
+        try:
+            vr = self._open_reader(path, hw)
+        except Exception as e:
+            raise RuntimeError(f"Failed to open video '{path}': {e}")
+
+        total_frames = len(vr)
+        if total_frames == 0:
+            raise RuntimeError(f"Video '{path}' has 0 frames.")
+
+        # Fallback to 30 if native_fps is None or zero
+        native_fps = vr.get_avg_fps() or 30.0
+        duration_seconds = total_frames / native_fps
+
+        frames_idx, timestamps = sampler(total_frames, native_fps)
+        if len(frames_idx) == 0:
+            raise RuntimeError(f"No frames sampled from '{path}'.")
+
+        # Decode every distinct frame once, in order, then scatter back to the requested layout
+        unique_idx, inverse = np.unique(np.asarray(frames_idx, dtype=np.int64), return_inverse=True)
+        unique_idx = unique_idx.tolist()
+        try:
+            num_chunks = min(self.max_workers, len(unique_idx) // self.min_frames_per_chunk)
+            chunks = _split_on_keyframes(unique_idx, vr.get_key_indices(), num_chunks) if num_chunks > 1 else [unique_idx]
+            if len(chunks) == 1:
+                decoded = _to_numpy(vr.get_batch(unique_idx))
+            else:
+                # First chunk reuses the reader we already opened, the others open their own
+                futures = [self.executor.submit(self._decode_chunk, path, hw, chunk) for chunk in chunks[1:]]
+                parts = [_to_numpy(vr.get_batch(chunks[0]))] + [f.result() for f in futures]
+                decoded = np.concatenate(parts, axis=0)
+        except Exception as e:
+            raise RuntimeError(f"Failed to read frames from '{path}': {e}")
+        del vr
+
+        frames = decoded[inverse.reshape(-1)]
+        if cache_key is not None:
+            self.cache.put(cache_key, frames, timestamps, duration_seconds)
+        return list(frames), timestamps, duration_seconds
+
+    def load_images(self, paths: Sequence[str]) -> List[Optional[np.ndarray]]:
+        """
+        Loads image files concurrently (PIL releases the GIL while decoding), resized to
+        `target_size`. Entries that fail to load are returned as None and logged.
+        """
+
+        def _load(img_path: str) -> Optional[np.ndarray]:
+            try:
+                return _load_frame_file(img_path, self.target_size)
+            except Exception as e:
+                logger.error(f"Failed to load image '{img_path}': {e}")
+                return None
+
+        # Clip sampling can repeat a frame, load every file once
+        unique_paths = list(dict.fromkeys(paths))
+        if len(unique_paths) <= 1 or self.max_workers == 1:
+            loaded = [_load(p) for p in unique_paths]
+        else:
+            loaded = list(self.executor.map(_load, unique_paths))
+        by_path = dict(zip(unique_paths, loaded))
+        return [by_path[p] for p in paths]
+
+
+_default_service: Optional[VideoFrameService] = None
+
+
+def get_default_frame_service() -> VideoFrameService:
+    """Service used by the module-level loaders when none is passed: native size, no cache."""
+    global _default_service
+    if _default_service is None:
+        _default_service = VideoFrameService()
+    return _default_service
@@ -0,0 +1,199 @@
+import re
+import logging
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import torch
+
+from smolvlm.constants import IGNORE_INDEX, DEFAULT_IMAGE_TOKEN, DEFAULT_VIDEO_TOKEN
+
+logger = logging.getLogger(__name__)
+
+SYSTEM_STR = "System:"
+USER_STR = "User:"
+END_OF_UTTERANCE_STR = "<end_of_utterance>"
+
+# Placeholders that should have been single special tokens but were split by the tokenizer,
+# one entry per token position (a set of accepted token strings).
+GLOBAL_IMG_PIECES: List[Tuple[str, ...]] = [("<",), ("global",), ("-",), ("img",), (">",)]
+ROW_COL_PIECES: List[Tuple[str, ...]] = [
+    ("<",), ("row",), ("_",), tuple("123456789"), ("_",), ("col",), ("_",), tuple("123456789"), (">",)
+]
+
+
+##############################################################################
+# Vectorized matching helpers
+##############################################################################
+def _as_numpy(ids) -> np.ndarray:
+    if isinstance(ids, torch.Tensor):
+        return ids.detach().cpu().numpy()
+    return np.asarray(ids)
+
+
+def find_subsequence_occurrences(sequence, pattern: Sequence) -> np.ndarray:
+    """
+    Returns the start index of every (possibly overlapping) occurrence of `pattern`
+    in `sequence`, as a sorted int64 array.
+
+    Each element of `pattern` is either a single token id or a collection of accepted ids.
+    The match is a sliding window over the whole array: one vectorized comparison per
+    pattern position instead of one Python slice comparison per sequence position.
+    """
+    seq = _as_numpy(sequence)
+    n, m = len(seq), len(pattern)
+    if m == 0 or n < m:
+        return np.empty(0, dtype=np.int64)
+
+    hits = np.ones(n - m + 1, dtype=bool)
+    for k, accepted in enumerate(pattern):
+        window = seq[k : n - m + 1 + k]
+        if isinstance(accepted, (list, tuple, set, frozenset, np.ndarray)):
+            hits &= np.isin(window, np.fromiter(accepted, dtype=seq.dtype, count=len(accepted)))
+        else:
+            hits &= window == accepted
+    return np.flatnonzero(hits).astype(np.int64)
+
+
+def _role_spans(
+    starts: np.ndarray,
+    ends: np.ndarray,
+    start_len: int,
+    end_len: int,
+    seq_len: int,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Pairs every role delimiter with the next end marker, skipping delimiters that fall
+    inside an already-masked span. Same semantics as the sequential scan: a span starts at
+    the delimiter and stops right before the next end marker (or at the end of the sequence),
+    and the search resumes after that end marker.
+    """
+    span_starts, span_ends = [], []
+    pos = 0
+    while True:
+        i = np.searchsorted(starts, pos, side="left")
+        if i == len(starts):
+            break
+        start = int(starts[i])
+        j = np.searchsorted(ends, start + start_len, side="left")
+        end = int(ends[j]) if j < len(ends) else seq_len
+        span_starts.append(start)
+        span_ends.append(end)
+        pos = end + end_len
+    return np.asarray(span_starts, dtype=np.int64), np.asarray(span_ends, dtype=np.int64)
+
+
+def _spans_to_mask(span_starts: np.ndarray, span_ends: np.ndarray, seq_len: int) -> np.ndarray:
+    # Interval arithmetic: +1 at each start, -1 at each end, prefix sum > 0 is covered
+    delta = np.zeros(seq_len + 1, dtype=np.int32)
+    np.add.at(delta, span_starts, 1)
+    np.add.at(delta, span_ends, -1)
+    return np.cumsum(delta[:-1]) > 0
+
+
+def role_mask(input_ids, role_ids: Sequence[int], end_ids: Sequence[int]) -> np.ndarray:
+    """
+    Boolean mask over `input_ids` covering every span from a `role_ids` delimiter
+    up to (excluding) the next `end_ids` marker, or to the end of the sequence.
+    """
+    seq = _as_numpy(input_ids)
+    starts = find_subsequence_occurrences(seq, role_ids)
+    if len(starts) == 0:
+        return np.zeros(len(seq), dtype=bool)
+    ends = find_subsequence_occurrences(seq, end_ids)
+    span_starts, span_ends = _role_spans(starts, ends, len(role_ids), len(end_ids), len(seq))
+    return _spans_to_mask(span_starts, span_ends, len(seq))
+
+
+def _window_mask(starts: np.ndarray, width: int, seq_len: int) -> np.ndarray:
+    return _spans_to_mask(starts, np.minimum(starts + width, seq_len), seq_len)
+
+
+##############################################################################
+# Masking engine
+##############################################################################
+class LabelMasker:
+    """
+    Builds training labels from `input_ids` in a handful of vectorized passes.
+
+    Everything that only depends on the tokenizer (delimiter ids, the ids of image/patch
+    special tokens, the id patterns of mis-tokenized placeholders) is resolved once at
+    construction instead of once per sample.
+
+    Args:
+        tokenizer: The tokenizer used to produce `input_ids`.
+        mask_system_tokens (bool): Mask "System:" turns.
+        mask_user_tokens (bool): Mask "User:" turns.
+    """
+
+    def __init__(self, tokenizer, mask_system_tokens: bool = True, mask_user_tokens: bool = False):
+        self.mask_system_tokens = mask_system_tokens
+        self.mask_user_tokens = mask_user_tokens
+
+        self.system_ids = tokenizer.encode(SYSTEM_STR, add_special_tokens=False)
+        self.user_ids = tokenizer.encode(USER_STR, add_special_tokens=False)
+        self.end_ids = tokenizer.encode(END_OF_UTTERANCE_STR, add_special_tokens=False)
+
+        vocab = tokenizer.get_vocab()
+        special_ids = []
+        if tokenizer.pad_token_id is not None:
+            special_ids.append(tokenizer.pad_token_id)
+        if DEFAULT_IMAGE_TOKEN in tokenizer.additional_special_tokens:
+            special_ids.append(tokenizer.convert_tokens_to_ids(DEFAULT_IMAGE_TOKEN))
+        if DEFAULT_VIDEO_TOKEN in tokenizer.additional_special_tokens:
+            special_ids.append(tokenizer.convert_tokens_to_ids(DEFAULT_VIDEO_TOKEN))
+        if "<global-img>" in vocab:
+            special_ids.append(tokenizer.convert_tokens_to_ids("<global-img>"))
+        image_patches = re.compile(r"<row_\d+_col_\d+>")
+        patch_tokens = [token for token in vocab if image_patches.fullmatch(token)]
+        if len(patch_tokens) > 0:
+            special_ids.extend(tokenizer.convert_tokens_to_ids(patch_tokens))
+        self.special_ids = torch.tensor(sorted(set(special_ids)), dtype=torch.long)
+
+        # Token strings -> ids, so placeholder detection runs on ids without detokenizing
+        self.global_img_pattern = self._pieces_to_ids(GLOBAL_IMG_PIECES, vocab)
+        self.row_col_pattern = self._pieces_to_ids(ROW_COL_PIECES, vocab)
+
+    @staticmethod
+    def _pieces_to_ids(pieces: List[Tuple[str, ...]], vocab: Dict[str, int]) -> Optional[List[Tuple[int, ...]]]:
+        pattern = []
+        for accepted in pieces:
+            ids = tuple(vocab[p] for p in accepted if p in vocab)
+            if not ids:
+                return None  # a piece that is not a token can never be produced
+            pattern.append(ids)
+        return pattern
+
+    def split_placeholder_mask(self, input_ids) -> np.ndarray:
+        """Positions of "<global-img>" / "<row_i_col_j>" placeholders that were split into several tokens."""
+        seq = _as_numpy(input_ids)
+        mask = np.zeros(len(seq), dtype=bool)
+        for pattern in (self.global_img_pattern, self.row_col_pattern):
+            if pattern is None:
+                continue
+            starts = find_subsequence_occurrences(seq, pattern)
+            if len(starts):
+                mask |= _window_mask(starts, len(pattern), len(seq))
+        return mask
+
+    def mask_special_tokens(self, input_ids: torch.Tensor, labels: torch.Tensor):
+        if len(self.special_ids):
+            labels[torch.isin(input_ids, self.special_ids)] = IGNORE_INDEX
+
+        split_mask = self.split_placeholder_mask(input_ids)
+        if split_mask.any():
+            logger.warning(f"found {int(split_mask.sum())} global image + row col tokens not tokenized correctly!")
+            labels[torch.from_numpy(split_mask)] = IGNORE_INDEX
+
+    def __call__(self, input_ids: torch.Tensor) -> torch.Tensor:
+        labels = input_ids.clone()
+        self.mask_special_tokens(input_ids, labels)
+
+        seq = _as_numpy(input_ids)
+        mask = np.zeros(len(seq), dtype=bool)
+        if self.mask_system_tokens:
+            mask |= role_mask(seq, self.system_ids, self.end_ids)
+        if self.mask_user_tokens:
+            mask |= role_mask(seq, self.user_ids, self.end_ids)
+        if mask.any():
+            labels[torch.from_numpy(mask)] = IGNORE_INDEX
+        return labels
@@ -0,0 +1,581 @@
+import os
+import re
+import json
+import math
+import hashlib
+import logging
+from dataclasses import asdict, dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from smolvlm.datasets.dataset import DEFAULT_SYSTEM_MESSAGE, FRAME_TIMESTAMP_MESSAGE
+
+logger = logging.getLogger(__name__)
+
+# Same pattern as `scripts/create_mixture.py`: `_X_Y_s` in the name or json_path of a
+# video dataset gives the range of durations of its videos, in seconds.
+VIDEO_DURATION_PATTERN = r"_(\d+)_(\d+)_s"
+MEDIA_PLACEHOLDERS = ("<image>", "<video>")
+# Bump when the way lengths are counted changes, to invalidate the cached histograms.
+HISTOGRAM_VERSION = 1
+
+
+##############################################################################
+# Token counting
+##############################################################################
+@dataclass
+class TokenCountConfig:
+    """
+    How the length of a sample is estimated without running the processor. The visual
+    tokens follow the Idefics3 expansion: an image split in `rows x cols` tiles of
+    `tile_size` (after resizing its longest edge to `image_target_size`) takes
+    `rows * cols + 1` views (the tiles and the global image), each of `image_seq_len`
+    tokens plus the fake/row-col tokens around them. A video frame is a single view,
+    preceded by its "Frame from MM:SS" text.
+
+    Text is counted with `tokenizer` if given, else estimated at `chars_per_token`.
+    """
+
+    tokenizer: Optional[str] = None
+    chars_per_token: float = 3.6
+    tokens_per_turn: int = 5
+    image_seq_len: int = 64
+    tokens_around_view: int = 3
+    tile_size: int = 384
+    image_target_size: int = 1536
+    max_frames: int = 25
+    fps: float = 1.0
+    data_folder: Optional[str] = None
+    bin_size: int = 64
+
+    def cache_params(self) -> Dict[str, Any]:
+        params = asdict(self)
+        # The data folder only matters for the image sizes, through the paths it resolves.
+        params["data_folder"] = os.path.abspath(self.data_folder) if self.data_folder else None
+        params["version"] = HISTOGRAM_VERSION
+        return params
+
+
+class TokenCounter:
+    """
+    Counts the text and visual tokens of the samples of the annotation files
+    (`conversations` of `{from, value}` turns, with `image` or `video` media).
+    """
+
+    def __init__(self, config: TokenCountConfig):
+        self.config = config
+        self._tokenizer = None
+        if config.tokenizer:
+            from transformers import AutoTokenizer
+
+            self._tokenizer = AutoTokenizer.from_pretrained(config.tokenizer)
+        self.default_system_tokens = self.count_text(DEFAULT_SYSTEM_MESSAGE) + config.tokens_per_turn
+        self.view_tokens = config.image_seq_len + config.tokens_around_view
+        self.frame_tokens = self.view_tokens + self.count_text(f"{FRAME_TIMESTAMP_MESSAGE} 00:00:")
+
+    def count_text(self, text: str) -> int:
+        if not text:
+            return 0
+        if self._tokenizer is not None:
+            return len(self._tokenizer(text, add_special_tokens=False)["input_ids"])
+        return math.ceil(len(text) / self.config.chars_per_token)
+
+    def count_conversation(self, sample: Dict[str, Any]) -> int:
+        tokens = 0
+        has_system_turn = False
+        for turn in sample.get("conversations", []):
+            value = turn.get("value") or ""
+            for placeholder in MEDIA_PLACEHOLDERS:
+                value = value.replace(placeholder, "")
+            tokens += self.count_text(value) + self.config.tokens_per_turn
+            has_system_turn = has_system_turn or turn.get("from", "").lower() == "system"
+        if not has_system_turn:
+            system_message = next(
+                (
+                    v
+                    for k, v in sample.items()
+                    if isinstance(k, str) and "system" in k.lower() and "message" in k.lower() and isinstance(v, str)
+                ),
+                None,
+            )
+            if system_message is None:
+                tokens += self.default_system_tokens
+            else:
+                tokens += self.count_text(system_message) + self.config.tokens_per_turn
+        return tokens
+
+    def image_size(self, sample: Dict[str, Any], media: str, idx: int) -> Optional[Tuple[int, int]]:
+        """(height, width) from the annotation if it has them, else from the image header."""
+        heights, widths = sample.get("height"), sample.get("width")
+        if heights is not None and widths is not None:
+            if isinstance(heights, list):
+                heights, widths = heights[idx], widths[idx]
+            return int(heights), int(widths)
+        if self.config.data_folder:
+            try:
+                with Image.open(os.path.join(self.config.data_folder, media)) as img:
+                    return img.height, img.width
+            except Exception:
+                return None
+        return None
+
+    def count_image(self, size: Optional[Tuple[int, int]]) -> int:
+        target, tile = self.config.image_target_size, self.config.tile_size
+        if size is None:
+            # Unknown size: a square image, resized to `image_target_size`.
+            height = width = target
+        else:
+            height, width = size
+            scale = target / float(max(height, width))
+            height, width = max(1, round(height * scale)), max(1, round(width * scale))
+        num_tiles = math.ceil(height / tile) * math.ceil(width / tile)
+        num_views = num_tiles + 1 if num_tiles > 1 else 1
+        return num_views * self.view_tokens
+
+    def count_video_frames(self, sample: Dict[str, Any], dataset_entry: Dict[str, Any]) -> int:
+        """Frames sampled at `fps`, up to `max_frames`, like `_sample_uniform_frames`."""
+        duration = sample.get("duration")
+        if duration is None:
+            for key in ("name", "json_path"):
+                match = re.search(VIDEO_DURATION_PATTERN, dataset_entry.get(key, "").lower())
+                if match:
+                    duration = (int(match.group(1)) + int(match.group(2))) / 2.0
+                    break
+        if duration is None or self.config.fps <= 0:
+            return self.config.max_frames
+        return max(1, min(self.config.max_frames, int(round(self.config.fps * float(duration)))))
+
+    def count_sample(self, sample: Dict[str, Any], dataset_entry: Dict[str, Any]) -> Tuple[int, int]:
+        """Returns the (text tokens, visual tokens) of a sample."""
+        text_tokens = self.count_conversation(sample)
+        content_type = sample.get("type", dataset_entry.get("modality", "text")).lower()
+        if content_type == "video":
+            if not (sample.get("video") or sample.get("image")):
+                return text_tokens, 0
+            return text_tokens, self.count_video_frames(sample, dataset_entry) * self.frame_tokens
+        if content_type in ("image", "multiimage"):
+            media = sample.get("image") or []
+            if isinstance(media, str):
+                media = [media]
+            visual_tokens = sum(self.count_image(self.image_size(sample, m, idx)) for idx, m in enumerate(media))
+            return text_tokens, visual_tokens
+        return text_tokens, 0
+
+
+##############################################################################
+# Length histograms of the sources
+##############################################################################
+@dataclass
+class SourceHistogram:
+    """
+    Histogram of the total lengths (text + visual tokens) of the samples of a source,
+    by bins of `bin_size` tokens: the bin `b` holds the lengths in
+    `[b * bin_size + 1, (b + 1) * bin_size]`. For each bin we keep the number of samples
+    and their summed text and visual tokens, so the token counts under a length limit
+    (a multiple of `bin_size`) are exact.
+    """
+
+    json_path: str
+    num_samples: int
+    bin_size: int
+    counts: List[int] = field(default_factory=list)
+    text_tokens: List[int] = field(default_factory=list)
+    visual_tokens: List[int] = field(default_factory=list)
+
+    @classmethod
+    def from_lengths(cls, json_path: str, text_lengths: np.ndarray, visual_lengths: np.ndarray, bin_size: int):
+        total_lengths = np.maximum(text_lengths + visual_lengths, 1)
+        bins = (total_lengths - 1) // bin_size
+        num_bins = int(bins.max()) + 1 if len(bins) else 0
+        return cls(
+            json_path=json_path,
+            num_samples=len(total_lengths),
+            bin_size=bin_size,
+            counts=np.bincount(bins, minlength=num_bins).tolist(),
+            text_tokens=np.bincount(bins, weights=text_lengths, minlength=num_bins).astype(np.int64).tolist(),
+            visual_tokens=np.bincount(bins, weights=visual_lengths, minlength=num_bins).astype(np.int64).tolist(),
+        )
+
+    def num_usable_bins(self, max_length: Optional[int]) -> int:
+        if max_length is None:
+            return len(self.counts)
+        return min(len(self.counts), max_length // self.bin_size)
+
+    def usable(self, max_length: Optional[int]) -> Tuple[int, int, int]:
+        """(samples, text tokens, visual tokens) of the samples fitting in `max_length`."""
+        end = self.num_usable_bins(max_length)
+        return sum(self.counts[:end]), sum(self.text_tokens[:end]), sum(self.visual_tokens[:end])
+
+    def over_length_share(self, max_length: Optional[int]) -> float:
+        if not self.num_samples:
+            return 0.0
+        return 1.0 - self.usable(max_length)[0] / self.num_samples
+
+    def mean_usable_tokens(self, max_length: Optional[int]) -> Tuple[float, float]:
+        """Mean (text, visual) tokens of the samples seen in training, the longer ones being replaced."""
+        num_samples, text_tokens, visual_tokens = self.usable(max_length)
+        if not num_samples:
+            return 0.0, 0.0
+        return text_tokens / num_samples, visual_tokens / num_samples
+
+    def sample_lengths(self, num: int, max_length: Optional[int], rng: np.random.Generator) -> np.ndarray:
+        end = self.num_usable_bins(max_length)
+        counts = np.asarray(self.counts[:end], dtype=np.float64)
+        if num <= 0 or counts.sum() == 0:
+            return np.zeros(0, dtype=np.int64)
+        bins = rng.choice(end, size=num, p=counts / counts.sum())
+        return bins * self.bin_size + rng.integers(1, self.bin_size + 1, size=num)
+
+
+def load_annotations(json_path: str) -> List[Dict[str, Any]]:
+    """Same formats as `SupervisedDataset._load_data`."""
+    if json_path.endswith(".json"):
+        with open(json_path, "r") as f:
+            return json.load(f)
+    elif json_path.endswith(".jsonl"):
+        with open(json_path, "r") as f:
+            return [json.loads(line) for line in f if line.strip()]
+    raise ValueError(f"Unsupported file format: {json_path}")
+
+
+def get_source_key(dataset_entry: Dict[str, Any]) -> Tuple[str, Any, Any]:
+    """What the lengths of the samples of an entry depend on, besides the counting config."""
+    return os.path.abspath(dataset_entry["json_path"]), dataset_entry.get("modality"), dataset_entry.get("name")
+
+
+def get_histogram_cache_path(cache_dir: str, dataset_entry: Dict[str, Any], config: TokenCountConfig) -> str:
+    """The cache is invalidated when the file, its modality or name, or the way tokens are counted change."""
+    json_path, modality, name = get_source_key(dataset_entry)
+    stat = os.stat(json_path)
+    key = {
+        "json_path": json_path,
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "modality": modality,
+        "name": name,
+        "config": config.cache_params(),
+    }
+    digest = hashlib.sha256(json.dumps(key, sort_keys=True).encode("utf-8")).hexdigest()
+    return os.path.join(cache_dir, f"{digest[:32]}.json")
+
+
+def scan_source(dataset_entry: Dict[str, Any], counter: TokenCounter) -> SourceHistogram:
+    """Reads the annotation file of a dataset entry once, and builds its length histogram."""
+    samples = load_annotations(dataset_entry["json_path"])
+    lengths = np.array([counter.count_sample(s, dataset_entry) for s in samples], dtype=np.int64).reshape(-1, 2)
+    return SourceHistogram.from_lengths(
+        dataset_entry["json_path"], lengths[:, 0], lengths[:, 1], counter.config.bin_size
+    )
+
+
+def load_or_scan_source(
+    dataset_entry: Dict[str, Any], counter: TokenCounter, cache_dir: Optional[str]
+) -> Tuple[SourceHistogram, bool]:
+    """Returns the histogram of a source, and whether it comes from the cache."""
+    cache_path = get_histogram_cache_path(cache_dir, dataset_entry, counter.config) if cache_dir else None
+    if cache_path and os.path.isfile(cache_path):
+        try:
+            with open(cache_path, "r") as f:
+                return SourceHistogram(**json.load(f)), True
+        except (OSError, ValueError, TypeError) as e:
+            logger.warning(f"[MixturePlanner] Ignoring corrupted histogram cache {cache_path}: {e}")
+
+    histogram = scan_source(dataset_entry, counter)
+    if cache_path:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(asdict(histogram), f)
+        os.replace(tmp_path, cache_path)
+    return histogram, False
+
+
+##############################################################################
+# Sampling ratios
+##############################################################################
+def parse_sampling_fraction(strategy: Optional[str], num_samples: int) -> Tuple[str, float]:
+    """
+    Returns the kind ("random", "first", "end") and the fraction of samples kept by a
+    `sampling_strategy`, as interpreted by `SupervisedDataset._apply_sampling_strategy`.
+    """
+    if not strategy or strategy == "all" or ":" not in strategy:
+        return "random", 1.0
+    kind, amount_str = strategy.split(":")
+    if amount_str.endswith("%"):
+        return kind, min(1.0, float(amount_str.strip("%")) / 100.0)
+    return kind, min(1.0, int(amount_str) / max(1, num_samples))
+
+
+def format_sampling(kind: str, fraction: float) -> str:
+    # 4 decimals: the planned fractions of the large sources are often well under 1%.
+    return f"{kind}:{round(fraction * 100, 4)}%"
+
+
+def num_sampled(num_samples: int, fraction: float) -> int:
+    """Number of samples kept for a fraction, like `_apply_sampling_strategy`."""
+    return min(num_samples, max(1, math.ceil(num_samples * fraction)))
+
+
+def solve_group_scale(base_fractions: np.ndarray, full_tokens: np.ndarray, target_tokens: float) -> float:
+    """
+    Finds the scale `c` such that the tokens of the group, `sum(min(1, c * b) * full)`,
+    reach `target_tokens`. The tokens grow with `c`, so a bisection converges.
+    """
+    active = base_fractions > 0
+    high = float(np.max(1.0 / base_fractions[active]))
+    low = 0.0
+    for _ in range(100):
+        mid = (low + high) / 2.0
+        if np.sum(np.minimum(1.0, mid * base_fractions) * full_tokens) < target_tokens:
+            low = mid
+        else:
+            high = mid
+    return high
+
+
+def solve_sampling_fractions(
+    groups: List[str],
+    base_fractions: np.ndarray,
+    full_tokens: np.ndarray,
+    target_shares: Dict[str, float],
+    total_tokens: Optional[float] = None,
+) -> Tuple[np.ndarray, float]:
+    """
+    Solves for the fraction of each source so that each group gets its share of the
+    training tokens. Inside a group, the relative fractions of the sources are kept
+    (they are scaled together), and a fraction can't exceed 1: the largest total
+    reachable is `min(full tokens of group / share of group)`, the group with the least
+    tokens for its share being sampled fully.
+
+    Args:
+        groups: The group of each source.
+        base_fractions: The fraction of each source in the input mixture.
+        full_tokens: The tokens of each source when sampled fully.
+        target_shares: The share of each group, summing to 1.
+        total_tokens: Optional smaller total of tokens to plan for.
+
+    Returns:
+        The fraction of each source, and the total of tokens planned.
+    """
+    groups = np.asarray(groups)
+    max_total_tokens = math.inf
+    for group, share in target_shares.items():
+        if share <= 0:
+            continue
+        in_group = (groups == group) & (base_fractions > 0)
+        group_tokens = float(np.sum(full_tokens[in_group]))
+        if group_tokens <= 0:
+            raise ValueError(f"The group {group} has a target share of {share:.2%} but no tokens to sample.")
+        max_total_tokens = min(max_total_tokens, group_tokens / share)
+
+    if total_tokens is None or total_tokens > max_total_tokens:
+        if total_tokens is not None:
+            logger.warning(
+                f"[MixturePlanner] {total_tokens:.3g} tokens can't be reached with the target shares, "
+                f"planning for the maximum of {max_total_tokens:.3g} tokens."
+            )
+        total_tokens = max_total_tokens
+
+    fractions = np.zeros(len(base_fractions), dtype=np.float64)
+    for group, share in target_shares.items():
+        in_group = groups == group
+        if share <= 0 or not in_group.any():
+            continue
+        scale = solve_group_scale(base_fractions[in_group], full_tokens[in_group], share * total_tokens)
+        fractions[in_group] = np.minimum(1.0, scale * base_fractions[in_group])
+    return fractions, total_tokens
+
+
+##############################################################################
+# Batch simulation
+##############################################################################
+@dataclass
+class BatchConfig:
+    per_device_batch_size: int = 1
+    gradient_accumulation_steps: int = 1
+    num_devices: int = 1
+    model_max_length: int = 16384
+    packed: bool = False
+    num_simulated_samples: int = 200_000
+    seed: int = 0
+
+
+def pack_lengths(lengths: np.ndarray, cutoff_len: int) -> np.ndarray:
+    """Greedy sequential packing of `PackedConcatDataset`: returns the length of each pack."""
+    packs = []
+    current = 0
+    for length in lengths.tolist():
+        if current > 0 and current + length > cutoff_len:
+            packs.append(current)
+            current = 0
+        current += length
+    if current > 0:
+        packs.append(current)
+    return np.asarray(packs, dtype=np.int64)
+
+
+def simulate_batches(
+    histograms: List[SourceHistogram], num_samples: List[int], batch_config: BatchConfig
+) -> Dict[str, float]:
+    """
+    Draws the lengths of the sampled mixture from the histograms (the sources in the
+    order of the YAML, as `ConcatDataset` does) and batches them like training does:
+    packed sequentially into `model_max_length` if `packed` (consecutive packs in a
+    batch), else shuffled. The collator pads each micro-batch to its longest item.
+    """
+    rng = np.random.default_rng(batch_config.seed)
+    total_samples = sum(num_samples)
+    scale = min(1.0, batch_config.num_simulated_samples / max(1, total_samples))
+    lengths = np.concatenate(
+        [np.zeros(0, dtype=np.int64)]
+        + [
+            histogram.sample_lengths(int(round(n * scale)), batch_config.model_max_length, rng)
+            for histogram, n in zip(histograms, num_samples)
+        ]
+    )
+    if not len(lengths):
+        raise ValueError("The planned mixture has no sample to simulate.")
+
+    if batch_config.packed:
+        items = pack_lengths(lengths, batch_config.model_max_length)
+    else:
+        items = rng.permutation(lengths)
+    batch_size = batch_config.per_device_batch_size
+    num_batches = len(items) // batch_size
+    if num_batches == 0:
+        batches = items[None, :]
+    else:
+        batches = items[: num_batches * batch_size].reshape(num_batches, batch_size)
+    real_tokens = batches.sum(axis=1)
+    padded_tokens = batches.max(axis=1) * batches.shape[1]
+
+    steps_factor = batch_config.gradient_accumulation_steps * batch_config.num_devices
+    items_per_epoch = len(items) / scale
+    return {
+        "simulated_samples": int(len(lengths)),
+        "samples_per_item": float(len(lengths) / len(items)),
+        "tokens_per_step": float(real_tokens.mean() * steps_factor),
+        "padded_tokens_per_step": float(padded_tokens.mean() * steps_factor),
+        "padding_efficiency": float(real_tokens.sum() / padded_tokens.sum()),
+        "packing_fill": float(items.mean() / batch_config.model_max_length),
+        "steps_per_epoch": float(items_per_epoch / (batch_size * steps_factor)),
+    }
+
+
+##############################################################################
+# Planning
+##############################################################################
+def iter_dataset_entries(mixture: Any) -> List[Dict[str, Any]]:
+    """The dataset entries of a mixture YAML, a `{type: [entries]}` mapping (as read by `build_datasets`) or a list."""
+    if isinstance(mixture, list):
+        return mixture
+    return [entry for entries in mixture.values() for entry in entries]
+
+
+def plan_mixture(
+    mixture: Any,
+    target_shares: Dict[str, float],
+    counter: TokenCounter,
+    batch_config: BatchConfig,
+    group_by: str = "modality",
+    total_tokens: Optional[float] = None,
+    cache_dir: Optional[str] = None,
+    progress: Optional[Callable[[str, bool], None]] = None,
+) -> Dict[str, Any]:
+    """
+    Plans the sampling strategies of a mixture to reach `target_shares` of the training
+    tokens per group (the value of `group_by` of the entries). The entries of `mixture`
+    are updated in place; the entries of a group with a share of 0 are removed.
+
+    Returns the report of the plan: the tokens per group and per source, the sources
+    read from the cache, and the simulated tokens/step and packing efficiency.
+    """
+    entries = iter_dataset_entries(mixture)
+    groups = [str(entry.get(group_by, "")).lower() for entry in entries]
+    missing = sorted(set(groups) - set(target_shares))
+    if missing:
+        raise ValueError(f"No target share for the groups {missing} (grouped by `{group_by}`).")
+    unused = sorted(set(target_shares) - set(groups))
+    if unused:
+        logger.warning(f"[MixturePlanner] No source for the groups {unused}, their shares are dropped.")
+    target_shares = {g: s for g, s in target_shares.items() if g in set(groups)}
+    total_share = sum(target_shares.values())
+    if total_share <= 0:
+        raise ValueError("The target shares sum to 0.")
+    target_shares = {g: s / total_share for g, s in target_shares.items()}
+
+    # The lengths depend on the modality and the name (video durations) of the entry, not only on its file
+    histograms_by_source: Dict[Tuple[str, Any, Any], Tuple[SourceHistogram, bool]] = {}
+    histograms = []
+    for entry in entries:
+        source_key = get_source_key(entry)
+        if source_key not in histograms_by_source:
+            histograms_by_source[source_key] = load_or_scan_source(entry, counter, cache_dir)
+            if progress is not None:
+                progress(entry["json_path"], histograms_by_source[source_key][1])
+        histograms.append(histograms_by_source[source_key][0])
+
+    max_length = batch_config.model_max_length
+    kinds, base_fractions, full_tokens, mean_tokens = [], [], [], []
+    for entry, histogram in zip(entries, histograms):
+        kind, fraction = parse_sampling_fraction(entry.get("sampling_strategy"), histogram.num_samples)
+        mean_text, mean_visual = histogram.mean_usable_tokens(max_length)
+        kinds.append(kind)
+        base_fractions.append(fraction)
+        mean_tokens.append((mean_text, mean_visual))
+        full_tokens.append(histogram.num_samples * (mean_text + mean_visual))
+    fractions, total_tokens = solve_sampling_fractions(
+        groups, np.asarray(base_fractions), np.asarray(full_tokens), target_shares, total_tokens
+    )
+
+    sources, kept_entries, kept_histograms, kept_num_samples = [], [], [], []
+    group_tokens = {g: {"text_tokens": 0.0, "visual_tokens": 0.0, "samples": 0} for g in target_shares}
+    for entry, group, histogram, kind, fraction, (mean_text, mean_visual) in zip(
+        entries, groups, histograms, kinds, fractions, mean_tokens
+    ):
+        n = num_sampled(histogram.num_samples, fraction) if fraction > 0 and histogram.num_samples else 0
+        source = {
+            "name": entry.get("name", entry["json_path"]),
+            "group": group,
+            "num_samples": histogram.num_samples,
+            "sampled": n,
+            "sampling_strategy": format_sampling(kind, fraction) if n else None,
+            "text_tokens": n * mean_text,
+            "visual_tokens": n * mean_visual,
+            "over_length_share": histogram.over_length_share(max_length),
+        }
+        sources.append(source)
+        if not n:
+            continue
+        entry["sampling_strategy"] = source["sampling_strategy"]
+        entry["_comment"] = f"# {n} samples, {int(source['text_tokens'] + source['visual_tokens'])} tokens"
+        group_tokens[group]["text_tokens"] += source["text_tokens"]
+        group_tokens[group]["visual_tokens"] += source["visual_tokens"]
+        group_tokens[group]["samples"] += n
+        kept_entries.append(entry)
+        kept_histograms.append(histogram)
+        kept_num_samples.append(n)
+
+    # Drop the entries with no sample: `random:0%` would still keep one.
+    if isinstance(mixture, list):
+        mixture[:] = [entry for entry in mixture if any(entry is kept for kept in kept_entries)]
+    else:
+        for key, key_entries in mixture.items():
+            mixture[key] = [entry for entry in key_entries if any(entry is kept for kept in kept_entries)]
+
+    planned_tokens = sum(g["text_tokens"] + g["visual_tokens"] for g in group_tokens.values())
+    for group, tokens in group_tokens.items():
+        tokens["target_share"] = target_shares[group]
+        tokens["share"] = (tokens["text_tokens"] + tokens["visual_tokens"]) / max(planned_tokens, 1.0)
+
+    return {
+        "total_tokens": planned_tokens,
+        "target_total_tokens": total_tokens,
+        "groups": group_tokens,
+        "sources": sources,
+        "num_cached": sum(cached for _, cached in histograms_by_source.values()),
+        "num_scanned": sum(not cached for _, cached in histograms_by_source.values()),
+        "batches": simulate_batches(kept_histograms, kept_num_samples, batch_config),
+    }
@@ -64,6 +64,22 @@ class DataArguments:
         default=25,
         metadata={"help": "FPS for video sampling if needed."}
     )
+    video_decode_threads: int = field(
+        default=2,
+        metadata={"help": "Decoder threads per video reader."}
+    )
+    video_io_workers: int = field(
+        default=4,
+        metadata={"help": "Thread pool size per dataloader worker for chunked video decode and frame-directory loading."}
+    )
+    video_cache_dir: Optional[str] = field(
+        default=None,
+        metadata={"help": "Directory for the on-disk cache of sampled video frames. Disabled if None."}
+    )
+    video_cache_max_gb: float = field(
+        default=50.0,
+        metadata={"help": "Size budget of the on-disk video frame cache, in GB."}
+    )
     packed: bool = field(default=False, metadata={"help": "Use sequnce packing."})
     loss_reduction: str = field(
         default="token",